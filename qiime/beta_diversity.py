@@ -41,7 +41,8 @@ from biom import load_table
 from qiime.util import (FunctionWithParams, TreeMissingError,
                         OtuMissingError)
 from qiime.format import format_matrix, format_distance_matrix
-from qiime.parse import parse_newick, PhyloNode
+from qiime.parse import parse_newick
+from cogent.core.tree import PhyloNode
 import qiime.beta_metrics
 
 
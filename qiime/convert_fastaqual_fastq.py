@@ -13,10 +13,19 @@ __email__ = "adam.robbinspianka@colorado.edu"
 from os import path
 from itertools import izip
 from collections import defaultdict
+from multiprocessing import Pool
 
-from qiime.parse import QiimeParseError, MinimalQualParser
-from skbio.parse.sequences import parse_fasta
-from skbio.parse.sequences import parse_fastq
+from numpy import asarray
+from qiime.parse import QiimeParseError
+from qiime.read_store import read_store_to_fasta, read_store_to_fastq
+from qiime.split_libraries_fastq import parse_fastq_records
+from qiime.util import SampleFileWriter
+from skbio.parse.sequences import parse_fasta, FastqParseError
+from skbio.parse.sequences.fasta import FastaFinder
+
+# the number of records converted before they are written to a single
+# output file
+conversion_block_size = 10000
 
 
 def convert_fastaqual_fastq(fasta_file_path, qual_file_path,
@@ -27,7 +36,9 @@ def convert_fastaqual_fastq(fasta_file_path, qual_file_path,
 
     fasta_file_path:  filepath of input FASTA or FASTQ file.
     qual_file_path:  filepath of input QUAL file (needed for making FASTQ files)
-    conversion_type:  Either fastqual_to_fastq or fastq_to_fastqual.
+    conversion_type:  Either fastqual_to_fastq or fastq_to_fastqual, or
+     read_store_to_fastaqual or read_store_to_fastq to convert a
+     qiime.read_store file (passed as fasta_file_path).
     output_directory:  Directory to output converted files.
     multiple_output_files:  Make one file per SampleID.
     ascii_increment:  Conversion value for fastq ascii character to numeric
@@ -47,9 +58,67 @@ def convert_fastaqual_fastq(fasta_file_path, qual_file_path,
                           multiple_output_files, ascii_increment,
                           full_fastq, full_fasta_headers)
 
+    elif conversion_type in ('read_store_to_fastaqual',
+                             'read_store_to_fastq'):
+        convert_read_store(fasta_file_path, output_directory,
+                           conversion_type == 'read_store_to_fastq',
+                           multiple_output_files, ascii_increment,
+                           full_fasta_headers)
+
     else:
-        raise ValueError('conversion_type must be fastaqual_to_fastq '
-                         'or fastq_to_fastaqual.')
+        raise ValueError('conversion_type must be fastaqual_to_fastq, '
+                         'fastq_to_fastaqual, read_store_to_fastaqual or '
+                         'read_store_to_fastq.')
+
+
+def convert_fastaqual_fastq_files(fasta_file_paths, qual_file_paths=None,
+                                  conversion_type='fastaqual_to_fastq',
+                                  output_directory='.',
+                                  multiple_output_files=False,
+                                  ascii_increment=33, full_fastq=False,
+                                  full_fasta_headers=False, processes=1):
+    """Calls convert_fastaqual_fastq on each of several input files.
+
+    fasta_file_paths:  filepaths of input FASTA, FASTQ or read store files.
+    qual_file_paths:  filepaths of the QUAL files matching fasta_file_paths
+     (needed for making FASTQ files).
+    processes:  Number of input files to convert at once, in separate
+     processes.
+
+    The other parameters are those of convert_fastaqual_fastq. Output files
+    are named after their input files, so input files can't have the same
+    name other than their extensions.
+    """
+    if qual_file_paths is None:
+        qual_file_paths = [None] * len(fasta_file_paths)
+    if len(qual_file_paths) != len(fasta_file_paths):
+        raise ValueError('The same number of FASTA and QUAL files must be '
+                         'provided.')
+    output_names = [get_filename_with_new_ext(fp, '', output_directory)
+                    for fp in fasta_file_paths]
+    if len(set(output_names)) != len(output_names):
+        raise ValueError('Input files must have different names, as the '
+                         'output files are named after them.')
+
+    jobs = [(fasta_fp, qual_fp, conversion_type, output_directory,
+             multiple_output_files, ascii_increment, full_fastq,
+             full_fasta_headers)
+            for fasta_fp, qual_fp in zip(fasta_file_paths, qual_file_paths)]
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        if pool is None:
+            map(_convert_fastaqual_fastq, jobs)
+        else:
+            pool.map(_convert_fastaqual_fastq, jobs, chunksize=1)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _convert_fastaqual_fastq(args):
+    """ Pool.map wrapper around convert_fastaqual_fastq """
+    return convert_fastaqual_fastq(*args)
 
 
 def get_filename_with_new_ext(original_file_path, new_ext, output_directory):
@@ -64,6 +133,40 @@ def get_filename_with_new_ext(original_file_path, new_ext, output_directory):
                      path.splitext(path.split(original_file_path)[1])[0] + new_ext)
 
 
+def _get_fastq_qual_chars(ascii_increment):
+    """Return a dict mapping quality scores, as text, to FASTQ characters
+
+    Only the scores that map to ASCII codes between 32 and 126 are
+    included, so a score missing from the dict either can't be converted
+    or isn't written as an int normally is (e.g., '040').
+    """
+    return dict((str(score), chr(score + ascii_increment))
+                for score in range(32 - ascii_increment, 127 - ascii_increment))
+
+
+def _get_fastq_qual_scores(ascii_increment):
+    """Return a dict mapping FASTQ characters to quality scores, as text
+
+    parse_fastq only decodes quality scores between 0 and 62, with an
+    ascii_increment of 33 or 64.
+    """
+    if ascii_increment not in (33, 64):
+        raise ValueError("Unknown PHRED offset of %s" % ascii_increment)
+    return dict((chr(score + ascii_increment), str(score))
+                for score in range(63))
+
+
+def _parse_qual_text(qual_file):
+    """Yield (label, quality scores as text) for each record of a QUAL file
+
+    The labels are those MinimalQualParser gives, but the quality scores
+    are left as strings, so that they can be looked up in the tables of
+    _get_fastq_qual_chars.
+    """
+    for rec in FastaFinder(qual_file):
+        yield rec[0][1:].split()[0], ' '.join(rec[1:]).split()
+
+
 def convert_fastq(fasta_file_path, qual_file_path, output_directory='.',
                   multiple_output_files=False, ascii_increment=33,
                   full_fastq=False, full_fasta_headers=False,
@@ -78,7 +181,9 @@ def convert_fastq(fasta_file_path, qual_file_path, output_directory='.',
      quality score.
     full_fastq:  Write labels to both sequence and quality score lines.
     full_fasta_headers:  Retain all data on fasta label, instead of breaking at
-     first whitespace.'''
+     first whitespace.
+    per_file_buffer_size:  With multiple_output_files, the number of bytes
+     of records to hold in memory for a file before writing them out.'''
 
     fasta_file = open(fasta_file_path, 'U')
     qual_file = open(qual_file_path, 'U')
@@ -91,100 +196,105 @@ def convert_fastq(fasta_file_path, qual_file_path, output_directory='.',
                                                      output_directory)
 
         fastq_file = open(output_file_path, 'w')
+        fastq_records = []
     else:
-        fastq_lookup = defaultdict(str)
-
-    # iterate through the FASTA and QUAL files entry by entry (assume the
-    # entries are synchronized)
-    for fasta_data, qual_data in izip(parse_fasta(fasta_file),
-                                      MinimalQualParser(qual_file)):
-
-        qual_header = qual_data[0]
-        fasta_header = fasta_data[0]
-
-        label = fasta_header.split()[0]
-        sample_id = label.split('_')[0]
-
-        sequence = fasta_data[1]
-        qual = qual_data[1]
-
-        # check whether the entries are actually (at least nominally) synch'd
-        if qual_header != label:
-            raise KeyError(("QUAL header (%s) does not match "
-                            "FASTA header (%s)") % (qual_header, label))
-
-        if len(sequence) != len(qual):
-            raise KeyError(("Sequence length does not match QUAL length for "
-                            "label (%s)") % label)
-
-        if multiple_output_files:
-            output_file_path = get_filename_with_new_ext(fasta_file_path,
-                                                         '_' + sample_id +
-                                                         '.fastq',
-                                                         output_directory)
-
-            # when we use multiple output files, we close each file after each
-            # sequence is written to avoid using up all the file handles, so
-            # we must open the file each time in append mode
-            # fastq_file = open(output_file_path, 'a')
-
-        if full_fasta_headers:
-            fastq_sequence_header = fasta_header
-        else:
-            fastq_sequence_header = label
-
-        if full_fastq:
-            fastq_quality_header = fastq_sequence_header
-        else:
-            fastq_quality_header = ''
+        # output files are kept open (up to a limit) and written to in large
+        # chunks, and like the files of earlier versions are appended to
+        writer = SampleFileWriter(append=True)
+        output_file_paths = {}
+        buffered_sizes = defaultdict(int)
+
+    # quality scores are converted by looking up their text, rather than
+    # converting them to ints and back
+    get_qual_char = _get_fastq_qual_chars(ascii_increment).__getitem__
+
+    try:
+        # iterate through the FASTA and QUAL files entry by entry (assume the
+        # entries are synchronized)
+        for fasta_data, qual_data in izip(parse_fasta(fasta_file),
+                                          _parse_qual_text(qual_file)):
+
+            qual_header, qual_scores = qual_data
+            fasta_header, sequence = fasta_data
+
+            try:
+                qual_str = ''.join(map(get_qual_char, qual_scores))
+            except KeyError:
+                qual_str = None
+                try:
+                    qual = asarray(qual_scores, dtype=int)
+                except ValueError:
+                    raise QiimeParseError("Invalid qual file. Check the "
+                                          "format of the qual files.")
+
+            label = fasta_header.split()[0]
+            sample_id = label.split('_')[0]
+
+            # check whether the entries are actually (at least nominally)
+            # synch'd
+            if qual_header != label:
+                raise KeyError(("QUAL header (%s) does not match "
+                                "FASTA header (%s)") % (qual_header, label))
+
+            if len(sequence) != len(qual_scores):
+                raise KeyError(("Sequence length does not match QUAL length "
+                                "for label (%s)") % label)
+
+            if qual_str is None:
+                for qual_score in qual:
+                    # increment the qual score by the asciiIncrement (default
+                    # 33), to get the character that represents that
+                    # position's quality.
+                    qual_score += ascii_increment
+                    if qual_score < 32 or qual_score > 126:
+                        raise ValueError(
+                            "Cannot convert quality score to ASCII code" +
+                            " between 32 and 126: " +
+                            str(qual_score - ascii_increment) +
+                            "using ascii_increment = " + str(ascii_increment))
+                qual_str = ''.join([chr(q + ascii_increment) for q in qual])
+
+            if full_fasta_headers:
+                fastq_sequence_header = fasta_header
+            else:
+                fastq_sequence_header = label
 
-        # Writing to FASTQ file
-        record = '@%s\n%s\n+%s\n' % (fastq_sequence_header,
-                                     sequence,
-                                     fastq_quality_header)
+            if full_fastq:
+                fastq_quality_header = fastq_sequence_header
+            else:
+                fastq_quality_header = ''
 
-        if multiple_output_files:
-            fastq_lookup[output_file_path] += record
-        else:
-            fastq_file.write(record)
-
-        for qual_score in qual:
-            # increment the qual score by the asciiIncrement (default 33),
-            # and print the corresponding character, which represents that
-            # position's quality.
-            qual_score += ascii_increment
-            if qual_score < 32 or qual_score > 126:
-                raise ValueError("Cannot convert quality score to ASCII code" +
-                                 " between 32 and 126: " + str(qual_score - ascii_increment) +
-                                 "using ascii_increment = " + str(ascii_increment))
+            record = '@%s\n%s\n+%s\n%s\n' % (fastq_sequence_header,
+                                              sequence,
+                                              fastq_quality_header,
+                                              qual_str)
 
             if multiple_output_files:
-                fastq_lookup[output_file_path] += chr(qual_score)
+                try:
+                    output_file_path = output_file_paths[sample_id]
+                except KeyError:
+                    output_file_path = get_filename_with_new_ext(
+                        fasta_file_path, '_' + sample_id + '.fastq',
+                        output_directory)
+                    output_file_paths[sample_id] = output_file_path
+                writer.write(output_file_path, record)
+                buffered_sizes[output_file_path] += len(record)
+                if buffered_sizes[output_file_path] >= per_file_buffer_size:
+                    writer.flush_file(output_file_path)
+                    buffered_sizes[output_file_path] = 0
             else:
-                fastq_file.write(chr(qual_score))
-
+                fastq_records.append(record)
+                if len(fastq_records) >= conversion_block_size:
+                    fastq_file.write(''.join(fastq_records))
+                    fastq_records = []
+    finally:
+        # write last seqs to output files, or close the output file if there
+        # is only one
         if multiple_output_files:
-            fastq_lookup[output_file_path] += '\n'
+            writer.close()
         else:
-            fastq_file.write('\n')
-
-        if multiple_output_files:
-            if len(fastq_lookup[output_file_path]) >= per_file_buffer_size:
-                fastq_file = open(output_file_path, 'a')
-                fastq_file.write(fastq_lookup[output_file_path])
-                fastq_lookup[output_file_path] = ''
-                fastq_file.close()
-
-    # write last seqs to output files, or close the output file if thre is only
-    # one
-    if multiple_output_files:
-        for output_file_path, records in fastq_lookup.iteritems():
-            if records:
-                fastq_file = open(output_file_path, 'a')
-                fastq_file.write(records)
-                fastq_file.close()
-    else:
-        fastq_file.close()
+            fastq_file.write(''.join(fastq_records))
+            fastq_file.close()
 
 
 def convert_fastaqual(fasta_file_path, output_directory='.',
@@ -200,11 +310,19 @@ def convert_fastaqual(fasta_file_path, output_directory='.',
      quality score.
     full_fastq:  Write labels to both sequence and quality score lines.
     full_fasta_headers:  Retain all data on fasta label, instead of breaking at
-     first whitespace.'''
+     first whitespace.
+    per_file_buffer_size:  With multiple_output_files, the number of bytes
+     of records to hold in memory for a file before writing them out.'''
 
     # rename this to avoid confusion...
     fastq_fp = fasta_file_path
 
+    # quality characters are converted by looking up the text of their
+    # scores, and any other characters are found with a single translate
+    qual_scores = _get_fastq_qual_scores(ascii_increment)
+    get_qual_score = qual_scores.__getitem__
+    valid_qual_chars = ''.join(qual_scores)
+
     # if we are NOT using multiple output files, then open our two (and only)
     # output files here
     if not multiple_output_files:
@@ -217,81 +335,116 @@ def convert_fastaqual(fasta_file_path, output_directory='.',
 
         fasta_out_f = open(fasta_out_fp, 'w')
         qual_out_f = open(qual_out_fp, 'w')
+        fasta_records = []
+        qual_records = []
 
     else:
-        fasta_out_lookup = defaultdict(str)
-        qual_out_lookup = defaultdict(str)
-
-    fpo = ascii_increment
-    for header, sequence, qual in parse_fastq(open(fastq_fp, 'U'),
-                                              strict=False,
-                                              phred_offset=fpo):
-        label = header.split()[0]
-        sample_id = label.split('_')[0]
-
-        if multiple_output_files:
-            fasta_out_fp = get_filename_with_new_ext(fastq_fp,
-                                                     '_' + sample_id + '.fna',
-                                                     output_directory)
-
-            qual_out_fp = get_filename_with_new_ext(fastq_fp,
-                                                    '_' + sample_id + '.qual',
-                                                    output_directory)
-
-        if full_fasta_headers:
-            label = header
-
-        if (qual < 0).any():
-            raise ValueError("Output qual scores are negative values. "
-                             "Use different ascii_increment value than %s" %
-                             str(ascii_increment))
-
-        # write QUAL file, 60 qual scores per line
-        qual_record = [">%s\n" % label]
-        for i in range(0, len(qual), 60):
-            qual_record.append(' '.join([str(q) for q in qual[i:i + 60]]))
-            qual_record.append('\n')
-        qual_record = ''.join(qual_record)
+        # output files are kept open (up to a limit) and written to in large
+        # chunks, and like the files of earlier versions are appended to
+        writer = SampleFileWriter(append=True)
+        output_file_paths = {}
+        buffered_sizes = defaultdict(int)
+
+    try:
+        for header, sequence, qual in \
+                parse_fastq_records(open(fastq_fp, 'U')):
+            if qual.translate(None, valid_qual_chars):
+                raise FastqParseError("Failed qual conversion for seq id: "
+                                      "%s. This may be because you passed "
+                                      "an incorrect value for phred_offset."
+                                      % header)
+
+            label = header.split()[0]
+            sample_id = label.split('_')[0]
+
+            if full_fasta_headers:
+                label = header
+
+            # write QUAL file, 60 qual scores per line
+            scores = map(get_qual_score, qual)
+            qual_record = [">%s\n" % label]
+            for i in range(0, len(scores), 60):
+                qual_record.append(' '.join(scores[i:i + 60]))
+                qual_record.append('\n')
+            qual_record = ''.join(qual_record)
+
+            # write FASTA file
+            fasta_record = '>%s\n%s\n' % (label, sequence)
 
+            if multiple_output_files:
+                try:
+                    fasta_out_fp, qual_out_fp = output_file_paths[sample_id]
+                except KeyError:
+                    fasta_out_fp = get_filename_with_new_ext(
+                        fastq_fp, '_' + sample_id + '.fna', output_directory)
+                    qual_out_fp = get_filename_with_new_ext(
+                        fastq_fp, '_' + sample_id + '.qual', output_directory)
+                    output_file_paths[sample_id] = fasta_out_fp, qual_out_fp
+                writer.write(fasta_out_fp, fasta_record)
+                writer.write(qual_out_fp, qual_record)
+                buffered_sizes[fasta_out_fp] += \
+                    len(fasta_record) + len(qual_record)
+                if buffered_sizes[fasta_out_fp] >= per_file_buffer_size:
+                    writer.flush_file(fasta_out_fp)
+                    writer.flush_file(qual_out_fp)
+                    buffered_sizes[fasta_out_fp] = 0
+            else:
+                fasta_records.append(fasta_record)
+                qual_records.append(qual_record)
+                if len(fasta_records) >= conversion_block_size:
+                    fasta_out_f.write(''.join(fasta_records))
+                    qual_out_f.write(''.join(qual_records))
+                    fasta_records = []
+                    qual_records = []
+    finally:
+        # if we have one output file, close it now
         if multiple_output_files:
-            qual_out_lookup[qual_out_fp] += qual_record
+            writer.close()
         else:
-            qual_out_f.write(qual_record)
+            fasta_out_f.write(''.join(fasta_records))
+            qual_out_f.write(''.join(qual_records))
+            fasta_out_f.close()
+            qual_out_f.close()
 
-        # write FASTA file
-        fasta_record = '>%s\n%s\n' % (label, sequence)
-        if multiple_output_files:
-            fasta_out_lookup[fasta_out_fp] += fasta_record
-        else:
-            fasta_out_f.write(fasta_record)
 
-        # if we're writing multiple output files, we must close after each
-        # sequeunce write to avoid potentiallyusing up all the OS's filehandles
-        if multiple_output_files:
-            if fasta_out_lookup[fasta_out_fp] >= per_file_buffer_size:
-                fasta_f = open(fasta_out_fp, 'a')
-                fasta_f.write(fasta_out_lookup[fasta_out_fp])
-                fasta_f.close()
-                fasta_out_lookup[fasta_out_fp] = ''
-
-                qual_f = open(qual_out_fp, 'a')
-                qual_f.write(qual_out_lookup[qual_out_fp])
-                qual_f.close()
-                qual_out_lookup[qual_out_fp] = ''
-
-    # if we have one output file, close it now
+def convert_read_store(read_store_fp, output_directory='.', to_fastq=False,
+                       multiple_output_files=False, ascii_increment=33,
+                       full_fasta_headers=False):
+    """Takes a read store, generates FASTA and QUAL files or a FASTQ file
+
+    read_store_fp:  filepath of input read store (see qiime.read_store).
+    output_directory:  Directory to output converted files.
+    to_fastq:  Write a FASTQ file rather than FASTA and QUAL files. Either
+     requires the read store to have quality scores.
+    multiple_output_files:  Not supported for read stores.
+    ascii_increment:  Value added to the quality scores to get the FASTQ
+     ascii characters.
+    full_fasta_headers:  Retain all data on the labels, instead of breaking
+     at first whitespace."""
     if multiple_output_files:
-        for fasta_out_fp, records in fasta_out_lookup.iteritems():
-            if records:
-                fasta_f = open(fasta_out_fp, 'a')
-                fasta_f.write(records)
-                fasta_f.close()
-
-        for qual_out_fp, records in qual_out_lookup.iteritems():
-            if records:
-                qual_f = open(qual_out_fp, 'a')
-                qual_f.write(records)
-                qual_f.close()
+        raise ValueError('multiple_output_files is not supported when '
+                         'converting read stores. Use '
+                         'split_sequence_file_on_sample_ids.py on the output.')
+
+    if full_fasta_headers:
+        label_to_name = None
+    else:
+        label_to_name = lambda label: label.split()[0]
+
+    read_store_f = open(read_store_fp, 'rb')
+    if to_fastq:
+        fastq_out_f = open(get_filename_with_new_ext(read_store_fp, '.fastq',
+                                                     output_directory), 'w')
+        read_store_to_fastq(read_store_f, fastq_out_f, ascii_increment,
+                            label_to_name=label_to_name)
+        fastq_out_f.close()
     else:
+        fasta_out_f = open(get_filename_with_new_ext(read_store_fp, '.fna',
+                                                     output_directory), 'w')
+        qual_out_f = open(get_filename_with_new_ext(read_store_fp, '.qual',
+                                                    output_directory), 'w')
+        read_store_to_fasta(read_store_f, fasta_out_f, qual_out_f,
+                            label_to_name=label_to_name)
         fasta_out_f.close()
         qual_out_f.close()
+    read_store_f.close()
@@ -18,10 +18,12 @@ __maintainer__ = "William Walters"
 __email__ = "william.a.walters@colorado.edu"
 
 from string import upper
-from itertools import izip
+from itertools import imap, islice, izip
+from cStringIO import StringIO
+from multiprocessing import Pool
 from os.path import join
 from os import rename
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from operator import itemgetter
 from gzip import GzipFile
 
@@ -59,7 +61,8 @@ def process_files_and_demultiplex_sequences(mapping_file,
                                             write_unassigned_reads=False,
                                             disable_bc_correction=False,
                                             added_demultiplex_field=None,
-                                            save_barcode_frequencies=False):
+                                            save_barcode_frequencies=False,
+                                            processes=1):
     """ Handles file IO, calls main demultiplexing function
 
     mapping_file:  filepath to metadata mapping file.
@@ -79,6 +82,8 @@ def process_files_and_demultiplex_sequences(mapping_file,
      and demultiplexes according to data in fasta labels.
     save_barcode_frequencies:  Saves the frequencies of barcode sequences in
      a separate output file.
+    processes:  Number of chunks of sequences to demultiplex at once, in
+     separate processes.
     """
 
     file_data = {}
@@ -105,7 +110,8 @@ def process_files_and_demultiplex_sequences(mapping_file,
     log_data, bc_freqs, seq_counts, corrected_bc_count =\
         demultiplex_sequences(file_data, keep_barcode, barcode_type,
                               max_bc_errors, start_index, write_unassigned_reads,
-                              disable_bc_correction, added_demultiplex_field)
+                              disable_bc_correction, added_demultiplex_field,
+                              processes)
 
     final_log_data = process_log_data(log_data, seq_counts, mapping_file,
                                       fasta_files, qual_files, corrected_bc_count, keep_barcode, barcode_type,
@@ -143,7 +149,8 @@ def demultiplex_sequences(file_data,
                           start_index=1,
                           write_unassigned_reads=False,
                           disable_bc_correction=False,
-                          added_demultiplex_field=None):
+                          added_demultiplex_field=None,
+                          processes=1):
     """ Main program function for demultiplexing fasta sequence data
 
     file_data:  dict of open file objects, contains input fasta, qual, and
@@ -160,6 +167,8 @@ def demultiplex_sequences(file_data,
     disable_bc_correction:  Only tests for exact matches to barcodes.
     added_demultiplex_field:  Uses data supplied in metadata mapping field
      and demultiplexes according to data in fasta labels.
+    processes:  Number of chunks of sequences to demultiplex at once, in
+     separate processes.
     """
 
     header, mapping_data = check_map(file_data['mapping_file'], barcode_type,
@@ -177,7 +186,7 @@ def demultiplex_sequences(file_data,
         assign_seqs(
             file_data, ids_bcs_added_field, bc_lens, all_bcs, keep_barcode,
             barcode_type, max_bc_errors, start_index, write_unassigned_reads,
-            disable_bc_correction, added_demultiplex_field)
+            disable_bc_correction, added_demultiplex_field, processes)
 
     return log_data, bc_freqs, seq_counts, corrected_bc_count
 
@@ -192,7 +201,9 @@ def assign_seqs(file_data,
                 start_index=1,
                 write_unassigned_reads=False,
                 disable_bc_correction=False,
-                added_demultiplex_field=None):
+                added_demultiplex_field=None,
+                processes=1,
+                chunk_size=10000):
     """ Demultiplexes, writes seqs/qual files, returns log data
 
     file_data:  dict of open file objects, contains input fasta, qual, and
@@ -214,99 +225,196 @@ def assign_seqs(file_data,
      and demultiplexes according to data in fasta labels.
     save_barcode_frequencies:  Saves the frequencies of barcode sequences in
      a separate output file.
+    processes:  Number of chunks of sequences to demultiplex at once, in
+     separate processes.
+    chunk_size:  Number of sequences in each chunk.
     """
 
     log_data = initialize_log_data(ids_bcs_added_field)
     bc_freqs = defaultdict(int)
 
     seq_counts = 0
-    enum_val = start_index
     corrected_bc_count = [0, 0]
 
+    settings = (ids_bcs_added_field, bc_lens, all_bcs, keep_barcode,
+                barcode_type, max_bc_errors, write_unassigned_reads,
+                disable_bc_correction, added_demultiplex_field)
+    jobs = iter_assign_seqs_jobs(iter_seq_records(file_data), start_index,
+                                 settings, chunk_size)
+
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        while True:
+            # Hand out a few chunks per process at a time, so that reads
+            # waiting to be demultiplexed don't pile up in memory
+            curr_jobs = list(islice(jobs, 2 * processes))
+            if not curr_jobs:
+                break
+            if pool is None:
+                results = imap(_assign_seqs_chunk, curr_jobs)
+            else:
+                results = pool.imap(_assign_seqs_chunk, curr_jobs)
+
+            for outputs, chunk_log_data, chunk_bc_freqs, chunk_seq_counts,\
+                    chunk_corrected_bc_count in results:
+                for output_key, output_data in outputs.items():
+                    file_data[output_key].write(output_data)
+                for log_id, curr_count in chunk_log_data.items():
+                    log_data[log_id] += curr_count
+                for bc, curr_count in chunk_bc_freqs:
+                    bc_freqs[bc] += curr_count
+                seq_counts += chunk_seq_counts
+                corrected_bc_count[0] += chunk_corrected_bc_count[0]
+                corrected_bc_count[1] += chunk_corrected_bc_count[1]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return log_data, bc_freqs, seq_counts, corrected_bc_count
+
+
+def iter_seq_records(file_data):
+    """ Yields (fasta label, fasta seq, qual scores) for each input sequence
+
+    file_data:  dict of open file objects, contains input fasta and qual
+     files. Qual scores are None if there are no qual files.
+    """
+
     if file_data['qual_files']:
         for curr_fasta, curr_qual in zip(file_data['fasta_files'],
                                          file_data['qual_files']):
             for fasta_data, qual_data in izip(parse_fasta(curr_fasta),
                                               MinimalQualParser(curr_qual, full_header=True)):
-
-                seq_counts += 1
                 fasta_label, fasta_seq = fasta_data
                 qual_label, qual_seq = qual_data
-
-                bc, corrected_bc, num_errors, added_field =\
-                    get_demultiplex_data(ids_bcs_added_field,
-                                         fasta_label, fasta_seq, bc_lens, all_bcs, barcode_type,
-                                         max_bc_errors, disable_bc_correction, added_demultiplex_field)
-
-                bc_freqs[bc] += 1
-
-                sample_id, log_id, bc_corrected_result =\
-                    get_output_ids(ids_bcs_added_field,
-                                   corrected_bc, num_errors, added_field, max_bc_errors,
-                                   enum_val)
-                if bc_corrected_result == 'corrected':
-                    corrected_bc_count[0] += 1
-                if bc_corrected_result == 'not_corrected':
-                    corrected_bc_count[1] += 1
-
-                label_line = get_label_line(sample_id, fasta_label, bc,
-                                            corrected_bc, num_errors)
-
-                if sample_id.startswith("Unassigned") and\
-                        write_unassigned_reads:
-                    write_fasta_line(file_data['unassigned_seqs_f'],
-                                     fasta_seq, label_line, True, len(bc))
-                    write_qual_line(file_data['unassigned_qual_f'],
-                                    list(qual_seq), label_line, True, len(bc))
-                elif not sample_id.startswith("Unassigned"):
-                    write_fasta_line(file_data['demultiplexed_seqs_f'],
-                                     fasta_seq, label_line, keep_barcode, len(bc))
-                    write_qual_line(file_data['demultiplexed_qual_f'],
-                                    list(qual_seq), label_line, keep_barcode, len(bc))
-
-                if log_id:
-                    log_data[log_id] += 1
-
-                enum_val += 1
-
+                yield fasta_label, fasta_seq, qual_seq
     else:
         for curr_fasta in file_data['fasta_files']:
             for fasta_label, fasta_seq in parse_fasta(curr_fasta):
-                seq_counts += 1
-                bc, corrected_bc, num_errors, added_field =\
-                    get_demultiplex_data(ids_bcs_added_field,
-                                         fasta_label, fasta_seq, bc_lens, all_bcs, barcode_type,
-                                         max_bc_errors, disable_bc_correction, added_demultiplex_field)
+                yield fasta_label, fasta_seq, None
 
-                bc_freqs[bc] += 1
 
-                sample_id, log_id, bc_corrected_result =\
-                    get_output_ids(ids_bcs_added_field,
-                                   corrected_bc, num_errors, added_field, max_bc_errors,
-                                   enum_val)
+def iter_assign_seqs_jobs(seq_records,
+                          start_index,
+                          settings,
+                          chunk_size=10000):
+    """ Splits sequence records into chunks to demultiplex separately
 
-                if bc_corrected_result == 'corrected':
-                    corrected_bc_count[0] += 1
-                if bc_corrected_result == 'not_corrected':
-                    corrected_bc_count[1] += 1
+    seq_records:  iterable of (fasta label, fasta seq, qual scores)
+    start_index:  Specifies the first number used to enumerate output sequences.
+    settings:  tuple of the arguments of assign_seqs_chunk following enum_val
+    chunk_size:  number of sequences in each chunk
 
-                label_line = get_label_line(sample_id, fasta_label, bc,
-                                            corrected_bc, num_errors)
+    Yields (chunk records, enum_val, settings) tuples, where enum_val is
+     the number of the first sequence of the chunk, so that sequences are
+     numbered as if they were demultiplexed one after another.
+    """
 
-                if sample_id.startswith("Unassigned") and\
-                        write_unassigned_reads:
-                    write_fasta_line(file_data['unassigned_seqs_f'],
-                                     fasta_seq, label_line, True, len(bc))
-                elif not sample_id.startswith("Unassigned"):
-                    write_fasta_line(file_data['demultiplexed_seqs_f'],
-                                     fasta_seq, label_line, keep_barcode, len(bc))
+    enum_val = start_index
+    while True:
+        records = list(islice(seq_records, chunk_size))
+        if not records:
+            break
+        yield records, enum_val, settings
+        enum_val += len(records)
+
+
+def _assign_seqs_chunk(args):
+    """ Pool.imap wrapper around assign_seqs_chunk """
+    records, enum_val, settings = args
+    return assign_seqs_chunk(records, enum_val, *settings)
+
+
+def assign_seqs_chunk(records,
+                      enum_val,
+                      ids_bcs_added_field,
+                      bc_lens,
+                      all_bcs,
+                      keep_barcode=False,
+                      barcode_type="golay_12",
+                      max_bc_errors=1.5,
+                      write_unassigned_reads=False,
+                      disable_bc_correction=False,
+                      added_demultiplex_field=None):
+    """ Demultiplexes a chunk of sequences, returns output and log data
+
+    records:  list of (fasta label, fasta seq, qual scores) tuples, with
+     qual scores of None if there are no qual files.
+    enum_val:  Number used to enumerate the first sequence of the chunk.
+    Other arguments are as for assign_seqs.
+
+    Returns a dict of file_data output key: data to write to that file, the
+     log_data of the chunk, a list of (barcode, count) in the order barcodes
+     were found, and the seq_counts and corrected_bc_count of the chunk.
+    Barcodes are looked up once per distinct barcode read (and added
+     demultiplex field) in the chunk.
+    """
 
-                if log_id:
-                    log_data[log_id] += 1
+    log_data = defaultdict(int)
+    # Barcodes are kept in the order they are found, so that merged barcode
+    # frequencies are ordered as if all sequences were demultiplexed at once
+    bc_freqs = OrderedDict()
+    corrected_bc_count = [0, 0]
+    outputs = defaultdict(StringIO)
 
-                enum_val += 1
+    bc_cache = {}
+    max_bc_len = max(bc_lens)
 
-    return log_data, bc_freqs, seq_counts, corrected_bc_count
+    for fasta_label, fasta_seq, qual_seq in records:
+        # The barcode only depends on the start of the sequence, and on the
+        # added demultiplex field found in the label
+        bc_key = fasta_seq[0:max_bc_len]
+        if added_demultiplex_field:
+            bc_key = bc_key, get_added_demultiplex_field(
+                ids_bcs_added_field, fasta_label, added_demultiplex_field)
+        try:
+            bc, corrected_bc, num_errors, added_field = bc_cache[bc_key]
+        except KeyError:
+            bc, corrected_bc, num_errors, added_field =\
+                get_demultiplex_data(ids_bcs_added_field,
+                                     fasta_label, fasta_seq, bc_lens, all_bcs, barcode_type,
+                                     max_bc_errors, disable_bc_correction, added_demultiplex_field)
+            bc_cache[bc_key] = bc, corrected_bc, num_errors, added_field
+
+        bc_freqs[bc] = bc_freqs.get(bc, 0) + 1
+
+        sample_id, log_id, bc_corrected_result =\
+            get_output_ids(ids_bcs_added_field,
+                           corrected_bc, num_errors, added_field, max_bc_errors,
+                           enum_val)
+        if bc_corrected_result == 'corrected':
+            corrected_bc_count[0] += 1
+        if bc_corrected_result == 'not_corrected':
+            corrected_bc_count[1] += 1
+
+        label_line = get_label_line(sample_id, fasta_label, bc,
+                                    corrected_bc, num_errors)
+
+        if sample_id.startswith("Unassigned") and\
+                write_unassigned_reads:
+            write_fasta_line(outputs['unassigned_seqs_f'],
+                             fasta_seq, label_line, True, len(bc))
+            if qual_seq is not None:
+                write_qual_line(outputs['unassigned_qual_f'],
+                                qual_seq.tolist(), label_line, True, len(bc))
+        elif not sample_id.startswith("Unassigned"):
+            write_fasta_line(outputs['demultiplexed_seqs_f'],
+                             fasta_seq, label_line, keep_barcode, len(bc))
+            if qual_seq is not None:
+                write_qual_line(outputs['demultiplexed_qual_f'],
+                                qual_seq.tolist(), label_line, keep_barcode, len(bc))
+
+        if log_id:
+            log_data[log_id] += 1
+
+        enum_val += 1
+
+    outputs = dict((output_key, output_f.getvalue())
+                   for output_key, output_f in outputs.items())
+
+    return outputs, dict(log_data), bc_freqs.items(), len(records),\
+        corrected_bc_count
 
 
 def get_output_ids(ids_bcs_added_field,
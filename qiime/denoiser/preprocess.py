@@ -20,9 +20,10 @@ from tempfile import mkstemp
 
 from skbio.parse.sequences import parse_fasta
 from bfillings.denoiser import (Flowgram, build_averaged_flowgram,
-                             lazy_parse_sff_handle, build_prefix_map)
+                             lazy_parse_sff_handle)
 
 from qiime.util import load_qiime_config
+from qiime.prefix_map import build_prefix_map
 from qiime.denoiser.cluster_utils import submit_jobs
 from qiime.denoiser.flowgram_filter import cleanup_sff,\
     truncate_flowgrams_in_SFF, extract_barcodes_from_mapping
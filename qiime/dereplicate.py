@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Dereplication of sequence collections that may not fit in memory.
+
+Sequences are keyed on their 128-bit (md5) digest rather than on the
+sequences themselves. Whenever max_seqs_in_memory records have been
+collected they are sorted and spilled to a temporary file, and the sorted
+runs are then merged, so peak memory use is bounded by max_seqs_in_memory
+regardless of the number of input sequences.
+"""
+
+from cPickle import dump, load, HIGHEST_PROTOCOL
+from hashlib import md5
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
+from os import close, remove
+from tempfile import mkstemp, TemporaryFile
+
+default_max_seqs_in_memory = 500000
+
+
+class _Descending(object):
+
+    """Wraps a record so that heapq.merge yields records in descending order
+    """
+    __slots__ = ['Record']
+
+    def __init__(self, record):
+        self.Record = record
+
+    def __lt__(self, other):
+        return self.Record > other.Record
+
+
+def _write_run(records, tmp_dir):
+    """Write sorted records to a temp file, returning the filepath"""
+    fd, run_fp = mkstemp(prefix='qiime_dereplicate_', suffix='.run',
+                         dir=tmp_dir)
+    close(fd)
+    run_f = open(run_fp, 'wb')
+    for record in records:
+        dump(record, run_f, HIGHEST_PROTOCOL)
+    run_f.close()
+    return run_fp
+
+
+def _read_run(run_fp):
+    """Yield the records in a run file, deleting it once it's read"""
+    run_f = open(run_fp, 'rb')
+    try:
+        while True:
+            yield load(run_f)
+    except EOFError:
+        pass
+    finally:
+        run_f.close()
+        remove(run_fp)
+
+
+def external_sort(records, max_records_in_memory=default_max_seqs_in_memory,
+                  reverse=False, tmp_dir=None):
+    """Yield records (tuples) in sorted order, spilling to disk as needed
+
+    At most max_records_in_memory records are held in memory at once; if
+    there are more than this, sorted runs are written to tmp_dir and merged.
+    """
+    run_fps = []
+    buffered = []
+    try:
+        for record in records:
+            buffered.append(record)
+            if len(buffered) >= max_records_in_memory:
+                buffered.sort(reverse=reverse)
+                run_fps.append(_write_run(buffered, tmp_dir))
+                buffered = []
+        buffered.sort(reverse=reverse)
+    except:
+        for run_fp in run_fps:
+            remove(run_fp)
+        raise
+
+    if not run_fps:
+        for record in buffered:
+            yield record
+        return
+
+    runs = [_read_run(run_fp) for run_fp in run_fps] + [iter(buffered)]
+    if reverse:
+        for wrapped in merge(*[(_Descending(r) for r in run)
+                               for run in runs]):
+            yield wrapped.Record
+    else:
+        for record in merge(*runs):
+            yield record
+
+
+def dereplicate_seqs(seqs, unique_seqs_f=None, seq_id_map_f=None,
+                     sorted_seqs_f=None,
+                     sort_by_abundance=True,
+                     max_seqs_in_memory=default_max_seqs_in_memory,
+                     tmp_dir=None, unique_id_prefix='QiimeExactMatch.'):
+    """Collapse identical sequences in seqs, using bounded memory
+
+    seqs: (label, seq) pairs (e.g., from parse_fasta)
+    unique_seqs_f: if provided, one fasta record is written here for each
+     unique sequence, labelled unique_id_prefix + the first seq id (the
+     first word of the label) with that sequence
+    seq_id_map_f: if provided, the exact match map is written here, with
+     one tab-separated line per unique sequence: the unique sequence's
+     label followed by the ids of all sequences that are identical to it
+     (in input order)
+    sorted_seqs_f: if provided, all of the input records are written
+     here, grouped by sequence
+    sort_by_abundance: if True, unique sequences (and the groups in
+     sorted_seqs_f) are written in order of decreasing abundance, with
+     ties broken by sequence (as in qiime.sort.sort_fasta_by_abundance);
+     otherwise they are written in the order they first appear in seqs
+    max_seqs_in_memory: maximum number of records held in memory by
+     each external sort
+
+    Returns the number of unique sequences.
+    """
+    def digested_seqs():
+        for i, (label, seq) in enumerate(seqs):
+            yield md5(seq).digest(), i, label, seq
+
+    if sorted_seqs_f is not None:
+        # full labels for each group are written here as groups are
+        # collapsed, and read back when the groups are written out
+        labels_f = TemporaryFile(prefix='qiime_dereplicate_', dir=tmp_dir)
+    else:
+        labels_f = None
+
+    def unique_seqs():
+        for digest, group in groupby(
+                external_sort(digested_seqs(), max_seqs_in_memory,
+                              tmp_dir=tmp_dir),
+                key=itemgetter(0)):
+            count = 0
+            labels_offset = labels_f.tell() if labels_f is not None else None
+            for _, i, label, seq in group:
+                seq_id = label.split()[0]
+                if count == 0:
+                    first_index = i
+                    unique_id = '%s%s' % (unique_id_prefix, seq_id)
+                    if seq_id_map_f is not None:
+                        seq_id_map_f.write(unique_id)
+                if seq_id_map_f is not None:
+                    seq_id_map_f.write('\t%s' % seq_id)
+                if labels_f is not None:
+                    labels_f.write('%s\n' % label)
+                count += 1
+            if seq_id_map_f is not None:
+                seq_id_map_f.write('\n')
+            if sort_by_abundance:
+                yield count, seq, first_index, unique_id, labels_offset
+            else:
+                yield first_index, count, seq, unique_id, labels_offset
+
+    if sort_by_abundance:
+        ordered = ((count, seq, unique_id, labels_offset)
+                   for count, seq, first_index, unique_id, labels_offset
+                   in external_sort(unique_seqs(), max_seqs_in_memory,
+                                    reverse=True, tmp_dir=tmp_dir))
+    else:
+        ordered = ((count, seq, unique_id, labels_offset)
+                   for first_index, count, seq, unique_id, labels_offset
+                   in external_sort(unique_seqs(), max_seqs_in_memory,
+                                    tmp_dir=tmp_dir))
+
+    num_unique = 0
+    for count, seq, unique_id, labels_offset in ordered:
+        if unique_seqs_f is not None:
+            unique_seqs_f.write('>%s\n%s\n' % (unique_id, seq))
+        if labels_f is not None:
+            labels_f.seek(labels_offset)
+            for j in range(count):
+                sorted_seqs_f.write('>%s\n%s\n' % (labels_f.readline()[:-1],
+                                                   seq))
+        num_unique += 1
+
+    if labels_f is not None:
+        labels_f.close()
+    return num_unique
@@ -11,22 +11,33 @@ __email__ = "william.a.walters@gmail.com"
 
 import numpy as np
 
-from string import upper
-from itertools import izip, cycle
+from string import maketrans, upper
+from itertools import islice, izip, repeat
+from operator import add
 from os.path import join
 from os import rename
 from re import compile
 
-from skbio.parse.sequences import parse_fastq
 from skbio.sequence import DNA
 from skbio.format.sequences import format_fastq_record
 
 from qiime.check_id_map import process_id_map
 from qiime.split_libraries_fastq import (check_header_match_pre180,
-                                         check_header_match_180_or_later)
+                                         check_header_match_180_or_later,
+                                         parse_fastq_records)
 from qiime.parse import is_casava_v180_or_later
+from qiime.pattern_matcher import PatternMatcher
 from qiime.pycogent_backports.fastq import FastqParseError
 
+# number of reads (or pairs of reads) that are processed and written together
+extract_barcodes_block_size = 4096
+
+# translation table complementing each character that DNA can complement
+_complement_map = DNA.complement_map()
+_complement_chars = ''.join(_complement_map)
+_complement_table = maketrans(_complement_chars,
+                              ''.join(_complement_map.values()))
+
 
 def extract_barcodes(fastq1,
                      fastq2=None,
@@ -76,7 +87,8 @@ def extract_barcodes(fastq1,
     if attempt_read_orientation:
         header, mapping_data, run_description, errors, warnings =\
             process_id_map(map_fp)
-        forward_primers, reverse_primers = get_primers(header, mapping_data)
+        forward_primers, reverse_primers = get_primer_matchers(header,
+                                                               mapping_data)
         output_bc_not_oriented = open(join(output_dir,
                                            "barcodes_not_oriented.fastq.incomplete"), "w")
         fastq1_out_not_oriented = open(join(output_dir,
@@ -103,53 +115,65 @@ def extract_barcodes(fastq1,
         output_fastq1 = None
         output_fastq2 = None
 
+    check_header_match_f = get_casava_version(fastq1)
+
+    header_index = 0
+
+    reads1 = parse_fastq_records(fastq1)
     if not fastq2:
-        fastq2 = cycle(["@", "AAAAAAAAAAAA", "+", "AAAAAAAAAAAA"])
+        reads2 = repeat(("", "AAAAAAAAAAAA", "AAAAAAAAAAAA"))
         not_paired = True
     else:
+        reads2 = parse_fastq_records(fastq2)
         not_paired = False
+    read_pairs = izip(reads1, reads2)
 
-    check_header_match_f = get_casava_version(fastq1)
+    # reads are processed in blocks, so that barcodes are reverse
+    # complemented and output is written for many reads at once
+    while True:
+        read_pairs_block = list(islice(read_pairs,
+                                       extract_barcodes_block_size))
+        if not read_pairs_block:
+            break
 
-    header_index = 0
-
-    for read1_data, read2_data in izip(
-            parse_fastq(fastq1, strict=False, enforce_qual_range=False),
-            parse_fastq(fastq2, strict=False, enforce_qual_range=False)):
         if not disable_header_match:
-            if not check_header_match_f(read1_data[header_index],
-                                        read2_data[header_index]):
-                raise FastqParseError("Headers of read1 and read2 do not match. Can't continue. "
-                                      "Confirm that the fastq sequences that you are "
-                                      "passing match one another. --disable_header_match can be "
-                                      "used to suppress header checks.")
+            for read1_data, read2_data in read_pairs_block:
+                if not check_header_match_f(read1_data[header_index],
+                                            read2_data[header_index]):
+                    raise FastqParseError("Headers of read1 and read2 do not match. Can't continue. "
+                                          "Confirm that the fastq sequences that you are "
+                                          "passing match one another. --disable_header_match can be "
+                                          "used to suppress header checks.")
 
         if input_type == "barcode_single_end":
-            process_barcode_single_end_data(read1_data, output_bc_fastq,
-                                            output_fastq1, bc1_len, rev_comp_bc1)
+            process_barcode_single_end_reads(
+                [read1_data for read1_data, _ in read_pairs_block],
+                output_bc_fastq, output_fastq1, bc1_len, rev_comp_bc1)
 
         elif input_type == "barcode_paired_end":
-            process_barcode_paired_end_data(read1_data, read2_data,
-                                            output_bc_fastq, output_fastq1, output_fastq2, bc1_len, bc2_len,
-                                            rev_comp_bc1, rev_comp_bc2, attempt_read_orientation,
-                                            forward_primers, reverse_primers, output_bc_not_oriented,
-                                            fastq1_out_not_oriented, fastq2_out_not_oriented)
+            process_barcode_paired_end_reads(read_pairs_block,
+                                             output_bc_fastq, output_fastq1, output_fastq2, bc1_len, bc2_len,
+                                             rev_comp_bc1, rev_comp_bc2, attempt_read_orientation,
+                                             forward_primers, reverse_primers, output_bc_not_oriented,
+                                             fastq1_out_not_oriented, fastq2_out_not_oriented)
 
         elif input_type == "barcode_paired_stitched":
-            process_barcode_paired_stitched(read1_data,
-                                            output_bc_fastq, output_fastq1, bc1_len, bc2_len,
-                                            rev_comp_bc1, rev_comp_bc2, attempt_read_orientation,
-                                            forward_primers, reverse_primers, output_bc_not_oriented,
-                                            fastq1_out_not_oriented, switch_bc_order)
+            process_barcode_paired_stitched_reads(
+                [read1_data for read1_data, _ in read_pairs_block],
+                output_bc_fastq, output_fastq1, bc1_len, bc2_len,
+                rev_comp_bc1, rev_comp_bc2, attempt_read_orientation,
+                forward_primers, reverse_primers, output_bc_not_oriented,
+                fastq1_out_not_oriented, switch_bc_order)
 
         elif input_type == "barcode_in_label":
-            if not_paired:
-                curr_read2_data = False
-            else:
-                curr_read2_data = read2_data
-            process_barcode_in_label(read1_data, curr_read2_data,
-                                     output_bc_fastq, bc1_len, bc2_len,
-                                     rev_comp_bc1, rev_comp_bc2, char_delineator)
+            for read1_data, read2_data in read_pairs_block:
+                if not_paired:
+                    curr_read2_data = False
+                else:
+                    curr_read2_data = read2_data
+                process_barcode_in_label(read1_data, curr_read2_data,
+                                         output_bc_fastq, bc1_len, bc2_len,
+                                         rev_comp_bc1, rev_comp_bc2, char_delineator)
 
     output_bc_fastq.close()
     rename(output_bc_fastq.name, join(output_dir, "barcodes.fastq"))
@@ -191,6 +215,94 @@ def get_casava_version(fastq1):
     return check_header_match_f
 
 
+def reverse_complement_seqs(seqs):
+    """ Returns the reverse complements of seqs
+
+    seqs: list of DNA sequence strings
+
+    The sequences are complemented with a single str.translate of the
+        joined sequences, and reversing the joined complements reverses both
+        the order of the sequences and each sequence. Raises the
+        BiologicalSequenceError that DNA.rc would if a sequence contains a
+        character that can't be complemented.
+    """
+    if not seqs:
+        return []
+    joined_seqs = '\n'.join(seqs)
+    if joined_seqs.translate(None, _complement_chars + '\n'):
+        for seq in seqs:
+            DNA(seq).rc()
+    return joined_seqs.translate(_complement_table)[::-1].split('\n')[::-1]
+
+
+def _get_ascii_qual_read(read_data):
+    """ Returns read_data with its quality scores as a phred+33 string """
+    return (read_data[0], read_data[1],
+            (np.asarray(read_data[2], dtype=np.int8) + 33).tostring())
+
+
+def _write_fastq_records(output, headers, seqs, quals):
+    """ Writes fastq records with phred+33 quality strings in one write """
+    output.write(''.join(['@%s\n%s\n+\n%s\n' % record
+                          for record in izip(headers, seqs, quals)]))
+
+
+def _get_barcodes(seqs, quals, bc_slice, rev_comp_bc):
+    """ Returns the barcodes and barcode quality strings sliced from reads
+
+    seqs: sequences of the reads
+    quals: quality strings of the reads
+    bc_slice: slice of each read that is its barcode
+    rev_comp_bc: reverse complement the barcodes (and reverse their quality
+        strings).
+    """
+    bc_reads = [seq[bc_slice] for seq in seqs]
+    bc_quals = [qual[bc_slice] for qual in quals]
+    if rev_comp_bc:
+        bc_reads = reverse_complement_seqs(bc_reads)
+        bc_quals = [bc_qual[::-1] for bc_qual in bc_quals]
+    return bc_reads, bc_quals
+
+
+def _search_primers(primers, seq):
+    """ Returns True if any of primers is found in seq """
+    for curr_primer in primers:
+        if curr_primer.search(seq):
+            return True
+    return False
+
+
+def get_paired_read_orientation(read1_seq,
+                                read2_seq,
+                                forward_primers,
+                                reverse_primers):
+    """ Returns True if read 1 is the forward read, False if read 2 is
+
+    read1_seq: sequence of read 1
+    read2_seq: sequence of read 2
+    forward_primers: list of regular expression generators (or of
+        PatternMatchers, see get_primer_matchers), forward primers
+    reverse_primers: list of regular expression generators (or of
+        PatternMatchers), reverse primers
+
+    The first primer found decides the orientation, checking each forward
+        primer in read 1 and then read 2 before any reverse primers. Returns
+        None if no primer is found in either read.
+    """
+
+    for curr_primer in forward_primers:
+        if curr_primer.search(read1_seq):
+            return True
+        if curr_primer.search(read2_seq):
+            return False
+    for curr_primer in reverse_primers:
+        if curr_primer.search(read1_seq):
+            return False
+        if curr_primer.search(read2_seq):
+            return True
+    return None
+
+
 def process_barcode_single_end_data(read1_data,
                                     output_bc_fastq,
                                     output_fastq1,
@@ -205,22 +317,38 @@ def process_barcode_single_end_data(read1_data,
     rev_comp_bc1: reverse complement barcode before writing.
     """
 
-    header_index = 0
-    sequence_index = 1
-    quality_index = 2
+    process_barcode_single_end_reads([_get_ascii_qual_read(read1_data)],
+                                     output_bc_fastq, output_fastq1, bc1_len,
+                                     rev_comp_bc1)
 
-    bc_read = read1_data[sequence_index][:bc1_len]
-    bc_qual = read1_data[quality_index][:bc1_len]
-    if rev_comp_bc1:
-        bc_read = str(DNA(bc_read).rc())
-        bc_qual = bc_qual[::-1]
+    return
 
-    bc_lines = format_fastq_record(read1_data[header_index], bc_read, bc_qual)
-    output_bc_fastq.write(bc_lines)
-    seq_lines = format_fastq_record(read1_data[header_index],
-                                    read1_data[sequence_index][bc1_len:],
-                                    read1_data[quality_index][bc1_len:])
-    output_fastq1.write(seq_lines)
+
+def process_barcode_single_end_reads(reads,
+                                     output_bc_fastq,
+                                     output_fastq1,
+                                     bc1_len=6,
+                                     rev_comp_bc1=False):
+    """ Processes, writes single-end barcode data, parsed sequences of reads
+
+    reads: list of (header, read, quality string) tuples, with phred+33
+        quality strings as returned by parse_fastq_records
+    output_bc_fastq: open output fastq filepath
+    output_fastq1: open output fastq reads filepath
+    bc1_len: length of barcode to remove from beginning of data
+    rev_comp_bc1: reverse complement barcode before writing.
+    """
+
+    if not reads:
+        return
+    headers, seqs, quals = zip(*reads)
+
+    bc_reads, bc_quals = _get_barcodes(seqs, quals, slice(None, bc1_len),
+                                       rev_comp_bc1)
+    _write_fastq_records(output_bc_fastq, headers, bc_reads, bc_quals)
+    _write_fastq_records(output_fastq1, headers,
+                         [seq[bc1_len:] for seq in seqs],
+                         [qual[bc1_len:] for qual in quals])
 
     return
 
@@ -258,8 +386,10 @@ def process_barcode_paired_end_data(read1_data,
         orientation) the read will either be written to the forward (read 1) or
         reverse (read 2) reads for the case of paired files, or the read will be
         reverse complemented in the case of stitched reads.
-    forward_primers: list of regular expression generators, forward primers
-    reverse_primers: list of regular expression generators, reverse primers
+    forward_primers: list of regular expression generators (or of
+        PatternMatchers, see get_primer_matchers), forward primers
+    reverse_primers: list of regular expression generators (or of
+        PatternMatchers), reverse primers
     output_bc_not_oriented: Barcode output from reads that are not oriented
     fastq1_out_not_oriented: Open filepath to write reads 1 where primers
         can't be found when attempt_read_orientation is True.
@@ -267,78 +397,92 @@ def process_barcode_paired_end_data(read1_data,
         can't be found when attempt_read_orientation is True.
     """
 
-    header_index = 0
-    sequence_index = 1
-    quality_index = 2
+    process_barcode_paired_end_reads(
+        [(_get_ascii_qual_read(read1_data), _get_ascii_qual_read(read2_data))],
+        output_bc_fastq, output_fastq1, output_fastq2, bc1_len, bc2_len,
+        rev_comp_bc1, rev_comp_bc2, attempt_read_orientation, forward_primers,
+        reverse_primers, output_bc_not_oriented, fastq1_out_not_oriented,
+        fastq2_out_not_oriented)
+
+    return
+
+
+def process_barcode_paired_end_reads(read_pairs,
+                                     output_bc_fastq,
+                                     output_fastq1,
+                                     output_fastq2,
+                                     bc1_len=6,
+                                     bc2_len=6,
+                                     rev_comp_bc1=False,
+                                     rev_comp_bc2=False,
+                                     attempt_read_orientation=False,
+                                     forward_primers=None,
+                                     reverse_primers=None,
+                                     output_bc_not_oriented=None,
+                                     fastq1_out_not_oriented=None,
+                                     fastq2_out_not_oriented=None):
+    """ Processes, writes paired-end barcode data, parsed sequences of reads
+
+    read_pairs: list of (read 1, read 2) pairs, each read a (header, read,
+        quality string) tuple as returned by parse_fastq_records
+
+    The remaining parameters are those of process_barcode_paired_end_data.
+    """
 
-    found_primer_match = False
-    # Break from orientation search as soon as a match is found
     if attempt_read_orientation:
-        # First check forward primers
-        for curr_primer in forward_primers:
-            if curr_primer.search(read1_data[sequence_index]):
-                read1 = read1_data
-                read2 = read2_data
-                found_primer_match = True
-                break
-            if curr_primer.search(read2_data[sequence_index]):
-                read1 = read2_data
-                read2 = read1_data
-                found_primer_match = True
-                break
-        # Check reverse primers if forward primers not found
-        if not found_primer_match:
-            for curr_primer in reverse_primers:
-                if curr_primer.search(read1_data[sequence_index]):
-                    read1 = read2_data
-                    read2 = read1_data
-                    found_primer_match = True
-                    break
-                if curr_primer.search(read2_data[sequence_index]):
-                    read1 = read1_data
-                    read2 = read2_data
-                    found_primer_match = True
-                    break
-    else:
-        read1 = read1_data
-        read2 = read2_data
-
-    if not found_primer_match and attempt_read_orientation:
-        read1 = read1_data
-        read2 = read2_data
-        output_bc = output_bc_not_oriented
-        output_read1 = fastq1_out_not_oriented
-        output_read2 = fastq2_out_not_oriented
+        oriented_pairs = []
+        not_oriented_pairs = []
+        for read1_data, read2_data in read_pairs:
+            read1_is_forward = get_paired_read_orientation(read1_data[1],
+                                                           read2_data[1], forward_primers, reverse_primers)
+            if read1_is_forward is None:
+                not_oriented_pairs.append((read1_data, read2_data))
+            elif read1_is_forward:
+                oriented_pairs.append((read1_data, read2_data))
+            else:
+                oriented_pairs.append((read2_data, read1_data))
+        _write_paired_end_reads(not_oriented_pairs, output_bc_not_oriented,
+                                fastq1_out_not_oriented, fastq2_out_not_oriented, bc1_len,
+                                bc2_len, rev_comp_bc1, rev_comp_bc2)
     else:
-        output_bc = output_bc_fastq
-        output_read1 = output_fastq1
-        output_read2 = output_fastq2
-
-    bc_read1 = read1[sequence_index][0:bc1_len]
-    bc_read2 = read2[sequence_index][0:bc2_len]
-    bc_qual1 = read1[quality_index][0:bc1_len]
-    bc_qual2 = read2[quality_index][0:bc2_len]
-    if rev_comp_bc1:
-        bc_read1 = str(DNA(bc_read1).rc())
-        bc_qual1 = bc_qual1[::-1]
-    if rev_comp_bc2:
-        bc_read2 = str(DNA(bc_read2).rc())
-        bc_qual2 = bc_qual2[::-1]
-
-    bc_lines = format_fastq_record(read1[header_index],
-                                   bc_read1 + bc_read2,
-                                   np.hstack([bc_qual1, bc_qual2]))
-    output_bc.write(bc_lines)
-    seq1_lines = format_fastq_record(read1[header_index],
-                                     read1[sequence_index][bc1_len:], read1[quality_index][bc1_len:])
-    output_read1.write(seq1_lines)
-    seq2_lines = format_fastq_record(read2[header_index],
-                                     read2[sequence_index][bc2_len:], read2[quality_index][bc2_len:])
-    output_read2.write(seq2_lines)
+        oriented_pairs = read_pairs
+
+    _write_paired_end_reads(oriented_pairs, output_bc_fastq, output_fastq1,
+                            output_fastq2, bc1_len, bc2_len, rev_comp_bc1, rev_comp_bc2)
 
     return
 
 
+def _write_paired_end_reads(read_pairs,
+                            output_bc,
+                            output_read1,
+                            output_read2,
+                            bc1_len,
+                            bc2_len,
+                            rev_comp_bc1,
+                            rev_comp_bc2):
+    """ Writes the barcodes and parsed sequences of oriented read pairs """
+
+    if not read_pairs:
+        return
+    reads1, reads2 = zip(*read_pairs)
+    headers1, seqs1, quals1 = zip(*reads1)
+    headers2, seqs2, quals2 = zip(*reads2)
+
+    bc_reads1, bc_quals1 = _get_barcodes(seqs1, quals1, slice(0, bc1_len),
+                                         rev_comp_bc1)
+    bc_reads2, bc_quals2 = _get_barcodes(seqs2, quals2, slice(0, bc2_len),
+                                         rev_comp_bc2)
+    _write_fastq_records(output_bc, headers1, map(add, bc_reads1, bc_reads2),
+                         map(add, bc_quals1, bc_quals2))
+    _write_fastq_records(output_read1, headers1,
+                         [seq[bc1_len:] for seq in seqs1],
+                         [qual[bc1_len:] for qual in quals1])
+    _write_fastq_records(output_read2, headers2,
+                         [seq[bc2_len:] for seq in seqs2],
+                         [qual[bc2_len:] for qual in quals2])
+
+
 def process_barcode_paired_stitched(read_data,
                                     output_bc_fastq,
                                     output_fastq,
@@ -368,8 +512,10 @@ def process_barcode_paired_stitched(read_data,
         orientation) the read will either be written to the forward (read 1) or
         reverse (read 2) reads for the case of paired files, or the read will be
         reverse complemented in the case of stitched reads.
-    forward_primers: list of regular expression generators, forward primers
-    reverse_primers: list of regular expression generators, reverse primers
+    forward_primers: list of regular expression generators (or of
+        PatternMatchers, see get_primer_matchers), forward primers
+    reverse_primers: list of regular expression generators (or of
+        PatternMatchers), reverse primers
     output_bc_not_oriented: Barcode output from reads that are not oriented
     fastq_out_not_oriented: Open filepath to write reads where primers
         can't be found when attempt_read_orientation is True.
@@ -379,60 +525,95 @@ def process_barcode_paired_stitched(read_data,
         orders are dictated by the the parameter chosen for the fastq files.
     """
 
-    header_index = 0
-    sequence_index = 1
-    quality_index = 2
+    process_barcode_paired_stitched_reads([_get_ascii_qual_read(read_data)],
+                                          output_bc_fastq, output_fastq, bc1_len, bc2_len, rev_comp_bc1,
+                                          rev_comp_bc2, attempt_read_orientation, forward_primers,
+                                          reverse_primers, output_bc_not_oriented, fastq_out_not_oriented,
+                                          switch_bc_order)
+
+    return
 
-    read_seq = read_data[sequence_index]
-    read_qual = read_data[quality_index]
 
-    found_primer_match = False
-    # Break from orientation search as soon as a match is found
+def process_barcode_paired_stitched_reads(reads,
+                                          output_bc_fastq,
+                                          output_fastq,
+                                          bc1_len=6,
+                                          bc2_len=6,
+                                          rev_comp_bc1=False,
+                                          rev_comp_bc2=False,
+                                          attempt_read_orientation=False,
+                                          forward_primers=None,
+                                          reverse_primers=None,
+                                          output_bc_not_oriented=None,
+                                          fastq_out_not_oriented=None,
+                                          switch_bc_order=False):
+    """ Processes stitched barcoded reads, writes barcodes, parsed reads
+
+    reads: list of (header, read, quality string) tuples, with phred+33
+        quality strings as returned by parse_fastq_records
+
+    The remaining parameters are those of process_barcode_paired_stitched.
+    """
+
     if attempt_read_orientation:
-        for curr_primer in forward_primers:
-            if curr_primer.search(read_data[sequence_index]):
-                found_primer_match = True
-                break
-        if not found_primer_match:
-            for curr_primer in reverse_primers:
-                if curr_primer.search(read_data[sequence_index]):
-                    read_seq = str(DNA(read_seq).rc())
-                    read_qual = read_qual[::-1]
-                    found_primer_match = True
-                    break
-
-    if not found_primer_match and attempt_read_orientation:
-        output_bc = output_bc_not_oriented
-        output_read = fastq_out_not_oriented
+        oriented_reads = []
+        not_oriented_reads = []
+        # indices in oriented_reads of the reads found in the reverse
+        # orientation, which are reverse complemented together
+        rc_indices = []
+        for read_data in reads:
+            if _search_primers(forward_primers, read_data[1]):
+                oriented_reads.append(read_data)
+            elif _search_primers(reverse_primers, read_data[1]):
+                rc_indices.append(len(oriented_reads))
+                oriented_reads.append(read_data)
+            else:
+                not_oriented_reads.append(read_data)
+        rc_seqs = reverse_complement_seqs([oriented_reads[i][1]
+                                           for i in rc_indices])
+        for i, rc_seq in izip(rc_indices, rc_seqs):
+            header, _, qual = oriented_reads[i]
+            oriented_reads[i] = (header, rc_seq, qual[::-1])
+        _write_stitched_reads(not_oriented_reads, output_bc_not_oriented,
+                              fastq_out_not_oriented, bc1_len, bc2_len, rev_comp_bc1,
+                              rev_comp_bc2, switch_bc_order)
     else:
-        output_bc = output_bc_fastq
-        output_read = output_fastq
+        oriented_reads = reads
 
-    bc_read1 = read_seq[0:bc1_len]
-    bc_read2 = read_seq[-bc2_len:]
-    bc_qual1 = read_qual[0:bc1_len]
-    bc_qual2 = read_qual[-bc2_len:]
+    _write_stitched_reads(oriented_reads, output_bc_fastq, output_fastq,
+                          bc1_len, bc2_len, rev_comp_bc1, rev_comp_bc2, switch_bc_order)
 
-    if rev_comp_bc1:
-        bc_read1 = str(DNA(bc_read1).rc())
-        bc_qual1 = bc_qual1[::-1]
-    if rev_comp_bc2:
-        bc_read2 = str(DNA(bc_read2).rc())
-        bc_qual2 = bc_qual2[::-1]
+    return
 
-    if switch_bc_order:
-        bc_read1, bc_read2 = bc_read2, bc_read1
-        bc_qual1, bc_qual2 = bc_qual2, bc_qual1
 
-    bc_lines = format_fastq_record(read_data[header_index],
-                                   bc_read1 + bc_read2,
-                                   np.hstack([bc_qual1, bc_qual2]))
-    output_bc.write(bc_lines)
-    seq_lines = format_fastq_record(read_data[header_index],
-                                    read_seq[bc1_len:-bc2_len], read_qual[bc1_len:-bc2_len])
-    output_read.write(seq_lines)
+def _write_stitched_reads(reads,
+                          output_bc,
+                          output_read,
+                          bc1_len,
+                          bc2_len,
+                          rev_comp_bc1,
+                          rev_comp_bc2,
+                          switch_bc_order):
+    """ Writes the barcodes and parsed sequences of oriented stitched reads
+    """
+
+    if not reads:
+        return
+    headers, seqs, quals = zip(*reads)
 
-    return
+    bc_reads1, bc_quals1 = _get_barcodes(seqs, quals, slice(0, bc1_len),
+                                         rev_comp_bc1)
+    bc_reads2, bc_quals2 = _get_barcodes(seqs, quals, slice(-bc2_len, None),
+                                         rev_comp_bc2)
+    if switch_bc_order:
+        bc_reads1, bc_reads2 = bc_reads2, bc_reads1
+        bc_quals1, bc_quals2 = bc_quals2, bc_quals1
+
+    _write_fastq_records(output_bc, headers, map(add, bc_reads1, bc_reads2),
+                         map(add, bc_quals1, bc_quals2))
+    _write_fastq_records(output_read, headers,
+                         [seq[bc1_len:-bc2_len] for seq in seqs],
+                         [qual[bc1_len:-bc2_len] for qual in quals])
 
 
 def process_barcode_in_label(read1_data,
@@ -498,13 +679,16 @@ def process_barcode_in_label(read1_data,
     return
 
 
-def get_primers(header,
-                mapping_data):
-    """ Returns lists of forward/reverse primer regular expression generators
+def get_primer_seqs(header,
+                    mapping_data):
+    """ Returns sets of forward/reverse primer sequences
 
     header:  list of strings of header data.
     mapping_data:  list of lists of mapping data
 
+    The forward primers include the reverse complements of the reverse
+    primers, and vice versa. Primers may contain IUPAC degenerate characters.
+
     Will raise error if either the LinkerPrimerSequence or ReversePrimer fields
         are not present
     """
@@ -519,10 +703,6 @@ def get_primers(header,
     else:
         raise IndexError(("Mapping file is missing ReversePrimer field."))
 
-    iupac = {'A': 'A', 'T': 'T', 'G': 'G', 'C': 'C', 'R': '[AG]', 'Y': '[CT]',
-             'S': '[GC]', 'W': '[AT]', 'K': '[GT]', 'M': '[AC]', 'B': '[CGT]',
-             'D': '[AGT]', 'H': '[ACT]', 'V': '[ACG]', 'N': '[ACGT]'}
-
     raw_forward_primers = set([])
     raw_forward_rc_primers = set([])
     raw_reverse_primers = set([])
@@ -550,6 +730,27 @@ def get_primers(header,
     raw_forward_primers.update(raw_reverse_rc_primers)
     raw_reverse_primers.update(raw_forward_rc_primers)
 
+    return raw_forward_primers, raw_reverse_primers
+
+
+def get_primers(header,
+                mapping_data):
+    """ Returns lists of forward/reverse primer regular expression generators
+
+    header:  list of strings of header data.
+    mapping_data:  list of lists of mapping data
+
+    Will raise error if either the LinkerPrimerSequence or ReversePrimer fields
+        are not present
+    """
+
+    iupac = {'A': 'A', 'T': 'T', 'G': 'G', 'C': 'C', 'R': '[AG]', 'Y': '[CT]',
+             'S': '[GC]', 'W': '[AT]', 'K': '[GT]', 'M': '[AC]', 'B': '[CGT]',
+             'D': '[AGT]', 'H': '[ACT]', 'V': '[ACG]', 'N': '[ACGT]'}
+
+    raw_forward_primers, raw_reverse_primers = get_primer_seqs(header,
+                                                               mapping_data)
+
     forward_primers = []
     reverse_primers = []
     for curr_primer in raw_forward_primers:
@@ -560,3 +761,22 @@ def get_primers(header,
                                                 symbol in curr_primer])))
 
     return forward_primers, reverse_primers
+
+
+def get_primer_matchers(header,
+                        mapping_data):
+    """ Returns forward/reverse primer matchers in single item lists
+
+    header:  list of strings of header data.
+    mapping_data:  list of lists of mapping data
+
+    Each list can be passed in place of the list of regular expression
+        generators returned by get_primers: the matcher searches a read for
+        all of the (expanded degenerate) primers in a single pass.
+    """
+
+    raw_forward_primers, raw_reverse_primers = get_primer_seqs(header,
+                                                               mapping_data)
+
+    return ([PatternMatcher(raw_forward_primers, expand_degeneracies=True)],
+            [PatternMatcher(raw_reverse_primers, expand_degeneracies=True)])
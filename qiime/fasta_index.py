@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Random access to the records of (possibly very large) fasta files.
+
+A fasta index maps each sequence id (the first word of the fasta label) to
+the byte offset and length of its record in the fasta file. Sequences are
+then read only when they are requested, from a memory map of the fasta
+file, rather than loading the whole file into a dict. An index can be
+saved as a tab-separated sidecar file (<fasta_fp>.idx by default) so it
+only needs to be built once.
+
+A sample index similarly maps each sample id in a demultiplexed (post-
+split_libraries) fasta or fastq file to the byte ranges of its records
+(<seqs_fp>.sidx by default).
+"""
+
+from mmap import mmap, ACCESS_READ
+from os import stat
+from os.path import exists, getsize
+
+fasta_index_suffix = '.idx'
+sample_index_suffix = '.sidx'
+
+
+def build_fasta_index(fasta_f):
+    """Return {seq_id: (offset, length)} for each record in fasta_f
+
+    fasta_f must be opened in binary mode ('rb') so that offsets are byte
+    offsets. A ValueError is raised if a sequence id occurs more than once,
+    as only one of the records could be indexed.
+    """
+    index = {}
+    seq_id = None
+    start = offset = 0
+    for line in fasta_f:
+        if line.startswith('>'):
+            if seq_id is not None:
+                _add_to_fasta_index(index, seq_id, start, offset - start)
+            label = line[1:].split()
+            seq_id = label[0] if label else ''
+            start = offset
+        offset += len(line)
+    if seq_id is not None:
+        _add_to_fasta_index(index, seq_id, start, offset - start)
+    return index
+
+
+def _add_to_fasta_index(index, seq_id, offset, length):
+    """Add seq_id to index, raising a ValueError if it's already there"""
+    if seq_id in index:
+        raise ValueError("Duplicate sequence id %s (at bytes %d and %d) "
+                         "can't be indexed." % (seq_id, index[seq_id][0],
+                                                offset))
+    index[seq_id] = (offset, length)
+
+
+def parse_fasta_with_offsets(fasta_f):
+    """Yield (label, seq, offset, length) for each record in fasta_f
+
+    As build_fasta_index, but the records are also parsed, so that a fasta
+    file can be indexed in the same pass as it is otherwise processed.
+    fasta_f must be opened in binary mode ('rb').
+    """
+    label = None
+    seq_lines = []
+    start = offset = 0
+    for line in fasta_f:
+        if line.startswith('>'):
+            if label is not None:
+                yield label, ''.join(seq_lines), start, offset - start
+            label = line[1:].strip()
+            seq_lines = []
+            start = offset
+        elif label is not None:
+            seq_lines.append(line.strip())
+        offset += len(line)
+    if label is not None:
+        yield label, ''.join(seq_lines), start, offset - start
+
+
+def parse_fastq_with_offsets(fastq_f):
+    """Yield (label, seq, qual, offset, length) for each record in fastq_f
+
+    Sequences and quality scores may be wrapped over several lines: the
+    sequence ends at the '+' line, and the quality scores end once there
+    are as many of them as there are bases (as a quality line may start
+    with '@'). fastq_f must be opened in binary mode ('rb').
+    """
+    offset = 0
+    lines = iter(fastq_f)
+    for header in lines:
+        if not header.strip():
+            offset += len(header)
+            continue
+        if not header.startswith('@'):
+            raise ValueError("Malformed fastq record at byte %d. Records "
+                             "must start with '@'." % offset)
+        length = len(header)
+        seq_lines = []
+        for line in lines:
+            length += len(line)
+            if line.startswith('+'):
+                break
+            seq_lines.append(line.strip())
+        else:
+            raise ValueError("Incomplete fastq record at byte %d." % offset)
+        seq = ''.join(seq_lines)
+
+        qual_lines = []
+        qual_length = 0
+        # a record with an empty sequence still has a (blank) quality line
+        while qual_length < len(seq) or not qual_lines:
+            try:
+                line = lines.next()
+            except StopIteration:
+                raise ValueError("Incomplete fastq record at byte %d."
+                                 % offset)
+            length += len(line)
+            qual_lines.append(line.strip())
+            qual_length += len(qual_lines[-1])
+        if qual_length != len(seq):
+            raise ValueError("Fastq record at byte %d has %d quality scores "
+                             "for %d bases." % (offset, qual_length,
+                                                len(seq)))
+        yield (header[1:].strip(), seq, ''.join(qual_lines), offset, length)
+        offset += length
+
+
+def sample_id_from_seq_id(seq_id):
+    """Return the sample id of a post-split_libraries sequence id"""
+    return seq_id.split()[0].rsplit('_', 1)[0]
+
+
+class SampleIndexBuilder(object):
+
+    """Accumulates a sample index as the records of a file are read or written
+
+    Consecutive records from the same sample are merged into a single
+    byte range. Index is {sample_id: [(offset, length), ...]}, with each
+    sample's ranges in file order.
+    """
+
+    def __init__(self):
+        self.Index = {}
+        self.Offset = 0
+        self._last_ranges = None
+
+    def add(self, seq_id, length, offset=None):
+        """Add the record for seq_id, of length bytes, at offset
+
+        If offset is not provided, the record is taken to follow the
+        previously added record.
+        """
+        if offset is None:
+            offset = self.Offset
+        ranges = self.Index.setdefault(sample_id_from_seq_id(seq_id), [])
+        if ranges is self._last_ranges and \
+                ranges[-1][0] + ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((offset, length))
+        self._last_ranges = ranges
+        self.Offset = offset + length
+
+
+def build_sample_index(seqs_f, file_type='fasta'):
+    """Return {sample_id: [(offset, length), ...]} for a demultiplexed file
+
+    seqs_f: post-split_libraries fasta or fastq file (sequence ids of the
+     form SampleID_SeqID), opened in binary mode ('rb')
+
+    Consecutive records from the same sample are merged into a single
+    byte range, and each sample's ranges are in file order.
+    """
+    if file_type == 'fasta':
+        records = parse_fasta_with_offsets(seqs_f)
+    elif file_type == 'fastq':
+        records = parse_fastq_with_offsets(seqs_f)
+    else:
+        raise ValueError("file_type must be either fasta or fastq")
+
+    builder = SampleIndexBuilder()
+    for record in records:
+        builder.add(record[0], record[-1], record[-2])
+    return builder.Index
+
+
+def write_sample_index(index, seqs_fp, index_fp):
+    """Write a sample index (built from seqs_fp) to index_fp"""
+    index_f = open(index_fp, 'w')
+    index_f.write('#%s\n' % _fasta_fingerprint(seqs_fp))
+    ranges = [(offset, length, sample_id)
+              for sample_id, sample_ranges in index.iteritems()
+              for offset, length in sample_ranges]
+    ranges.sort()
+    for offset, length, sample_id in ranges:
+        index_f.write('%s\t%d\t%d\n' % (sample_id, offset, length))
+    index_f.close()
+
+
+def parse_sample_index(lines):
+    """Parse a sample index file into {sample_id: [(offset, length), ...]}
+    """
+    index = {}
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        sample_id, offset, length = line.rstrip('\n').split('\t')
+        index.setdefault(sample_id, []).append((int(offset), int(length)))
+    return index
+
+
+def _fasta_fingerprint(fasta_fp):
+    """Return a string identifying the current version of fasta_fp"""
+    fasta_stat = stat(fasta_fp)
+    return '%d\t%d' % (fasta_stat.st_size, int(fasta_stat.st_mtime))
+
+
+def write_fasta_index(index, fasta_fp, index_fp):
+    """Write index (built from fasta_fp) to index_fp"""
+    index_f = open(index_fp, 'w')
+    index_f.write('#%s\n' % _fasta_fingerprint(fasta_fp))
+    for seq_id, (offset, length) in sorted(index.items(),
+                                           key=lambda e: e[1][0]):
+        index_f.write('%s\t%d\t%d\n' % (seq_id, offset, length))
+    index_f.close()
+
+
+def parse_fasta_index(lines):
+    """Parse a fasta index file into {seq_id: (offset, length)}"""
+    index = {}
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        seq_id, offset, length = line.rstrip('\n').split('\t')
+        index[seq_id] = (int(offset), int(length))
+    return index
+
+
+def _fasta_index_is_current(fasta_fp, index_fp):
+    """Return True if index_fp was written for the current fasta_fp"""
+    if not exists(index_fp):
+        return False
+    index_f = open(index_fp, 'U')
+    header = index_f.readline()
+    index_f.close()
+    return header.strip('#\n') == _fasta_fingerprint(fasta_fp)
+
+
+class FastaIndex(object):
+
+    """Read-only, dict-like access to the sequences in a fasta file
+
+    FastaIndex(fasta_fp)[seq_id] returns the sequence whose label starts
+    with seq_id, reading only that record from disk. An up-to-date index
+    file at index_fp (<fasta_fp>.idx by default) is loaded rather than
+    scanning the fasta file; if save_index is True and there is no
+    up-to-date index file, the index that is built is written to index_fp
+    for use by later runs. Sequence ids must be unique (see
+    build_fasta_index).
+    """
+
+    def __init__(self, fasta_fp, index_fp=None, save_index=False):
+        self.FastaFp = fasta_fp
+        if index_fp is None:
+            index_fp = fasta_fp + fasta_index_suffix
+        self.IndexFp = index_fp
+
+        if _fasta_index_is_current(fasta_fp, index_fp):
+            self._index = parse_fasta_index(open(index_fp, 'U'))
+        else:
+            fasta_f = open(fasta_fp, 'rb')
+            self._index = build_fasta_index(fasta_f)
+            fasta_f.close()
+            if save_index:
+                try:
+                    write_fasta_index(self._index, fasta_fp, index_fp)
+                except IOError:
+                    # the index is only an optimization, so it's not an
+                    # error if it can't be saved (e.g., read-only directory)
+                    pass
+
+        self._fasta_f = None
+        self._data = None
+        if getsize(fasta_fp) > 0:
+            self._fasta_f = open(fasta_fp, 'rb')
+            self._data = mmap(self._fasta_f.fileno(), 0, access=ACCESS_READ)
+
+    def close(self):
+        """Release the memory map and file handle"""
+        if self._data is not None:
+            self._data.close()
+            self._fasta_f.close()
+            self._data = self._fasta_f = None
+
+    def _read_record(self, offset, length):
+        """Return (label, seq) for the record at offset"""
+        lines = self._data[offset:offset + length].splitlines()
+        return lines[0][1:].strip(), ''.join([l.strip() for l in lines[1:]])
+
+    def _get_record(self, seq_id):
+        """Return (label, seq) for seq_id"""
+        return self._read_record(*self._index[seq_id])
+
+    def __getitem__(self, seq_id):
+        return self._get_record(seq_id)[1]
+
+    def get(self, seq_id, default=None):
+        try:
+            return self[seq_id]
+        except KeyError:
+            return default
+
+    def get_label(self, seq_id):
+        """Return the full fasta label of seq_id"""
+        return self._get_record(seq_id)[0]
+
+    def __contains__(self, seq_id):
+        return seq_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iteritems(self):
+        """Yield (seq_id, seq) for all sequences, in file order"""
+        for seq_id, (offset, length) in sorted(self._index.items(),
+                                               key=lambda e: e[1][0]):
+            yield seq_id, self._read_record(offset, length)[1]
+
+    def iter_records(self, seq_ids=None):
+        """Yield (label, seq) for seq_ids (default: all) in file order
+
+        Reading the records in the order they appear in the file keeps disk
+        access sequential. seq_ids that aren't in the index are ignored.
+        """
+        if seq_ids is None:
+            seq_ids = self._index
+        offsets = sorted([self._index[seq_id] for seq_id in set(seq_ids)
+                          if seq_id in self._index])
+        for offset, length in offsets:
+            yield self._read_record(offset, length)
+
+
+class SampleIndex(object):
+
+    """Reads the records of selected samples from a demultiplexed file
+
+    The sample index at index_fp (<seqs_fp>.sidx by default) must be up to
+    date with seqs_fp, or a ValueError is raised (use
+    sample_index_is_current to check first). Only the byte ranges holding
+    the records of the requested samples are read from seqs_fp.
+    """
+
+    def __init__(self, seqs_fp, index_fp=None):
+        if index_fp is None:
+            index_fp = seqs_fp + sample_index_suffix
+        if not _fasta_index_is_current(seqs_fp, index_fp):
+            raise ValueError("%s is not an up-to-date sample index for %s."
+                             % (index_fp, seqs_fp))
+        self.SeqsFp = seqs_fp
+        self.IndexFp = index_fp
+        self._index = parse_sample_index(open(index_fp, 'U'))
+
+    def __contains__(self, sample_id):
+        return sample_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def iter_lines(self, sample_ids):
+        """Yield the lines of the records of sample_ids, in file order
+
+        sample_ids that aren't in the index are ignored.
+        """
+        ranges = sorted([r for sample_id in set(sample_ids)
+                         for r in self._index.get(sample_id, [])])
+        seqs_f = open(self.SeqsFp, 'rb')
+        try:
+            for offset, length in ranges:
+                seqs_f.seek(offset)
+                end = offset + length
+                while offset < end:
+                    line = seqs_f.readline()
+                    if not line:
+                        break
+                    offset += len(line)
+                    yield line
+        finally:
+            seqs_f.close()
+
+    def iter_records(self, sample_ids):
+        """Yield (label, seq) for the fasta records of sample_ids"""
+        for label, seq, _, _ in parse_fasta_with_offsets(
+                self.iter_lines(sample_ids)):
+            yield label, seq
+
+
+def sample_index_is_current(seqs_fp, index_fp=None):
+    """Return True if there's an up-to-date sample index for seqs_fp"""
+    if index_fp is None:
+        index_fp = seqs_fp + sample_index_suffix
+    return _fasta_index_is_current(seqs_fp, index_fp)
@@ -23,6 +23,8 @@ from qiime.parse import (parse_distmat, parse_mapping_file,
                          parse_metadata_state_descriptions)
 from qiime.format import format_distance_matrix, format_mapping_file
 from qiime.util import MetadataMap
+from qiime.fasta_index import FastaIndex, SampleIndex
+from qiime.read_store import ReadStore
 
 
 def get_otu_ids_from_taxonomy_f(positive_taxa=None,
@@ -329,7 +331,15 @@ def filter_fasta(input_seqs_f, output_seqs_f, seqs_to_keep, negate=False,
                  seqid_f=None):
     """ Write filtered input_seqs to output_seqs_f which contains only seqs_to_keep
 
-        input_seqs can be the output of parse_fasta or parse_fastq
+        input_seqs can be the output of parse_fasta or parse_fastq, or a
+        qiime.fasta_index.FastaIndex, in which case only the sequences that
+        are kept are read (unless seqid_f is provided: it is passed each
+        full sequence label, so all of the records are read, in file
+        order). input_seqs can also be a
+        qiime.fasta_index.SampleIndex if seqid_f selects sequences by their
+        sample id: seqid_f is then passed each sample id, and only the
+        sequences of the samples that are kept are read. input_seqs can
+        also be a qiime.read_store.ReadStore.
     """
     if seqid_f is None:
         seqs_to_keep_lookup = {}.fromkeys([seq_id.split()[0]
@@ -349,9 +359,19 @@ def filter_fasta(input_seqs_f, output_seqs_f, seqs_to_keep, negate=False,
         else:
             keep_seq = lambda x: not seqid_f(x)
 
-    for seq_id, seq in parse_fasta(input_seqs_f):
-        if keep_seq(seq_id):
+    if isinstance(input_seqs_f, SampleIndex) or \
+            (isinstance(input_seqs_f, FastaIndex) and seqid_f is None):
+        for seq_id, seq in input_seqs_f.iter_records(
+                [seq_id for seq_id in input_seqs_f if keep_seq(seq_id)]):
             output_seqs_f.write('>%s\n%s\n' % (seq_id, seq))
+    else:
+        if isinstance(input_seqs_f, (FastaIndex, ReadStore)):
+            records = input_seqs_f.iter_records()
+        else:
+            records = parse_fasta(input_seqs_f)
+        for seq_id, seq in records:
+            if keep_seq(seq_id):
+                output_seqs_f.write('>%s\n%s\n' % (seq_id, seq))
     output_seqs_f.close()
 
 
@@ -599,9 +619,27 @@ def filter_otus_from_otu_map(input_otu_map_fp,
         and return something).
 
     """
-    results = set()
     output_otu_map_f = open(output_otu_map_fp, 'w')
-    for line in open(input_otu_map_fp, 'U'):
+    results = filter_otu_map_lines(open(input_otu_map_fp, 'U'),
+                                   output_otu_map_f,
+                                   min_count,
+                                   min_sample_count)
+    output_otu_map_f.close()
+    return results
+
+
+def filter_otu_map_lines(otu_map_lines,
+                         output_otu_map_f,
+                         min_count,
+                         min_sample_count=1):
+    """ Write lines of otu_map_lines for otus with at least min_count seqs
+
+        As filter_otus_from_otu_map, but takes an iterable of otu map lines
+        and an open output file, so the otu map can be filtered as it is
+        being generated. Returns the set of retained otu ids.
+    """
+    results = set()
+    for line in otu_map_lines:
         fields = line.strip().split('\t')
         sample_ids = set([e.split('_')[0] for e in fields[1:]])
         # only write this line if the otu has more than n sequences (so
@@ -609,7 +647,6 @@ def filter_otus_from_otu_map(input_otu_map_fp,
         if (len(fields) > min_count) and (len(sample_ids) >= min_sample_count):
             output_otu_map_f.write(line)
             results.add(fields[0].split('\t')[0])
-    output_otu_map_f.close()
     return results
 
 
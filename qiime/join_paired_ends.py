@@ -2,23 +2,311 @@
 
 __author__ = "Mike Robeson"
 __copyright__ = "Copyright 2013, The QIIME Project"
-__credits__ = ["Mike Robeson"]
+__credits__ = ["Mike Robeson", "agent"]
 __license__ = "GPL"
 __version__ = "1.9.1-dev"
 __maintainer__ = "Mike Robeson"
 __email__ = "robesonms@ornl.gov"
 
+from itertools import imap, islice, izip, izip_longest
+from multiprocessing import Pool
+from tempfile import gettempdir
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from skbio.parse.sequences import parse_fastq
 from skbio.format.sequences import format_fastq_record
 from bfillings.fastq_join import FastqJoin, join_paired_end_reads_fastqjoin
 from bfillings.seqprep import SeqPrep, join_paired_end_reads_seqprep
+from qiime.extract_barcodes import reverse_complement_seqs
+from qiime.split_libraries_fastq import (parse_fastq_records,
+                                         _pre180_header_end)
 from qiime.util import qiime_open
 import os
 import gzip
 
+# highest quality score given to a base where the reads overlap
+max_joined_qual = 41
+
+
+def _get_joined_qual_tables(max_qual=max_joined_qual):
+    """Return tables of the quality scores of bases where two reads overlap
+
+    Returns (agree_quals, disagree_quals), which are indexed by the phred+33
+    quality characters (as uint8 codes) of the overlapping bases and hold
+    the phred+33 quality character of the joined base. agree_quals is for
+    bases that agree. disagree_quals is for bases that disagree, where the
+    base with the higher quality score is kept, and is indexed by the higher
+    and then the lower quality character.
+
+    The quality scores are the posterior probabilities that the joined
+    base is wrong, given a uniform prior over the four bases and independent
+    errors in the two reads (Edgar & Flyvbjerg, Bioinformatics 2015).
+    """
+    qual_scores = np.maximum(np.arange(256) - 33, 0)
+    p_error = 10 ** (-qual_scores / 10.0)
+    p1 = p_error[:, np.newaxis]
+    p2 = p_error[np.newaxis, :]
+
+    agree_error = (p1 * p2 / 3) / ((1 - p1) * (1 - p2) + p1 * p2 / 3)
+    # the base of read 1 (with error probability p1) is kept
+    p_kept_base = (1 - p1) * p2 / 3
+    disagree_error = 1 - p_kept_base / (p_kept_base + p1 * (1 - p2) / 3 +
+                                        2 * p1 * p2 / 9)
+
+    tables = []
+    for error in agree_error, disagree_error:
+        with np.errstate(divide='ignore'):
+            quals = np.round(-10 * np.log10(error))
+        tables.append((np.clip(quals, 0, max_qual) + 33).astype(np.uint8))
+    return tuple(tables)
+
+_agree_quals, _disagree_quals = _get_joined_qual_tables()
+
+
+def find_overlap(seq1, seq2, min_overlap=6, perc_max_diff=8):
+    """Return the length of the best overlap of the end of seq1 with seq2
+
+    seq1: sequence of read 1
+    seq2: reverse complemented sequence of read 2
+    min_overlap: minimum allowed overlap
+    perc_max_diff: maximum percentage of mismatches allowed in the overlap
+
+    The mismatches of every possible overlap are counted at once, by
+    comparing the start of seq2 with a (strided, not copied) matrix of the
+    windows of the end of seq1. Of the overlaps with at most perc_max_diff
+    percent mismatches, the one with the lowest (mismatches ** 2 + 1) /
+    length is chosen, as fastq-join chooses it (the longest of those that
+    score the same, as fastq-join tries the longest overlap first and only
+    replaces it with a strictly better one). Returns 0 if the reads don't
+    overlap.
+    """
+    m = min(len(seq1), len(seq2))
+    if m < min_overlap or min_overlap < 1:
+        return 0
+    # the last m bases of seq1, followed by m bases that match nothing, so
+    # that window i overlaps seq2 by m - i bases
+    end1 = np.zeros(2 * m, dtype=np.uint8)
+    end1[:m] = np.fromstring(seq1[len(seq1) - m:], dtype=np.uint8)
+    start2 = np.fromstring(seq2[:m], dtype=np.uint8)
+    num_windows = m - min_overlap + 1
+    windows = as_strided(end1, (num_windows, m), (1, 1))
+    mismatches = (windows != start2).sum(axis=1) - np.arange(num_windows)
+    overlaps = np.arange(m, min_overlap - 1, -1)
+    scores = np.where(mismatches <= perc_max_diff * overlaps // 100,
+                      1000 * (mismatches ** 2 + 1) // overlaps,
+                      np.iinfo(int).max)
+    # the first of the lowest scores, i.e. the longest of those overlaps
+    best = scores.argmin()
+    if scores[best] == np.iinfo(int).max:
+        return 0
+    return int(overlaps[best])
+
+
+def join_overlapping_reads(seq1, qual1, seq2, qual2, overlap):
+    """Return the (seq, qual) of two reads joined where they overlap
+
+    seq1, qual1: sequence and phred+33 quality string of read 1
+    seq2, qual2: reverse complemented sequence and reversed phred+33 quality
+        string of read 2
+    overlap: the number of bases by which the end of read 1 overlaps the
+        start of read 2
+
+    In the overlap, bases that agree are kept and bases that disagree are
+    taken from the read with the higher quality score (read 1 if both score
+    the same), with the posterior quality scores of _get_joined_qual_tables.
+    """
+    end1 = len(seq1) - overlap
+    bases1 = np.fromstring(seq1[end1:], dtype=np.uint8)
+    bases2 = np.fromstring(seq2[:overlap], dtype=np.uint8)
+    quals1 = np.fromstring(qual1[end1:], dtype=np.uint8)
+    quals2 = np.fromstring(qual2[:overlap], dtype=np.uint8)
+
+    agree = bases1 == bases2
+    use_read2 = ~agree & (quals2 > quals1)
+    bases = np.where(use_read2, bases2, bases1)
+    quals = np.where(agree, _agree_quals[quals1, quals2],
+                     _disagree_quals[np.where(use_read2, quals2, quals1),
+                                     np.where(use_read2, quals1, quals2)])
+    return (seq1[:end1] + bases.tostring() + seq2[overlap:],
+            qual1[:end1] + quals.tostring() + qual2[overlap:])
+
+
+def _read_labels_match(label1, label2):
+    """Return True if label1 and label2 are the labels of a read pair
+
+    The labels must be the same up to the first whitespace, ignoring the
+    read number of older Illumina labels (e.g., '#0/1' and '#0/2').
+    """
+    id1 = label1.split(None, 1)[0] if label1 else label1
+    id2 = label2.split(None, 1)[0] if label2 else label2
+    end1 = _pre180_header_end(id1)
+    return end1 == _pre180_header_end(id2) and id1[:end1] == id2[:end1]
+
+
+def join_read_pairs_chunk(read_pairs, min_overlap=6, perc_max_diff=8):
+    """Join a chunk of read pairs, returning the text of each output file
+
+    read_pairs: list of (read 1, read 2, index read) tuples, each read a
+        (label, seq, phred+33 quality string) tuple as returned by
+        parse_fastq_records, and index read None if there are no index reads
+    min_overlap, perc_max_diff: see find_overlap
+
+    Returns the fastq text of the joined reads, of the reads 1 and reads 2
+    of the pairs that could not be joined, and of the index reads of the
+    joined pairs. Joined reads are labeled as read 1.
+    """
+    joined = []
+    unjoined1 = []
+    unjoined2 = []
+    barcodes = []
+    seqs2 = reverse_complement_seqs([read2[1] for _, read2, _ in read_pairs])
+    for (read1, read2, index_read), seq2 in izip(read_pairs, seqs2):
+        label1, seq1, qual1 = read1
+        if not _read_labels_match(label1, read2[0]):
+            raise ValueError("The header of read %s doesn't match the header "
+                             "of read %s. The forward and reverse reads must "
+                             "be in the same order." % (read2[0], label1))
+        if index_read is not None and index_read[0] != label1:
+            raise ValueError("The header of index read %s doesn't match the "
+                             "header of read %s. The index reads and paired-"
+                             "end reads must be in the same order and have "
+                             "identical headers." % (index_read[0], label1))
+        overlap = find_overlap(seq1, seq2, min_overlap, perc_max_diff)
+        if overlap:
+            seq, qual = join_overlapping_reads(seq1, qual1, seq2,
+                                               read2[2][::-1], overlap)
+            joined.append('@%s\n%s\n+\n%s\n' % (label1, seq, qual))
+            if index_read is not None:
+                barcodes.append('@%s\n%s\n+\n%s\n' % index_read)
+        else:
+            unjoined1.append('@%s\n%s\n+\n%s\n' % read1)
+            unjoined2.append('@%s\n%s\n+\n%s\n' % read2)
+    return (''.join(joined), ''.join(unjoined1), ''.join(unjoined2),
+            ''.join(barcodes))
+
+
+def _iter_read_pairs(read_records):
+    """Yield (read 1, read 2, index read) tuples from parsed fastq files
+
+    read_records: the records of the reads 1 and reads 2 files, and
+        optionally of the index reads file (otherwise index read is None)
+
+    Raises a ValueError if the files have different numbers of reads.
+    """
+    for reads in izip_longest(*read_records):
+        if None in reads:
+            raise ValueError("The forward, reverse and index reads files "
+                             "must have the same number of reads.")
+        if len(reads) == 2:
+            yield reads[0], reads[1], None
+        else:
+            yield reads
+
+
+def _join_read_pairs_chunk(args):
+    """Pool.imap wrapper around join_read_pairs_chunk"""
+    return join_read_pairs_chunk(*args)
+
+
+def join_paired_end_reads_native(reads1_infile_path,
+                                 reads2_infile_path,
+                                 perc_max_diff=None,
+                                 min_overlap=None,
+                                 outfile_label='nativejoin',
+                                 working_dir=gettempdir(),
+                                 index_reads_fp=None,
+                                 processes=1,
+                                 chunk_size=10000):
+    """Joins paired-end reads in-process. Returns dict of file paths.
+
+        -reads1_infile_path : reads1.fastq infile path
+        -reads2_infile_path : reads2.fastq infile path
+        -perc_max_diff : maximum % diff of overlap differences allowed
+            (default 8, as fastq-join)
+        -min_overlap : minimum allowed overlap required to assemble reads
+            (default 6, as fastq-join)
+        -outfile_label : base name for output files.
+        -index_reads_fp : index / barcode reads infile path. If given, the
+            index reads of the joined pairs are written while joining, as
+            write_synced_barcodes_fastq would write them.
+        -processes : number of chunks of chunk_size pairs to join at once,
+            in separate processes.
+
+        Output files are named as join_paired_end_reads_fastqjoin names
+        them, and the returned dict has the same keys (and 'Barcodes' if
+        index_reads_fp is given).
+    """
+    if perc_max_diff is None:
+        perc_max_diff = 8
+    elif not (isinstance(perc_max_diff, int) and 0 <= perc_max_diff <= 100):
+        raise ValueError("perc_max_diff must be int between 0-100!")
+    if min_overlap is None:
+        min_overlap = 6
+    elif not (isinstance(min_overlap, int) and 0 < min_overlap):
+        raise ValueError("min_overlap must be an int > 0!")
+
+    path_dict = {}
+    path_dict['Assembled'] = os.path.join(working_dir,
+                                          outfile_label + '.join.fastq')
+    path_dict['UnassembledReads1'] = os.path.join(working_dir,
+                                                  outfile_label + '.un1.fastq')
+    path_dict['UnassembledReads2'] = os.path.join(working_dir,
+                                                  outfile_label + '.un2.fastq')
+    input_files = [qiime_open(reads1_infile_path),
+                   qiime_open(reads2_infile_path)]
+    read_records = [parse_fastq_records(input_files[0]),
+                    parse_fastq_records(input_files[1])]
+    if index_reads_fp:
+        # named as write_synced_barcodes_fastq names it
+        path_dict['Barcodes'] = \
+            os.path.splitext(path_dict['Assembled'])[0] + '_barcodes.fastq'
+        input_files.append(qiime_open(index_reads_fp))
+        read_records.append(parse_fastq_records(input_files[2]))
+    read_pairs = _iter_read_pairs(read_records)
+
+    output_keys = ['Assembled', 'UnassembledReads1', 'UnassembledReads2',
+                   'Barcodes']
+    output_files = [open(path_dict[key], 'w') if key in path_dict else None
+                    for key in output_keys]
+
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        while True:
+            # Hand out a few chunks per process at a time, so that reads
+            # waiting to be joined don't pile up in memory
+            jobs = []
+            for i in range(2 * processes):
+                chunk = list(islice(read_pairs, chunk_size))
+                if not chunk:
+                    break
+                jobs.append((chunk, min_overlap, perc_max_diff))
+            if not jobs:
+                break
+            if pool is None:
+                results = imap(_join_read_pairs_chunk, jobs)
+            else:
+                results = pool.imap(_join_read_pairs_chunk, jobs)
+
+            for outputs in results:
+                for output_file, output_data in izip(output_files, outputs):
+                    if output_file is not None:
+                        output_file.write(output_data)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for f in input_files + output_files:
+            if f is not None:
+                f.close()
+
+    return path_dict
+
+
 join_method_constructors = {}
 join_method_names = {'fastq-join': join_paired_end_reads_fastqjoin,
-                     'SeqPrep': join_paired_end_reads_seqprep}
+                     'SeqPrep': join_paired_end_reads_seqprep,
+                     'native': join_paired_end_reads_native}
 
 
 def write_synced_barcodes_fastq(joined_fp, index_fp):
@@ -17,7 +17,8 @@ from scipy.cluster.hierarchy import linkage
 from skbio.tree import TreeNode
 from skbio.diversity.beta import pw_distances
 
-from qiime.parse import parse_newick, PhyloNode
+from qiime.parse import parse_newick
+from cogent.core.tree import PhyloNode
 from qiime.filter import filter_samples_from_otu_table
 
 
@@ -17,8 +17,9 @@ import subprocess
 from qiime.process_sff import (
     check_sfffile,
 )
+from qiime.sff_reader import SffReader
 from cogent.parse.binary_sff import (
-    parse_binary_sff, write_binary_sff,
+    write_common_header,
 )
 
 
@@ -68,18 +69,50 @@ def combine_sff_data(*sff_datasets):
     return combined_header, combined_reads
 
 
-def make_per_library_sff(sff_fps, id_list_fp, debug=False):
+def write_filtered_sff(sff_readers, output_file, ids_to_keep):
+    """Write the reads of sff_readers whose ID is in ids_to_keep.
+
+    The reads are copied from the input files as they are, and the output
+    has the common header of the last of the input files, as
+    combine_sff_data and filter_sff_reads give it.
+    """
+    kept_reads = []
+    for reader in sff_readers:
+        kept_reads.append([i for i, name in enumerate(reader.names)
+                           if name in ids_to_keep])
+
+    header = sff_readers[-1].header.copy()
+    header['number_of_reads'] = sum(map(len, kept_reads))
+    header['index_offset'] = 0
+    header['index_length'] = 0
+    write_common_header(output_file, header)
+    for reader, read_indices in zip(sff_readers, kept_reads):
+        output_file.write(''.join([reader.get_read_bytes(i)
+                                   for i in read_indices]))
+
+
+def make_per_library_sff(sff_fps, id_list_fp, debug=False,
+                         sff_readers=None):
+    """Write the reads of sff_fps listed in id_list_fp to an SFF file.
+
+    sff_readers: SffReaders of sff_fps, if already open
+    """
     id_list_basepath, _ = os.path.splitext(id_list_fp)
     output_fp = id_list_basepath + '.sff'
 
-    sff_datasets = [parse_binary_sff(open(fp), True) for fp in sff_fps]
-    sff_data = combine_sff_data(*sff_datasets)
+    if sff_readers is None:
+        readers = [SffReader(open(fp, 'rb')) for fp in sff_fps]
+    else:
+        readers = sff_readers
     ids = parse_id_list(open(id_list_fp))
 
-    filtered_sff_data = filter_sff_reads(sff_data, ids_to_keep=ids)
     if debug:
         print 'Creating SFF file for %s' % id_list_fp
-    write_binary_sff(open(output_fp, 'w'), *filtered_sff_data)
+    with open(output_fp, 'wb') as output_file:
+        write_filtered_sff(readers, output_file, ids)
+    if sff_readers is None:
+        for reader in readers:
+            reader.close()
 
 
 def make_per_library_sff_with_sfffile(
@@ -97,6 +130,10 @@ def make_per_library_sff_with_sfffile(
 
 def make_per_library_sffs(
         sff_fps, id_list_dir, use_sfftools=False, sfffile_path=None, debug=False):
+    # the SFF files are read once, rather than once per library
+    sff_readers = None
+    if not use_sfftools:
+        sff_readers = [SffReader(open(fp, 'rb')) for fp in sff_fps]
     for dirpath, dirnames, filenames in os.walk(id_list_dir):
         for filename in filenames:
             if filename.startswith('.'):
@@ -107,4 +144,8 @@ def make_per_library_sffs(
                 make_per_library_sff_with_sfffile(
                     sff_fps, id_list_fp, sfffile_path, debug)
             else:
-                make_per_library_sff(sff_fps, id_list_fp, debug)
+                make_per_library_sff(sff_fps, id_list_fp, debug,
+                                     sff_readers)
+    if sff_readers is not None:
+        for reader in sff_readers:
+            reader.close()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Compact, integer-coded OTU maps.
+
+An OtuMap stores sequence ids once each (interned to int32 indices) and
+the membership of each OTU as CSR-style arrays: the members of the i-th
+OTU are SeqIds[Members[Offsets[i]:Offsets[i + 1]]]. Chained OTU maps
+(e.g., an exact-match prefilter followed by clustering, or the successive
+rounds of an OTU picking workflow) can then be composed with array gathers
+rather than by concatenating lists of sequence id strings, and the
+sequence ids are only turned back into text when the map is written.
+"""
+
+from array import array
+
+from numpy import (arange, asarray, concatenate, cumsum, int32, int64, repeat,
+                   unique, zeros)
+
+
+class OtuMap(object):
+
+    """An OTU map with integer-coded sequence ids
+
+    OtuIds: list of OTU ids, in the order they were added
+    SeqIds: list of sequence ids; members are indices into this list
+    Offsets: int64 array of len(OtuIds) + 1 offsets into Members
+    Members: int32 array of sequence id indices
+    """
+
+    def __init__(self, otu_ids, seq_ids, offsets, members):
+        self.OtuIds = otu_ids
+        self.SeqIds = seq_ids
+        self.Offsets = asarray(offsets, dtype=int64)
+        self.Members = asarray(members, dtype=int32)
+        self._otu_index = dict([(otu_id, i)
+                                for i, otu_id in enumerate(otu_ids)])
+
+    @classmethod
+    def from_clusters(cls, clusters, otu_ids=None):
+        """Build an OtuMap from (otu_id, seq_ids) pairs
+
+        If otu_ids is provided, clusters are lists of seq ids and
+        otu_ids[i] is the id of the i-th cluster. If an OTU id occurs more
+        than once, its last list of sequence ids is used (as with
+        qiime.parse.fields_to_dict).
+        """
+        if otu_ids is not None:
+            clusters = zip(otu_ids, clusters)
+        seq_index = {}
+        seq_ids = []
+        otu_index = {}
+        otu_ids = []
+        otu_members = []
+        for otu_id, cluster in clusters:
+            members = array('i')
+            for seq_id in cluster:
+                try:
+                    members.append(seq_index[seq_id])
+                except KeyError:
+                    seq_index[seq_id] = len(seq_ids)
+                    members.append(len(seq_ids))
+                    seq_ids.append(seq_id)
+            if otu_id in otu_index:
+                otu_members[otu_index[otu_id]] = members
+            else:
+                otu_index[otu_id] = len(otu_ids)
+                otu_ids.append(otu_id)
+                otu_members.append(members)
+
+        offsets = [0]
+        for members in otu_members:
+            offsets.append(offsets[-1] + len(members))
+        if otu_members:
+            members = concatenate([asarray(m, dtype=int32)
+                                   for m in otu_members])
+        else:
+            members = []
+        return cls(otu_ids, seq_ids, offsets, members)
+
+    @classmethod
+    def from_lines(cls, lines, delim='\t'):
+        """Parse an OTU map file (one OTU id and its seq ids per line)
+
+        delim=None splits on any whitespace, so mixed tabs and spaces are
+        handled. Blank lines are skipped.
+        """
+        def clusters():
+            for line in lines:
+                fields = [f.strip() for f in line.split(delim)]
+                if fields and fields[0]:
+                    yield fields[0], fields[1:]
+        return cls.from_clusters(clusters())
+
+    def __len__(self):
+        return len(self.OtuIds)
+
+    def __contains__(self, otu_id):
+        return otu_id in self._otu_index
+
+    def _member_indices(self, i):
+        return self.Members[self.Offsets[i]:self.Offsets[i + 1]]
+
+    def __getitem__(self, otu_id):
+        seq_ids = self.SeqIds
+        return [seq_ids[j]
+                for j in self._member_indices(self._otu_index[otu_id])]
+
+    def iteritems(self):
+        """Yield (otu_id, seq_ids) in the order the OTUs were added"""
+        seq_ids = self.SeqIds
+        for i, otu_id in enumerate(self.OtuIds):
+            yield otu_id, [seq_ids[j] for j in self._member_indices(i)]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def to_dict(self):
+        return dict(self.iteritems())
+
+    def _rows(self, otu_ids):
+        """Return the row indices of otu_ids, raising KeyError if missing"""
+        otu_index = self._otu_index
+        return asarray([otu_index[otu_id] for otu_id in otu_ids],
+                       dtype=int64)
+
+    def _gather(self, rows):
+        """Return the concatenated members of rows, and their sizes"""
+        starts = self.Offsets[rows]
+        sizes = self.Offsets[rows + 1] - starts
+        total = sizes.sum() if len(sizes) else 0
+        # position of each output member within its own OTU, plus that
+        # OTU's start offset
+        ends = cumsum(sizes)
+        indices = (arange(total, dtype=int64) - repeat(ends - sizes, sizes) +
+                   repeat(starts, sizes))
+        return self.Members[indices], sizes
+
+    def expand(self, seq_id_map):
+        """Replace each member of this map with its members in seq_id_map
+
+        The members of this map must be OTU ids in seq_id_map (an OtuMap),
+        for example when this map was built by clustering the
+        representative sequences of the OTUs in seq_id_map. Returns a new
+        OtuMap with this map's OTU ids and seq_id_map's sequence ids. A
+        KeyError is raised if a member isn't an OTU in seq_id_map.
+        """
+        # look up only the sequence ids that are members of an OTU
+        used = unique(self.Members)
+        seq_ids = self.SeqIds
+        lookup = zeros(len(seq_ids), dtype=int64)
+        lookup[used] = seq_id_map._rows([seq_ids[j] for j in used])
+        rows = lookup[self.Members]
+        members, sizes = seq_id_map._gather(rows)
+        member_offsets = concatenate([[0], cumsum(sizes)])
+        offsets = member_offsets[self.Offsets]
+        return OtuMap(list(self.OtuIds), seq_id_map.SeqIds, offsets, members)
+
+    def expand_ids(self, otu_ids):
+        """Return the seq ids of all members of otu_ids, in order"""
+        members, sizes = self._gather(self._rows(otu_ids))
+        seq_ids = self.SeqIds
+        return [seq_ids[j] for j in members]
+
+    def write(self, otu_map_f):
+        """Write this map in QIIME's tab-separated OTU map format"""
+        for otu_id, seq_ids in self.iteritems():
+            otu_map_f.write('%s\t%s\n' % (otu_id, '\t'.join(seq_ids)))
@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 
+from itertools import imap
+from multiprocessing import Pool
 from os.path import basename, join
 from time import time
 from cogent.core.tree import TreeNode
 from os import system
 import os
 
+from numpy import array, concatenate
+from scipy.sparse import coo_matrix
+from biom import load_table
+from biom.table import Table
+
 __author__ = "Daniel McDonald"
 __copyright__ = "Copyright 2013, The QIIME Project"
 __credits__ = ["Daniel McDonald", "Greg Caporaso", "Jai Ram Rideout"]
@@ -163,3 +170,101 @@ def start_job(node, merge_otus_fp, queue, wrap_call=torque_job, submit=True):
 
     node.FullCommand = wrapped
     node.StartTime = time()
+
+
+def read_table_entries(table_fp):
+    """Load a BIOM table and return its ids, metadata and non-zero entries
+
+    Returns (observation ids, sample ids, observation metadata, sample
+    metadata, rows, cols, values), where rows, cols and values are the COO
+    coordinates of the table's non-zero entries. This is a plain tuple so it
+    can be passed back cheaply from a worker process.
+    """
+    table = load_table(table_fp)
+    entries = table.matrix_data.tocoo()
+    return (list(table.ids(axis='observation')), list(table.ids()),
+            _plain_metadata(table.metadata(axis='observation')),
+            _plain_metadata(table.metadata()),
+            entries.row, entries.col, entries.data)
+
+
+def _plain_metadata(md):
+    """Convert biom's metadata defaultdicts (which can't be pickled) to dicts
+    """
+    if md is None:
+        return None
+    return [None if e is None else dict(e) for e in md]
+
+
+def _add_ids(ids, md, index, all_ids, all_md, had_md):
+    """Add ids to a global id index, returning their global positions
+
+    Metadata follows biom.Table.merge's rule for tables merged pairwise:
+    new ids take the table's metadata, and ids that were already added
+    keep theirs, unless no earlier table had metadata for this axis
+    (had_md is False), in which case theirs is taken from this table.
+    """
+    positions = []
+    for i, id_ in enumerate(ids):
+        try:
+            position = index[id_]
+            is_new = False
+        except KeyError:
+            position = index[id_] = len(all_ids)
+            all_ids.append(id_)
+            all_md.append(None)
+            is_new = True
+        if md is not None and (is_new or not had_md):
+            all_md[position] = md[i]
+        positions.append(position)
+    return array(positions, dtype=int)
+
+
+def merge_otu_tables_kway(input_fps, processes=1):
+    """Merge any number of BIOM tables in a single pass
+
+    The tables are read (by processes worker processes if processes > 1)
+    and their entries are accumulated into one global observation/sample
+    index and a single COO matrix, so no intermediate tables are created.
+    Counts for the same observation and sample are summed, and ids are
+    ordered by first occurrence, and metadata is handled as by _add_ids, so
+    the result is the same as merging the tables pairwise with
+    biom.Table.merge.
+    """
+    if not input_fps:
+        raise ValueError("No tables to merge.")
+
+    if processes > 1:
+        pool = Pool(processes)
+        tables = pool.imap(read_table_entries, input_fps)
+    else:
+        pool = None
+        tables = imap(read_table_entries, input_fps)
+
+    obs_index, obs_ids, obs_md = {}, [], []
+    sample_index, sample_ids, sample_md = {}, [], []
+    had_obs_md, had_sample_md = False, False
+    rows, cols, values = [], [], []
+    try:
+        for (t_obs_ids, t_sample_ids, t_obs_md, t_sample_md,
+             t_rows, t_cols, t_values) in tables:
+            obs_positions = _add_ids(t_obs_ids, t_obs_md, obs_index,
+                                     obs_ids, obs_md, had_obs_md)
+            sample_positions = _add_ids(t_sample_ids, t_sample_md,
+                                        sample_index, sample_ids, sample_md,
+                                        had_sample_md)
+            had_obs_md = had_obs_md or t_obs_md is not None
+            had_sample_md = had_sample_md or t_sample_md is not None
+            rows.append(obs_positions[t_rows])
+            cols.append(sample_positions[t_cols])
+            values.append(t_values)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    data = coo_matrix((concatenate(values).astype(float),
+                       (concatenate(rows), concatenate(cols))),
+                      shape=(len(obs_ids), len(sample_ids))).tocsr()
+    data.eliminate_zeros()
+    return Table(data, obs_ids, sample_ids, obs_md, sample_md)
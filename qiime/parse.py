@@ -22,14 +22,8 @@ from types import GeneratorType
 from numpy import concatenate, repeat, zeros, nan, asarray
 from numpy.random import permutation
 
-from skbio.stats.ordination import OrdinationResults
-from skbio.parse.record_finder import LabeledRecordFinder
-from cogent.parse.tree import DndParser
-from skbio.parse.sequences import parse_fastq
-from skbio.parse.sequences.fasta import FastaFinder
-from skbio.sequence import DNA
-from skbio.io.util import open_file
-from cogent.core.tree import PhyloNode
+# skbio and cogent are imported by the functions that use them, since this
+# module is imported (via qiime.util) by every QIIME script.
 
 
 def is_casava_v180_or_later(header_line):
@@ -59,7 +53,7 @@ class IlluminaParseError(QiimeParseError):
     pass
 
 
-def parse_newick(lines, constructor=PhyloNode):
+def parse_newick(lines, constructor=None):
     """Return PhyloNode from newick file handle stripping quotes from tip names
 
         This function wraps cogent.parse.tree.DndParser stripping
@@ -73,6 +67,10 @@ def parse_newick(lines, constructor=PhyloNode):
          corresponding OTU identifier. Disaster follows.
 
     """
+    from cogent.parse.tree import DndParser
+    if constructor is None:
+        from cogent.core.tree import PhyloNode
+        constructor = PhyloNode
     return DndParser(lines, constructor=constructor, unescape_name=True)
 
 
@@ -365,6 +363,7 @@ def parse_coords(lines):
     Strategy: read the file using skbio's parser and return the objects
               we want
     """
+    from skbio.stats.ordination import OrdinationResults
     pcoa_results = OrdinationResults.read(lines)
     return (pcoa_results.site_ids, pcoa_results.site, pcoa_results.eigvals,
             pcoa_results.proportion_explained)
@@ -725,6 +724,7 @@ def parse_illumina_line(l, barcode_length, rev_comp_barcode,
         barcode = y_position_subfields[1][:barcode_length]
 
     if rev_comp_barcode:
+        from skbio.sequence import DNA
         barcode = str(DNA(barcode).rc())
 
     result = {
@@ -750,6 +750,7 @@ def parse_qual_score(infile, value_cast_f=int):
 
 def MinimalQualParser(infile, value_cast_f=int, full_header=False):
     """Yield quality scores"""
+    from skbio.parse.sequences.fasta import FastaFinder
     for rec in FastaFinder(infile):
         curr_id = rec[0][1:]
         curr_qual = ' '.join(rec[1:])
@@ -945,6 +946,7 @@ def parse_items(fp):
     list
         List of the items parsed from the file
     """
+    from skbio.io.util import open_file
     with open_file(fp, 'U') as f:
         items = f.read().strip('\n').split('\n')
 
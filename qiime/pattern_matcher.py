@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Search sequences for many barcodes or primers at once.
+
+Testing each barcode or primer in a mapping file against each read costs
+time in proportion to the number of patterns. PatternMatcher instead
+indexes fixed-length seeds taken from the patterns: a pattern that occurs
+in a sequence with at most k mismatches must match one of k + 1
+non-overlapping seeds exactly (the pigeonhole principle), so a single scan
+of the k-mers of the sequence against the seed index finds every candidate
+position, and only those candidates are compared against their patterns.
+"""
+
+from itertools import imap
+from operator import ne
+
+from skbio.sequence import DNA
+
+# the number of patterns from which exact matches are found by scanning the
+# seed index rather than searching for each pattern in turn
+exact_search_max_patterns = 24
+
+
+class PatternMatcher(object):
+
+    """Find occurrences of a set of patterns in sequences
+
+    patterns: iterable of pattern sequences (e.g., barcodes or primers)
+    max_mismatches: maximum number of mismatches to allow when matching a
+        pattern (substitutions only)
+    expand_degeneracies: if True, patterns containing IUPAC degenerate
+        characters are replaced with all of their non-degenerate versions,
+        so that e.g. 'R' in a pattern matches 'A' or 'G' in a sequence.
+        Otherwise all characters are matched literally.
+
+    Hits are reported as (start, pattern, mismatches) tuples, where pattern
+    is the (non-degenerate) pattern found at seq[start:start+len(pattern)].
+    """
+
+    def __init__(self, patterns, max_mismatches=0,
+                 expand_degeneracies=False):
+        if max_mismatches < 0:
+            raise ValueError("max_mismatches must be zero or greater.")
+        self.max_mismatches = max_mismatches
+
+        unique_patterns = set()
+        for pattern in patterns:
+            if expand_degeneracies:
+                unique_patterns.update(
+                    [str(p) for p in DNA(pattern.strip()).nondegenerates()])
+            else:
+                unique_patterns.add(pattern)
+        self.patterns = sorted(unique_patterns)
+        self._pattern_set = frozenset(self.patterns)
+
+        # patterns too short to contain max_mismatches + 1 seeds are
+        # compared at every position
+        seeds_per_pattern = max_mismatches + 1
+        self._short_patterns = [p for p in self.patterns
+                                if len(p) < seeds_per_pattern]
+        seeded = [p for p in self.patterns if len(p) >= seeds_per_pattern]
+        if seeded:
+            self._seed_length = \
+                min([len(p) for p in seeded]) // seeds_per_pattern
+        else:
+            self._seed_length = 0
+
+        # map each seed to the (offset of the seed in the pattern,
+        # pattern) pairs that it was taken from
+        self._seeds = {}
+        seed_length = self._seed_length
+        for pattern in seeded:
+            for offset in range(0, seeds_per_pattern * seed_length,
+                                seed_length):
+                seed = pattern[offset:offset + seed_length]
+                self._seeds.setdefault(seed, []).append((offset, pattern))
+        self._seed_set = frozenset(self._seeds)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __contains__(self, pattern):
+        """Return True if pattern is one of the (non-degenerate) patterns"""
+        return pattern in self._pattern_set
+
+    def _mismatches(self, seq, start, pattern):
+        """Return the mismatches between pattern and seq from start"""
+        if self.max_mismatches == 0:
+            return 0 if seq.startswith(pattern, start) else 1
+        return sum(imap(ne, seq[start:start + len(pattern)], pattern))
+
+    def _iter_hits(self, seq):
+        """Yield hits in seq, possibly including duplicates"""
+        max_mismatches = self.max_mismatches
+        if max_mismatches == 0 and \
+                len(self.patterns) < exact_search_max_patterns:
+            # str.find is faster than a scan of the seed index until there
+            # are a few dozen patterns
+            for pattern in self.patterns:
+                start = seq.find(pattern)
+                while start != -1:
+                    yield start, pattern, 0
+                    start = seq.find(pattern, start + 1)
+            return
+
+        seq_len = len(seq)
+        seed_length = self._seed_length
+        if seed_length and seq_len >= seed_length:
+            # find the seeds among the k-mers of seq in one pass, and then
+            # the positions of only those seeds
+            kmers = map(seq.__getslice__, xrange(seq_len - seed_length + 1),
+                        xrange(seed_length, seq_len + 1))
+            for seed in self._seed_set.intersection(kmers):
+                seed_hit = self._seeds[seed]
+                i = seq.find(seed)
+                while i != -1:
+                    for offset, pattern in seed_hit:
+                        start = i - offset
+                        if start < 0 or start + len(pattern) > seq_len:
+                            continue
+                        mismatches = self._mismatches(seq, start, pattern)
+                        if mismatches <= max_mismatches:
+                            yield start, pattern, mismatches
+                    i = seq.find(seed, i + 1)
+
+        for pattern in self._short_patterns:
+            for start in xrange(seq_len - len(pattern) + 1):
+                mismatches = self._mismatches(seq, start, pattern)
+                if mismatches <= max_mismatches:
+                    yield start, pattern, mismatches
+
+    def find_all(self, seq):
+        """Return all hits in seq, sorted by start position and pattern"""
+        return sorted(set(self._iter_hits(seq)))
+
+    def search(self, seq):
+        """Return a hit in seq, or None if no pattern occurs in seq"""
+        for hit in self._iter_hits(seq):
+            return hit
+        return None
+
+    def match_start(self, seq):
+        """Return the (pattern, mismatches) best matching the start of seq
+
+        Each pattern is compared with seq over the length of the shorter of
+        the two, as split_libraries.count_mismatches does, so a pattern
+        longer than seq can match. Returns None if no pattern matches within
+        max_mismatches.
+        """
+        if seq in self._pattern_set:
+            return seq, 0
+
+        max_mismatches = self.max_mismatches
+        seed_length = self._seed_length
+        candidates = set(self._short_patterns)
+        if seed_length and \
+                len(seq) >= (max_mismatches + 1) * seed_length:
+            # each matching pattern matches at least one of its seeds
+            get = self._seeds.get
+            for offset in range(0, (max_mismatches + 1) * seed_length,
+                                seed_length):
+                for seed_offset, pattern in \
+                        get(seq[offset:offset + seed_length], ()):
+                    if seed_offset == offset:
+                        candidates.add(pattern)
+        else:
+            candidates.update(self.patterns)
+
+        best = None
+        for pattern in candidates:
+            mismatches = sum(imap(ne, seq, pattern))
+            if mismatches <= max_mismatches and \
+                    (best is None or (mismatches, pattern) <
+                     (best[1], best[0])):
+                best = pattern, mismatches
+        return best
@@ -25,14 +25,15 @@ from tempfile import mkstemp
 from bfillings.mothur import parse_otu_list as mothur_parse
 
 from skbio.util import remove_files, flatten
-from skbio.tree import CompressedTrie, fasta_to_pairlist
 from skbio.parse.sequences import parse_fasta
 from skbio.alignment import SequenceCollection
 from skbio.sequence import DNA
 
 from qiime.util import FunctionWithParams, get_qiime_temp_dir
 from qiime.sort import sort_fasta_by_abundance
-from qiime.parse import fields_to_dict
+from qiime.dereplicate import dereplicate_seqs
+from qiime.otu_map import OtuMap
+from qiime.prefix_map import build_prefix_map
 
 from bfillings.blast import blast_seqs, Blastall, BlastResult
 from bfillings.formatdb import build_blast_db_from_fasta_path
@@ -148,9 +149,7 @@ class OtuPicker(FunctionWithParams):
         trunc_id = lambda a_b: (a_b[0].split()[0], a_b[1])
         # get the prefix map
         with open(seq_path, 'U') as seq_lines:
-            t = CompressedTrie(fasta_to_pairlist(imap(trunc_id,
-                                                      parse_fasta(seq_lines))))
-        mapping = t.prefix_map
+            mapping = build_prefix_map(imap(trunc_id, parse_fasta(seq_lines)))
         for key in mapping.keys():
                 mapping[key].append(key)
 
@@ -170,7 +169,16 @@ class OtuPicker(FunctionWithParams):
                                 containing all seq_ids with
                                 duplicate FASTA sequences
             Output: an extended list of cluster lists
+
+            If filter_map is a qiime.otu_map.OtuMap, the clusters are
+            expanded with array gathers rather than list concatenation.
         """
+        if isinstance(filter_map, OtuMap):
+            cluster_map = OtuMap.from_clusters(
+                clusters, otu_ids=range(len(clusters)))
+            return [seq_ids for _, seq_ids in
+                    cluster_map.expand(filter_map).iteritems()]
+
         results = []
         for cluster in clusters:
             full_cluster = []
@@ -967,8 +975,7 @@ class TrieOtuPicker(OtuPicker):
                         parse_fasta(open(seq_path)))
 
         # Build the mapping
-        t = CompressedTrie(fasta_to_pairlist(seqs))
-        mapping = t.prefix_map
+        mapping = build_prefix_map(seqs)
         log_lines.append('Num OTUs: %d' % len(mapping))
 
         if result_path:
@@ -1176,21 +1183,41 @@ class UclustOtuPickerBase(OtuPicker):
 
         return result
 
-    def _apply_identical_sequences_prefilter(self, seq_path):
-        """ """
+    def _apply_identical_sequences_prefilter(self, seq_path,
+                                             sort_by_abundance=False):
+        """ Collapse identical sequences in seq_path to a temp fasta file
+
+            The sequences are dereplicated on disk (see
+            qiime.dereplicate.dereplicate_seqs), so this works with input
+            files that are too large to hold in memory. If
+            sort_by_abundance is True, the unique sequences are also sorted
+            by abundance (replacing a separate _presort_by_abundance pass).
+        """
+        if sort_by_abundance:
+            # if doing our presort by abundance we _always_ need to
+            # disable uclust's sorting.
+            self.Params['suppress_sort'] = True
+
         fd, unique_seqs_fp = mkstemp(
             prefix='UclustExactMatchFilter', suffix='.fasta')
         close(fd)
-        seqs_to_cluster, exact_match_id_map =\
-            self._prefilter_exact_matches(parse_fasta(open(seq_path, 'U')))
+        fd, exact_match_map_fp = mkstemp(
+            prefix='UclustExactMatchFilter', suffix='.txt')
+        close(fd)
         self.files_to_remove.append(unique_seqs_fp)
+        self.files_to_remove.append(exact_match_map_fp)
+
         unique_seqs_f = open(unique_seqs_fp, 'w')
-        for seq_id, seq in seqs_to_cluster:
-            unique_seqs_f.write('>%s\n%s\n' % (seq_id, seq))
+        exact_match_map_f = open(exact_match_map_fp, 'w')
+        dereplicate_seqs(parse_fasta(open(seq_path, 'U')),
+                         unique_seqs_f,
+                         exact_match_map_f,
+                         sort_by_abundance=sort_by_abundance,
+                         tmp_dir=get_qiime_temp_dir())
         unique_seqs_f.close()
-        # clean up the seqs_to_cluster list as it can be big and we
-        # don't need it again
-        # del(seqs_to_cluster)
+        exact_match_map_f.close()
+
+        exact_match_id_map = OtuMap.from_lines(open(exact_match_map_fp, 'U'))
         return exact_match_id_map, unique_seqs_fp
 
 
@@ -1255,17 +1282,18 @@ class UclustOtuPicker(UclustOtuPickerBase):
         original_fasta_path = seq_path
         self.files_to_remove = []
 
-        if self.Params['presort_by_abundance']:
+        if prefilter_identical_sequences:
+            # Collapse identical sequences to a new file, sorting them by
+            # abundance in the same pass if requested
+            exact_match_id_map, seq_path =\
+                self._apply_identical_sequences_prefilter(
+                    seq_path, self.Params['presort_by_abundance'])
+        elif self.Params['presort_by_abundance']:
             # seq path will become the temporary sorted sequences
             # filepath, to be cleaned up after the run
             seq_path = self._presort_by_abundance(seq_path)
             self.files_to_remove.append(seq_path)
 
-        # Collapse idetical sequences to a new file
-        if prefilter_identical_sequences:
-            exact_match_id_map, seq_path =\
-                self._apply_identical_sequences_prefilter(seq_path)
-
         # perform the clustering
         clusters, failures, seeds = get_clusters_from_fasta_filepath(
             seq_path,
@@ -1878,17 +1906,18 @@ class UclustReferenceOtuPicker(UclustOtuPickerBase):
             self.Params['next_new_cluster_number'] = next_new_cluster_number
         self.files_to_remove = []
 
-        if self.Params['presort_by_abundance']:
+        if prefilter_identical_sequences:
+            # Collapse identical sequences to a new file, sorting them by
+            # abundance in the same pass if requested
+            exact_match_id_map, seq_fp =\
+                self._apply_identical_sequences_prefilter(
+                    seq_fp, self.Params['presort_by_abundance'])
+        elif self.Params['presort_by_abundance']:
             # seq path will become the temporary sorted sequences
             # filepath, to be cleaned up after the run
             seq_fp = self._presort_by_abundance(seq_fp)
             self.files_to_remove.append(seq_fp)
 
-        # Collapse idetical sequences to a new file
-        if prefilter_identical_sequences:
-            exact_match_id_map, seq_fp =\
-                self._apply_identical_sequences_prefilter(seq_fp)
-
         # perform the clustering
         cluster_map, failures, new_seeds = get_clusters_from_fasta_filepath(
             seq_fp,
@@ -2106,17 +2135,24 @@ def expand_failures(failures, seq_id_map):
     return result
 
 
-def map_otu_map_files(otu_files, failures_file=None):
+def merge_otu_map_files(otu_files):
+    """Return an OtuMap of the chained OTU maps in otu_files, in run order
+    """
     # passing delim=None splits on any whitespace, so can handle mixed tabs
     # and spaces
-    result = fields_to_dict(otu_files[0], delim=None)
+    result = OtuMap.from_lines(otu_files[0], delim=None)
     for otu_file in otu_files[1:]:
-        current_otu_map = fields_to_dict(otu_file, delim=None)
-        result = expand_otu_map_seq_ids(current_otu_map, result)
-    if failures_file:
-        result = expand_failures(failures_file, result)
+        result = OtuMap.from_lines(otu_file, delim=None).expand(result)
     return result
 
+
+def map_otu_map_files(otu_files, failures_file=None):
+    result = merge_otu_map_files(otu_files)
+    if failures_file:
+        return result.expand_ids([failure.strip()
+                                  for failure in failures_file])
+    return result.to_dict()
+
 # End functions to support merging OTU tables
 
 
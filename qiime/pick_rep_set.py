@@ -25,10 +25,26 @@ from qiime.parse import fields_to_dict
 from random import choice
 from numpy import argmax
 from skbio.parse.sequences import parse_fasta
+from qiime.fasta_index import FastaIndex
 
 label_to_name = lambda x: x.split()[0]
 
 
+def _load_seqs(seq_path, save_fasta_index):
+    """Return a FastaIndex of seq_path, or a dict if it has duplicate ids
+
+    A fasta file with duplicate sequence ids can't be indexed, so it is
+    loaded into a dict instead, in which the last record with each id wins.
+    """
+    try:
+        return FastaIndex(seq_path, save_index=save_fasta_index)
+    except ValueError:
+        seq_f = open(seq_path, 'U')
+        seqs = dict(parse_fasta(seq_f, label_to_name=label_to_name))
+        seq_f.close()
+        return seqs
+
+
 def first(items):
     """Returns first item from a list, used to fake random for testing."""
     return items[0]
@@ -140,7 +156,7 @@ class GenericRepSetPicker(RepSetPicker):
         RepSetPicker.__init__(self, _params)
 
     def __call__(self, seq_path, otu_path, result_path=None, log_path=None,
-                 sort_by='otu'):
+                 sort_by='otu', save_fasta_index=False):
         """Returns dict mapping {otu_id:[seq_ids]} for each otu.
 
         Parameters:
@@ -150,62 +166,66 @@ class GenericRepSetPicker(RepSetPicker):
         dumps the result to the desired path instead of returning it.
         log_path: path to log, which includes dump of params.
         sort_by: sort by otu or seq_id
+        save_fasta_index: save the index of seq_path (see
+        qiime.fasta_index.FastaIndex) so later runs don't need to rebuild it
         """
-        # Load the seq path. We may want to change that in the future
-        # to avoid the overhead of loading large sequence collections
-        # during this step.
-        seq_f = open(seq_path, 'U')
-        seqs = dict(parse_fasta(seq_f, label_to_name=label_to_name))
-        seq_f.close()
-
-        # Load the otu file
-        otu_f = open(otu_path, 'U')
-        otus = fields_to_dict(otu_f)
-        otu_f.close()
-
-        if self.Params['ChoiceFRequiresSeqs']:
-            choice_f = self.Params['ChoiceF'](seqs)
-        else:
-            choice_f = self.Params['ChoiceF']
-
-        # actually pick the set
-        result = {}
-        for set_id, ids in otus.items():
-            result[set_id] = choice_f(ids, seqs)
-
-        if result_path:
-            # if the user provided a result_path, write the
-            # results to file with one tab-separated line per
-            # cluster
-            of = open(result_path, 'w')
-            if sort_by == 'seq_id':
-                def key(s):
-                    try:
-                        return int(s[1].split('_', 1)[-1])
-                    except ValueError:
-                        return s
+        # Index the seq path rather than loading it, so only the sequences
+        # that are needed are read from disk.
+        seqs = _load_seqs(seq_path, save_fasta_index)
+        try:
+            # Load the otu file
+            otu_f = open(otu_path, 'U')
+            otus = fields_to_dict(otu_f)
+            otu_f.close()
+
+            if self.Params['ChoiceFRequiresSeqs']:
+                # read all of the sequences once, in file order, rather
+                # than looking each one up in the index
+                choice_f = self.Params['ChoiceF'](dict(seqs.iteritems()))
             else:
-                key = lambda s: s
-            for cluster, id_ in sorted(result.items(), key=key):
-                of.write('>%s %s\n%s\n' % (cluster, id_, seqs[id_]))
-            of.close()
-            result = None
-            log_str = 'Result path: %s' % result_path
-        else:
-            # if the user did not provide a result_path, store
-                # the result in a dict of {otu_id: rep_id},
-            log_str = 'Result path: None, returned as dict.'
-
-        if log_path:
-            # if the user provided a log file path, log the run
-            log_file = open(log_path, 'w')
-            log_file.write(str(self))
-            log_file.write('\n')
-            log_file.write('%s\n' % log_str)
-
-        # return the result (note this is None if the data was
-        # written to file)
-        return result
+                choice_f = self.Params['ChoiceF']
+
+            # actually pick the set
+            result = {}
+            for set_id, ids in otus.items():
+                result[set_id] = choice_f(ids, seqs)
+
+            if result_path:
+                # if the user provided a result_path, write the
+                # results to file with one tab-separated line per
+                # cluster
+                of = open(result_path, 'w')
+                if sort_by == 'seq_id':
+                    def key(s):
+                        try:
+                            return int(s[1].split('_', 1)[-1])
+                        except ValueError:
+                            return s
+                else:
+                    key = lambda s: s
+                for cluster, id_ in sorted(result.items(), key=key):
+                    of.write('>%s %s\n%s\n' % (cluster, id_, seqs[id_]))
+                of.close()
+                result = None
+                log_str = 'Result path: %s' % result_path
+            else:
+                # if the user did not provide a result_path, store
+                    # the result in a dict of {otu_id: rep_id},
+                log_str = 'Result path: None, returned as dict.'
+
+            if log_path:
+                # if the user provided a log file path, log the run
+                log_file = open(log_path, 'w')
+                log_file.write(str(self))
+                log_file.write('\n')
+                log_file.write('%s\n' % log_str)
+
+            # return the result (note this is None if the data was
+            # written to file)
+            return result
+        finally:
+            if isinstance(seqs, FastaIndex):
+                seqs.close()
 
 
 class ReferenceRepSetPicker(RepSetPicker):
@@ -233,7 +253,8 @@ class ReferenceRepSetPicker(RepSetPicker):
         RepSetPicker.__init__(self, _params)
 
     def __call__(self, seq_path, otu_path, reference_path,
-                 result_path=None, log_path=None, sort_by='otu'):
+                 result_path=None, log_path=None, sort_by='otu',
+                 save_fasta_index=False):
         """Returns dict mapping {otu_id:[seq_ids]} for each otu.
 
         Parameters:
@@ -243,98 +264,98 @@ class ReferenceRepSetPicker(RepSetPicker):
         dumps the result to the desired path instead of returning it.
         log_path: path to log, which includes dump of params.
         sort_by: sort by otu or seq_id
+        save_fasta_index: save the indices of seq_path and reference_path
+        (see qiime.fasta_index.FastaIndex) so later runs don't need to
+        rebuild them
         """
-        # Load the seq path. We may want to change that in the future
-        # to avoid the overhead of loading large sequence collections
-        # during this step.
-        if seq_path:
-            seq_f = open(seq_path, 'U')
-            seqs = dict(parse_fasta(seq_f, label_to_name=label_to_name))
-            seq_f.close()
-        else:
-            # allows the user to not pass seqs, which can be useful when
-            # all otus are based on reference sequences
-            seqs = {}
-
-        # Load the reference_path. We may want to change that in the future
-        # to avoid the overhead of loading large sequence collections
-        # during this step.
-        reference_f = open(reference_path, 'U')
-        reference_seqs = dict(
-            parse_fasta(reference_f, label_to_name=label_to_name))
-        reference_f.close()
-
-        # Load the otu file
-        otu_f = open(otu_path, 'U')
-        otus = fields_to_dict(otu_f)
-        otu_f.close()
-
-        if self.Params['ChoiceFRequiresSeqs']:
-            choice_f = self.Params['ChoiceF'](seqs)
-        else:
-            choice_f = self.Params['ChoiceF']
-
-        # actually pick the set
-        result = {}
-        for set_id, ids in otus.items():
-            if set_id in reference_seqs:
-                result[set_id] = (reference_seqs, set_id)
-            elif seqs:
-                result[set_id] = (seqs, choice_f(ids, seqs))
+        # Index the seq path rather than loading it, so only the sequences
+        # that are needed are read from disk. seqs may be left empty, which
+        # allows the user to not pass seqs (useful when all otus are based
+        # on reference sequences).
+        seqs = {}
+        reference_seqs = None
+        try:
+            if seq_path:
+                seqs = _load_seqs(seq_path, save_fasta_index)
+            reference_seqs = _load_seqs(reference_path, save_fasta_index)
+
+            # Load the otu file
+            otu_f = open(otu_path, 'U')
+            otus = fields_to_dict(otu_f)
+            otu_f.close()
+
+            if self.Params['ChoiceFRequiresSeqs']:
+                # read all of the sequences once, in file order, rather
+                # than looking each one up in the index
+                choice_f = self.Params['ChoiceF'](dict(seqs.iteritems()))
             else:
-                raise KeyError("Unknown reference sequence identifier: %s\n" % set_id +
-                               "Have you provided the correct reference sequence file? " +
-                               "Did you forget to provide a seqs filepath for de novo OTUs?")
-
-        if result_path:
-            of = open(result_path, 'w')
-            if sort_by == 'seq_id':
-                def key(s):
+                choice_f = self.Params['ChoiceF']
+
+            # actually pick the set
+            result = {}
+            for set_id, ids in otus.items():
+                if set_id in reference_seqs:
+                    result[set_id] = (reference_seqs, set_id)
+                elif seqs:
+                    result[set_id] = (seqs, choice_f(ids, seqs))
+                else:
+                    raise KeyError("Unknown reference sequence identifier: %s\n" % set_id +
+                                   "Have you provided the correct reference sequence file? " +
+                                   "Did you forget to provide a seqs filepath for de novo OTUs?")
+
+            if result_path:
+                of = open(result_path, 'w')
+                if sort_by == 'seq_id':
+                    def key(s):
+                        try:
+                            return int(s[1].split('_', 1)[-1])
+                        except ValueError:
+                            return s
+                else:
+                    key = lambda s: s
+                for cluster, rep in sorted(result.items(), key=key):
+                    seq_lookup, id_ = rep
                     try:
-                        return int(s[1].split('_', 1)[-1])
-                    except ValueError:
-                        return s
+                        of.write('>%s %s\n%s\n' % (cluster, id_, seq_lookup[id_]))
+                    except KeyError:
+                        raise KeyError("Sequence identifiers (%s and %s) " % (cluster, id_) +
+                                       "not found in reference or sequence collection.")
+                of.close()
+                result = None
+                log_str = 'Result path: %s' % result_path
             else:
-                key = lambda s: s
-            for cluster, rep in sorted(result.items(), key=key):
-                seq_lookup, id_ = rep
-                try:
-                    of.write('>%s %s\n%s\n' % (cluster, id_, seq_lookup[id_]))
-                except KeyError:
-                    raise KeyError("Sequence identifiers (%s and %s) " % (cluster, id_) +
-                                   "not found in reference or sequence collection.")
-            of.close()
-            result = None
-            log_str = 'Result path: %s' % result_path
-        else:
-            # The return value here differs from GenericRepSetPicker
-            # because it is possible for the representative sequences
-            # to be ambiguous. For example, if the identifiers in
-            # seq_path and reference_path are both integers, returning
-            # a sequence identifier is not sufficent to determine which
-            # sequence collection the reference sequence came from.
-            # Therefore if the user did not provide a result_path, store
-            # the result in a dict of {otu_id: (rep_id, rep_seq)},
-            log_str = 'Result path: None, returned as dict.'
-
-            for cluster, rep in result.items():
-                seq_lookup, id_ = rep
-                try:
-                    result[cluster] = (id_, seq_lookup[id_])
-                except KeyError:
-                    raise KeyError("Sequence identifiers (%s and %s) " % (cluster, id_) +
-                                   "not found in reference or sequence collection.")
-
-        if log_path:
-            # if the user provided a log file path, log the run
-            log_file = open(log_path, 'w')
-            log_file.write(str(self))
-            log_file.write('\n')
-            log_file.write('%s\n' % log_str)
-
-        # return the result (note this is None if the data was
-        # written to file)
-        return result
+                # The return value here differs from GenericRepSetPicker
+                # because it is possible for the representative sequences
+                # to be ambiguous. For example, if the identifiers in
+                # seq_path and reference_path are both integers, returning
+                # a sequence identifier is not sufficent to determine which
+                # sequence collection the reference sequence came from.
+                # Therefore if the user did not provide a result_path, store
+                # the result in a dict of {otu_id: (rep_id, rep_seq)},
+                log_str = 'Result path: None, returned as dict.'
+
+                for cluster, rep in result.items():
+                    seq_lookup, id_ = rep
+                    try:
+                        result[cluster] = (id_, seq_lookup[id_])
+                    except KeyError:
+                        raise KeyError("Sequence identifiers (%s and %s) " % (cluster, id_) +
+                                       "not found in reference or sequence collection.")
+
+            if log_path:
+                # if the user provided a log file path, log the run
+                log_file = open(log_path, 'w')
+                log_file.write(str(self))
+                log_file.write('\n')
+                log_file.write('%s\n' % log_str)
+
+            # return the result (note this is None if the data was
+            # written to file)
+            return result
+        finally:
+            for index in (seqs, reference_seqs):
+                if isinstance(index, FastaIndex):
+                    index.close()
 
 
 rep_set_picking_methods = {
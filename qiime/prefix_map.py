@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent", "Jens Reeder"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Prefix maps built by sorting rather than with a trie.
+
+A prefix map clusters each sequence with a longer sequence that it is an
+exact prefix of. This gives the same clusters as the prefix_map of skbio's
+CompressedTrie (up to how ties are broken, see build_prefix_map), but
+instead of one Python object per trie node only the distinct sequences
+and their ids are held in memory: the distinct
+sequences are sorted, which places every sequence immediately before the
+sequences it is a prefix of, and the clusters are then derived in a single
+scan of the sorted order.
+"""
+
+
+def build_prefix_map(seqs):
+    """Build a prefix map from (seq_id, seq) pairs
+
+    Returns a dict of {seq_id: [seq_ids]}. Each key is the first id (in
+    the order of seqs) of a sequence that is not a prefix of any other
+    sequence, and its values are the remaining ids with that sequence,
+    followed by the ids of sequences that are prefixes of it. A sequence
+    that is a prefix of several others is assigned to the largest of the
+    candidate clusters, as in the prefix_map of skbio's CompressedTrie.
+
+    Ties between candidate clusters of the same size are broken in favour
+    of the cluster whose sequence sorts first, so the result doesn't
+    depend on the order of seqs or on the sequence ids. CompressedTrie
+    breaks such ties in dict iteration order (i.e., by the hashes of the
+    ids), so in that case it may pick a different, equally large, cluster.
+
+    To build a suffix map, pass reversed sequences.
+    """
+    ids_by_seq = {}
+    for seq_id, seq in seqs:
+        try:
+            ids_by_seq[seq].append(seq_id)
+        except KeyError:
+            ids_by_seq[seq] = [seq_id]
+
+    mapping = {}
+    # each entry is [seq, ids, key of the largest cluster below this seq,
+    # size of that cluster]; each seq on the stack is a prefix of those
+    # above it
+    stack = []
+
+    def pop():
+        seq, ids, best_key, best_size = stack.pop()
+        if best_key is None:
+            # no longer sequence starts with seq
+            best_key = ids[0]
+            mapping[best_key] = ids[1:]
+            best_size = len(ids) - 1
+        else:
+            mapping[best_key].extend(ids)
+            best_size += len(ids)
+        if stack and best_size > stack[-1][3]:
+            stack[-1][2] = best_key
+            stack[-1][3] = best_size
+
+    for seq in sorted(ids_by_seq):
+        while stack and not seq.startswith(stack[-1][0]):
+            pop()
+        stack.append([seq, ids_by_seq.pop(seq), None, -1])
+    while stack:
+        pop()
+    return mapping
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Local alignment of a primer against many sequences at once.
+
+split_libraries.local_align_primer_seq aligns a primer and a read with
+PyCogent's local pair HMM (match 1, mismatch -1, gap open 5, gap extend 2).
+Building the cogent sequence, HMM and alignment objects costs far more than
+the alignment itself, and reads are aligned one at a time. PrimerAligner
+runs the same Viterbi recursion with numpy over a batch of reads: cells on
+an anti-diagonal of the dynamic programming matrix only depend on the two
+previous anti-diagonals, so each anti-diagonal is computed for every
+primer position and every read of the batch at once. Scores, transitions
+and tie-breaking follow PyCogent's, so the alignments are the same as those
+of pair_hmm_align_unaligned_seqs.
+"""
+
+from numpy import (add, empty, exp, fromstring, identity, inner, intp, log,
+                   maximum, newaxis, ones, uint8, zeros)
+from cogent import DNA
+from cogent.align.align import make_dna_scoring_dict
+from cogent.align.indel_model import ClassicGapScores
+from cogent.align.pairwise import adaptPairTM
+
+# the characters that can be aligned (the DNA alphabet and its ambiguity
+# codes, other than the gap character)
+_chars = ''.join(sorted(c for c in DNA.Ambiguities if c != '-'))
+_nondegenerate_chars = 'ACGT'
+
+
+def _get_match_scores(match=1, mismatch=-1):
+    """Return the log odds scores of aligning each pair of _chars
+
+    Computed as PyCogent computes the match emission scores of its pair HMM
+    (see cogent.align.pairwise.PairEmissionProbs), so that the scores are
+    identical to the last bit.
+    """
+    alphabet = DNA.Alphabet
+    scoring_dict = make_dna_scoring_dict(match=match, transition=mismatch,
+                                         transversion=mismatch)
+    scores = zeros([len(alphabet), len(alphabet)])
+    for i, a in enumerate(alphabet):
+        for j, b in enumerate(alphabet):
+            scores[i, j] = scoring_dict[a, b]
+    psub = exp(scores)
+    mprobs = ones(len(psub)) / len(psub)
+
+    likelihoods = alphabet.fromAmbigToLikelihoods(list(_chars), float)
+    x_plh = inner(likelihoods, psub)
+    x_plh /= inner(likelihoods, mprobs)[..., newaxis]
+    y_plh = inner(likelihoods, identity(len(psub)))
+    y_plh /= inner(likelihoods, mprobs)[..., newaxis]
+
+    # the last row and column are for padding at the ends of reads, which
+    # can not be aligned
+    match_scores = empty([len(_chars) + 1, len(_chars) + 1])
+    match_scores.fill(-float('inf'))
+    match_scores[:-1, :-1] = log(inner(x_plh * mprobs, y_plh))
+    return match_scores
+
+
+def _get_char_codes():
+    """Return an array mapping each byte to its index in _chars"""
+    char_codes = empty(256, dtype=intp)
+    char_codes.fill(len(_chars))
+    for i, c in enumerate(_chars):
+        char_codes[ord(c)] = i
+        char_codes[ord(c.lower())] = i
+    return char_codes
+
+_match_scores = _get_match_scores()
+_char_codes = _get_char_codes()
+
+# the states of the pair HMM, in PyCogent's order
+_begin, _gap_in_seq, _gap_in_primer, _match = 0, 1, 2, 3
+
+
+def _get_transition_scores(gap_open=5, gap_extend=2):
+    """Return the log transition scores of the pair HMM"""
+    _, transitions = adaptPairTM(ClassicGapScores(gap_open, gap_extend))
+    return log(transitions)
+
+_transition_scores = _get_transition_scores()
+
+
+class PrimerAligner(object):
+
+    """Locally align a primer with sequences
+
+    primer: the primer sequence, which may contain IUPAC degenerate
+        characters
+    batch_size: the number of sequences to align at once
+    max_cache_size: the number of alignments to remember. Alignments are
+        remembered by sequence, so a sequence that has been aligned before
+        is not aligned again.
+
+    Alignments are returned as (primer_hit, target_hit) tuples, the aligned
+    (uppercase) primer and sequence, which contain '-' where either has a
+    gap, as the sequences of the alignment returned by
+    split_libraries.pair_hmm_align_unaligned_seqs.
+    """
+
+    def __init__(self, primer, batch_size=128, max_cache_size=2 ** 16):
+        primer = primer.upper()
+        if not primer:
+            raise ValueError("Can't align an empty primer.")
+        self._check_chars(primer)
+        self.primer = primer
+        self.batch_size = batch_size
+        self.max_cache_size = max_cache_size
+        self._primer_codes = _char_codes[fromstring(primer, dtype=uint8)]
+        # a read containing a non-degenerate primer exactly has that
+        # occurrence as its best alignment, as every aligned position scores
+        # less than an identical pair of non-degenerate characters
+        self._exact_hits = not primer.translate(None, _nondegenerate_chars)
+        self._cache = {}
+
+    def _check_chars(self, seq):
+        """Raise a ValueError if seq has characters that can't be aligned"""
+        invalid_chars = seq.translate(None, _chars)
+        if invalid_chars:
+            raise ValueError("Can't align character %r in %s" %
+                             (invalid_chars[0], seq))
+
+    def align(self, seq):
+        """Return the (primer_hit, target_hit) alignment of seq"""
+        return self.align_seqs([seq])[0]
+
+    def align_seqs(self, seqs):
+        """Return the (primer_hit, target_hit) alignment of each of seqs"""
+        cache = self._cache
+        primer = self.primer
+        to_align = set()
+        for seq in seqs:
+            if seq not in cache:
+                upper_seq = seq.upper()
+                if not upper_seq:
+                    raise ValueError("Can't align an empty sequence.")
+                self._check_chars(upper_seq)
+                if self._exact_hits and primer in upper_seq:
+                    cache[seq] = primer, primer
+                else:
+                    to_align.add(seq)
+
+        # sequences of similar lengths are aligned together, so that little
+        # of each batch is padding
+        to_align = sorted(to_align, key=len)
+        for start in range(0, len(to_align), self.batch_size):
+            batch = to_align[start:start + self.batch_size]
+            cache.update(zip(batch, self._align_batch(batch)))
+
+        result = [cache[seq] for seq in seqs]
+        if len(cache) > self.max_cache_size:
+            cache.clear()
+        return result
+
+    def _align_batch(self, seqs):
+        """Return the alignments of seqs, computed together"""
+        primer_codes = self._primer_codes
+        primer_len = len(primer_codes)
+        batch_size = len(seqs)
+        max_seq_len = max(map(len, seqs))
+        # anti-diagonal d of the (primer position i, read position j) matrix
+        # holds the cells with i + j == d, and cells are stored as
+        # [d, i, read], with position 0 of primer and reads before their
+        # first characters
+        num_diagonals = primer_len + max_seq_len + 1
+
+        seq_codes = empty((max_seq_len, batch_size), dtype=intp)
+        seq_codes.fill(len(_chars))
+        for read, seq in enumerate(seqs):
+            seq_codes[:len(seq), read] = _char_codes[fromstring(seq,
+                                                                dtype=uint8)]
+        emissions = empty((num_diagonals, primer_len + 1, batch_size))
+        for i in range(1, primer_len + 1):
+            emissions[i + 1:i + max_seq_len + 1, i] = \
+                _match_scores[primer_codes[i - 1]][seq_codes]
+
+        shape = (num_diagonals, primer_len + 1, batch_size)
+        match_scores = empty(shape)
+        match_scores.fill(-float('inf'))
+        seq_gap_scores = match_scores.copy()
+        primer_gap_scores = match_scores.copy()
+        t = _transition_scores
+        begin_match = t[_begin, _match]
+        seq_gap_match = t[_gap_in_seq, _match]
+        primer_gap_match = t[_gap_in_primer, _match]
+        match_match = t[_match, _match]
+        seq_gap_extend = t[_gap_in_seq, _gap_in_seq]
+        seq_gap_open = t[_match, _gap_in_seq]
+        primer_gap_extend = t[_gap_in_primer, _gap_in_primer]
+        primer_gap_open = t[_match, _gap_in_primer]
+        buf = empty((primer_len, batch_size))
+
+        # only the scores are computed here: the path through the states is
+        # recovered from them when tracing back the best alignment
+        for d in range(2, primer_len + max_seq_len + 1):
+            start = max(1, d - max_seq_len)
+            stop = min(primer_len, d - 1) + 1
+            best = match_scores[d, start:stop]
+            tmp = buf[:stop - start]
+
+            # a match continues from (i - 1, j - 1), or starts the alignment
+            add(seq_gap_scores[d - 2, start - 1:stop - 1], seq_gap_match,
+                out=best)
+            maximum(best, begin_match, out=best)
+            add(primer_gap_scores[d - 2, start - 1:stop - 1],
+                primer_gap_match, out=tmp)
+            maximum(best, tmp, out=best)
+            add(match_scores[d - 2, start - 1:stop - 1], match_match,
+                out=tmp)
+            maximum(best, tmp, out=best)
+            best += emissions[d, start:stop]
+
+            # a gap in the read continues from (i - 1, j)
+            best = seq_gap_scores[d, start:stop]
+            add(seq_gap_scores[d - 1, start - 1:stop - 1], seq_gap_extend,
+                out=best)
+            add(match_scores[d - 1, start - 1:stop - 1], seq_gap_open,
+                out=tmp)
+            maximum(best, tmp, out=best)
+
+            # a gap in the primer continues from (i, j - 1)
+            best = primer_gap_scores[d, start:stop]
+            add(primer_gap_scores[d - 1, start:stop], primer_gap_extend,
+                out=best)
+            add(match_scores[d - 1, start:stop], primer_gap_open, out=tmp)
+            maximum(best, tmp, out=best)
+
+        # the alignment ends at the best scoring match, the first in
+        # (primer position, read position) order if several score the same
+        best_scores = match_scores.max(axis=0).max(axis=0)
+        end_cells = []
+        for read, best_score in enumerate(best_scores):
+            diagonals, rows = (match_scores[:, :, read] ==
+                               best_score).nonzero()
+            end_cells.append(min(zip(rows, diagonals - rows)))
+
+        primer = self.primer
+        result = []
+        for read, seq in enumerate(seqs):
+            seq = seq.upper()
+            i, j = end_cells[read]
+            state = _match
+            primer_hit = []
+            target_hit = []
+            # follow the states back to the start of the alignment, taking
+            # the first of equally scoring previous states as PyCogent does
+            while state != _begin:
+                d = i + j
+                if state == _match:
+                    primer_hit.append(primer[i - 1])
+                    target_hit.append(seq[j - 1])
+                    best = begin_match
+                    state = _begin
+                    for prev_state, prev_scores in (
+                            (_gap_in_seq, seq_gap_scores),
+                            (_gap_in_primer, primer_gap_scores),
+                            (_match, match_scores)):
+                        score = prev_scores[d - 2, i - 1, read] + \
+                            t[prev_state, _match]
+                        if score > best:
+                            best = score
+                            state = prev_state
+                    i -= 1
+                    j -= 1
+                elif state == _gap_in_seq:
+                    primer_hit.append(primer[i - 1])
+                    target_hit.append('-')
+                    if match_scores[d - 1, i - 1, read] + seq_gap_open > \
+                            seq_gap_scores[d - 1, i - 1, read] + \
+                            seq_gap_extend:
+                        state = _match
+                    i -= 1
+                else:
+                    primer_hit.append('-')
+                    target_hit.append(seq[j - 1])
+                    if match_scores[d - 1, i, read] + primer_gap_open > \
+                            primer_gap_scores[d - 1, i, read] + \
+                            primer_gap_extend:
+                        state = _match
+                    j -= 1
+            result.append((''.join(reversed(primer_hit)),
+                           ''.join(reversed(target_hit))))
+        return result
@@ -13,10 +13,13 @@ from subprocess import check_call
 
 from burrito.util import ApplicationNotFoundError
 from cogent.parse.binary_sff import (
-    parse_binary_sff, format_binary_sff, write_binary_sff, decode_accession,
+    parse_binary_sff, write_binary_sff, decode_accession,
+    format_common_header, format_read_header,
 )
 from burrito.util import which
+from numpy import cumsum
 
+from qiime.sff_reader import SffReader
 from qiime.util import qiime_open, is_gzip
 
 __author__ = "Rob Knight"
@@ -116,9 +119,29 @@ def format_binary_sff_as_fna(sff_file, output_file=None, qual=False):
     # TODO: Move to PyCogent
     if output_file is None:
         output_file = StringIO()
-    _, reads = parse_binary_sff(sff_file)
-    for read in reads:
-        output_file.write(format_read_as_fna(read, qual))
+    reader = SffReader(sff_file)
+    read_headers = reader.read_headers
+    # see format_read_as_fna for the clipping of reads
+    start_idxs = read_headers['clip_qual_left'].astype(int) - 1
+    end_idxs = read_headers['clip_qual_right'].astype(int)
+    write = output_file.write
+    for i, name in enumerate(reader.names):
+        start_idx = start_idxs[i]
+        end_idx = end_idxs[i]
+        timestamp, _, region, location = decode_accession(name)
+        write('>%s length=%d xy=%04d_%04d region=%d '
+              'run=R_%d_%02d_%02d_%02d_%02d_%02d_\n' %
+              ((name, end_idx - start_idx) + location + (region,) +
+               timestamp))
+        if qual:
+            # slice as a list, so that a start_idx of -1 behaves as it does
+            # for the scores of a parsed read
+            scores = reader.get_quality_scores(i).tolist()
+            write(' '.join(map(str, scores[start_idx:end_idx])))
+        else:
+            write(reader.get_bases(i)[start_idx:end_idx])
+        write('\n')
+    reader.close()
     return output_file
 
 
@@ -167,6 +190,57 @@ def format_read_as_fna(read, qual=False):
     return out.getvalue()
 
 
+def _get_flowgram_strs():
+    """Return the text of each (native) flowgram value in sffinfo output
+    """
+    if _get_flowgram_strs.strs is None:
+        _get_flowgram_strs.strs = ['\t%01.2f' % (x * 0.01)
+                                   for x in range(2 ** 16)]
+    return _get_flowgram_strs.strs
+
+_get_flowgram_strs.strs = None
+
+
+def format_binary_sff_as_txt(sff_file, output_file=None):
+    """Write a binary SFF file to an output file, in sffinfo's text format.
+
+    The output is that of cogent.parse.binary_sff.format_binary_sff. If no
+    output file is provided, an in-memory file-like buffer is used (namely,
+    a StringIO object).
+    """
+    if output_file is None:
+        output_file = StringIO()
+    reader = SffReader(sff_file)
+    write = output_file.write
+    write(format_common_header(reader.header))
+    flowgram_strs = _get_flowgram_strs()
+    for i in range(len(reader)):
+        read_header = reader.get_read_header(i)
+        write(format_read_header(read_header))
+        write('\nFlowgram:')
+        write(''.join([flowgram_strs[x]
+                       for x in reader.get_flowgram_values(i).tolist()]))
+        write('\nFlow Indexes:')
+        flow_indexes = cumsum(reader.get_flow_index_per_base(i)).tolist()
+        write(''.join(['\t%d' % x for x in flow_indexes]))
+
+        # bases outside the (1-based, inclusive) clip_qual_left and
+        # clip_qual_right are lowercase
+        bases = reader.get_bases(i)
+        left_idx = max(read_header['clip_qual_left'] - 1, 0)
+        right_idx = max(read_header['clip_qual_right'], left_idx)
+        write('\nBases:\t')
+        write(bases[:left_idx].lower())
+        write(bases[left_idx:right_idx].upper())
+        write(bases[right_idx:].lower())
+        write('\nQuality Scores:')
+        write(''.join(['\t%d' % x
+                       for x in reader.get_quality_scores(i).tolist()]))
+        write('\n')
+    reader.close()
+    return output_file
+
+
 _MISSING_APP_MESSAGE = (
     "%s is not in $PATH. Is it installed? Have you added it to $PATH?")
 
@@ -206,7 +280,8 @@ def make_flow_txt(sff_fp, output_fp, use_sfftools=False):
         _check_call(['sffinfo', sff_fp], stdout=open(output_fp, 'w'))
     else:
         try:
-            format_binary_sff(qiime_open(sff_fp, 'rb'), open(output_fp, 'w'))
+            format_binary_sff_as_txt(qiime_open(sff_fp, 'rb'),
+                                     open(output_fp, 'w'))
         except:
             raise IOError("Could not parse SFF %s" % sff_fp)
 
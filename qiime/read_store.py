@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""A compressed, chunked binary container for demultiplexed reads.
+
+A read store holds the same records as a seqs.fna (and optionally
+seqs.qual) file in a fraction of the space, and can be read back without
+parsing text. The file starts with read_store_magic and is followed by
+independent chunks of up to chunk_size reads. Each chunk has a fixed-size
+header (the number of reads, the total and sum of squared read lengths,
+and the number of new sample ids and compressed payload bytes) followed
+by a zlib-compressed payload holding:
+
+ - the sample ids first seen in this chunk (sample ids are interned, so
+   each is stored once per file, and each read stores a uint32 code);
+ - the remainder of each read's label (the label with the leading
+   sample id removed);
+ - the read lengths;
+ - the bases packed four per byte (A=0, C=1, G=2, T=3), plus the
+   positions and values of any other characters (e.g., N);
+ - optionally, the quality scores, delta-coded within each read.
+
+Because the read counts and length sums are in the chunk headers,
+count_read_store doesn't need to decompress anything.
+"""
+
+from struct import Struct
+from zlib import compress, decompress
+
+from numpy import (array, cumsum, concatenate, frombuffer, int64,
+                   repeat, sqrt, uint8, uint32, where, zeros)
+
+read_store_magic = 'QIIMERS\x01'
+read_store_suffix = '.qrs'
+
+# n_reads, has_qual, n_new_samples, total length, sum of squared lengths,
+# payload length
+_chunk_header = Struct('<IBIQQQ')
+# each field of a chunk's payload is preceded by its length
+_field_length = Struct('<Q')
+
+_base_codes = zeros(256, dtype=uint8) + 255
+for _code, _base in enumerate('ACGT'):
+    _base_codes[ord(_base)] = _code
+_code_bases = frombuffer('ACGT', dtype=uint8)
+
+
+def is_read_store(fp):
+    """Return True if fp is a read store (based on its magic number)"""
+    with open(fp, 'rb') as f:
+        return f.read(len(read_store_magic)) == read_store_magic
+
+
+def _split_label(label):
+    """Return (sample id, rest of label) for a QIIME sequence label"""
+    seq_id, space, description = label.partition(' ')
+    sample_id, underscore, seq_num = seq_id.rpartition('_')
+    if not underscore:
+        return '', label
+    return sample_id, '_' + seq_num + space + description
+
+
+def pack_bases(seqs):
+    """Return (packed bases, exception positions, exception values)
+
+    seqs is a list of sequence strings. Bases are packed four per byte
+    (2 bits per base); any character other than ACGT is stored as a
+    position in the concatenated sequences and its character code.
+    """
+    bases = frombuffer(''.join(seqs), dtype=uint8)
+    codes = _base_codes[bases]
+    exception_positions = where(codes == 255)[0].astype(uint32)
+    exception_values = bases[exception_positions]
+    codes[exception_positions] = 0
+    padded = zeros(-(-len(codes) // 4) * 4, dtype=uint8)
+    padded[:len(codes)] = codes
+    padded = padded.reshape(-1, 4)
+    packed = (padded[:, 0] << 6) | (padded[:, 1] << 4) | \
+        (padded[:, 2] << 2) | padded[:, 3]
+    return packed.astype(uint8), exception_positions, exception_values
+
+
+def unpack_bases(packed, n_bases, exception_positions, exception_values):
+    """Return the concatenated sequences packed by pack_bases as a string
+    """
+    codes = zeros((len(packed), 4), dtype=uint8)
+    codes[:, 0] = packed >> 6
+    codes[:, 1] = (packed >> 4) & 3
+    codes[:, 2] = (packed >> 2) & 3
+    codes[:, 3] = packed & 3
+    bases = _code_bases[codes.ravel()[:n_bases]]
+    bases[exception_positions] = exception_values
+    return bases.tostring()
+
+
+def _read_starts(lengths):
+    """Return the offset of each read in the concatenated reads"""
+    ends = cumsum(lengths, dtype=int64)
+    return ends - lengths
+
+
+def delta_encode_quals(quals, lengths):
+    """Delta-code concatenated quality scores within each read
+
+    quals is a uint8 array of the concatenated quality scores of reads with
+    the given lengths. The first score of each read is stored as is, and
+    every other score as the (mod 256) difference from the previous one.
+    """
+    deltas = quals.copy()
+    deltas[1:] -= quals[:-1]
+    starts = _read_starts(lengths)
+    starts = starts[lengths > 0]
+    deltas[starts] = quals[starts]
+    return deltas
+
+
+def delta_decode_quals(deltas, lengths):
+    """Invert delta_encode_quals"""
+    totals = cumsum(deltas, dtype=int64)
+    starts = _read_starts(lengths)
+    # the running total before the start of each read
+    before = concatenate([[0], totals])[starts]
+    quals = totals - repeat(before, lengths)
+    return (quals % 256).astype(uint8)
+
+
+class ReadStoreWriter(object):
+
+    """Write reads to a read store, one chunk at a time
+
+    Reads are passed to write as (label, seq, qual) where qual is a
+    sequence of integer quality scores (0 to 255) or None. Either all or
+    none of the reads in a store should have quality scores.
+    """
+
+    def __init__(self, read_store_f, chunk_size=65536, compression_level=6):
+        self._f = read_store_f
+        self.ChunkSize = chunk_size
+        self.CompressionLevel = compression_level
+        self._sample_codes = {}
+        self._labels = []
+        self._seqs = []
+        self._quals = []
+        self._f.write(read_store_magic)
+
+    def write(self, label, seq, qual=None):
+        if qual is not None:
+            if len(qual) != len(seq):
+                raise ValueError("Sequence and quality scores have different "
+                                 "lengths: %s" % label)
+            self._quals.append(qual)
+        self._labels.append(label)
+        self._seqs.append(seq)
+        if len(self._labels) >= self.ChunkSize:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered reads as a chunk"""
+        labels = self._labels
+        if not labels:
+            return
+        seqs = self._seqs
+        quals = self._quals
+        if quals and len(quals) != len(seqs):
+            raise ValueError("Either all or none of the reads must have "
+                             "quality scores.")
+
+        sample_codes = self._sample_codes
+        new_sample_ids = []
+        codes = zeros(len(labels), dtype=uint32)
+        rests = []
+        for i, label in enumerate(labels):
+            sample_id, rest = _split_label(label)
+            try:
+                codes[i] = sample_codes[sample_id]
+            except KeyError:
+                codes[i] = sample_codes[sample_id] = len(sample_codes)
+                new_sample_ids.append(sample_id)
+            rests.append(rest)
+
+        lengths = array([len(seq) for seq in seqs], dtype=uint32)
+        packed, exception_positions, exception_values = pack_bases(seqs)
+        fields = ['\n'.join(new_sample_ids),
+                  '\n'.join(rests),
+                  codes.tostring(),
+                  lengths.tostring(),
+                  packed.tostring(),
+                  exception_positions.tostring(),
+                  exception_values.tostring()]
+        if quals:
+            qual_array = concatenate([array(q, dtype=uint8) for q in quals])
+            fields.append(
+                delta_encode_quals(qual_array, lengths).tostring())
+        payload = ''.join(['%s%s' % (_field_length.pack(len(field)), field)
+                           for field in fields])
+        payload = compress(payload, self.CompressionLevel)
+
+        lengths = lengths.astype(int64)
+        self._f.write(_chunk_header.pack(len(labels), bool(quals),
+                                         len(new_sample_ids),
+                                         int(lengths.sum()),
+                                         int((lengths * lengths).sum()),
+                                         len(payload)))
+        self._f.write(payload)
+        self._labels = []
+        self._seqs = []
+        self._quals = []
+
+    def close(self):
+        self.flush()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _read_magic(read_store_f):
+    if read_store_f.read(len(read_store_magic)) != read_store_magic:
+        raise ValueError("Not a read store file.")
+
+
+def _iter_chunk_headers(read_store_f):
+    """Yield chunk header fields, leaving read_store_f at each payload"""
+    while True:
+        header = read_store_f.read(_chunk_header.size)
+        if not header:
+            return
+        if len(header) != _chunk_header.size:
+            raise ValueError("Truncated read store chunk header.")
+        yield _chunk_header.unpack(header)
+
+
+def _split_payload(payload):
+    fields = []
+    offset = 0
+    while offset < len(payload):
+        field_length, = _field_length.unpack_from(payload, offset)
+        offset += _field_length.size
+        fields.append(payload[offset:offset + field_length])
+        offset += field_length
+    return fields
+
+
+def parse_read_store(read_store_f):
+    """Yield (label, seq, qual) for each read in read_store_f
+
+    read_store_f must be opened in binary mode. qual is a uint8 array of
+    quality scores, or None if the store has no quality scores.
+    """
+    _read_magic(read_store_f)
+    sample_ids = []
+    for n_reads, has_qual, n_new_samples, n_bases, _, payload_length in \
+            _iter_chunk_headers(read_store_f):
+        payload = read_store_f.read(payload_length)
+        if len(payload) != payload_length:
+            raise ValueError("Truncated read store chunk.")
+        fields = _split_payload(decompress(payload))
+        if n_new_samples:
+            sample_ids.extend(fields[0].split('\n'))
+        rests = fields[1].split('\n')
+        codes = frombuffer(fields[2], dtype=uint32)
+        lengths = frombuffer(fields[3], dtype=uint32).astype(int64)
+        seqs = unpack_bases(frombuffer(fields[4], dtype=uint8), n_bases,
+                            frombuffer(fields[5], dtype=uint32),
+                            frombuffer(fields[6], dtype=uint8))
+        if has_qual:
+            quals = delta_decode_quals(frombuffer(fields[7], dtype=uint8),
+                                       lengths)
+        ends = cumsum(lengths)
+        starts = ends - lengths
+        for i in xrange(n_reads):
+            start = starts[i]
+            end = ends[i]
+            sample_id = sample_ids[codes[i]]
+            qual = quals[start:end] if has_qual else None
+            yield sample_id + rests[i], seqs[start:end], qual
+
+
+class ReadStore(object):
+
+    """A read store file, which can be iterated over more than once
+
+    Iterating yields (label, seq, qual) as in parse_read_store.
+    """
+
+    def __init__(self, read_store_fp):
+        self.Filepath = read_store_fp
+
+    def __iter__(self):
+        with open(self.Filepath, 'rb') as read_store_f:
+            for record in parse_read_store(read_store_f):
+                yield record
+
+    def iter_records(self):
+        """Yield (label, seq) for each read"""
+        for label, seq, _ in self:
+            yield label, seq
+
+    def __len__(self):
+        return count_read_store(self.Filepath)[0]
+
+
+def read_store_to_fasta(read_store_f, fasta_f, qual_f=None,
+                        label_to_name=None):
+    """Write the reads in read_store_f as fasta (and optionally qual)
+
+    label_to_name, if provided, is applied to each label (e.g., to keep
+    only the sequence id).
+    """
+    for label, seq, qual in parse_read_store(read_store_f):
+        if label_to_name is not None:
+            label = label_to_name(label)
+        fasta_f.write('>%s\n%s\n' % (label, seq))
+        if qual_f is not None:
+            if qual is None:
+                raise ValueError("The read store has no quality scores.")
+            # 60 quality scores per line, as in QIIME's qual files
+            qual_f.write('>%s\n' % label)
+            for i in xrange(0, len(qual), 60):
+                qual_f.write('%s\n' % ' '.join(map(str, qual[i:i + 60])))
+
+
+def read_store_to_fastq(read_store_f, fastq_f, phred_offset=33,
+                        label_to_name=None):
+    """Write the reads in read_store_f as fastq"""
+    for label, seq, qual in parse_read_store(read_store_f):
+        if qual is None:
+            raise ValueError("The read store has no quality scores.")
+        if label_to_name is not None:
+            label = label_to_name(label)
+        fastq_f.write('@%s\n%s\n+\n%s\n' %
+                      (label, seq,
+                       (qual + phred_offset).astype(uint8).tostring()))
+
+
+def count_read_store(read_store_fp):
+    """Return (count, mean length, std of lengths) of reads in a read store
+
+    Only the chunk headers are read. (None, None) are returned for the
+    mean and std if the store is empty, as with qiime.util.count_seqs.
+    """
+    count = total = total_sq = 0
+    with open(read_store_fp, 'rb') as read_store_f:
+        _read_magic(read_store_f)
+        for n_reads, _, _, n_bases, n_bases_sq, payload_length in \
+                _iter_chunk_headers(read_store_f):
+            count += n_reads
+            total += n_bases
+            total_sq += n_bases_sq
+            read_store_f.seek(payload_length, 1)
+    if count == 0:
+        return 0, None, None
+    mean = total / count
+    return count, mean, sqrt(max(total_sq / count - mean * mean, 0.0))
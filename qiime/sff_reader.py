@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Read binary SFF files with numpy.
+
+cogent.parse.binary_sff reads an SFF file one field at a time, unpacking
+every flowgram value, flow index and quality score of every read into a
+tuple of Python ints. SffReader instead memory-maps the file (or reads it
+into memory, if it is compressed) and finds where each read starts in a
+single pass over the read headers, so that the fields of a read are numpy
+arrays viewing the file's bytes, and reads can be copied to another SFF
+file without decoding them at all.
+"""
+
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+
+import numpy as np
+from cogent.parse.binary_sff import (common_header_fields,
+                                     read_header_fields,
+                                     validate_common_header)
+
+common_header_dtype = np.dtype([('magic_number', '>u4'),
+                                ('version', '>u4'),
+                                ('index_offset', '>u8'),
+                                ('index_length', '>u4'),
+                                ('number_of_reads', '>u4'),
+                                ('header_length', '>u2'),
+                                ('key_length', '>u2'),
+                                ('number_of_flows_per_read', '>u2'),
+                                ('flowgram_format_code', 'u1')])
+
+read_header_dtype = np.dtype([('read_header_length', '>u2'),
+                              ('name_length', '>u2'),
+                              ('number_of_bases', '>u4'),
+                              ('clip_qual_left', '>u2'),
+                              ('clip_qual_right', '>u2'),
+                              ('clip_adapter_left', '>u2'),
+                              ('clip_adapter_right', '>u2')])
+
+_read_header_struct = Struct('>HHIHHHH')
+
+
+def _pad(position, unit=8):
+    """Return position rounded up to a multiple of unit"""
+    return (position + unit - 1) // unit * unit
+
+
+class SffReader(object):
+
+    """The reads of a binary SFF file
+
+    sff_file: open binary SFF file. Files on disk are memory-mapped; other
+        file-like objects (e.g., gzipped files) are read into memory.
+
+    header: dict of the common header fields, as
+        cogent.parse.binary_sff.parse_common_header returns them
+    names: list of the names of the reads
+    read_headers: structured array (of read_header_dtype) of the read
+        header fields of each read
+    read_offsets, read_ends: arrays of the positions in the file of the
+        start and end (including padding) of each read
+
+    The flowgram values, flow indices and quality scores of read i are
+    arrays viewing the file, returned by get_flowgram_values(i) etc.
+    Flowgram values are native (i.e., 100 times the normalized values).
+    """
+
+    def __init__(self, sff_file):
+        # a gzipped file's fileno is that of the compressed file, so only
+        # files on disk are mapped
+        self._buffer = None
+        if isinstance(sff_file, file) and sff_file.tell() == 0:
+            try:
+                self._buffer = mmap(sff_file.fileno(), 0,
+                                    access=ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # e.g., an empty file or a pipe
+                pass
+        if self._buffer is None:
+            self._buffer = sff_file.read()
+        buff = self._buffer
+        if len(buff) < common_header_dtype.itemsize:
+            raise ValueError("SFF file is too short to contain a header.")
+
+        header_values = np.frombuffer(buff, common_header_dtype, 1)[0]
+        header = dict(zip(common_header_fields,
+                          [int(v) for v in header_values]))
+        validate_common_header(header)
+        offset = common_header_dtype.itemsize
+        header['flow_chars'] = \
+            buff[offset:offset + header['number_of_flows_per_read']]
+        offset += header['number_of_flows_per_read']
+        header['key_sequence'] = buff[offset:offset + header['key_length']]
+        self.header = header
+        self.number_of_flows = header['number_of_flows_per_read']
+        self._header_end = _pad(offset + header['key_length'])
+
+        # the reads follow each other (and perhaps the index), so the
+        # length of each read has to be known to find the next one
+        num_reads = header['number_of_reads']
+        index_offset = header['index_offset']
+        flows_length = 2 * self.number_of_flows
+        unpack_from = _read_header_struct.unpack_from
+        read_offsets = np.empty(num_reads, dtype=np.int64)
+        read_ends = np.empty(num_reads, dtype=np.int64)
+        data_offsets = np.empty(num_reads, dtype=np.int64)
+        read_header_values = []
+        names = []
+        position = self._header_end
+        last_header_start = len(buff) - _read_header_struct.size
+        for i in xrange(num_reads):
+            if position == index_offset:
+                position += header['index_length']
+            if position > last_header_start:
+                break
+            read_offsets[i] = position
+            values = unpack_from(buff, position)
+            read_header_values.append(values)
+            name_start = position + _read_header_struct.size
+            names.append(buff[name_start:name_start + values[1]])
+            position = _pad(name_start + values[1])
+            data_offsets[i] = position
+            position = _pad(position + flows_length + 3 * values[2])
+            read_ends[i] = position
+        if position > len(buff) or len(names) < num_reads:
+            raise ValueError("SFF file ends before the end of its reads.")
+
+        self.names = names
+        self.read_headers = np.array(read_header_values,
+                                     dtype=read_header_dtype)
+        self.read_offsets = read_offsets
+        self.read_ends = read_ends
+        self._data_offsets = data_offsets
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_read_header(self, i):
+        """Return a dict of the read header fields of read i"""
+        read_header = dict(zip(read_header_fields,
+                               [int(v) for v in self.read_headers[i]]))
+        read_header['Name'] = self.names[i]
+        return read_header
+
+    def get_flowgram_values(self, i):
+        """Return the (native) flowgram values of read i"""
+        return np.frombuffer(self._buffer, '>u2', self.number_of_flows,
+                             self._data_offsets[i])
+
+    def get_flow_index_per_base(self, i):
+        """Return the flow index increments of the bases of read i"""
+        return np.frombuffer(self._buffer, np.uint8,
+                             self.read_headers['number_of_bases'][i],
+                             self._data_offsets[i] + 2 * self.number_of_flows)
+
+    def get_bases(self, i):
+        """Return the bases of read i, as a string"""
+        number_of_bases = int(self.read_headers['number_of_bases'][i])
+        start = self._data_offsets[i] + 2 * self.number_of_flows + \
+            number_of_bases
+        return self._buffer[start:start + number_of_bases]
+
+    def get_quality_scores(self, i):
+        """Return the quality scores of the bases of read i"""
+        number_of_bases = self.read_headers['number_of_bases'][i]
+        return np.frombuffer(self._buffer, np.uint8, number_of_bases,
+                             self._data_offsets[i] +
+                             2 * self.number_of_flows + 2 * number_of_bases)
+
+    def get_read(self, i):
+        """Return read i as a dict, as cogent.parse.binary_sff.parse_read
+        (with native flowgram values) returns it
+        """
+        read = self.get_read_header(i)
+        read['flowgram_values'] = tuple(self.get_flowgram_values(i).tolist())
+        read['flow_index_per_base'] = \
+            tuple(self.get_flow_index_per_base(i).tolist())
+        read['Bases'] = self.get_bases(i)
+        read['quality_scores'] = tuple(self.get_quality_scores(i).tolist())
+        return read
+
+    def get_header_bytes(self):
+        """Return the common header section, as it is in the file"""
+        return self._buffer[:self._header_end]
+
+    def get_read_bytes(self, i):
+        """Return read i (header and data sections), as it is in the file"""
+        return self._buffer[self.read_offsets[i]:self.read_ends[i]]
+
+    def close(self):
+        """Unmap the file
+
+        Arrays returned by the reader must not be used after closing it.
+        """
+        if isinstance(self._buffer, mmap):
+            self._buffer.close()
@@ -7,6 +7,7 @@ from operator import itemgetter
 from numpy import array
 from skbio.parse.sequences import parse_fasta
 from qiime.parse import parse_mapping_file
+from qiime.dereplicate import dereplicate_seqs, default_max_seqs_in_memory
 
 __author__ = "Greg Caporaso"
 __copyright__ = "Copyright 2011, The QIIME Project"
@@ -116,36 +117,22 @@ def sort_sample_ids_by_mapping_value(mapping_file, field, field_type_f=float):
     return results
 
 
-def sort_fasta_by_abundance(fasta_lines, fasta_out_f):
+def sort_fasta_by_abundance(fasta_lines, fasta_out_f,
+                            max_seqs_in_memory=default_max_seqs_in_memory,
+                            tmp_dir=None):
     """ Sort seqs in fasta_line by abundance, write all seqs to fasta_out_f
 
      Note that all sequences are written out, not just unique ones.
 
      fasta_lines: input file handle (or similar object)
      fasta_out_f: output file handle (or similar object)
-
-    ** The current implementation works well for fairly large data sets,
-       (e.g., several combined 454 runs) but we may want to revisit if it
-       chokes on very large (e.g., Illumina) files. --Greg **
+     max_seqs_in_memory: at most this many sequences are held in memory;
+      if there are more, sorted runs are spilled to temp files in tmp_dir
+      (see qiime.dereplicate.dereplicate_seqs)
 
     """
-    seq_index = {}
-    count = 0
-    for seq_id, seq in parse_fasta(fasta_lines):
-        count += 1
-        try:
-            seq_index[seq].append(seq_id)
-        except KeyError:
-            seq_index[seq] = [seq_id]
-
-    seqs = []
-    for k, v in seq_index.items():
-        seqs.append((len(v), k, v))
-        del seq_index[k]
-    seqs.sort()
-    for count, seq, seq_ids in seqs[::-1]:
-        for seq_id in seq_ids:
-            fasta_out_f.write('>%s\n%s\n' % (seq_id, seq))
+    dereplicate_seqs(parse_fasta(fasta_lines), sorted_seqs_f=fasta_out_f,
+                     max_seqs_in_memory=max_seqs_in_memory, tmp_dir=tmp_dir)
 
 
 def sort_otu_table_by_mapping_field(otu_table_data,
@@ -38,9 +38,10 @@ import re
 from gzip import GzipFile
 from os import mkdir, stat
 from collections import defaultdict
+from itertools import chain, imap, islice, izip
 from string import upper
 
-from numpy import array, mean, arange, histogram
+from numpy import array, asarray, mean, arange, histogram, uint8
 from numpy import __version__ as numpy_version
 import warnings
 warnings.filterwarnings('ignore', 'Not using MPI as mpi4py not found')
@@ -57,7 +58,9 @@ from qiime.barcode import correct_barcode
 from qiime.hamming import decode_barcode_8
 from qiime.golay import decode as decode_golay_12
 from qiime.format import format_histograms
-from qiime.parse import QiimeParseError, parse_qual_scores
+from qiime.pattern_matcher import PatternMatcher
+from qiime.primer_aligner import PrimerAligner
+from qiime.parse import QiimeParseError
 from qiime.util import create_dir, median_absolute_deviation
 
 # Including new=True in the histogram() call is necessary to
@@ -91,6 +94,10 @@ BARCODE_TYPES = {
     # length is None, corresponding to variable length.
     "variable_length": (None, lambda bc, bcodes: (bc, 0))}
 
+# Number of reads checked together by check_seqs, so that the reverse primers
+# can be aligned with all of them at once
+check_seqs_chunk_size = 1024
+
 
 def get_infile(filename):
     """Returns filehandle, allowing gzip input."""
@@ -244,6 +251,50 @@ def local_align_primer_seq(primer, sequence, sw_scorer=equality_scorer_ambigs):
     primer_hit = str(alignment.Seqs[0])
     target_hit = str(alignment.Seqs[1])
 
+    return count_primer_hit_mismatches(primer_hit, target_hit, query_sequence,
+                                       sw_scorer)
+
+
+def local_align_primer_seqs(primer_seqs, primer_aligners=None,
+                            sw_scorer=equality_scorer_ambigs):
+    """Perform local alignment of primers with many sequences
+
+        primer_seqs: dict of primer: target sequences to test primer against
+        primer_aligners: dict of primer: qiime.primer_aligner.PrimerAligner,
+         to which aligners are added for primers that don't have one. Pass
+         the same dict to align more sequences with the same primers.
+
+        Returns a dict of (primer, sequence): (number of mismatches, start
+         position in sequence of the hit), as local_align_primer_seq would
+         return. The sequences of each primer are aligned in batches, which
+         is much faster than aligning them one at a time.
+    """
+    if primer_aligners is None:
+        primer_aligners = {}
+
+    result = {}
+    for primer, seqs in primer_seqs.items():
+        if primer not in primer_aligners:
+            primer_aligners[primer] = PrimerAligner(primer)
+        seqs = list(set(seqs))
+        hits = primer_aligners[primer].align_seqs(seqs)
+        for seq, (primer_hit, target_hit) in izip(seqs, hits):
+            result[primer, seq] = count_primer_hit_mismatches(
+                primer_hit, target_hit, seq, sw_scorer)
+    return result
+
+
+def count_primer_hit_mismatches(primer_hit, target_hit, query_sequence,
+                                sw_scorer=equality_scorer_ambigs):
+    """Count mismatches in an alignment of a primer with a sequence
+
+        primer_hit: the aligned primer
+        target_hit: the aligned part of query_sequence
+        query_sequence: the sequence aligned with the primer
+
+        Returns the number of mismatches (including gaps),
+         and the start position in query_sequence of the hit.
+    """
     # Count insertions and deletions
     insertions = primer_hit.count('-')
     deletions = target_hit.count('-')
@@ -360,6 +411,98 @@ def fasta_ids(fasta_files, verbose=False):
     return all_ids
 
 
+def parse_qual_record_scores(lines):
+    """Returns the quality scores in lines of a qual record as uint8 array"""
+    try:
+        scores = asarray(' '.join(lines).split(), dtype=int)
+    except ValueError:
+        raise QiimeParseError(
+            "Invalid qual file. Check the format of the qual files.")
+    if len(scores) and (scores.min() < 0 or scores.max() > 255):
+        raise QiimeParseError(
+            "Invalid qual file. Quality scores must be between 0 and 255.")
+    return scores.astype(uint8)
+
+
+class QualScores(object):
+
+    """Quality scores of the reads in qual files, looked up by read id
+
+    qual_files: open qual files
+
+    Replaces the dict of read id: quality scores returned by
+    qiime.parse.parse_qual_scores without loading all quality scores into
+    memory. check_seqs looks up the reads of the fasta files in order, so
+    while lookups follow the order of the records in the qual files, each
+    record is parsed as it is reached and then dropped. At the first lookup
+    out of order, the position of each record in the qual files is indexed,
+    and records are then read from the files as they are looked up.
+
+    Quality scores are returned as uint8 arrays.
+    """
+
+    def __init__(self, qual_files):
+        self.qual_files = qual_files
+        self._records = self._iter_records()
+        self._offsets = None
+
+    def __nonzero__(self):
+        return bool(self.qual_files)
+
+    def _iter_records(self):
+        """Yields the (read id, score lines) of each record in order"""
+        for qual_file in self.qual_files:
+            rid = None
+            lines = []
+            for line in qual_file:
+                if line.startswith('>'):
+                    if rid is not None:
+                        yield rid, lines
+                    rid = line[1:].split()[0]
+                    lines = []
+                else:
+                    lines.append(line)
+            if rid is not None:
+                yield rid, lines
+
+    def _index_records(self):
+        """Records the (qual file, offset) of each record by read id"""
+        self._offsets = {}
+        for qual_file in self.qual_files:
+            qual_file.seek(0)
+            while True:
+                offset = qual_file.tell()
+                line = qual_file.readline()
+                if not line:
+                    break
+                if line.startswith('>'):
+                    self._offsets.setdefault(line[1:].split()[0],
+                                             (qual_file, offset))
+
+    def get(self, read_id, default=None):
+        """Returns the quality scores of read_id, or default if not found"""
+        if self._offsets is None:
+            for rid, lines in self._records:
+                if rid == read_id:
+                    return parse_qual_record_scores(lines)
+                break
+            self._index_records()
+
+        try:
+            qual_file, offset = self._offsets[read_id]
+        except KeyError:
+            return default
+        qual_file.seek(offset)
+        qual_file.readline()
+        lines = []
+        while True:
+            line = qual_file.readline()
+            if not line or line.startswith('>'):
+                break
+            lines.append(line)
+        return parse_qual_record_scores(lines)
+
+
 def count_ambig(curr_seq, valid_chars='ATCG'):
     """Counts non-standard characters in seq"""
     up_seq = curr_seq.upper()
@@ -545,6 +688,9 @@ def check_window_qual_scores(qual_scores, window=50, min_average=25):
     """Check that all windows have ave qual score > threshold."""
 
     # Code from Jens Reeder, added 1-13-2010
+    # Sum as Python ints, which don't overflow as uint8 scores would
+    if hasattr(qual_scores, 'tolist'):
+        qual_scores = qual_scores.tolist()
     l = len(qual_scores)
 
     window = min(window, l)
@@ -594,8 +740,16 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
 
     primer_mismatch_count = 0
     all_primers_lens = sorted(set(all_primers.values()))
+    if not disable_primer_check:
+        # match each read against all of the primers for its barcode at once
+        primer_matchers = {}
+        for barcode, primers in primer_seqs_lens.items():
+            primer_matchers[barcode] = PatternMatcher(primers, max_primer_mm)
+        all_primers_matcher = PatternMatcher(all_primers, max_primer_mm)
 
     reverse_primer_not_found = 0
+    # reverse primers are aligned with the reads of a chunk together
+    rev_primer_aligners = {}
 
     sliding_window_failed = 0
     trunc_ambi_base_counts = 0
@@ -603,8 +757,16 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
     below_seq_min_after_trunc = 0
     below_seq_min_after_ambi_trunc = 0
 
-    for fasta_in in fasta_files:
-        for curr_id, curr_seq in parse_fasta(fasta_in):
+    records = chain.from_iterable(imap(parse_fasta, fasta_files))
+    while True:
+        chunk = list(islice(records, check_seqs_chunk_size))
+        if not chunk:
+            break
+        # reads passing the barcode and primer checks, and the sequences to
+        # align with each reverse primer
+        passed = []
+        rev_primer_seqs = defaultdict(list)
+        for curr_id, curr_seq in chunk:
             curr_rid = curr_id.split()[0]
             curr_seq = upper(curr_seq)
 
@@ -659,8 +821,8 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
                     # of the given primer, or degenerate variations thereof.
                     primer_len = current_primers.values()[0]
 
-                    if primer_exceeds_mismatches(raw_seq[:primer_len],
-                                                 current_primers, max_primer_mm):
+                    if primer_matchers[raw_barcode].match_start(
+                            raw_seq[:primer_len]) is None:
                         bc_counts['#FAILED'].append(curr_rid)
                         primer_mismatch_count += 1
                         continue
@@ -671,12 +833,10 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
                     # our primer sets, so, in ascending order of all the given
                     # primer lengths, a sequence will the sliced out and compared
                     # to the primer set.
-                    current_primers = all_primers
                     found_match = False
                     for seq_slice_len in all_primers_lens:
-                        if not(
-                            primer_exceeds_mismatches(raw_seq[:seq_slice_len],
-                                                      current_primers, max_primer_mm)):
+                        if all_primers_matcher.match_start(
+                                raw_seq[:seq_slice_len]) is not None:
                             primer_len = seq_slice_len
                             found_match = True
                             break
@@ -713,6 +873,20 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
 
             curr_samp_id = valid_map.get(curr_bc, 'Unassigned')
 
+            if reverse_primers in ("truncate_only", "truncate_remove"):
+                for curr_rev_primer in rev_primers.get(curr_bc, []):
+                    rev_primer_seqs[curr_rev_primer].append(cres)
+            passed.append((curr_id, curr_rid, curr_seq, curr_qual,
+                           barcode_len, primer_len, cbc, cpr, cres,
+                           total_bc_primer_len, bc_diffs, curr_bc,
+                           curr_samp_id))
+
+        rev_primer_hits = local_align_primer_seqs(rev_primer_seqs,
+                                                  rev_primer_aligners)
+
+        for (curr_id, curr_rid, curr_seq, curr_qual, barcode_len, primer_len,
+             cbc, cpr, cres, total_bc_primer_len, bc_diffs, curr_bc,
+             curr_samp_id) in passed:
             new_id = "%s_%d" % (curr_samp_id, curr_ix)
             # check if writing out primer
             write_seq = cres
@@ -724,8 +898,8 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
                     for curr_rev_primer in rev_primer:
                         # Try to find lowest count of mismatches for all
                         # reverse primers
-                        rev_primer_mm, rev_primer_index  = \
-                            local_align_primer_seq(curr_rev_primer, cres)
+                        rev_primer_mm, rev_primer_index = \
+                            rev_primer_hits[curr_rev_primer, cres]
                         mm_tested[rev_primer_mm] = rev_primer_index
 
                     rev_primer_mm = min(mm_tested.keys())
@@ -746,8 +920,8 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
                     for curr_rev_primer in rev_primer:
                         # Try to find lowest count of mismatches for all
                         # reverse primers
-                        rev_primer_mm, rev_primer_index  = \
-                            local_align_primer_seq(curr_rev_primer, cres)
+                        rev_primer_mm, rev_primer_index = \
+                            rev_primer_hits[curr_rev_primer, cres]
                         mm_tested[rev_primer_mm] = rev_primer_index
 
                     rev_primer_mm = min(mm_tested.keys())
@@ -1363,10 +1537,8 @@ def preprocess(fasta_files, qual_files, mapping_file,
     if qual_files:
         for q in qual_files:
             q.seek(0)
-        # Load quality scores
-        qual_mappings = parse_qual_scores(qual_files)
-        for q in qual_files:
-            q.close()
+        # Quality scores are read as the reads are checked
+        qual_mappings = QualScores(qual_files)
     else:
         qual_mappings = {}
 
@@ -1446,6 +1618,9 @@ def preprocess(fasta_files, qual_files, mapping_file,
                                                           median_length_filtering, added_demultiplex_field,
                                                           reverse_primer_mismatches, truncate_ambi_bases)
 
+    for q in qual_files:
+        q.close()
+
     # Write log file
     log_file = open(dir_prefix + '/' + "split_library_log.txt", 'w+')
     log_file.write('\n'.join(log_stats))
@@ -10,7 +10,7 @@ __version__ = "1.9.1-dev"
 __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
-from itertools import izip, cycle
+from itertools import izip, cycle, islice
 from os.path import split, splitext, join
 from os import makedirs
 
@@ -18,7 +18,6 @@ import numpy as np
 
 from skbio.parse.sequences import parse_fastq
 from skbio.sequence import DNA
-from skbio.format.sequences import format_fastq_record
 
 from qiime.format import (format_histogram_one_count,
                           format_split_libraries_fastq_log)
@@ -134,14 +133,25 @@ def quality_filter_sequence(header,
         return 0, sequence, quality
 
 
+def _pre180_header_end(header):
+    """Return the index of the first '#' or '/' in header, or its length"""
+    end = header.find('#')
+    if end == -1:
+        end = len(header)
+    slash = header.find('/', 0, end)
+    if slash != -1:
+        end = slash
+    return end
+
+
 def check_header_match_pre180(header1, header2):
 
-    # split on '#' and '/' to handle cases with and without the
-    # Illumina quality digit
-    header1 = header1.split('#')[0].split('/')[0]
-    header2 = header2.split('#')[0].split('/')[0]
+    # compare up to the first '#' or '/' to handle cases with and without
+    # the Illumina quality digit
+    end1 = _pre180_header_end(header1)
+    end2 = _pre180_header_end(header2)
 
-    return header1 == header2
+    return end1 == end2 and header1[:end1] == header2[:end2]
 
 
 def check_header_match_180_or_later(header1, header2):
@@ -149,6 +159,19 @@ def check_header_match_180_or_later(header1, header2):
 
         These contain information on the read number, so can differ
     """
+    # headers usually differ only in the read number following the space
+    # (e.g., 'M00176:17:000000000-A0CNA:1:1:15487:1773 1:N:0:0' and
+    # 'M00176:17:000000000-A0CNA:1:1:15487:1773 2:N:0:0'), so check for
+    # that before comparing each field
+    space = header1.find(' ')
+    if space != -1 and header2.find(' ') == space and \
+            header1[:space] == header2[:space]:
+        colon1 = header1.find(':', space)
+        colon2 = header2.find(':', space)
+        if colon1 != -1 and colon2 != -1 and \
+                header1[colon1:] == header2[colon2:]:
+            return True
+
     header1 = header1.split(':')
     header2 = header2.split(':')
     for e1, e2 in zip(header1, header2):
@@ -312,8 +335,9 @@ def process_fastq_single_end_read_file(fastq_read_f,
     count_barcode_errors_exceed_max = 0
     sequence_lengths = []
     seqs_per_sample_counts = {}
+    # the barcode quality scores aren't used, so aren't decoded
     for bc_data, read_data in izip(
-            parse_fastq(fastq_barcode_f, strict=False, phred_offset=phred_offset),
+            parse_fastq_labels_and_seqs(fastq_barcode_f),
             parse_fastq(fastq_read_f, strict=False, phred_offset=phred_offset)):
         input_sequence_count += 1
         # Confirm match between barcode and read headers
@@ -439,6 +463,164 @@ def make_histograms(lengths, binwidth=10):
     return hist, bin_edges
 
 
+def _fastq_blocks(fastq_f, block_size):
+    """Yield blocks of fastq_f that each end at a four-line record boundary
+
+    fastq_f can be an open file or any other iterable of lines (with or
+    without trailing newlines).
+    """
+    try:
+        read = fastq_f.read
+    except AttributeError:
+        lines = iter(fastq_f)
+        while True:
+            block_lines = list(islice(lines, 4 * 4096))
+            if not block_lines:
+                break
+            yield '\n'.join([l.rstrip('\n') for l in block_lines]) + '\n'
+        return
+
+    readline = fastq_f.readline
+    while True:
+        block = read(block_size)
+        if not block:
+            break
+        if not block.endswith('\n'):
+            block += readline()
+        # complete the last record of the block so that no record spans
+        # two blocks
+        extra_lines = [readline() for i in range(-block.count('\n') % 4)]
+        yield block + ''.join(extra_lines)
+
+
+def _is_plain_fastq_block(block):
+    """Return True if no line in block needs to be stripped of whitespace
+
+    i.e., block contains complete records with no blank lines, no leading or
+    trailing whitespace on any line, and '\\n' line endings.
+    """
+    return (block.endswith('\n') and block.count('\n') % 4 == 0 and
+            not block.startswith('\n') and
+            '\n\n' not in block and ' \n' not in block and
+            '\n ' not in block and '\r' not in block and
+            '\t' not in block and '\x0b' not in block and
+            '\x0c' not in block and not block.startswith(' '))
+
+
+def _iter_stripped_fastq_spans(block):
+    """Yield the spans of the records in block, stripping each line"""
+    whitespace = ' \t\r\n\x0b\x0c'
+    find = block.find
+    block_end = len(block)
+    pos = 0
+    while pos < block_end:
+        ends = []
+        for i in range(4):
+            end = find('\n', pos if not ends else ends[-1] + 1)
+            if end == -1:
+                end = block_end
+            ends.append(end)
+            if end >= block_end - 1:
+                break
+        starts = [pos] + [e + 1 for e in ends[:-1]]
+        record_end = min(ends[-1] + 1, block_end)
+
+        # strip each line, as parse_fastq does
+        spans = []
+        for start, end in zip(starts, ends):
+            while start < end and block[start] in whitespace:
+                start += 1
+            while end > start and block[end - 1] in whitespace:
+                end -= 1
+            spans.append((start, end))
+
+        if spans[0][0] == spans[0][1]:
+            # parse_fastq skips a record that starts with a blank line (i.e.,
+            # blank lines at the end of the file)
+            pos = record_end
+            continue
+        if len(spans) < 4:
+            raise FastqParseError("Incomplete FASTQ record found at end "
+                                  "of file")
+
+        (label_start, label_end), (seq_start, seq_end), \
+            _, (qual_start, qual_end) = spans
+        # the first character (usually '@') is dropped from the label
+        label_start += 1
+        canonical = (block[pos] == '@' and
+                     label_start == pos + 1 and
+                     label_end == ends[0] and
+                     seq_start == starts[1] and seq_end == ends[1] and
+                     ends[2] == starts[2] + 1 and block[starts[2]] == '+' and
+                     qual_start == starts[3] and qual_end == ends[3] and
+                     record_end == ends[3] + 1)
+        yield (block, pos, record_end, label_start, label_end,
+               seq_start, seq_end, qual_start, qual_end, canonical)
+        pos = record_end
+
+
+def iter_fastq_spans(fastq_f, block_size=2 ** 22):
+    """Yield the positions of the fields of each record in fastq_f
+
+    fastq_f is read in large blocks, and rather than creating strings for
+    each record this yields tuples of (block, record_start, record_end,
+    label_start, label_end, seq_start, seq_end, qual_start, qual_end,
+    canonical), where the label, sequence and quality string are
+    block[label_start:label_end] etc. These are the fields that
+    skbio.parse.sequences.parse_fastq would return (i.e., with surrounding
+    whitespace and the leading '@' removed, and the quality string not yet
+    decoded), so they only need to be sliced out of the block if they are
+    used. canonical is True if block[record_start:record_end] is exactly
+    the record as format_fastq_record would write it, so can be copied to
+    an output file as is.
+    """
+    for block in _fastq_blocks(fastq_f, block_size):
+        if not _is_plain_fastq_block(block):
+            for spans in _iter_stripped_fastq_spans(block):
+                yield spans
+            continue
+
+        # the lines don't need to be stripped, so the fields are the lines
+        # themselves
+        find = block.find
+        block_end = len(block)
+        pos = 0
+        while pos < block_end:
+            seq_start = find('\n', pos) + 1
+            plus_start = find('\n', seq_start) + 1
+            qual_start = find('\n', plus_start) + 1
+            record_end = find('\n', qual_start) + 1
+            yield (block, pos, record_end, pos + 1, seq_start - 1,
+                   seq_start, plus_start - 1, qual_start, record_end - 1,
+                   block[pos] == '@' and qual_start - plus_start == 2 and
+                   block[plus_start] == '+')
+            pos = record_end
+
+
+def parse_fastq_labels_and_seqs(fastq_f):
+    """Yield (label, seq) for each record in fastq_f
+
+    This is parse_fastq without decoding the quality scores, for reads whose
+    quality scores are not used (e.g., barcode reads).
+    """
+    for (block, _, _, label_start, label_end, seq_start, seq_end,
+         _, _, _) in iter_fastq_spans(fastq_f):
+        yield block[label_start:label_end], block[seq_start:seq_end]
+
+
+def parse_fastq_records(fastq_f):
+    """Yield (label, seq, qual) for each record in fastq_f
+
+    This is parse_fastq without decoding the quality scores: qual is the
+    quality string as it appears in fastq_f, for reads whose quality scores
+    are copied to the output rather than used.
+    """
+    for (block, _, _, label_start, label_end, seq_start, seq_end,
+         qual_start, qual_end, _) in iter_fastq_spans(fastq_f):
+        yield (block[label_start:label_end], block[seq_start:seq_end],
+               block[qual_start:qual_end])
+
+
 def extract_reads_from_interleaved(
         input_fp, forward_id, reverse_id, output_dir):
     """Parses a single fastq file and creates two new files: forward and reverse, based on
@@ -453,18 +635,77 @@ def extract_reads_from_interleaved(
     ffp = open(forward_fp, 'w')
     rfp = open(reverse_fp, 'w')
 
-    for label, seq, qual in parse_fastq(qiime_open(input_fp), strict=False,
-                                        enforce_qual_range=False):
-        fastq_string = format_fastq_record(label, seq, qual)
-        if forward_id in label:
-            ffp.write(fastq_string)
-        elif reverse_id in label and forward_id not in label:
-            rfp.write(fastq_string)
+    # consecutive records that are written to the same file unchanged are
+    # written with a single write of the block that contains them
+    run_block = None
+    run_start = run_end = 0
+    run_f = None
+    for (block, record_start, record_end, label_start, label_end, seq_start,
+         seq_end, qual_start, qual_end, canonical) in \
+            iter_fastq_spans(qiime_open(input_fp)):
+        if block.find(forward_id, label_start, label_end) != -1:
+            out_f = ffp
+        elif block.find(reverse_id, label_start, label_end) != -1:
+            out_f = rfp
         else:
+            if run_f is not None:
+                run_f.write(run_block[run_start:run_end])
             ffp.close()
             rfp.close()
             raise ValueError("One of the input sequences doesn't have either identifier "
                              "or it has both.\nLabel: %s\nForward: %s\n Reverse: %s" %
-                             (label, forward_id, reverse_id))
+                             (block[label_start:label_end], forward_id,
+                              reverse_id))
+
+        if canonical and out_f is run_f and block is run_block and \
+                record_start == run_end:
+            run_end = record_end
+            continue
+        if run_f is not None:
+            run_f.write(run_block[run_start:run_end])
+            run_f = None
+        if canonical:
+            run_block, run_start, run_end, run_f = \
+                block, record_start, record_end, out_f
+        else:
+            out_f.write('@%s\n%s\n+\n%s\n' % (block[label_start:label_end],
+                                              block[seq_start:seq_end],
+                                              block[qual_start:qual_end]))
+    if run_f is not None:
+        run_f.write(run_block[run_start:run_end])
     ffp.close()
     rfp.close()
+
+
+def offset_seq_id(label, offset):
+    """Add offset to the sequence number of a post-split_libraries label
+
+    e.g., offset_seq_id('S1_3 M001:1:1 orig_bc=AC', 10) returns
+    'S1_13 M001:1:1 orig_bc=AC'
+    """
+    seq_id, space, description = label.partition(' ')
+    sample_id, seq_num = seq_id.rsplit('_', 1)
+    return '%s_%d%s%s' % (sample_id, int(seq_num) + offset, space,
+                          description)
+
+
+def offset_seq_ids_in_lines(lines, offset, file_type='fasta'):
+    """Yield lines, adding offset to the sequence numbers in the labels
+
+    lines are the lines of a file written by split_libraries_fastq.py:
+    labels are the lines starting with '>' if file_type is 'fasta' (which
+    also applies to qual files), or the first line of each four-line
+    record if file_type is 'fastq'.
+    """
+    if file_type == 'fastq':
+        for i, line in enumerate(lines):
+            if i % 4 == 0:
+                yield '@%s\n' % offset_seq_id(line[1:].rstrip('\n'), offset)
+            else:
+                yield line
+    else:
+        for line in lines:
+            if line.startswith('>'):
+                yield '>%s\n' % offset_seq_id(line[1:].rstrip('\n'), offset)
+            else:
+                yield line
@@ -10,16 +10,20 @@ __maintainer__ = "Charudatta Navare"
 __email__ = "charudatta.navare@gmail.com"
 
 from collections import defaultdict
-from os import close, path, mkdir, rmdir
+from multiprocessing import Pool
+from os import path, mkdir, rmdir
 from re import search
 from tempfile import mkstemp
-from itertools import izip
+from itertools import imap, izip
+
+from numpy import (arange, asarray, bincount, flatnonzero, fromstring,
+                   maximum, minimum, newaxis, repeat, uint8, where, zeros)
 
 from qiime.golay import get_invalid_golay_barcodes
 from qiime.parse import parse_mapping_file_to_dict
 from qiime.split_libraries import check_map, expand_degeneracies
 from qiime.split_libraries_fastq import correct_barcode
-from qiime.util import get_qiime_temp_dir, qiime_system_call
+from qiime.util import get_qiime_temp_dir
 from burrito.util import ApplicationError
 from skbio.parse.sequences import parse_fasta, parse_fastq
 from skbio.util import remove_files
@@ -27,6 +31,14 @@ from skbio.sequence import DNASequence
 from bfillings.uclust import get_clusters_from_fasta_filepath
 
 
+# bases that are equally supported at a position of a consensus sequence are
+# resolved in favour of the one that comes last in this order
+consensus_tie_order = ''.join(dict.fromkeys(DNASequence.iupac_characters()))
+_consensus_tie_ranks = zeros(256, dtype=int)
+_consensus_tie_ranks[fromstring(consensus_tie_order, dtype=uint8)] = \
+    arange(1, len(consensus_tie_order) + 1)
+
+
 class PairedEndParseError(Exception):
     pass
 
@@ -103,7 +115,8 @@ def get_LEA_seq_consensus_seqs(fwd_read_f, rev_read_f,
                                min_reads_per_random_bc,
                                min_difference_clusters,
                                barcode_column,
-                               reverse_primer_column):
+                               reverse_primer_column,
+                               processes=1):
     """
     Reads mapping file, input file, and other command line arguments
     fills dictionary called consensus_seq_lookup which will contain:
@@ -144,6 +157,8 @@ def get_LEA_seq_consensus_seqs(fwd_read_f, rev_read_f,
         header of barcode column
     reverse_primer_column: string
         header of the reverse primer column
+    processes: int, optional
+        number of processes across which to spread the random barcodes
     Returns
     ----------
     consensus_seq_lookup: defaultdict
@@ -187,7 +202,8 @@ def get_LEA_seq_consensus_seqs(fwd_read_f, rev_read_f,
                                                      output_dir,
                                                      min_difference_clusters,
                                                      max_cluster_ratio,
-                                                     min_consensus)
+                                                     min_consensus,
+                                                     processes)
 
     log_out = format_lea_seq_log(input_seqs_count,
                                  barcode_errors_exceed_max_count,
@@ -199,69 +215,156 @@ def get_LEA_seq_consensus_seqs(fwd_read_f, rev_read_f,
     return consensus_seq_lookup, log_out
 
 
+def get_cluster_sizes(seqs, min_difference_in_clusters):
+    """
+    Clusters sequences greedily, in the order given, and returns the
+    number of sequences in each cluster
+    Each sequence joins the first cluster whose centroid (the sequence
+    that started the cluster) it matches with at least
+    min_difference_in_clusters identity, and otherwise starts a new
+    cluster. Identity is the fraction of matching positions over the
+    length of the shorter of the two sequences, both read from their
+    first base, as the reads of a random barcode are all trimmed to start
+    at the same position.
+    Parameters
+    ----------
+    seqs: list
+        list of sequences
+    min_difference_in_clusters: float
+        percent identity threshold for cluster formation
+    Returns
+    ----------
+    cluster_sizes: list
+        number of sequences in each cluster, in the order that the
+        clusters were created
+    """
+    if not seqs:
+        return []
+
+    max_len = max(map(len, seqs))
+    centroids = zeros((len(seqs), max_len), dtype=uint8)
+    centroid_lens = zeros(len(seqs), dtype=int)
+    cluster_sizes = []
+    # identical sequences always share a cluster
+    seq_to_cluster = {}
+
+    for seq in seqs:
+        try:
+            cluster_sizes[seq_to_cluster[seq]] += 1
+            continue
+        except KeyError:
+            pass
+
+        seq_len = len(seq)
+        num_clusters = len(cluster_sizes)
+        cluster = None
+        if num_clusters and seq_len:
+            seq_array = fromstring(seq, dtype=uint8)
+            # positions beyond the end of a centroid hold zeros, which
+            # never match a sequence character
+            matches = (centroids[:num_clusters, :seq_len] ==
+                       seq_array).sum(axis=1)
+            overlaps = minimum(centroid_lens[:num_clusters], seq_len)
+            similar = flatnonzero(
+                matches >= min_difference_in_clusters * overlaps)
+            if len(similar):
+                cluster = similar[0]
+        elif num_clusters:
+            cluster = 0
+
+        if cluster is None:
+            cluster = num_clusters
+            centroids[cluster, :seq_len] = fromstring(seq, dtype=uint8)
+            centroid_lens[cluster] = seq_len
+            cluster_sizes.append(0)
+        cluster_sizes[cluster] += 1
+        seq_to_cluster[seq] = cluster
+
+    return cluster_sizes
+
+
 def get_cluster_ratio(fasta_seqs, min_difference_in_clusters):
     """
-    Uses uclust to calculate cluster ratio
+    Clusters sequences to calculate cluster ratio
     cluster_ratio =
     num_of_seq_in_cluster_with_max_seq
     divided by
     num_of_seq_in cluster_with_second_higest_seq
     Parameters
     ----------
-    fasta_seqs: list
-        list of fasta sequences
+    fasta_seqs: string or list
+        fasta formatted sequences, or a list of sequences
     min_difference_in_clusters: float
         percent identity threshold for cluster formation
     Returns
     ----------
     cluster_ratio: float
-        cluster ratio of the sequences using uclust
+        cluster ratio of the sequences (see get_cluster_sizes)
         cluster_ratio =
         num_of_seq_in_cluster_with_max_seq /
         num_of_seq_in cluster_with_second_higest_seq
     """
-    cluster_percent_id = min_difference_in_clusters
-    temp_dir = get_qiime_temp_dir()
-    fd_uc, uclust_tempfile_name = mkstemp(dir=temp_dir, suffix='.uc')
-    close(fd_uc)
-    fd_fas, fasta_tempfile_name = mkstemp(dir=temp_dir, suffix='.uc')
-    close(fd_fas)
-    with open(fasta_tempfile_name, 'w') as fasta_tempfile:
-        fasta_tempfile.write(fasta_seqs)
-    fasta_tempfile.close()
-    count = 0
-    command = "uclust --usersort --input {} --uc {} --id 0.98".format(
-        fasta_tempfile_name, uclust_tempfile_name)
-    # In the function, I am calling uclust a large number of times.
-    # Initially I was using from bfillings.get_clusters_from_fasta_filepath
-    # but due to issue (biocore/bfillingss#31), I have temporarily
-    # reverted to qiime_system_call.
-
-    count_lookup = defaultdict(int)
-
-    qiime_system_call(command)
-    uclust_tempfile = open(uclust_tempfile_name, 'r')
-    for line in uclust_tempfile:
-        if search(r'^C', line):
-            pieces = line.split('\t')
-            count_lookup[pieces[1]] += int(pieces[2])
-            count += 1
-    uclust_tempfile.close()
-    files_to_be_removed = list()
-    files_to_be_removed.append(uclust_tempfile_name)
-    remove_files(files_to_be_removed)
-
-    sorted_counts_in_clusters = sorted(
-        count_lookup.iteritems(),
-        key=lambda x: x[1], reverse=True)
-    try:
-        max_cluster_count = \
-            float(str(sorted_counts_in_clusters[0][1]))
-        second_cluster_count = \
-            float(str(sorted_counts_in_clusters[1][1]))
-        return max_cluster_count / second_cluster_count
-    except IndexError:
+    if isinstance(fasta_seqs, str):
+        fasta_seqs = [seq for _, seq in parse_fasta(fasta_seqs.splitlines())]
+
+    cluster_sizes = sorted(get_cluster_sizes(fasta_seqs,
+                                             min_difference_in_clusters),
+                           reverse=True)
+    if len(cluster_sizes) < 2:
         return 1
+    return cluster_sizes[0] / cluster_sizes[1]
+
+
+def get_seqs_consensus(seqs, counts, min_consensus):
+    """
+    Returns consensus sequence from a set of sequences
+    At each position, the base carried by the most reads (each sequence
+    counting as many reads as its count) is chosen. Ties are broken in
+    favour of the base found in the sequence with the highest count, and
+    then by consensus_tie_order.
+    Parameters
+    ----------
+    seqs: list
+        list of sequences, all of the same length
+    counts: list
+        number of times each sequence has appeared
+    min_consensus: float
+    Returns
+    ----------
+    consensus_seq: string
+        consensus sequence for the given list of sequences
+    """
+    length = len(seqs[0])
+    number_of_seqs = len(seqs)
+
+    for seq in seqs:
+        if len(seq) != length:
+            raise SeqLengthMismatchError()
+
+    # (reads x positions) matrix of characters, and the index into a
+    # (positions x characters) table of each of its elements
+    seqs_matrix = fromstring(''.join(seqs), dtype=uint8).reshape(
+        number_of_seqs, length)
+    table_idx = (seqs_matrix + arange(length) * 256).ravel()
+    counts = asarray(counts, dtype=int)
+    read_counts = repeat(counts, length)
+
+    freqs = bincount(table_idx, weights=read_counts,
+                     minlength=256 * length).reshape(length, 256)
+    max_counts = zeros(256 * length, dtype=int)
+    maximum.at(max_counts, table_idx, read_counts)
+
+    max_freqs = freqs.max(axis=1)
+    candidates = freqs == max_freqs[:, newaxis]
+    max_counts = where(candidates, max_counts.reshape(length, 256), -1)
+    candidates &= max_counts == max_counts.max(axis=1)[:, newaxis]
+    tie_ranks = where(candidates, _consensus_tie_ranks, -1)
+
+    scores = 10.0 * max_freqs / number_of_seqs
+    if (scores < min_consensus).any():
+        raise LowConsensusScoreError()
+
+    return tie_ranks.argmax(axis=1).astype(uint8).tostring()
 
 
 def get_consensus(fasta_tempfile, min_consensus):
@@ -284,6 +387,7 @@ def get_consensus(fasta_tempfile, min_consensus):
     ----------
     consensus_seq: string
         consensus sequence for the given list of sequences
+        (see get_seqs_consensus)
     """
     seqs = list()
     counts = list()
@@ -293,53 +397,7 @@ def get_consensus(fasta_tempfile, min_consensus):
         counts.append(int(RE_output.group(1)))
         seqs.append(seq)
 
-    length = len(seqs[0])
-    number_of_seqs = len(seqs)
-
-    for seq_index in range(number_of_seqs):
-        if len(seqs[seq_index]) != length:
-            raise SeqLengthMismatchError()
-
-    freq_this_pos_this_base = dict()
-    count_of_seq_with_max_count = dict()
-
-    for x in range(length):
-        freq_this_pos_this_base[x] = dict()
-        count_of_seq_with_max_count[x] = dict()
-
-        for y in DNASequence.iupac_characters():
-            freq_this_pos_this_base[x][y] = 0
-            count_of_seq_with_max_count[x][y] = 0
-
-        for this_seq_count, seq in enumerate(seqs):
-            freq_this_pos_this_base[x][
-                seq[x]] += counts[this_seq_count]
-            if counts[this_seq_count] > count_of_seq_with_max_count[x][seq[x]]:
-                count_of_seq_with_max_count[x][seq[x]] = counts[this_seq_count]
-
-    consensus = list()
-    for index in range(length):
-        sorted_bases = sorted(
-            freq_this_pos_this_base[index].iteritems(),
-            key=lambda x: x[1])
-        max_base, max_freq = sorted_bases[-1]
-
-        for (counter, (b, n)) in enumerate(sorted_bases):
-            if max_freq == n:
-                try:
-                    if (count_of_seq_with_max_count[counter][b] >
-                            count_of_seq_with_max_count[counter][max_base]):
-                        max_base = b
-                except KeyError:
-                    pass
-
-        score = 10.0 * max_freq / number_of_seqs
-        if score < min_consensus:
-            raise LowConsensusScoreError()
-        consensus.append(max_base)
-
-    consensus_seq = ''.join(map(str, consensus))
-    return consensus_seq
+    return get_seqs_consensus(seqs, counts, min_consensus)
 
 
 def select_unique_rand_bcs(rand_bcs, unique_threshold):
@@ -451,6 +509,67 @@ def check_barcodes(bc_to_sid, barcode_len, barcode_type):
                 ' '.join(invalid_golay_barcodes))
 
 
+def get_random_bc_consensus(seq_counts,
+                            min_difference_in_clusters,
+                            max_cluster_ratio,
+                            min_consensus):
+    """
+    Generates the LEA-seq consensus sequence of the reads of one random
+    barcode
+    Parameters
+    ----------
+    seq_counts: list
+        list of ((fwd_seq, rev_seq), number of reads) tuples
+    min_difference_in_clusters: float
+        percent identity threshold for cluster formation
+    max_cluster_ratio: float
+        cluster_ratio below which you need to find the consensus sequence
+    min_consensus: float
+        minimum score allowable at any position in sequence
+    Returns
+    ----------
+    consensus_seq: string
+        fwd and rev consensus sequences, separated by '^'
+    """
+    fwd_seqs = list()
+    rev_seqs = list()
+    counts = list()
+    max_freq = 0
+    for (fwd_seq, rev_seq), count in seq_counts:
+        fwd_seqs.append(fwd_seq)
+        rev_seqs.append(rev_seq)
+        counts.append(count)
+        if count > max_freq:
+            max_freq = count
+            majority_seq = fwd_seq + "^" + rev_seq
+    # select majority sequence for the sample_id,
+    # and for that particular random_bc
+
+    fwd_cluster_ratio = get_cluster_ratio(fwd_seqs,
+                                          min_difference_in_clusters)
+    rev_cluster_ratio = get_cluster_ratio(rev_seqs,
+                                          min_difference_in_clusters)
+
+    # If the cluster ratio exists, and
+    # if is is below the threshold(max_cluster_ratio),
+    # set the consensus seq as the majority seq
+    # otherwise call get_seqs_consensus function
+    if fwd_cluster_ratio == 0 or rev_cluster_ratio == 0:
+        return "No consensus"
+    elif (fwd_cluster_ratio > max_cluster_ratio
+            and rev_cluster_ratio > max_cluster_ratio):
+        return majority_seq
+    else:
+        fwd_consensus = get_seqs_consensus(fwd_seqs, counts, min_consensus)
+        rev_consensus = get_seqs_consensus(rev_seqs, counts, min_consensus)
+        return fwd_consensus + "^" + rev_consensus
+
+
+def _get_random_bc_consensus(args):
+    """Pool.imap wrapper around get_random_bc_consensus"""
+    return get_random_bc_consensus(*args)
+
+
 def get_consensus_seqs_lookup(random_bc_lookup,
                               random_bc_reads,
                               random_bcs,
@@ -459,7 +578,8 @@ def get_consensus_seqs_lookup(random_bc_lookup,
                               output_dir,
                               min_difference_in_clusters,
                               max_cluster_ratio,
-                              min_consensus):
+                              min_consensus,
+                              processes=1):
     """
     Generates LEA-seq consensus sequence
     For each sample id, for each random barcode, consensus sequence is created
@@ -477,11 +597,16 @@ def get_consensus_seqs_lookup(random_bc_lookup,
     min_reads_per_random_bc:
         minimum number of reads per random bc, for it not to be discarded
     output_dir: dirpath
-        output directory path
+        output directory path (unused; consensus sequences are computed
+        without temporary files)
     min_difference_in_clusters: float
         percent identity threshold for cluster formation
     max_cluster_ratio: float
         cluster_ratio below which you need to find the consensus sequence
+    min_consensus: float
+        minimum score allowable at any position in sequence
+    processes: int, optional
+        number of processes across which to spread the random barcodes
     Returns
     ----------
     consensus_seq_lookup: defaultdict
@@ -498,6 +623,7 @@ def get_consensus_seqs_lookup(random_bc_lookup,
     # to remove random bcs that are selected
     # during the pruning step (select_unique_rand_bcs)
 
+    keys = list()
     for sample_id in random_bc_lookup:
         random_bc_keep[sample_id] = select_unique_rand_bcs(
             random_bcs[sample_id],
@@ -507,75 +633,26 @@ def get_consensus_seqs_lookup(random_bc_lookup,
         for random_bc in random_bc_lookup[sample_id]:
             if random_bc in random_bc_keep[sample_id] and random_bc_reads[
                     sample_id][random_bc] >= min_reads_per_random_bc:
-                fwd_fd, fwd_fasta_tempfile_name = mkstemp(
-                    dir=output_dir, prefix='fwd', suffix='.fas')
-                rev_fd, rev_fasta_tempfile_name = mkstemp(
-                    dir=output_dir, prefix='rev', suffix='.fas')
-                close(fwd_fd)
-                close(rev_fd)
-
-                # create fasta files for all fwd and rev seqs
-                # for that sample id and random bc.
-                fwd_fasta_tempfile = open(fwd_fasta_tempfile_name, 'w')
-                rev_fasta_tempfile = open(rev_fasta_tempfile_name, 'w')
-                max_freq = 0
-                for seq_index, fwd_rev in enumerate(
-                        random_bc_lookup[sample_id][random_bc]):
-                    fwd_seq, rev_seq = fwd_rev
-                    fwd_line = ">{}{}|{}\n{}\n".format(
-                        seq_index, random_bc,
-                        random_bc_lookup[sample_id][random_bc][fwd_rev],
-                        fwd_seq)
-                    rev_line = ">{}{}|{}\n{}\n".format(
-                        seq_index, random_bc,
-                        random_bc_lookup[sample_id][random_bc][fwd_rev],
-                        rev_seq)
-                    fwd_fasta_tempfile.write(fwd_line)
-                    rev_fasta_tempfile.write(rev_line)
-                    if random_bc_lookup[sample_id][
-                            random_bc][fwd_rev] > max_freq:
-                        max_freq = random_bc_lookup[
-                            sample_id][random_bc][fwd_rev]
-                        majority_seq = fwd_seq + "^" + rev_seq
-                # select majority sequence for the sample_id,
-                # and for that particular random_bc
-
-                fwd_fasta_tempfile.close()
-                rev_fasta_tempfile.close()
-                fwd_cluster_ratio = get_cluster_ratio(
-                    fwd_fasta_tempfile_name,
-                    min_difference_in_clusters)
-                rev_cluster_ratio = get_cluster_ratio(
-                    rev_fasta_tempfile_name,
-                    min_difference_in_clusters)
-
-                # If the cluster ratio exists, and
-                # if is is below the threshold(max_cluster_ratio),
-                # set the consensus seq as the majority seq
-                # otherwise call get_consensus function
-                if fwd_cluster_ratio == 0 or rev_cluster_ratio == 0:
-                    consensus_seq = "No consensus"
-                elif (fwd_cluster_ratio > max_cluster_ratio
-                        and rev_cluster_ratio > max_cluster_ratio):
-                    consensus_seq = majority_seq
-                else:
-                    fwd_fasta_tempfile = open(fwd_fasta_tempfile_name, 'r')
-                    rev_fasta_tempfile = open(rev_fasta_tempfile_name, 'r')
-                    fwd_consensus = get_consensus(
-                        fwd_fasta_tempfile,
-                        min_consensus)
-                    rev_consensus = get_consensus(
-                        rev_fasta_tempfile,
-                        min_consensus)
-                    fwd_fasta_tempfile.close()
-                    rev_fasta_tempfile.close()
-                    consensus_seq = fwd_consensus + "^" + rev_consensus
+                keys.append((sample_id, random_bc))
 
+    jobs = ((random_bc_lookup[sample_id][random_bc].items(),
+             min_difference_in_clusters, max_cluster_ratio, min_consensus)
+            for sample_id, random_bc in keys)
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            consensus_seqs = pool.imap(_get_random_bc_consensus, jobs,
+                                       chunksize=100)
+            for (sample_id, random_bc), consensus_seq in izip(
+                    keys, consensus_seqs):
                 consensus_seq_lookup[sample_id][random_bc] = consensus_seq
-                files_to_be_removed = list()
-                files_to_be_removed.append(fwd_fasta_tempfile_name)
-                files_to_be_removed.append(rev_fasta_tempfile_name)
-                remove_files(files_to_be_removed)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for (sample_id, random_bc), consensus_seq in izip(
+                keys, imap(_get_random_bc_consensus, jobs)):
+            consensus_seq_lookup[sample_id][random_bc] = consensus_seq
 
     # return the entire defaultdict 'consensus_seq_lookup
     # which has consensus sequence for each sample id,
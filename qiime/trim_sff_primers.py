@@ -15,6 +15,7 @@ Replaces the sff files with the trimmed versions.
 """
 
 from itertools import imap
+from struct import pack
 from os import walk, devnull, remove, rename, close
 from os.path import splitext, join, exists
 from shutil import move
@@ -23,10 +24,10 @@ from sys import stderr
 from tempfile import mkstemp, TemporaryFile
 
 from burrito.util import ApplicationNotFoundError
-from cogent.parse.binary_sff import parse_binary_sff, write_binary_sff
 from burrito.util import which
 
 from qiime.parse import parse_mapping_file
+from qiime.sff_reader import SffReader
 
 
 def get_technical_lengths(input_map, debug=False):
@@ -97,14 +98,23 @@ def set_sff_trimpoints(sff_dir, technical_lengths):
             readlength = technical_lengths[lib_id]
         except KeyError:
             continue
-        sff_data = parse_binary_sff(open(sff_fp), True)
-        clipped_header, clipped_reads = set_clip_qual_left(
-            sff_data, readlength)
+        # the reads are copied as they are, other than clip_qual_left
+        # (sfftools use 1-based indexing), rather than parsed and written
+        clip_qual_left = pack('>H', readlength + 1)
+        clip_start = 8
+        clip_end = clip_start + len(clip_qual_left)
+        reader = SffReader(open(sff_fp, 'rb'))
 
         fd, temp_fp = mkstemp(dir=sff_dir)
         close(fd)
-        with open(temp_fp, 'w') as f:
-            write_binary_sff(f, clipped_header, clipped_reads)
+        with open(temp_fp, 'wb') as f:
+            f.write(reader.get_header_bytes())
+            for i in range(len(reader)):
+                read_bytes = reader.get_read_bytes(i)
+                f.write(read_bytes[:clip_start])
+                f.write(clip_qual_left)
+                f.write(read_bytes[clip_end:])
+        reader.close()
 
         move(temp_fp, sff_fp)
 
@@ -10,12 +10,14 @@ __version__ = "1.9.1-dev"
 __maintainer__ = "William Walters"
 __email__ = "William.A.Walters@colorado.edu"
 
+from collections import defaultdict
+from itertools import islice
 from os.path import join, basename
 
 from skbio.parse.sequences import parse_fasta
 from skbio.sequence import DNA
 
-from qiime.split_libraries import local_align_primer_seq
+from qiime.split_libraries import local_align_primer_seqs
 from qiime.check_id_map import process_id_map
 
 
@@ -90,7 +92,8 @@ def truncate_rev_primers(fasta_f,
                          output_fp,
                          reverse_primers,
                          truncate_option='truncate_only',
-                         primer_mismatches=2):
+                         primer_mismatches=2,
+                         chunk_size=1024):
     """ Locally aligns reverse primers, trucates or removes seqs
 
     fasta_f:  open file of fasta file
@@ -98,6 +101,7 @@ def truncate_rev_primers(fasta_f,
     reverse_primers: dictionary of SampleID:reverse primer sequence
     truncate_option: either truncate_only, truncate_remove
     primer_mismatches: number of allowed primer mismatches
+    chunk_size: number of seqs to align with the reverse primers at once
     """
 
     log_data = {
@@ -107,43 +111,60 @@ def truncate_rev_primers(fasta_f,
         'seqs_written': 0
     }
 
-    for label, seq in parse_fasta(fasta_f):
-        curr_label = label.split('_')[0]
-
-        log_data['total_seqs'] += 1
-
-        # Check fasta label for valid SampleID, if not found, just write seq
-        try:
-            curr_rev_primer = reverse_primers[curr_label]
-        except KeyError:
-            log_data['sample_id_not_found'] += 1
-            output_fp.write('>%s\n%s\n' % (label, seq))
-            log_data['seqs_written'] += 1
-            continue
+    records = parse_fasta(fasta_f)
+    rev_primer_aligners = {}
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+
+        rev_primer_seqs = defaultdict(list)
+        for label, seq in chunk:
+            for rev_primer in reverse_primers.get(label.split('_')[0], []):
+                rev_primer_seqs[rev_primer].append(seq)
+        rev_primer_hits = local_align_primer_seqs(rev_primer_seqs,
+                                                  rev_primer_aligners)
+
+        for label, seq in chunk:
+            curr_label = label.split('_')[0]
+
+            log_data['total_seqs'] += 1
+
+            # Check fasta label for valid SampleID, if not found, just
+            # write seq
+            try:
+                curr_rev_primer = reverse_primers[curr_label]
+            except KeyError:
+                log_data['sample_id_not_found'] += 1
+                output_fp.write('>%s\n%s\n' % (label, seq))
+                log_data['seqs_written'] += 1
+                continue
 
-        mm_tests = {}
-        for rev_primer in curr_rev_primer:
+            mm_tests = {}
+            for rev_primer in curr_rev_primer:
 
-            rev_primer_mm, rev_primer_index =\
-                local_align_primer_seq(rev_primer, seq)
+                rev_primer_mm, rev_primer_index =\
+                    rev_primer_hits[rev_primer, seq]
 
-            mm_tests[rev_primer_mm] = rev_primer_index
+                mm_tests[rev_primer_mm] = rev_primer_index
 
-        rev_primer_mm = min(mm_tests.keys())
-        rev_primer_index = mm_tests[rev_primer_mm]
+            rev_primer_mm = min(mm_tests.keys())
+            rev_primer_index = mm_tests[rev_primer_mm]
 
-        if rev_primer_mm > primer_mismatches:
-            if truncate_option == "truncate_remove":
-                log_data['reverse_primer_not_found'] += 1
+            if rev_primer_mm > primer_mismatches:
+                if truncate_option == "truncate_remove":
+                    log_data['reverse_primer_not_found'] += 1
+                else:
+                    log_data['reverse_primer_not_found'] += 1
+                    log_data['seqs_written'] += 1
+                    output_fp.write('>%s\n%s\n' % (label, seq))
             else:
-                log_data['reverse_primer_not_found'] += 1
-                log_data['seqs_written'] += 1
-                output_fp.write('>%s\n%s\n' % (label, seq))
-        else:
-            # Check for zero seq length after truncation, will not write seq
-            if rev_primer_index > 0:
-                log_data['seqs_written'] += 1
-                output_fp.write('>%s\n%s\n' % (label, seq[0:rev_primer_index]))
+                # Check for zero seq length after truncation, will not
+                # write seq
+                if rev_primer_index > 0:
+                    log_data['seqs_written'] += 1
+                    output_fp.write('>%s\n%s\n' %
+                                    (label, seq[0:rev_primer_index]))
 
     return log_data
 
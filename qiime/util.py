@@ -22,7 +22,7 @@ import tempfile
 import os
 from os import getenv, listdir, close
 from os.path import abspath, basename, exists, dirname, join, splitext, isfile
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from gzip import open as gz_open
 from sys import stderr
 from copy import deepcopy
@@ -30,56 +30,71 @@ from datetime import datetime
 from subprocess import Popen
 from random import random
 from itertools import repeat, izip
+from multiprocessing import Pool
 from functools import partial
 
 from numpy import (array, zeros, shape, vstack, ndarray, asarray,
                    float, where, isnan, std, sqrt, ravel, mean, median,
-                   sum as np_sum, nan, sort)
+                   sum as np_sum, nan, sort, frombuffer, flatnonzero, append,
+                   concatenate, cumsum, arange, uint8, int64, searchsorted)
 from numpy.ma import MaskedArray
 from numpy.ma.extras import apply_along_axis
 
-from biom.util import compute_counts_per_sample_stats, biom_open, HAVE_H5PY
-from biom import load_table
-from biom.exception import BiomException
-from biom.table import Table
-
-from cogent.parse.tree import DndParser
-from cogent.cluster.procrustes import procrustes
-
-from skbio.util import remove_files, create_dir
-from skbio.format.sequences import format_fastq_record
 from burrito.util import ApplicationError, CommandLineApplication, FilePath
 from burrito.util import which
-from skbio.sequence import DNASequence
-from skbio.parse.sequences import parse_fasta
-from skbio.parse.sequences import FastaIterator, FastqIterator
-
-from bfillings.blast import Blastall, BlastResult
-from bfillings.formatdb import (build_blast_db_from_fasta_path,
-    build_blast_db_from_fasta_file)
-from qiime_default_reference import (get_template_alignment,
-    get_reference_sequences, get_reference_taxonomy,
-    get_template_alignment_column_mask)
-
 
 from qcli import make_option, qcli_system_call, parse_command_line_parameters
 
 from qiime import __version__ as qiime_library_version
+from qiime.fasta_index import (FastaIndex, SampleIndex,
+                               parse_fasta_with_offsets,
+                               parse_fastq_with_offsets,
+                               sample_id_from_seq_id)
+from qiime.read_store import count_read_store, read_store_suffix
 from qiime.parse import (parse_qiime_config_files,
                          parse_coords,
                          parse_newick,
                          fields_to_dict,
-                         PhyloNode,
                          parse_mapping_file,
                          parse_denoiser_mapping,
-                         parse_fastq,
                          mapping_file_to_dict)
 
-# for backward compatibility - compute_seqs_per_library_stats has
-# been removed in favor of biom.util.compute_counts_per_sample_stats,
-# which has the same interface as the former
-# qiime.util.compute_seqs_per_library_stats
-compute_seqs_per_library_stats = compute_counts_per_sample_stats
+# Nearly every QIIME script imports this module, and some scripts are run
+# thousands of times by pipelines, so the heavier dependencies (biom,
+# cogent, skbio, bfillings, qiime_default_reference) are imported by the
+# functions that use them rather than here. The functions below wrap the
+# few objects from those packages that are part of this module's
+# interface.
+
+
+def parse_fasta(*args, **kwargs):
+    """Wraps skbio.parse.sequences.parse_fasta, importing it on first use
+    """
+    from skbio.parse.sequences import parse_fasta
+    return parse_fasta(*args, **kwargs)
+
+
+def create_dir(*args, **kwargs):
+    """Wraps skbio.util.create_dir, importing it on first use"""
+    from skbio.util import create_dir
+    return create_dir(*args, **kwargs)
+
+
+def remove_files(*args, **kwargs):
+    """Wraps skbio.util.remove_files, importing it on first use"""
+    from skbio.util import remove_files
+    return remove_files(*args, **kwargs)
+
+
+def compute_seqs_per_library_stats(*args, **kwargs):
+    """Wraps biom.util.compute_counts_per_sample_stats
+
+    For backward compatibility - compute_seqs_per_library_stats has been
+    removed in favor of biom.util.compute_counts_per_sample_stats, which has
+    the same interface as the former qiime.util.compute_seqs_per_library_stats
+    """
+    from biom.util import compute_counts_per_sample_stats
+    return compute_counts_per_sample_stats(*args, **kwargs)
 
 # add a support message to script-raised errors
 parse_command_line_parameters = partial(parse_command_line_parameters,
@@ -120,8 +135,12 @@ class ScriptsDirError(IOError):
     """Exception for when the QIIME scripts directory cannot be found."""
     pass
 
-class EmptyBIOMTableError(BiomException):
-    """Exception for when an empty BIOM table is encountered."""
+class EmptyBIOMTableError(ValueError):
+    """Exception for when an empty BIOM table is encountered.
+
+    This is not a biom.exception.BiomException so that biom doesn't need to
+    be imported to define it.
+    """
     pass
 
 def make_safe_f(f, allowed_params):
@@ -199,6 +218,7 @@ class FunctionWithParams(object):
 
     def getTree(self, tree_source):
         """Returns parsed tree from putative tree source"""
+        from cogent.core.tree import PhyloNode
         if isinstance(tree_source, PhyloNode):
             tree = tree_source  # accept tree object directly for tests
         elif tree_source:
@@ -238,6 +258,8 @@ class FunctionWithParams(object):
 
     def getBiomData(self, data):
         """returns a biom object regardless of whether path or object given"""
+        from biom import load_table
+        from biom.table import Table
         try:
             if isfile(data):
                 return load_table(data)
@@ -340,6 +362,9 @@ def load_qiime_config():
 
     # For files that are defined in the qiime-default-reference package,
     # add values to the qiime_config if they haven't already been defined.
+    from qiime_default_reference import (get_template_alignment,
+                                         get_reference_sequences,
+                                         get_reference_taxonomy)
     qiime_config['pick_otus_reference_seqs_fp'] = \
         qiime_config['pick_otus_reference_seqs_fp'] or get_reference_sequences()
 
@@ -364,7 +389,7 @@ def load_qiime_config():
     return qiime_config
 
 def qiime_blast_seqs(seqs,
-                     blast_constructor=Blastall,
+                     blast_constructor=None,
                      blast_program='blastn',
                      blast_db=None,
                      refseqs=None,
@@ -379,8 +404,16 @@ def qiime_blast_seqs(seqs,
 
     seqs: a list (or object with list-like interace) of (seq_id, seq)
      tuples (e.g., the output of parse_fasta)
+    blast_constructor: the blast application controller to use (default:
+     bfillings.blast.Blastall)
 
     """
+    from bfillings.blast import Blastall, BlastResult
+    from bfillings.formatdb import (build_blast_db_from_fasta_path,
+                                    build_blast_db_from_fasta_file)
+
+    if blast_constructor is None:
+        blast_constructor = Blastall
 
     assert blast_db or refseqs_fp or refseqs, \
         'Must provide either a blast_db or a fasta ' +\
@@ -434,7 +467,7 @@ def qiime_blast_seqs(seqs,
 
 
 def qiime_blastx_seqs(seqs,
-                      blast_constructor=Blastall,
+                      blast_constructor=None,
                       blast_db=None,
                       refseqs=None,
                       refseqs_fp=None,
@@ -464,7 +497,16 @@ def qiime_blastx_seqs(seqs,
 
 
 def extract_seqs_by_sample_id(seqs, sample_ids, negate=False):
-    """ Returns (seq id, seq) pairs if sample_id is in sample_ids """
+    """ Returns (seq id, seq) pairs if sample_id is in sample_ids
+
+        The sample id of a sequence is everything before the last '_' in
+        the first word of its id (as in qiime.fasta_index.SampleIndex).
+
+        seqs can be (seq id, seq) pairs, a qiime.fasta_index.FastaIndex,
+        in which case only the matching sequences are read, or a
+        qiime.fasta_index.SampleIndex, in which case only the byte ranges
+        holding the matching samples' sequences are read.
+    """
     sample_ids = {}.fromkeys(sample_ids)
 
     if not negate:
@@ -474,9 +516,19 @@ def extract_seqs_by_sample_id(seqs, sample_ids, negate=False):
         def f(s):
             return s not in sample_ids
 
+    if isinstance(seqs, FastaIndex):
+        for r in seqs.iter_records([seq_id for seq_id in seqs
+                                    if f(sample_id_from_seq_id(seq_id))]):
+            yield r
+        return
+
+    if isinstance(seqs, SampleIndex):
+        for r in seqs.iter_records([s for s in seqs if f(s)]):
+            yield r
+        return
+
     for seq_id, seq in seqs:
-        sample_id = seq_id.split('_')[0]
-        if f(sample_id):
+        if f(sample_id_from_seq_id(seq_id)):
             yield seq_id, seq
 
 
@@ -522,6 +574,7 @@ def write_seqs_to_fastq(fp, seqs, write_mode='w'):
 
         seqs: list of (seq_id,seq,qual_id,qual) tuples
     """
+    from skbio.format.sequences import format_fastq_record
     with open(fp, write_mode) as f:
         for s in seqs:
             f.write(format_fastq_record(s[0], s[1], s[3]))
@@ -538,7 +591,7 @@ def get_generated_by_for_biom_tables():
 
 
 def write_biom_table(biom_table, biom_table_fp, compress=True,
-                     write_hdf5=HAVE_H5PY, table_type='OTU table'):
+                     write_hdf5=None, table_type='OTU table'):
     """Writes a BIOM table to the specified filepath
 
     Parameters
@@ -552,8 +605,8 @@ def write_biom_table(biom_table, biom_table_fp, compress=True,
         file will be enabled. This option is only relevant if ``write_hdf5`` is
         ``True``.
     write_hdf5 : bool, optional
-        Defaults to ``True`` if H5PY is installed and to ``False`` if H5PY is
-        not installed. If ``True`` the output biom table will be written as an
+        Defaults to ``None``, which means ``True`` if H5PY is installed and
+        ``False`` if H5PY is not installed. If ``True`` the output biom table will be written as an
         HDF5 binary file, otherwise it will be a JSON string.
     table_type : str, optional
         The Table.type value to set for the table before it is written. Note
@@ -572,6 +625,10 @@ def write_biom_table(biom_table, biom_table_fp, compress=True,
     generated_by = get_generated_by_for_biom_tables()
     biom_table.type = table_type
 
+    from biom.util import biom_open, HAVE_H5PY
+    if write_hdf5 is None:
+        write_hdf5 = HAVE_H5PY
+
     if write_hdf5:
         with biom_open(biom_table_fp, 'w') as biom_file:
             biom_table.to_hdf5(biom_file, generated_by, compress)
@@ -580,10 +637,102 @@ def write_biom_table(biom_table, biom_table_fp, compress=True,
             biom_table.to_json(generated_by, biom_file)
 
 
+class SampleFileWriter(object):
+
+    """Writes data to many files with bounded memory and open file handles
+
+    Data written to each file is buffered in memory. When the total size of
+    the buffers exceeds max_buffer_size bytes, the largest buffers are
+    written out until at most half of max_buffer_size remains buffered, so
+    files receiving many records are written in large chunks while small
+    files are written only when the writer is closed. At most
+    max_open_files files are open at once: the least recently used file is
+    closed when another needs to be opened, and is re-opened in append mode
+    if it is written to again. If compress is True, files are written with
+    gzip compression.
+
+    Files are truncated when they are first written to, unless append is
+    True.
+    """
+
+    def __init__(self,
+                 max_buffer_size=64 * 2 ** 20,
+                 max_open_files=256,
+                 compress=False,
+                 append=False):
+        self.MaxBufferSize = max_buffer_size
+        self.MaxOpenFiles = max_open_files
+        self.Compress = compress
+        self.Append = append
+        self._buffers = {}
+        self._buffer_sizes = {}
+        self._buffered = 0
+        self._handles = OrderedDict()
+        self._opened = set()
+
+    def write(self, fp, data):
+        """Buffer data to be written to fp"""
+        try:
+            self._buffers[fp].append(data)
+            self._buffer_sizes[fp] += len(data)
+        except KeyError:
+            self._buffers[fp] = [data]
+            self._buffer_sizes[fp] = len(data)
+        self._buffered += len(data)
+        if self._buffered > self.MaxBufferSize:
+            largest_first = sorted([(size, buffer_fp) for buffer_fp, size
+                                    in self._buffer_sizes.iteritems()],
+                                   reverse=True)
+            for size, buffer_fp in largest_first:
+                self.flush_file(buffer_fp)
+                if self._buffered <= self.MaxBufferSize // 2:
+                    break
+
+    def _get_handle(self, fp):
+        """Return an open handle to fp, closing the LRU handle if needed"""
+        try:
+            # move fp to the most recently used position
+            handle = self._handles.pop(fp)
+        except KeyError:
+            if len(self._handles) >= self.MaxOpenFiles:
+                self._handles.popitem(last=False)[1].close()
+            mode = 'ab' if self.Append or fp in self._opened else 'wb'
+            if self.Compress:
+                handle = gz_open(fp, mode)
+            else:
+                handle = open(fp, mode)
+            self._opened.add(fp)
+        self._handles[fp] = handle
+        return handle
+
+    def flush_file(self, fp):
+        """Write the buffered data for fp"""
+        data = self._buffers.pop(fp, None)
+        if data is None:
+            return
+        self._get_handle(fp).write(''.join(data))
+        self._buffered -= self._buffer_sizes.pop(fp)
+
+    def flush(self):
+        """Write all buffered data"""
+        for fp in self._buffers.keys():
+            self.flush_file(fp)
+
+    def close(self):
+        """Write all buffered data and close all files"""
+        self.flush()
+        for handle in self._handles.itervalues():
+            handle.close()
+        self._handles.clear()
+
+
 def split_sequence_file_on_sample_ids_to_files(seqs,
                                                file_type,
                                                output_dir,
-                                               per_sample_buffer_size=500):
+                                               per_sample_buffer_size=500,
+                                               max_buffer_size=64 * 2 ** 20,
+                                               max_open_files=256,
+                                               compress=False):
     """Split a demux sequence file into per-sample sequence file
 
         Parameters
@@ -596,67 +745,83 @@ def split_sequence_file_on_sample_ids_to_files(seqs,
         output_dir : str
             Path to directory where output should be written, will be created
             if it doesn't exist
-        per_sample_buffer_size : int, optional
-            Defaults to 500. The number of sequences that will be accumulated
-            for any given sample beore they are written out to disk.
+        per_sample_buffer_size : int or None, optional
+            Defaults to 500. The sequences for a sample are also written out
+            whenever this many have been accumulated for it. If None, they
+            are only written out as max_buffer_size requires.
+        max_buffer_size : int, optional
+            Defaults to 64MB. The maximum number of bytes of sequence data
+            that will be held in memory (across all samples) before the
+            largest per-sample buffers are written out to disk.
+        max_open_files : int, optional
+            Defaults to 256. The maximum number of output files that will be
+            open at once.
+        compress : bool, optional
+            Defaults to False. If True, the output files are gzipped (and
+            their names end in .gz).
+
+        Returns
+        -------
+        list
+            The output filepaths, in the order the samples were first
+            observed.
 
         Notes
         -----
-        - This function takes a buffered approach to writing files to avoid
+        - Output files are buffered and written through a pool of at most
+          max_open_files file handles (see SampleFileWriter) to avoid
           hitting errors arising from too many files being open when working
-          with large numbers of samples ids (e.g. > 1024 on linux)
+          with large numbers of samples ids (e.g. > 1024 on linux), without
+          re-opening files for every few records.
     """
     create_dir(output_dir)
     file_lookup = {}
     all_fps = []
+    buffered_counts = {}
 
     # Set these up here to reduce the number of checks that have to be
     # performed in the loop
     if file_type == 'fasta':
-        iter_ = FastaIterator([seqs])
-        sequence_writer = write_seqs_to_fasta
-        data_getter = lambda x: (x[0], x[1])
+        records = parse_fasta_with_offsets(seqs)
+        format_record = lambda r: '>%s\n%s\n' % r[:2]
     elif file_type == 'fastq':
-        iter_ = FastqIterator([seqs])
-        sequence_writer = write_seqs_to_fastq
-        data_getter = lambda x: x
+        records = parse_fastq_with_offsets(seqs)
+        format_record = lambda r: '@%s\n%s\n+\n%s\n' % r[:3]
     else:
         raise ValueError("file_type must be either fasta or fastq")
+    suffix = '.%s' % file_type
+    if compress:
+        suffix += '.gz'
 
+    writer = SampleFileWriter(max_buffer_size, max_open_files, compress)
     old_file_position = seqs.tell()
     seqs.seek(0)
-    for record in iter_:
-        seq_id = record['SequenceID']
-        seq = record['Sequence']
-        sample_id = seq_id.split()[0].rsplit('_', 1)[0]
-        qual_id = record['QualID']
-        qual = record['Qual']
-        # grab or create the list corresponding to the current sample id
-        try:
-            current_seqs = file_lookup[sample_id][1]
-        except KeyError:
-            current_fp = join(output_dir, sample_id + '.%s' % file_type)
-            all_fps.append(current_fp)
-            if exists(current_fp):
-                raise IOError(" %s already exists. Will not perform split "
-                              "-- remove this file or specify a different "
-                              "output directory." % current_fp)
-            current_seqs = list()
-            file_lookup[sample_id] = [current_fp, current_seqs]
-
-        # append the current sequence to the current seqs list
-        current_seqs.append(data_getter((seq_id, seq, qual_id, qual)))
-
-        # compare current_seqs length to the buffer size, and write
-        # if it has hit the buffer size
-        if len(current_seqs) == per_sample_buffer_size:
-            current_fp = file_lookup[sample_id][0]
-            sequence_writer(current_fp, current_seqs, write_mode='a')
-            # reset the current seqs buffer
-            file_lookup[sample_id][1] = list()
-
-    for current_fp, current_seqs in file_lookup.values():
-        sequence_writer(current_fp, current_seqs, write_mode='a')
+    try:
+        for record in records:
+            sample_id = sample_id_from_seq_id(record[0])
+            # grab or create the filepath corresponding to the current
+            # sample id
+            try:
+                current_fp = file_lookup[sample_id]
+            except KeyError:
+                current_fp = join(output_dir, sample_id + suffix)
+                if exists(current_fp):
+                    raise IOError(" %s already exists. Will not perform "
+                                  "split -- remove this file or specify a "
+                                  "different output directory." % current_fp)
+                all_fps.append(current_fp)
+                file_lookup[sample_id] = current_fp
+                buffered_counts[current_fp] = 0
+
+            writer.write(current_fp, format_record(record))
+
+            if per_sample_buffer_size is not None:
+                buffered_counts[current_fp] += 1
+                if buffered_counts[current_fp] == per_sample_buffer_size:
+                    writer.flush_file(current_fp)
+                    buffered_counts[current_fp] = 0
+    finally:
+        writer.close()
 
     seqs.seek(old_file_position)
 
@@ -734,6 +899,22 @@ def get_options_lookup():
     result['mapping_fp'] =\
         make_option('-m', '--mapping_fp', type="existing_filepath",
                     help='the mapping filepath')
+    result['save_fasta_index'] =\
+        make_option('--save_fasta_index', action='store_true',
+                    help='save an index of the input fasta file(s) next to'
+                    ' them (as <fasta_fp>.idx) so that later runs on the'
+                    ' same file(s) don\'t need to rebuild it. Existing,'
+                    ' up-to-date indices are always used'
+                    ' [default: %default]', default=False)
+    result['sample_index_fp'] =\
+        make_option('--sample_index_fp', type='existing_filepath',
+                    help='a sample index of the input file (as written by'
+                    ' split_libraries_fastq.py --write_sample_index or'
+                    ' split_sequence_file_on_sample_ids.py --write_index).'
+                    ' If provided, or if an up-to-date index exists next to'
+                    ' the input file (as <input_fp>.sidx), only the'
+                    ' sequences from the requested samples are read'
+                    ' [default: %default]', default=None)
 
     # Define options used by the workflow scripts
     result['jobs_to_start_workflow'] =\
@@ -743,6 +924,15 @@ def get_options_lookup():
                     ' jobs to be started if and only if -a is passed'
                     ' [default: %default]',
                     default=qiime_config['jobs_to_start'])
+    result['step_workers_workflow'] =\
+        make_option('--step_workers', type='int', default=None,
+                    help='Run QIIME\'s Python steps without starting a new'
+                    ' Python interpreter for each step. If 0, these steps'
+                    ' are run in the workflow\'s process; otherwise they'
+                    ' are run in a persistent pool of this many worker'
+                    ' processes. External tools are always run as separate'
+                    ' processes [default: %default; each step is run as a'
+                    ' separate process]')
 
     # Define options used by the parallel scripts
     result['jobs_to_start'] =\
@@ -891,6 +1081,7 @@ def summarize_pcoas(master_pcoa, support_pcoas,
         ideal fourths: Ideal fourths method as implemented in scipy
     """
     if apply_procrustes:
+        from cogent.cluster.procrustes import procrustes
         # perform procrustes before averaging
         support_pcoas = [list(sp) for sp in support_pcoas]
         master_pcoa = list(master_pcoa)
@@ -1051,12 +1242,17 @@ def degap_fasta_aln(seqs):
     seqs: list of label,seq pairs
     """
 
+    from skbio.sequence import DNASequence
     for (label, seq) in seqs:
         yield DNASequence(seq, id=label).degap()
 
 
-def write_degapped_fasta_to_file(seqs, tmp_dir=get_qiime_temp_dir()):
-    """ write degapped seqs to temp fasta file."""
+def write_degapped_fasta_to_file(seqs, tmp_dir=None):
+    """ write degapped seqs to temp fasta file.
+
+    tmp_dir defaults to the QIIME temp dir."""
+    if tmp_dir is None:
+        tmp_dir = get_qiime_temp_dir()
     fd, tmp_filename = tempfile.mkstemp(dir=tmp_dir, prefix="degapped_",
                                         suffix=".fasta")
     close(fd)
@@ -1324,11 +1520,128 @@ def inflate_denoiser_output(
 # Functions for counting sequences in fasta files
 
 
-def count_seqs(fasta_filepath, parser=parse_fasta):
+def _record_error(message):
+    """Return an skbio RecordError, importing it on first use"""
+    from skbio.io import RecordError
+    return RecordError(message)
+
+
+def scan_seq_lengths(seqs_f, file_type='fasta', block_size=2 ** 22):
+    """Return (count, total length, total squared length) of seqs_f's seqs
+
+        seqs_f: an open fasta or fastq file (e.g., from qiime_open). Line
+         ends may be '\n' or '\r\n'.
+        file_type: 'fasta' or 'fastq'. fastq records must be four lines.
+
+        The file is read in blocks of about block_size bytes, and sequence
+        lengths are computed from the positions of the line breaks and
+        non-whitespace bytes in each block, so no string is built for each
+        record. As with parse_fasta, leading and trailing whitespace is not
+        counted, and a RecordError is raised if there is sequence data
+        before the first fasta label or if a fasta label has no sequence.
+    """
+    fastq = file_type == 'fastq'
+    count = total = total_sq = 0
+    # the length of the last fasta record seen so far (its sequence may
+    # continue in the next block), or None before the first record
+    current = None
+    # the index (mod 4) of the next fastq line
+    line_num = 0
+
+    while True:
+        block = seqs_f.read(block_size)
+        if not block:
+            break
+        if not block.endswith('\n'):
+            # end the block at a line break
+            block += seqs_f.readline()
+        data = frombuffer(block, dtype=uint8)
+        ends = flatnonzero(data == 10)
+        if len(ends) == 0 or ends[-1] != len(data) - 1:
+            # the last line of the file has no line break
+            ends = append(ends, len(data))
+        # the first and last non-whitespace byte of each line, so that
+        # lengths are those of the stripped lines (0 for blank lines)
+        is_space = (data == 32) | ((data >= 9) & (data <= 13))
+        content = flatnonzero(~is_space)
+        content_lines = searchsorted(ends, content)
+        firsts = zeros(len(ends), dtype=int64)
+        lasts = firsts - 1
+        if len(content):
+            line_changes = content_lines[1:] != content_lines[:-1]
+            is_first = concatenate(([True], line_changes))
+            is_last = concatenate((line_changes, [True]))
+            firsts[content_lines[is_first]] = content[is_first]
+            lasts[content_lines[is_last]] = content[is_last]
+        lengths = lasts - firsts + 1
+
+        if fastq:
+            seq_lengths = lengths[(arange(line_num, line_num + len(lengths))
+                                   % 4) == 1].astype(int64)
+            line_num = (line_num + len(lengths)) % 4
+        else:
+            is_header = (lengths > 0) & (data[firsts] == 62)
+            header_lines = flatnonzero(is_header)
+            line_totals = concatenate(
+                ([0], cumsum(where(is_header, 0, lengths), dtype=int64)))
+            # the total sequence length between consecutive labels
+            record_lengths = line_totals[
+                concatenate(([0], header_lines + 1, [len(lengths)]))]
+            record_lengths = record_lengths[1:] - record_lengths[:-1]
+            if current is not None:
+                current += int(record_lengths[0])
+            elif record_lengths[0] > 0:
+                raise _record_error("Found fasta record without label line.")
+            if len(header_lines) == 0:
+                continue
+            seq_lengths = record_lengths[1:-1]
+            if current is not None:
+                seq_lengths = append([current], seq_lengths)
+            if (seq_lengths == 0).any():
+                raise _record_error("Found label line without sequences.")
+            current = int(record_lengths[-1])
+
+        count += len(seq_lengths)
+        total += int(seq_lengths.sum())
+        total_sq += int((seq_lengths * seq_lengths).sum())
+
+    if current is not None:
+        if current == 0:
+            raise _record_error("Found label line without sequences.")
+        count += 1
+        total += current
+        total_sq += current * current
+    return count, total, total_sq
+
+
+def seq_length_stats(count, total, total_sq):
+    """Return (count, mean, std) from the output of scan_seq_lengths"""
+    if count == 0:
+        return count, None, None
+    # computed from integers so that the variance is exact
+    variance = (count * total_sq - total * total) / float(count * count)
+    return count, total / float(count), sqrt(variance)
+
+
+def count_seqs(fasta_filepath, parser=None):
     """ Count the sequences in fasta_filepath
 
-        fasta_filepath: string indicating the full path to the file
+        fasta_filepath: string indicating the full path to the file. The
+         file may be gzipped. Read stores (see qiime.read_store) are counted
+         from their chunk headers.
+        parser: function to parse the records of the file, or None to count
+         fasta (or, if fasta_filepath ends with .fastq or .fq, fastq)
+         records with scan_seq_lengths.
     """
+    if fasta_filepath.endswith(read_store_suffix):
+        return count_read_store(fasta_filepath)
+    if parser is None:
+        seqs_f = qiime_open(fasta_filepath, 'rb')
+        try:
+            return seq_length_stats(*scan_seq_lengths(
+                seqs_f, _seqs_file_type(fasta_filepath)))
+        finally:
+            seqs_f.close()
     # Open the file and pass it to py_count_seqs_from_file -- wrapping
     # this makes for easier unit testing
     return count_seqs_from_file(open(fasta_filepath, 'U'), parser=parser)
@@ -1351,7 +1664,42 @@ def count_seqs_from_file(fasta_file, parser=parse_fasta):
         return result, mean(lens), std(lens)
 
 
-def count_seqs_in_filepaths(fasta_filepaths, seq_counter=count_seqs):
+def _seqs_file_type(fp):
+    """Return 'fastq' if fp ends with .fastq or .fq (or .gz), else 'fasta'"""
+    if fp.endswith('.gz'):
+        fp = fp[:-3]
+    if fp.endswith('.fastq') or fp.endswith('.fq'):
+        return 'fastq'
+    return 'fasta'
+
+
+def _parse_tree_tips(f):
+    # This is clunky, but really convenient bc
+    # it lets us count tree tips with count_seqs.py
+    from cogent.parse.tree import DndParser
+    from cogent.core.tree import PhyloNode
+    t = DndParser(f, constructor=PhyloNode)
+    return zip(t.iterTips(), repeat(''))
+
+
+def _count_seqs_in_filepath(fasta_filepath, seq_counter=count_seqs):
+    """Return seq_counter's result for fasta_filepath, or None on IOError
+    """
+    if fasta_filepath.endswith('.tre') or \
+            fasta_filepath.endswith('.ph') or \
+            fasta_filepath.endswith('.ntree'):
+        parser = _parse_tree_tips
+    else:
+        # fasta and fastq files are scanned by count_seqs
+        parser = None
+    try:
+        return seq_counter(fasta_filepath, parser=parser)
+    except IOError:
+        return None
+
+
+def count_seqs_in_filepaths(fasta_filepaths, seq_counter=count_seqs,
+                            processes=1):
     """ Wrapper to apply seq_counter to fasta_filepaths
 
         fasta_filepaths: list of one or more fasta filepaths
@@ -1359,37 +1707,33 @@ def count_seqs_in_filepaths(fasta_filepaths, seq_counter=count_seqs):
          and returns the count of the number of sequences
          (default: count_seqs) -- this is parameterized to
          facilitate unit testing
+        processes: number of files to count at once (in worker processes).
+         seq_counter must be picklable if processes > 1.
     """
     total = 0
     counts = []
     inaccessible_filepaths = []
+    count_filepath = partial(_count_seqs_in_filepath, seq_counter=seq_counter)
+    if processes > 1 and len(fasta_filepaths) > 1:
+        pool = Pool(min(processes, len(fasta_filepaths)))
+        try:
+            current_counts = pool.map(count_filepath, fasta_filepaths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        current_counts = map(count_filepath, fasta_filepaths)
+
     # iterate over the input files
-    for fasta_filepath in fasta_filepaths:
-        # if the file is actually fastq, use the fastq parser.
-        # otherwise use the fasta parser
-        if fasta_filepath.endswith('.fastq') or fasta_filepath.endswith('.fq'):
-            parser = partial(parse_fastq, enforce_qual_range=False)
-        elif fasta_filepath.endswith('.tre') or \
-                fasta_filepath.endswith('.ph') or \
-                fasta_filepath.endswith('.ntree'):
-             # This is clunky, but really convenient bc
-             # it lets us count tree tips with count_seqs.py
-            def parser(f):
-                t = DndParser(f, constructor=PhyloNode)
-                return zip(t.iterTips(), repeat(''))
+    for fasta_filepath, current_count in zip(fasta_filepaths, current_counts):
+        if current_count is None:
+            # if the file couldn't be open, keep track of the filepath
+            inaccessible_filepaths.append(fasta_filepath)
         else:
-            parser = parse_fasta
-
-        try:
-            # get the count of sequences in the current file
-            current_count = seq_counter(fasta_filepath, parser=parser)
-            # store it
+            # store the count of sequences in the current file
             counts.append((current_count, fasta_filepath))
             # and increment the total count
             total += current_count[0]
-        except IOError:
-            # if the file couldn't be open, keep track of the filepath
-            inaccessible_filepaths.append(fasta_filepath)
 
     return counts, total, inaccessible_filepaths
 
@@ -12,6 +12,7 @@ __maintainer__ = "William Anton Walters"
 __email__ = "william.a.walters@gmail.com"
 
 from collections import defaultdict
+from multiprocessing import Pool
 from os.path import split, join
 
 from skbio.parse.sequences import parse_fasta
@@ -19,6 +20,7 @@ from skbio.io import RecordError
 from cogent.parse.tree import DndParser
 from qiime.check_id_map import process_id_map
 from qiime.split_libraries import expand_degeneracies
+from qiime.pattern_matcher import PatternMatcher
 
 
 def get_mapping_details(mapping_fp,
@@ -101,23 +103,304 @@ def get_mapping_details(mapping_fp,
     return set(sample_ids), set(barcode_seqs), set(linker_primer_seqs)
 
 
-def verify_valid_fasta_format(input_fasta_fp):
-    """ Tests fasta filepath to determine if valid format
+class DuplicateLabelsChecker(object):
 
-    input_fasta_fp:  fasta filepath
+    """ Counts fasta labels to find duplicated labels
+
+    Like the other checkers, records are passed to add as they are read, and
+    checkers of parts of a fasta file can be combined with merge.
     """
 
-    fasta_f = open(input_fasta_fp, "U")
+    def __init__(self):
+        self.label_counts = defaultdict(int)
+
+    def add(self, seq_id, seq):
+        self.label_counts[seq_id] += 1
+
+    def merge(self, other):
+        for label, count in other.label_counts.iteritems():
+            self.label_counts[label] += count
+
+    def results(self):
+        """ Returns percent of duplicate labels, list of duplicated labels """
+        fasta_labels_count = float(sum(self.label_counts.itervalues()))
+        fasta_labels_derep = float(len(self.label_counts))
+
+        perc_dup = "%1.3f" %\
+            ((fasta_labels_count - fasta_labels_derep) / fasta_labels_count)
 
+        labels_from_dups = []
+        for label in self.label_counts:
+            if self.label_counts[label] > 1:
+                labels_from_dups.append(label)
+
+        return perc_dup, labels_from_dups
+
+
+class SampleIdLabelsChecker(object):
+
+    """ Checks that fasta labels are SampleID_X, with SampleIDs in mapping
+
+    sample_ids: set of sample IDs from mapping file
+
+    Also collects the SampleID part of each label (label_prefixes) for the
+    checks against all SampleIDs and against tree tips.
+    """
+
+    def __init__(self, sample_ids):
+        self.sample_ids = sample_ids
+        self.valid_id_count = 0
+        self.matches_sampleid_count = 0
+        self.label_prefixes = set()
+
+    def add(self, seq_id, seq):
+        curr_label = seq_id.split('_')
+        self.label_prefixes.add(curr_label[0])
+
+        # Should be length 2, if not skip other processing
+        if len(curr_label) != 2:
+            return
+
+        self.valid_id_count += 1
+
+        if curr_label[0] in self.sample_ids:
+            self.matches_sampleid_count += 1
+
+    def merge(self, other):
+        self.valid_id_count += other.valid_id_count
+        self.matches_sampleid_count += other.matches_sampleid_count
+        self.label_prefixes.update(other.label_prefixes)
+
+    def results(self, total_seq_count):
+        """ Returns percent of invalid labels, labels not matching SampleIDs
+        """
+        total_seq_count = float(total_seq_count)
+        valid_id_count = float(self.valid_id_count)
+        matches_sampleid_count = float(self.matches_sampleid_count)
+
+        perc_not_valid = "%1.3f" %\
+            ((total_seq_count - valid_id_count) / total_seq_count)
+        perc_nosampleid_match = "%1.3f" %\
+            ((total_seq_count - matches_sampleid_count) / total_seq_count)
+
+        return perc_not_valid, perc_nosampleid_match
+
+
+class SeqContentsChecker(object):
+
+    """ Counts seqs with invalid characters, barcodes, or primers present
+
+    barcodes: set of barcodes from the mapping file
+    linkerprimerseqs: set of linkerprimersequences from the mapping file
+    valid_chars: Currently allowed DNA chars
+    """
+
+    def __init__(self,
+                 barcodes,
+                 linkerprimerseqs,
+                 valid_chars=frozenset(['A', 'T', 'C', 'G', 'N', 'a', 't',
+                                        'c', 'g', 'n'])):
+        # Deleting the valid characters leaves any invalid ones
+        self.valid_chars = ''.join(valid_chars)
+
+        # Get max barcode length to checking the beginning of seq for
+        # barcode
+        if barcodes:
+            self.max_bc_len = max([len(bc_len) for bc_len in barcodes])
+        else:
+            self.max_bc_len = 0
+
+        self.barcode_matcher = PatternMatcher(barcodes)
+        self.primer_matcher = PatternMatcher(linkerprimerseqs)
+
+        self.invalid_chars_count = 0
+        self.barcodes_count = 0
+        self.linkerprimers_count = 0
+        self.barcodes_at_start = 0
+
+    def add(self, seq_id, seq):
+        # Only count one offending problem
+        if seq.translate(None, self.valid_chars):
+            self.invalid_chars_count += 1
+
+        if self.barcode_matcher.search(seq[:self.max_bc_len]) is not None:
+            self.barcodes_at_start += 1
+            self.barcodes_count += 1
+        elif self.barcode_matcher.search(seq) is not None:
+            self.barcodes_count += 1
+
+        if self.primer_matcher.search(seq) is not None:
+            self.linkerprimers_count += 1
+
+    def merge(self, other):
+        self.invalid_chars_count += other.invalid_chars_count
+        self.barcodes_count += other.barcodes_count
+        self.linkerprimers_count += other.linkerprimers_count
+        self.barcodes_at_start += other.barcodes_at_start
+
+    def results(self, total_seq_count):
+        """ Returns perc of seqs w/ invalid chars, barcodes, or primers """
+        invalid_chars_count = float(self.invalid_chars_count)
+        barcodes_count = float(self.barcodes_count)
+        linkerprimers_count = float(self.linkerprimers_count)
+        total_seq_count = float(total_seq_count)
+        barcodes_at_start_count = float(self.barcodes_at_start)
+
+        perc_invalid_chars = "%1.3f" %\
+            (invalid_chars_count / total_seq_count)
+        perc_barcodes_detected = "%1.3f" %\
+            (barcodes_count / total_seq_count)
+        perc_primers_detected = "%1.3f" %\
+            (linkerprimers_count / total_seq_count)
+        perc_barcodes_at_start_detected = "%1.3f" %\
+            (barcodes_at_start_count / total_seq_count)
+
+        return perc_invalid_chars, perc_barcodes_detected,\
+            perc_primers_detected, perc_barcodes_at_start_detected
+
+
+class SeqLengthsChecker(object):
+
+    """ Creates bins of sequence lens """
+
+    def __init__(self):
+        self.seq_lens = defaultdict(int)
+
+    def add(self, seq_id, seq):
+        self.seq_lens[len(seq)] += 1
+
+    def merge(self, other):
+        for seq_len, count in other.seq_lens.iteritems():
+            self.seq_lens[seq_len] += count
+
+    def results(self):
+        """ Returns a list of (count, seq len), most frequent first """
+        formatted_seq_lens = []
+
+        for curr_key in self.seq_lens:
+            formatted_seq_lens.append((self.seq_lens[curr_key], curr_key))
+
+        formatted_seq_lens.sort(reverse=True)
+
+        return formatted_seq_lens
+
+
+def _check_fasta_records(records,
+                         checkers):
+    """ Passes each (label, seq) in records to each checker
+
+    Returns the number of records. Raises RecordError if records are not
+     valid fasta format.
+    """
+    seq_count = 0
+    label = seq = None
     try:
-        for label, seq in parse_fasta(fasta_f):
-            continue
+        for label, seq in records:
+            seq_id = label.split()[0]
+            for checker in checkers:
+                checker.add(seq_id, seq)
+            seq_count += 1
     except RecordError:
         raise RecordError("Input fasta file not valid fasta format.  Error " +
                           "found at %s label and %s sequence " % (label, seq))
+    return seq_count
+
+
+def _check_fasta_chunk(args):
+    """ Runs checkers on the records of a part of a fasta file
 
+    args: tuple of (fasta filepath, start, end, checkers), where start and
+     end are the byte offsets of the part of the file.
+    """
+    input_fasta_fp, start, end, checkers = args
+    fasta_f = open(input_fasta_fp, "rb")
+    fasta_f.seek(start)
+    chunk = fasta_f.read(end - start)
+    fasta_f.close()
+    seq_count = _check_fasta_records(parse_fasta(chunk.splitlines()),
+                                     checkers)
+    return seq_count, checkers
+
+
+def get_fasta_chunks(input_fasta_fp,
+                     chunk_size=2 ** 26):
+    """ Returns (start, end) byte offsets splitting a fasta file by record
+
+    input_fasta_fp: fasta filepath
+    chunk_size: approximate size of each part of the file, in bytes
+    """
+    fasta_f = open(input_fasta_fp, "rb")
+    fasta_f.seek(0, 2)
+    file_size = fasta_f.tell()
+
+    starts = [0]
+    for offset in range(chunk_size, file_size, chunk_size):
+        if offset <= starts[-1]:
+            continue
+        # move to the start of the next record
+        fasta_f.seek(offset)
+        fasta_f.readline()
+        while True:
+            start = fasta_f.tell()
+            line = fasta_f.readline()
+            if not line or line.startswith('>'):
+                break
+        if start < file_size:
+            starts.append(start)
     fasta_f.close()
 
+    return zip(starts, starts[1:] + [file_size])
+
+
+def check_fasta(input_fasta_fp,
+                checkers,
+                processes=1,
+                chunk_size=2 ** 26):
+    """ Runs checkers on every record of a fasta file in a single pass
+
+    input_fasta_fp: fasta filepath
+    checkers: list of checker objects, each with an add(seq_id, seq) method
+     that accumulates the results of the check, and a merge(other) method
+     that adds the results of another checker of the same type.
+    processes: number of parts of the file to check at once. Each worker
+     process checks copies of the checkers, which are merged into checkers.
+    chunk_size: approximate size in bytes of the parts of the file checked by
+     each worker process
+
+    Returns the number of sequences in the file. Raises RecordError if the
+     file is not valid fasta format.
+    """
+    if processes <= 1:
+        fasta_f = open(input_fasta_fp, "U")
+        seq_count = _check_fasta_records(parse_fasta(fasta_f), checkers)
+        fasta_f.close()
+        return seq_count
+
+    chunks = get_fasta_chunks(input_fasta_fp, chunk_size)
+    seq_count = 0
+    pool = Pool(processes)
+    try:
+        for chunk_seq_count, chunk_checkers in pool.imap(
+                _check_fasta_chunk,
+                [(input_fasta_fp, start, end, checkers)
+                 for start, end in chunks]):
+            seq_count += chunk_seq_count
+            for checker, chunk_checker in zip(checkers, chunk_checkers):
+                checker.merge(chunk_checker)
+    finally:
+        pool.close()
+        pool.join()
+    return seq_count
+
+
+def verify_valid_fasta_format(input_fasta_fp):
+    """ Tests fasta filepath to determine if valid format
+
+    input_fasta_fp:  fasta filepath
+    """
+
+    check_fasta(input_fasta_fp, [])
+
 
 def get_fasta_labels(input_fasta_fp):
     """ Returns the fasta labels (text before whitespace) as a list
@@ -140,22 +423,11 @@ def get_dup_labels_perc(fasta_labels):
 
     fasta_labels: list of fasta labels
     """
-    fasta_labels_count = float(len(fasta_labels))
-    fasta_labels_derep = float(len(set(fasta_labels)))
-
-    perc_dup = "%1.3f" %\
-        ((fasta_labels_count - fasta_labels_derep) / fasta_labels_count)
-
-    label_counts = defaultdict(int)
-    for curr_label in fasta_labels:
-        label_counts[curr_label] += 1
-
-    labels_from_dups = []
-    for label in label_counts:
-        if label_counts[label] > 1:
-            labels_from_dups.append(label)
+    checker = DuplicateLabelsChecker()
+    for label in fasta_labels:
+        checker.add(label, None)
 
-    return perc_dup, labels_from_dups
+    return checker.results()
 
 
 def check_labels_sampleids(fasta_labels,
@@ -167,31 +439,11 @@ def check_labels_sampleids(fasta_labels,
     sample_ids: set of sample IDs from mapping file
     total_seq_count: int of total sequences in fasta file
     """
-    valid_id_count = 0
-    matches_sampleid_count = 0
-
+    checker = SampleIdLabelsChecker(sample_ids)
     for label in fasta_labels:
-        curr_label = label.split('_')
-
-        # Should be length 2, if not skip other processing
-        if len(curr_label) != 2:
-            continue
-
-        valid_id_count += 1
-
-        if curr_label[0] in sample_ids:
-            matches_sampleid_count += 1
+        checker.add(label, None)
 
-    total_seq_count = float(total_seq_count)
-    valid_id_count = float(valid_id_count)
-    matches_sampleid_count = float(matches_sampleid_count)
-
-    perc_not_valid = "%1.3f" %\
-        ((total_seq_count - valid_id_count) / total_seq_count)
-    perc_nosampleid_match = "%1.3f" %\
-        ((total_seq_count - matches_sampleid_count) / total_seq_count)
-
-    return perc_not_valid, perc_nosampleid_match
+    return checker.results(total_seq_count)
 
 
 def check_fasta_seqs(input_fasta_fp,
@@ -209,61 +461,10 @@ def check_fasta_seqs(input_fasta_fp,
     valid_chars: Currently allowed DNA chars
     """
 
-    input_fasta_f = open(input_fasta_fp, "U")
-
-    invalid_chars_count = 0
-    barcodes_count = 0
-    linkerprimers_count = 0
-    barcodes_at_start = 0
-
-    # Get max barcode length to checking the beginning of seq for barcode
-    if barcodes:
-        max_bc_len = max([len(bc_len) for bc_len in barcodes])
-    else:
-        max_bc_len = 0
-
-    for label, seq in parse_fasta(input_fasta_f):
-
-        # Only count one offending problem
-        for curr_nt in seq:
-            if curr_nt not in valid_chars:
-                invalid_chars_count += 1
-                break
-
-        sliced_seq = seq[0:max_bc_len]
-
-        for curr_bc in barcodes:
-            if curr_bc in sliced_seq:
-                barcodes_at_start += 1
-                break
-
-        for curr_bc in barcodes:
-            if curr_bc in seq:
-                barcodes_count += 1
-                break
-
-        for curr_primer in linkerprimerseqs:
-            if curr_primer in seq:
-                linkerprimers_count += 1
-                break
-
-    invalid_chars_count = float(invalid_chars_count)
-    barcodes_count = float(barcodes_count)
-    linkerprimers_count = float(linkerprimers_count)
-    total_seq_count = float(total_seq_count)
-    barcodes_at_start_count = float(barcodes_at_start)
-
-    perc_invalid_chars = "%1.3f" %\
-        (invalid_chars_count / total_seq_count)
-    perc_barcodes_detected = "%1.3f" %\
-        (barcodes_count / total_seq_count)
-    perc_primers_detected = "%1.3f" %\
-        (linkerprimers_count / total_seq_count)
-    perc_barcodes_at_start_detected = "%1.3f" %\
-        (barcodes_at_start_count / total_seq_count)
+    checker = SeqContentsChecker(barcodes, linkerprimerseqs, valid_chars)
+    check_fasta(input_fasta_fp, [checker])
 
-    return perc_invalid_chars, perc_barcodes_detected, perc_primers_detected,\
-        perc_barcodes_at_start_detected
+    return checker.results(total_seq_count)
 
 
 def check_fasta_seqs_lens(input_fasta_fp):
@@ -274,23 +475,10 @@ def check_fasta_seqs_lens(input_fasta_fp):
     input_fasta_fp:  input fasta filepath
     """
 
-    seq_lens = defaultdict(int)
-
-    input_fasta_f = open(input_fasta_fp, "U")
-
-    for label, seq in parse_fasta(input_fasta_f):
-        seq_lens[len(seq)] += 1
+    checker = SeqLengthsChecker()
+    check_fasta(input_fasta_fp, [checker])
 
-    input_fasta_f.close()
-
-    formatted_seq_lens = []
-
-    for curr_key in seq_lens:
-        formatted_seq_lens.append((seq_lens[curr_key], curr_key))
-
-    formatted_seq_lens.sort(reverse=True)
-
-    return formatted_seq_lens
+    return checker.results()
 
 
 def check_all_ids(fasta_labels,
@@ -401,7 +589,8 @@ def run_fasta_checks(input_fasta_fp,
                      same_seq_lens=False,
                      all_ids_found=False,
                      suppress_barcode_checks=False,
-                     suppress_primer_checks=False):
+                     suppress_primer_checks=False,
+                     processes=1):
     """ Returns dictionary of records for different fasta checks
 
     input_fasta_fp: fasta filepath
@@ -416,7 +605,8 @@ def run_fasta_checks(input_fasta_fp,
     suppress_barcode_checks=If True, will skip getting barcodes from mapping
      file and searching for these in sequences.
     suppress_primer_checks=If True, will skip getting primers from mapping
-     file and searching for these in sequences"""
+     file and searching for these in sequences
+    processes: number of parts of the fasta file to check at once"""
 
     # Stores details of various checks
     fasta_report = {}
@@ -425,39 +615,51 @@ def run_fasta_checks(input_fasta_fp,
     sample_ids, barcodes, linkerprimerseqs = get_mapping_details(mapping_fp,
                                                                  suppress_barcode_checks, suppress_primer_checks)
 
-    fasta_labels = get_fasta_labels(input_fasta_fp)
+    # run all of the checks of the fasta records in one pass of the file
+    dup_labels_checker = DuplicateLabelsChecker()
+    sample_id_checker = SampleIdLabelsChecker(sample_ids)
+    seq_contents_checker = SeqContentsChecker(barcodes, linkerprimerseqs)
+    checkers = [dup_labels_checker, sample_id_checker, seq_contents_checker]
+    if same_seq_lens:
+        seq_lens_checker = SeqLengthsChecker()
+        checkers.append(seq_lens_checker)
 
-    total_seq_count = len(fasta_labels)
+    total_seq_count = check_fasta(input_fasta_fp, checkers, processes)
 
     fasta_report['duplicate_labels'], fasta_report['duplicate_ids'] =\
-        get_dup_labels_perc(fasta_labels)
+        dup_labels_checker.results()
 
     fasta_report['invalid_labels'], fasta_report['nosample_ids_map'] =\
-        check_labels_sampleids(fasta_labels, sample_ids, total_seq_count)
+        sample_id_checker.results(total_seq_count)
 
     fasta_report['invalid_seq_chars'], fasta_report['barcodes_detected'],\
         fasta_report['linkerprimers_detected'],\
-        fasta_report['barcodes_at_start'] = check_fasta_seqs(input_fasta_fp,
-                                                             barcodes, linkerprimerseqs, total_seq_count)
+        fasta_report['barcodes_at_start'] =\
+        seq_contents_checker.results(total_seq_count)
+
+    # the remaining checks only need the SampleID part of each label
+    label_prefixes = sample_id_checker.label_prefixes
 
     if same_seq_lens:
-        fasta_report['same_seq_lens'] = check_fasta_seqs_lens(input_fasta_fp)
+        fasta_report['same_seq_lens'] = seq_lens_checker.results()
     else:
         fasta_report['same_seq_lens'] = False
 
     if all_ids_found:
-        fasta_report['all_ids_found'] = check_all_ids(fasta_labels, sample_ids)
+        fasta_report['all_ids_found'] = check_all_ids(label_prefixes,
+                                                     sample_ids)
     else:
         fasta_report['all_ids_found'] = False
 
     if tree_subset:
-        fasta_report['tree_subset'] = check_tree_subset(fasta_labels, tree_fp)
+        fasta_report['tree_subset'] = check_tree_subset(label_prefixes,
+                                                        tree_fp)
     else:
         fasta_report['tree_subset'] = False
 
     if tree_exact_match:
         fasta_report['tree_exact_match'] =\
-            check_tree_exact_match(fasta_labels, tree_fp)
+            check_tree_exact_match(label_prefixes, tree_fp)
     else:
         fasta_report['tree_exact_match'] = False
 
@@ -561,7 +763,8 @@ def validate_fasta(input_fasta_fp,
                    same_seq_lens=False,
                    all_ids_found=False,
                    suppress_barcode_checks=False,
-                   suppress_primer_checks=False):
+                   suppress_primer_checks=False,
+                   processes=1):
     """ Main function for validating demultiplexed fasta file
 
     input_fasta_fp: fasta filepath
@@ -578,15 +781,15 @@ def validate_fasta(input_fasta_fp,
      file and searching for these in sequences.
     suppress_primer_checks=If True, will skip getting primers from mapping
      file and searching for these in sequences
+    processes: number of parts of the fasta file to check at once
     """
 
-    # First test is valid fasta format, can't do other tests if file can't be
-    # parsed so will bail out here if invalid
-
-    verify_valid_fasta_format(input_fasta_fp)
+    # The fasta file is checked in a single pass, which raises a RecordError
+    # if it is not valid fasta format before any log is written
 
     fasta_report = run_fasta_checks(input_fasta_fp, mapping_fp, tree_fp,
                                     tree_subset, tree_exact_match, same_seq_lens, all_ids_found,
-                                    suppress_barcode_checks, suppress_primer_checks)
+                                    suppress_barcode_checks, suppress_primer_checks,
+                                    processes)
 
     write_log_file(output_dir, input_fasta_fp, fasta_report)
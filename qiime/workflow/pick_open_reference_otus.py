@@ -10,7 +10,9 @@ __version__ = "1.9.1-dev"
 __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
+from os import remove, rename
 from os.path import split, splitext, getsize, exists, abspath, join
+from random import random
 from shutil import copyfile, rmtree
 from numpy import inf
 from copy import deepcopy
@@ -18,16 +20,19 @@ from skbio.util import create_dir, remove_files
 from skbio.parse.sequences import parse_fasta
 from biom import load_table
 
-from qiime.util import (subsample_fasta, count_seqs_from_file)
+from qiime.fasta_index import (FastaIndex, fasta_index_suffix,
+                               parse_fasta_with_offsets, write_fasta_index)
 from qiime.filter import (filter_otus_from_otu_table,
                           get_seq_ids_from_fasta_file,
-                          filter_otus_from_otu_map)
+                          get_seq_ids_from_seq_id_file,
+                          filter_otu_map_lines)
 from qiime.workflow.util import (print_to_stdout,
                                  WorkflowLogger,
                                  generate_log_fp,
                                  log_input_md5s,
                                  get_params_str,
-                                 WorkflowError)
+                                 WorkflowError,
+                                 PythonStep)
 from qiime.util import write_biom_table
 from qiime.workflow.core_diversity_analyses import (format_index_link,
                                                     generate_index_page,
@@ -58,6 +63,113 @@ def final_repset_from_iteration_repsets_fps(repset_fasta_fps, final_repset_fp):
         final_repset_f.write('>%s\n%s\n' % record)
     final_repset_f.close()
 
+
+def write_failures_fasta(input_fasta_fp,
+                         index_fp,
+                         failures_list_fp=None,
+                         failures_fasta_fp=None,
+                         subsample_fasta_fp=None,
+                         percent_subsample=0.0):
+    """ Write, index and subsample the step 1 failures in a single pass
+
+        input_fasta_fp: the input to step 1. The sequences whose ids are
+         listed in failures_list_fp are written to failures_fasta_fp. If
+         failures_list_fp is None, input_fasta_fp is taken to be the
+         failures fasta file itself (e.g., if pre-computed step 1 failures
+         were provided), and it is only indexed and subsampled.
+        index_fp: a fasta index of the failures fasta file is written here,
+         so that the step 3 failures can later be read from it by offset
+         (see filter_failures_fasta)
+        subsample_fasta_fp: if provided, a random percent_subsample of the
+         failures are written here (as with qiime.util.subsample_fasta)
+
+        Returns the number of failures.
+    """
+    if failures_list_fp is not None:
+        failures = get_seq_ids_from_seq_id_file(open(failures_list_fp, 'U'))
+        failures_fasta_f = open(failures_fasta_fp, 'w')
+    else:
+        failures = None
+        failures_fasta_fp = input_fasta_fp
+    if subsample_fasta_fp is not None:
+        subsample_fasta_f = open(subsample_fasta_fp, 'w')
+
+    index = {}
+    num_failures = 0
+    offset = 0
+    input_fasta_f = open(input_fasta_fp, 'rb')
+    for label, seq, record_offset, record_length in \
+            parse_fasta_with_offsets(input_fasta_f):
+        seq_id = label.split()[0] if label else ''
+        record = '>%s\n%s\n' % (label, seq)
+        if failures is None:
+            index[seq_id] = (record_offset, record_length)
+        elif seq_id in failures:
+            failures_fasta_f.write(record)
+            index[seq_id] = (offset, len(record))
+            offset += len(record)
+        else:
+            continue
+        num_failures += 1
+        if subsample_fasta_fp is not None and random() < percent_subsample:
+            subsample_fasta_f.write(record)
+    input_fasta_f.close()
+    if failures is not None:
+        failures_fasta_f.close()
+    if subsample_fasta_fp is not None:
+        subsample_fasta_f.close()
+
+    write_fasta_index(index, failures_fasta_fp, index_fp)
+    return num_failures
+
+
+def filter_failures_fasta(failures_fasta_fp,
+                          failures_list_fp,
+                          output_fasta_fp,
+                          index_fp=None):
+    """ Write the records of failures_fasta_fp listed in failures_list_fp
+
+        Only the listed records are read from failures_fasta_fp, using the
+        index written by write_failures_fasta (at index_fp, or
+        <failures_fasta_fp>.idx by default). Records are written in the
+        order they appear in failures_fasta_fp.
+    """
+    seq_ids = get_seq_ids_from_seq_id_file(open(failures_list_fp, 'U'))
+    failures = FastaIndex(failures_fasta_fp, index_fp=index_fp)
+    output_fasta_f = open(output_fasta_fp, 'w')
+    for record in failures.iter_records(seq_ids):
+        output_fasta_f.write('>%s\n%s\n' % record)
+    output_fasta_f.close()
+    failures.close()
+
+
+def merge_and_filter_otu_maps(otu_map_fps,
+                              merged_otu_map_fp,
+                              filtered_otu_map_fp,
+                              min_otu_size):
+    """ Concatenate otu maps, and filter out otus with < min_otu_size seqs
+
+        Each of otu_map_fps is read once, and its lines are written to both
+        merged_otu_map_fp and (for otus with at least min_otu_size
+        sequences) filtered_otu_map_fp. Returns the set of otu ids in
+        filtered_otu_map_fp.
+    """
+    merged_otu_map_f = open(merged_otu_map_fp, 'w')
+
+    def merged_lines():
+        for otu_map_fp in otu_map_fps:
+            for line in open(otu_map_fp, 'U'):
+                merged_otu_map_f.write(line)
+                yield line
+
+    filtered_otu_map_f = open(filtered_otu_map_fp, 'w')
+    otus_to_keep = filter_otu_map_lines(merged_lines(),
+                                        filtered_otu_map_f,
+                                        min_otu_size)
+    filtered_otu_map_f.close()
+    merged_otu_map_f.close()
+    return otus_to_keep
+
 #####################
 # Start functions to port to new Qiime/qiime/workflow/util.py
 #####################
@@ -642,6 +754,7 @@ def pick_subsampled_open_reference_otus(input_fp,
         step1_dir = '%s/step1_otus' % output_dir
         create_dir(step1_dir)
         logger.write("Using pre-existing reference otu map and failures.\n\n")
+        write_step1_failures = False
     else:
         if prefilter_percent_id is not None:
             prefilter_dir = '%s/prefilter_otus/' % output_dir
@@ -695,16 +808,13 @@ def pick_subsampled_open_reference_otus(input_fp,
             refseqs_fp, parallel, params, logger)
         commands.append([('Pick Reference OTUs', step1_pick_otu_cmd)])
 
-        # Build the failures fasta file
+        # The failures fasta file is built below, in the same pass over the
+        # input that indexes and subsamples the failures
         step1_failures_list_fp = '%s/%s_failures.txt' % \
             (step1_dir, input_basename)
         step1_failures_fasta_fp = \
             '%s/failures.fasta' % step1_dir
-        step1_filter_fasta_cmd = 'filter_fasta.py -f %s -s %s -o %s' %\
-            (input_fp, step1_failures_list_fp, step1_failures_fasta_fp)
-
-        commands.append([('Generate full failures fasta file',
-                          step1_filter_fasta_cmd)])
+        write_step1_failures = True
 
         # Call the command handler on the list of commands
         command_handler(commands,
@@ -728,32 +838,51 @@ def pick_subsampled_open_reference_otus(input_fp,
     # name the final otu map
     merged_otu_map_fp = '%s/final_otu_map.txt' % output_dir
 
-    # count number of sequences in step 1 failures fasta file
-    with open(abspath(step1_failures_fasta_fp), 'U') as step1_failures_fasta_f:
-        num_failure_seqs, mean, std = count_seqs_from_file(step1_failures_fasta_f)
+    # Build the step 1 failures fasta file (unless it was provided),
+    # index it, count the failures, and subsample the failures to retain
+    # (roughly) the percent_subsample, all in a single pass over the input.
+    # The subsample is only used if steps 2 and 3 are run.
+    step1_failures_index_fp = \
+        '%s/failures.fasta%s' % (step1_dir, fasta_index_suffix)
+    step1_subsample_fasta_fp = '%s/subsampled_failures.fasta' % step1_dir
+    step1_failures_fasta_kwargs = {
+        'subsample_fasta_fp': abspath(step1_subsample_fasta_fp),
+        'percent_subsample': percent_subsample}
+    if write_step1_failures:
+        step1_failures_fasta_args = (abspath(input_fp),
+                                     abspath(step1_failures_index_fp))
+        step1_failures_fasta_kwargs['failures_list_fp'] = \
+            abspath(step1_failures_list_fp)
+        step1_failures_fasta_kwargs['failures_fasta_fp'] = \
+            abspath(step1_failures_fasta_fp)
+    else:
+        # the pre-computed failures fasta file is only indexed and
+        # subsampled
+        step1_failures_fasta_args = (abspath(step1_failures_fasta_fp),
+                                     abspath(step1_failures_index_fp))
+    num_failure_seqs = write_failures_fasta(*step1_failures_fasta_args,
+                                            **step1_failures_fasta_kwargs)
+    logger.write('# Write, index and subsample the step 1 failures using '
+                 'API\n%s\n\n' % PythonStep(
+                     'qiime.workflow.pick_open_reference_otus.'
+                     'write_failures_fasta',
+                     *step1_failures_fasta_args,
+                     **step1_failures_fasta_kwargs))
 
     # number of failures sequences is greater than the threshold,
     # continue to step 2,3 and 4
     run_step_2_and_3 = num_failure_seqs > minimum_failure_threshold
+    if not run_step_2_and_3:
+        remove(step1_subsample_fasta_fp)
 
     if run_step_2_and_3:
 
-        # Subsample the failures fasta file to retain (roughly) the
-        # percent_subsample
+        # Move the subsampled failures into the step 2 directory
         step2_dir = '%s/step2_otus/' % output_dir
         create_dir(step2_dir)
         step2_input_fasta_fp = \
                                '%s/subsampled_failures.fasta' % step2_dir
-        subsample_fasta(step1_failures_fasta_fp,
-                        step2_input_fasta_fp,
-                        percent_subsample)
-
-        logger.write('# Subsample the failures fasta file using API \n' +
-                 'python -c "import qiime; qiime.util.subsample_fasta' +
-                 '(\'%s\', \'%s\', \'%f\')\n\n"' % (abspath(step1_failures_fasta_fp),
-                                                    abspath(
-                                                        step2_input_fasta_fp),
-                                                    percent_subsample))
+        rename(step1_subsample_fasta_fp, step2_input_fasta_fp)
 
         # Prep the OTU picking command for the subsampled failures
         step2_cmd = pick_denovo_otus(step2_input_fasta_fp,
@@ -805,11 +934,15 @@ def pick_subsampled_open_reference_otus(input_fp,
         step4_dir = '%s/step4_otus/' % output_dir
         if run_step_2_and_3:
             step3_failures_fasta_fp = '%s/failures_failures.fasta' % step3_dir
-            step3_filter_fasta_cmd = 'filter_fasta.py -f %s -s %s -o %s' %\
-                (step1_failures_fasta_fp,
-                 step3_failures_list_fp, step3_failures_fasta_fp)
+            # this reads only the step 3 failures from the step 1 failures
+            # fasta file, using the index written with it
             commands.append([('Create fasta file of step3 failures',
-                            step3_filter_fasta_cmd)])
+                              PythonStep('qiime.workflow.pick_open_reference_otus.'
+                                         'filter_failures_fasta',
+                                         abspath(step1_failures_fasta_fp),
+                                         abspath(step3_failures_list_fp),
+                                         abspath(step3_failures_fasta_fp),
+                                         abspath(step1_failures_index_fp)))])
 
             failures_fp = step3_failures_fasta_fp
             failures_otus_fp = 'failures_failures_otus.txt'
@@ -829,32 +962,20 @@ def pick_subsampled_open_reference_otus(input_fp,
 
         step4_otu_map_fp = '%s/%s' % (step4_dir, failures_otus_fp)
         commands.append([('Pick de novo OTUs on %s failures' % failures_step, step4_cmd)])
+        otu_map_fps = [step1_otu_map_fp, step3_otu_map_fp, step4_otu_map_fp]
 
-        # Merge the otu maps, note that we are explicitly using the '>' operator
-        # otherwise passing the --force flag on the script interface would
-        # append the newly created maps to the map that was previously created
-        cat_otu_tables_cmd = 'cat %s %s %s > %s' %\
-            (step1_otu_map_fp, step3_otu_map_fp,
-             step4_otu_map_fp, merged_otu_map_fp)
-        commands.append([('Merge OTU maps', cat_otu_tables_cmd)])
         step4_repset_fasta_fp = '%s/step4_rep_set.fna' % step4_dir
         step4_rep_set_cmd = 'pick_rep_set.py -i %s -o %s -f %s' %\
             (step4_otu_map_fp, step4_repset_fasta_fp, failures_fp)
         commands.append(
             [('Pick representative set for subsampled failures', step4_rep_set_cmd)])
     else:
-        # Merge the otu maps, note that we are explicitly using the '>' operator
-        # otherwise passing the --force flag on the script interface would
-        # append the newly created maps to the map that was previously created
         if run_step_2_and_3:
             failures_fp = step3_failures_list_fp
         else:
             failures_fp = step1_failures_list_fp
             step3_otu_map_fp = ""
-
-        cat_otu_tables_cmd = 'cat %s %s > %s' %\
-            (step1_otu_map_fp, step3_otu_map_fp, merged_otu_map_fp)
-        commands.append([('Merge OTU maps', cat_otu_tables_cmd)])
+        otu_map_fps = [step1_otu_map_fp, step3_otu_map_fp]
 
         # Move the step 3 failures file to the top-level directory
         commands.append([('Move final failures file to top-level directory',
@@ -866,13 +987,16 @@ def pick_subsampled_open_reference_otus(input_fp,
                     close_logger_on_success=False)
     commands = []
 
-    otu_fp = merged_otu_map_fp
-    # Filter singletons from the otu map
+    # Merge the otu maps and filter singletons from the merged otu map.
+    # Both maps are written from scratch, so re-running with --force
+    # doesn't append to the maps that were previously created.
+    otu_map_fps = [abspath(fp) for fp in otu_map_fps if fp]
     otu_no_singletons_fp = '%s/final_otu_map_mc%d.txt' % (output_dir,
                                                           min_otu_size)
 
-    otus_to_keep = filter_otus_from_otu_map(
-        otu_fp,
+    otus_to_keep = merge_and_filter_otu_maps(
+        otu_map_fps,
+        merged_otu_map_fp,
         otu_no_singletons_fp,
         min_otu_size)
 
@@ -881,12 +1005,14 @@ def pick_subsampled_open_reference_otus(input_fp,
                         otu_no_singletons_fp,
                         _index_headers['otu_maps']))
 
-    logger.write('# Filter singletons from the otu map using API \n' +
-                 'python -c "import qiime; qiime.filter.filter_otus_from_otu_map' +
-                 '(\'%s\', \'%s\', \'%d\')"\n\n' % (abspath(otu_fp),
-                                                    abspath(
-                                                        otu_no_singletons_fp),
-                                                    min_otu_size))
+    logger.write('# Merge OTU maps and filter singletons from the otu map '
+                 'using API \n%s\n\n' % PythonStep(
+                     'qiime.workflow.pick_open_reference_otus.'
+                     'merge_and_filter_otu_maps',
+                     otu_map_fps,
+                     abspath(merged_otu_map_fp),
+                     abspath(otu_no_singletons_fp),
+                     min_otu_size))
 
     # make the final representative seqs file and a new refseqs file that
     # could be used in subsequent otu picking runs.
@@ -13,9 +13,20 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 import sys
-from os.path import join
+import imp
+from StringIO import StringIO
+from traceback import format_exc
+from multiprocessing import Pool
+from os import link, listdir, makedirs, remove, rename, stat, walk
+from os.path import (join, exists, isdir, isfile, abspath, relpath,
+                     dirname, samefile, splitext)
 from datetime import datetime
+from hashlib import md5
+from shlex import split as shlex_split
+from shutil import copy2, rmtree
+from tempfile import mkdtemp
 from cogent.util.misc import safe_md5
+from burrito.util import which
 from qiime.util import (qiime_system_call,
                         get_qiime_library_version)
 
@@ -104,37 +115,604 @@ def print_commands(commands,
 def call_commands_serially(commands,
                            status_update_callback,
                            logger,
-                           close_logger_on_success=True):
-    """Run list of commands, one after another """
+                           close_logger_on_success=True,
+                           result_cache=None,
+                           step_runner=None):
+    """Run list of commands, one after another
+
+    If result_cache (a WorkflowResultCache) is provided, steps whose
+    command, tool version and inputs match a previously cached step have
+    their outputs restored from the cache rather than being re-run.
+
+    If step_runner (a WorkflowStepRunner) is provided, it is used to run
+    each step, so that QIIME's Python steps can be run without starting a
+    new interpreter for each one.
+    """
+    if step_runner is not None:
+        system_call = step_runner.run
+    else:
+        system_call = run_workflow_step
     logger.write("Executing commands.\n\n")
     for c in commands:
         for e in c:
             status_update_callback('%s\n%s' % e)
             logger.write('# %s command \n%s\n\n' % e)
-            stdout, stderr, return_value = qiime_system_call(e[1])
-            if return_value != 0:
-                msg = "\n\n*** ERROR RAISED DURING STEP: %s\n" % e[0] +\
-                    "Command run was:\n %s\n" % e[1] +\
-                    "Command returned exit status: %d\n" % return_value +\
-                    "Stdout:\n%s\nStderr\n%s\n" % (stdout, stderr)
-                logger.write(msg)
-                logger.close()
-                raise WorkflowError(msg)
-            # in the no error case, we write commands' output to the log
-            # and also echo to this proc's stdout/stderr
+            if result_cache is not None:
+                stdout, stderr, return_value = result_cache.run(
+                    e[1], logger, system_call=system_call)
             else:
-                # write stdout and stderr to log file
-                logger.write("Stdout:\n%s\nStderr:\n%s\n" % (stdout, stderr))
-                # write stdout to stdout
-                if stdout:
-                    print stdout
-                # write stderr to stderr
-                if stderr:
-                    sys.stderr.write(stderr)
+                stdout, stderr, return_value = system_call(e[1])
+            _log_step_result(e, stdout, stderr, return_value, logger)
     if close_logger_on_success:
         logger.close()
 
 
+def _log_step_result(e, stdout, stderr, return_value, logger):
+    """Log the output of step e, raising a WorkflowError if it failed"""
+    if return_value != 0:
+        msg = "\n\n*** ERROR RAISED DURING STEP: %s\n" % e[0] +\
+            "Command run was:\n %s\n" % e[1] +\
+            "Command returned exit status: %d\n" % return_value +\
+            "Stdout:\n%s\nStderr\n%s\n" % (stdout, stderr)
+        logger.write(msg)
+        logger.close()
+        raise WorkflowError(msg)
+    # in the no error case, we write commands' output to the log
+    # and also echo to this proc's stdout/stderr
+    else:
+        # write stdout and stderr to log file
+        logger.write("Stdout:\n%s\nStderr:\n%s\n" % (stdout, stderr))
+        # write stdout to stdout
+        if stdout:
+            print stdout
+        # write stderr to stderr
+        if stderr:
+            sys.stderr.write(stderr)
+
+
+def _run_steps(steps):
+    """Pool.imap wrapper around run_workflow_step, running steps in turn
+
+    Returns (step, stdout, stderr, return_value) for each step that was run,
+    stopping after the first step that fails.
+    """
+    results = []
+    for e in steps:
+        stdout, stderr, return_value = run_workflow_step(e[1],
+                                                         in_process=True)
+        results.append((e, stdout, stderr, return_value))
+        if return_value != 0:
+            break
+    return results
+
+
+def call_commands_in_parallel(commands,
+                              status_update_callback,
+                              logger,
+                              close_logger_on_success=True,
+                              processes=2):
+    """Run list of commands, processes of them at a time
+
+    The steps of each item of commands are run one after another, but the
+    items are run concurrently in a pool of worker processes, so they must
+    not depend on each other. PythonSteps and calls to in_process_scripts
+    are run in the workers without starting a new interpreter. Steps are
+    logged in the order of commands, as call_commands_serially logs them.
+    """
+    logger.write("Executing commands.\n\n")
+    pool = Pool(processes)
+    try:
+        for results in pool.imap(_run_steps, commands):
+            for e, stdout, stderr, return_value in results:
+                status_update_callback('%s\n%s' % e)
+                logger.write('# %s command \n%s\n\n' % e)
+                _log_step_result(e, stdout, stderr, return_value, logger)
+    except:
+        # don't wait for the remaining commands once one has failed
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    if close_logger_on_success:
+        logger.close()
+
+
+# Commands that are never cached: cheap shell utilities whose side effects
+# (e.g., mv removing its source) can't be replayed by restoring outputs.
+_uncacheable_commands = set(['mv', 'cp', 'cat', 'rm', 'mkdir', 'ln',
+                             'python', 'cd', 'echo'])
+_shell_operators = set(['>', '>>', '<', '|', '||', '&&', ';', '&'])
+
+
+# QIIME scripts that are safe to run in-process by calling their main()
+# function. Scripts are added here (or with register_in_process_script)
+# when they don't depend on process-level state such as the working
+# directory or signal handlers.
+in_process_scripts = set(['alpha_diversity.py',
+                          'beta_diversity.py',
+                          'collate_alpha.py',
+                          'consensus_tree.py',
+                          'extract_barcodes.py',
+                          'filter_fasta.py',
+                          'filter_samples_from_otu_table.py',
+                          'make_otu_table.py',
+                          'multiple_rarefactions.py',
+                          'multiple_rarefactions_even_depth.py',
+                          'pick_rep_set.py',
+                          'principal_coordinates.py',
+                          'single_rarefaction.py',
+                          'tree_compare.py',
+                          'upgma_cluster.py'])
+
+# script name -> module, so each script is imported at most once per
+# process
+_script_modules = {}
+
+
+def register_in_process_script(script_name):
+    """Allow script_name to be run in-process by WorkflowStepRunner"""
+    in_process_scripts.add(script_name)
+
+
+def _import_function(function_name):
+    """Return the object named by a dotted path, e.g. 'qiime.util.f'"""
+    module_name, attr = function_name.rsplit('.', 1)
+    module = __import__(module_name, fromlist=[attr])
+    return getattr(module, attr)
+
+
+def _call_capturing_output(f, *args, **kwargs):
+    """Call f, returning (stdout, stderr, return_value)
+
+    Output written to sys.stdout and sys.stderr by f is captured, and
+    SystemExit and other exceptions are converted to non-zero return
+    values, as if f had been run as a separate process.
+    """
+    stdout, stderr = StringIO(), StringIO()
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        try:
+            f(*args, **kwargs)
+            return_value = 0
+        except SystemExit as e:
+            if e.code is None:
+                return_value = 0
+            elif isinstance(e.code, int):
+                return_value = e.code
+            else:
+                stderr.write('%s\n' % e.code)
+                return_value = 1
+        except Exception:
+            stderr.write(format_exc())
+            return_value = 1
+    finally:
+        sys.stdout, sys.stderr = old_stdout, old_stderr
+    return stdout.getvalue(), stderr.getvalue(), return_value
+
+
+class PythonStep(object):
+
+    """A workflow step that calls a QIIME library function in-process
+
+    PythonSteps can be included in the commands passed to a command
+    handler in place of a command string. The function is identified by
+    its dotted path (e.g., 'qiime.util.subsample_fasta') so that steps can
+    be sent to worker processes. When a PythonStep is printed or logged,
+    it is shown as the equivalent ``python -c`` command.
+    """
+
+    def __init__(self, function_name, *args, **kwargs):
+        self.function_name = function_name
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        args = [repr(a) for a in self.args]
+        args.extend(['%s=%r' % (k, v) for k, v in sorted(self.kwargs.items())])
+        return 'python -c "import qiime; %s(%s)"' % (self.function_name,
+                                                    ', '.join(args))
+
+    def run(self):
+        """Call the function, returning (stdout, stderr, return_value)"""
+        try:
+            f = _import_function(self.function_name)
+        except (ImportError, AttributeError):
+            return '', format_exc(), 1
+        return _call_capturing_output(f, *self.args, **self.kwargs)
+
+
+def _get_in_process_script_tokens(command):
+    """Return the tokens of command if it can be run in-process, else None
+    """
+    if isinstance(command, PythonStep):
+        return None
+    tokens = shlex_split(command)
+    if len(tokens) == 0 or tokens[0] not in in_process_scripts:
+        return None
+    for t in tokens:
+        if t in _shell_operators:
+            return None
+    return tokens
+
+
+def _load_script(script_name):
+    """Return the module for the QIIME script script_name, or None
+
+    None is returned if script_name can't be found in PATH.
+    """
+    try:
+        return _script_modules[script_name]
+    except KeyError:
+        pass
+    script_fp = which(script_name)
+    if script_fp is None:
+        return None
+    module_name = '_qiime_script_%s' % splitext(script_name)[0]
+    module = imp.load_source(module_name, script_fp)
+    _script_modules[script_name] = module
+    return module
+
+
+def _run_script_in_process(tokens):
+    """Run a QIIME script's main function with tokens as sys.argv"""
+    script_name = tokens[0]
+    module = _load_script(script_name)
+    if module is None:
+        return '', 'Could not find %s in PATH.\n' % script_name, 127
+    main = module.main
+    old_argv = sys.argv
+    sys.argv = tokens
+    try:
+        return _call_capturing_output(main)
+    finally:
+        sys.argv = old_argv
+
+
+def run_workflow_step(command, in_process=False):
+    """Run a workflow step, returning (stdout, stderr, return_value)
+
+    PythonSteps are always run in the current process. If in_process is
+    True, commands that call one of in_process_scripts are also run in the
+    current process; all other commands are run as subprocesses.
+    """
+    if isinstance(command, PythonStep):
+        return command.run()
+    if in_process:
+        tokens = _get_in_process_script_tokens(command)
+        if tokens is not None:
+            return _run_script_in_process(tokens)
+    return qiime_system_call(command)
+
+
+class WorkflowStepRunner(object):
+
+    """Runs workflow steps without starting a new interpreter for each
+
+    PythonSteps and calls to in_process_scripts are run in the current
+    process (if processes is 0) or in a persistent pool of worker
+    processes (otherwise), which keeps QIIME's imports warm across steps
+    while isolating the workflow from the steps' memory use and any
+    state they modify. External tools are always run as subprocesses.
+    """
+
+    def __init__(self, processes=0):
+        if processes > 0:
+            self._pool = Pool(processes)
+        else:
+            self._pool = None
+
+    def run(self, command):
+        """Run command, returning (stdout, stderr, return_value)"""
+        if self._pool is None:
+            return run_workflow_step(command, in_process=True)
+        if (isinstance(command, PythonStep) or
+                _get_in_process_script_tokens(command) is not None):
+            return self._pool.apply(run_workflow_step, (command, True))
+        return qiime_system_call(command)
+
+    def close(self):
+        """Shut down the worker pool, if any"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def _link_or_copy(src, dest):
+    """Hard-link src to dest, falling back to a copy across devices"""
+    if exists(dest):
+        remove(dest)
+    try:
+        link(src, dest)
+    except OSError:
+        copy2(src, dest)
+
+
+def _files_under(dir_fp):
+    """Return sorted relative paths of all files under dir_fp"""
+    result = []
+    for root, dirs, files in walk(dir_fp):
+        for f in files:
+            result.append(relpath(join(root, f), dir_fp))
+    result.sort()
+    return result
+
+
+def _digest_dir(dir_fp):
+    """Return an md5 hex digest of a directory's file names and contents"""
+    result = md5()
+    for rel_fp in _files_under(dir_fp):
+        result.update(rel_fp)
+        result.update(safe_md5(open(join(dir_fp, rel_fp), 'rb')).hexdigest())
+    return result.hexdigest()
+
+
+def _file_stat(fp):
+    """Return (size, mtime) for fp"""
+    s = stat(fp)
+    return s.st_size, s.st_mtime
+
+
+def _snapshot_dir(dir_fp):
+    """Return {relative path: (size, mtime)} for all files under dir_fp"""
+    result = {}
+    for rel_fp in _files_under(dir_fp):
+        result[rel_fp] = _file_stat(join(dir_fp, rel_fp))
+    return result
+
+
+def _get_output_options(script_name):
+    """Return the option strings that name outputs of script_name
+
+    For QIIME scripts, these are the options whose type is new_filepath,
+    new_dirpath or new_path. None is returned for other commands, or if
+    the script can't be loaded.
+    """
+    if not script_name.endswith('.py'):
+        return None
+    try:
+        script_info = _load_script(script_name).script_info
+    except Exception:
+        return None
+    options = (script_info.get('required_options', []) +
+               script_info.get('optional_options', []))
+    result = set()
+    for option in options:
+        if option.type is not None and option.type.startswith('new_'):
+            result.update(option._short_opts)
+            result.update(option._long_opts)
+    return result
+
+
+def _is_output_option(option, output_options):
+    """Return True if option names an output
+
+    output_options is the result of _get_output_options; if it is None,
+    -o and long options starting with --output are assumed to name outputs.
+    """
+    option = option.split('=', 1)[0]
+    if output_options is None:
+        return option == '-o' or option.startswith('--output')
+    return option in output_options
+
+
+class WorkflowResultCache(object):
+
+    """Content-addressed cache of workflow step outputs
+
+    Each step is keyed on its command line (with output paths abstracted
+    away), the QIIME library version, the md5 of the executable that is
+    run, and the md5s of all input files and directories named on the
+    command line. Values of output options (for QIIME scripts, options of
+    type new_filepath, new_dirpath or new_path; otherwise -o and
+    --output*) are always treated as outputs, even if they already exist
+    (e.g., from an earlier run), and are never hashed. Other tokens naming
+    existing files are treated as inputs, other tokens naming paths that
+    don't exist yet are treated as outputs, and other tokens naming
+    existing directories are treated as both: their contents are hashed
+    as inputs, and any files that are new or modified after the step runs
+    are treated as outputs. Only files that are new or modified after the
+    step runs are stored from existing output paths.
+
+    Outputs are hard-linked into the cache directory when a step
+    completes, and hard-linked back out when a later step has a matching
+    key, so restoring a cached step costs a few link calls. Note that
+    since cached files share inodes with the workflow's outputs, files
+    must not be modified in place after they are written.
+
+    Commands that use shell operators, inline code (tokens containing
+    whitespace, as in ``python -c "..."``), or simple shell utilities
+    such as ``mv`` are always run, since their inputs and side effects
+    can't be determined from the command line.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = abspath(cache_dir)
+        if not exists(self.cache_dir):
+            makedirs(self.cache_dir)
+        self._executable_md5s = {}
+
+    def _executable_md5(self, name):
+        try:
+            return self._executable_md5s[name]
+        except KeyError:
+            pass
+        fp = which(name)
+        if fp is None or not isfile(fp):
+            result = 'NA'
+        else:
+            result = safe_md5(open(fp, 'rb')).hexdigest()
+        self._executable_md5s[name] = result
+        return result
+
+    def is_cacheable(self, tokens):
+        """Return True if a tokenized command can be cached"""
+        if len(tokens) == 0 or tokens[0] in _uncacheable_commands:
+            return False
+        for t in tokens:
+            if t in _shell_operators or len(t.split()) != 1:
+                return False
+        return True
+
+    def get_step_key(self, tokens):
+        """Return (key, output_tokens, dir_tokens) for a tokenized command
+
+        output_tokens and dir_tokens are lists of token indices for tokens
+        that may name outputs (i.e., values of output options, and other
+        tokens that don't exist yet) and for existing input directories,
+        respectively.
+        """
+        key = md5()
+        key.update(get_qiime_library_version())
+        key.update(self._executable_md5(tokens[0]))
+        output_options = _get_output_options(tokens[0])
+        output_tokens = []
+        dir_tokens = []
+        is_output_value = False
+        for i, t in enumerate(tokens):
+            if is_output_value:
+                # the value of an output option: never hashed, so outputs
+                # left by an earlier run don't change the key
+                output_tokens.append(i)
+                key.update('\t<output>')
+                is_output_value = False
+            elif i == 0:
+                key.update('\t%s' % t)
+            elif t.startswith('-') and _is_output_option(t, output_options):
+                key.update('\t%s' % t)
+                # values passed as --output_dir=x are left in the key as-is
+                is_output_value = '=' not in t
+            elif isdir(t):
+                dir_tokens.append(i)
+                key.update('\t<dir:%s>' % _digest_dir(t))
+            elif isfile(t):
+                key.update('\t<file:%s>' %
+                           safe_md5(open(t, 'rb')).hexdigest())
+            elif t.startswith('-'):
+                key.update('\t%s' % t)
+            else:
+                # any other token could name an output. Only tokens that
+                # are clearly paths are abstracted away in the key, so
+                # values like metric names always remain part of it.
+                output_tokens.append(i)
+                if '/' in t:
+                    key.update('\t<output>')
+                else:
+                    key.update('\t%s' % t)
+        return key.hexdigest(), output_tokens, dir_tokens
+
+    def _entry_dir(self, key):
+        return join(self.cache_dir, key)
+
+    def restore(self, key, tokens):
+        """Restore cached outputs for key; return (stdout, stderr) or None
+        """
+        entry_dir = self._entry_dir(key)
+        if not exists(join(entry_dir, 'complete')):
+            return None
+        for slot in listdir(join(entry_dir, 'outputs')):
+            cached_fp = join(entry_dir, 'outputs', slot)
+            dest_fp = tokens[int(slot)]
+            if isfile(cached_fp):
+                if dirname(dest_fp) and not exists(dirname(dest_fp)):
+                    makedirs(dirname(dest_fp))
+                _link_or_copy(cached_fp, dest_fp)
+            else:
+                for rel_fp in _files_under(cached_fp):
+                    fp = join(dest_fp, rel_fp)
+                    if not exists(dirname(fp)):
+                        makedirs(dirname(fp))
+                    _link_or_copy(join(cached_fp, rel_fp), fp)
+        stdout = open(join(entry_dir, 'stdout.txt')).read()
+        stderr = open(join(entry_dir, 'stderr.txt')).read()
+        return stdout, stderr
+
+    def store(self, key, tokens, output_tokens, snapshots, stdout, stderr):
+        """Hard-link the outputs of a completed step into the cache
+
+        snapshots maps the indices of tokens that named existing paths
+        before the step ran to their _file_stat (for files) or
+        _snapshot_dir (for directories), so that only new or modified
+        files are stored.
+        """
+        entry_dir = self._entry_dir(key)
+        if exists(entry_dir):
+            return
+        # Build the entry in a temporary directory and move it into place
+        # so an interrupted store never leaves a partial entry behind.
+        tmp_dir = mkdtemp(dir=self.cache_dir, prefix='tmp_')
+        outputs_dir = join(tmp_dir, 'outputs')
+        makedirs(outputs_dir)
+        to_store = sorted(set(output_tokens) | set(snapshots))
+        for i in to_store:
+            fp = tokens[i]
+            snapshot = snapshots.get(i)
+            slot_fp = join(outputs_dir, str(i))
+            if not exists(fp):
+                continue
+            if isfile(fp):
+                if snapshot != _file_stat(fp):
+                    _link_or_copy(fp, slot_fp)
+                continue
+            for rel_fp, file_stat in _snapshot_dir(fp).items():
+                if snapshot is not None and snapshot.get(rel_fp) == file_stat:
+                    # existed before the step ran, so not an output
+                    continue
+                cached_fp = join(slot_fp, rel_fp)
+                if not exists(dirname(cached_fp)):
+                    makedirs(dirname(cached_fp))
+                _link_or_copy(join(fp, rel_fp), cached_fp)
+        open(join(tmp_dir, 'stdout.txt'), 'w').write(stdout)
+        open(join(tmp_dir, 'stderr.txt'), 'w').write(stderr)
+        open(join(tmp_dir, 'complete'), 'w').close()
+        try:
+            rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process stored the same step first
+            rmtree(tmp_dir)
+
+    def run(self, command, logger=None, system_call=None):
+        """Run command, or restore its outputs from the cache
+
+        system_call is the function used to run the command if it isn't
+        cached (default: run_workflow_step). Returns (stdout, stderr,
+        return_value), as qiime_system_call.
+        """
+        if system_call is None:
+            system_call = run_workflow_step
+        tokens = shlex_split(str(command))
+        if (len(tokens) == 3 and tokens[0] == 'mv' and exists(tokens[1]) and
+                exists(tokens[2]) and samefile(tokens[1], tokens[2])):
+            # a restored output is being renamed onto a link to the same
+            # cached file, left by an earlier run. mv refuses to do this,
+            # so just remove the source.
+            remove(tokens[1])
+            return '', '', 0
+        if not self.is_cacheable(tokens):
+            return system_call(command)
+        key, output_tokens, dir_tokens = self.get_step_key(tokens)
+        cached = self.restore(key, tokens)
+        if cached is not None:
+            if logger is not None:
+                logger.write("Restored outputs from cache entry %s\n\n" %
+                             key)
+            return cached[0], cached[1], 0
+        snapshots = {}
+        for i in output_tokens + dir_tokens:
+            if isdir(tokens[i]):
+                snapshots[i] = _snapshot_dir(tokens[i])
+            elif isfile(tokens[i]):
+                snapshots[i] = _file_stat(tokens[i])
+        stdout, stderr, return_value = system_call(command)
+        if return_value == 0:
+            self.store(key, tokens, output_tokens, snapshots,
+                       stdout, stderr)
+        return stdout, stderr, return_value
+
+
 def print_to_stdout(s):
     print s
 
@@ -13,13 +13,15 @@ __email__ = "gregcaporaso@gmail.com"
 from qiime.util import parse_command_line_parameters, get_options_lookup
 from qiime.util import make_option
 from os import makedirs
+from functools import partial
 from qiime.util import load_qiime_config
 from qiime.parse import parse_qiime_parameters
 from qiime.workflow.util import (print_commands,
                                  call_commands_serially,
                                  print_to_stdout,
                                  no_status_updates,
-                                 validate_and_set_jobs_to_start)
+                                 validate_and_set_jobs_to_start,
+                                 WorkflowStepRunner)
 from qiime.workflow.downstream import run_alpha_rarefaction
 
 qiime_config = load_qiime_config()
@@ -78,6 +80,7 @@ script_info['optional_options'] = [
                 help='the upper limit of rarefaction depths ' +
                 '[default: median sequence/sample count]'),
     options_lookup['jobs_to_start_workflow'],
+    options_lookup['step_workers_workflow'],
     make_option('--retain_intermediate_files', action='store_true', help='retain '
                 'intermediate files: rarefied OTU tables (rarefaction) and alpha diversity '
                 'results (alpha_div). By default these will be erased [default: %default]',
@@ -133,8 +136,13 @@ def main():
             option_parser.error("Output directory already exists. Please choose"
                                 " a different directory, or force overwrite with -f.")
 
+    step_runner = None
     if print_only:
         command_handler = print_commands
+    elif opts.step_workers is not None:
+        step_runner = WorkflowStepRunner(opts.step_workers)
+        command_handler = partial(call_commands_serially,
+                                  step_runner=step_runner)
     else:
         command_handler = call_commands_serially
 
@@ -143,19 +151,23 @@ def main():
     else:
         status_update_callback = no_status_updates
 
-    run_alpha_rarefaction(otu_table_fp=otu_table_fp,
-                          mapping_fp=mapping_fp,
-                          output_dir=output_dir,
-                          command_handler=command_handler,
-                          params=params,
-                          qiime_config=qiime_config,
-                          tree_fp=tree_fp,
-                          num_steps=num_steps,
-                          parallel=parallel,
-                          min_rare_depth=min_rare_depth,
-                          max_rare_depth=max_rare_depth,
-                          status_update_callback=status_update_callback,
-                          retain_intermediate_files=retain_intermediate_files)
+    try:
+        run_alpha_rarefaction(otu_table_fp=otu_table_fp,
+                              mapping_fp=mapping_fp,
+                              output_dir=output_dir,
+                              command_handler=command_handler,
+                              params=params,
+                              qiime_config=qiime_config,
+                              tree_fp=tree_fp,
+                              num_steps=num_steps,
+                              parallel=parallel,
+                              min_rare_depth=min_rare_depth,
+                              max_rare_depth=max_rare_depth,
+                              status_update_callback=status_update_callback,
+                              retain_intermediate_files=retain_intermediate_files)
+    finally:
+        if step_runner is not None:
+            step_runner.close()
 
 if __name__ == "__main__":
     main()
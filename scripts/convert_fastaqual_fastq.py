@@ -13,7 +13,7 @@ __email__ = "adam.robbinspianka@colorado.edu"
 
 from qiime.util import make_option, create_dir,\
     parse_command_line_parameters, get_options_lookup
-from qiime.convert_fastaqual_fastq import convert_fastaqual_fastq
+from qiime.convert_fastaqual_fastq import convert_fastaqual_fastq_files
 
 options_lookup = get_options_lookup()
 
@@ -28,7 +28,9 @@ assumed to follow immediately after the sequence with which they are \
 associated. The output FASTQ file will be generated in the specified output \
 directory with the same name as the input FASTA file, suffixed with '.fastq'. \
 A FASTQ file will be split into FASTA and QUAL files, and generated in the \
-designated output directory."
+designated output directory. Several input files (and matching QUAL \
+files) can be passed as comma-separated lists, and converted in parallel \
+with -O."
 
 script_info['script_usage'] = []
 script_info['script_usage'].append(("Example:",
@@ -38,19 +40,31 @@ script_info['script_usage'].append(("Example:",
                                     "Using input seqs.fastq generate fasta and qual files in fastaqual \
 directory:", "%prog -c fastq_to_fastaqual \
 -f seqs.fastq -o fastaqual"))
+script_info['script_usage'].append(("Example:",
+                                    "Using the input files seqs1.fna and \
+seqs2.fna with seqs1.qual and seqs2.qual, generate seqs1.fastq and \
+seqs2.fastq in the fastq_files directory, converting both files at once:",
+                                    "%prog -f seqs1.fna,seqs2.fna \
+-q seqs1.qual,seqs2.qual -o fastq_files/ -O 2"))
+script_info['script_usage'].append(("Example:",
+                                    "Using input read store seqs.qrs generate fasta and qual files in \
+fastaqual directory:", "%prog -c read_store_to_fastaqual \
+-f seqs.qrs -o fastaqual"))
 script_info['output_description'] = """Outputs a complete or minimal FASTQ \
 file, which omits the redundant sequence label on the quality scores, or splits\
  FASTQ file into matching FASTA/QUAL files."""
 
 script_info['required_options'] = [
     make_option('-f', '--fasta_file_path',
-                type='existing_filepath',
-                help='Input FASTA or FASTQ file.')]
+                type='existing_filepaths',
+                help='Input FASTA, FASTQ or read store file(s), '
+                'comma-separated if more than one.')]
 
 script_info['optional_options'] = [
 
-    make_option('-q', '--qual_file_path', type='existing_filepath',
-                help='Required input QUAL file if converting to FASTQ.',
+    make_option('-q', '--qual_file_path', type='existing_filepaths',
+                help='Required input QUAL file(s) if converting to FASTQ, '
+                'in the same order as the FASTA files.',
                 default=None),
 
     make_option('-o', '--output_dir',
@@ -59,9 +73,14 @@ script_info['optional_options'] = [
                 'exist. [default: %default]', default="."),
 
     make_option('-c', '--conversion_type',
-                type='choice', choices=['fastaqual_to_fastq', 'fastq_to_fastaqual'],
-                help='type of conversion: fastaqual_to_fastq or ' +
-                'fastq_to_fastaqual [default: %default]', default=
+                type='choice', choices=['fastaqual_to_fastq', 'fastq_to_fastaqual',
+                                        'read_store_to_fastaqual',
+                                        'read_store_to_fastq'],
+                help='type of conversion: fastaqual_to_fastq, ' +
+                'fastq_to_fastaqual, or read_store_to_fastaqual or ' +
+                'read_store_to_fastq to convert a read store written by ' +
+                'split_libraries_fastq.py --write_read_store (passed as -f) ' +
+                '[default: %default]', default=
                 "fastaqual_to_fastq"),
 
     make_option('-a', '--ascii_increment',
@@ -86,7 +105,11 @@ script_info['optional_options'] = [
                 action='store_true',
                 help='Create multiple FASTQ files, one for each sample, or ' +
                 'create multiple matching FASTA/QUAL for each sample. ' +
-                '[default=%default]', default=False)]
+                '[default=%default]', default=False),
+
+    make_option('-O', '--jobs_to_start', type='int',
+                help='Number of input files to convert at once, in '
+                'separate processes. [default: %default]', default=1)]
 
 script_info['version'] = __version__
 
@@ -102,12 +125,23 @@ def main():
     full_fasta_headers = opts.full_fasta_headers
     multiple_output_files = opts.multiple_output_files
     conversion_type = opts.conversion_type
+    jobs_to_start = opts.jobs_to_start
+
+    if jobs_to_start < 1:
+        option_parser.error("--jobs_to_start must be greater than zero. "
+                            "You provided %d." % jobs_to_start)
+    if qual_file_path is not None and \
+            len(qual_file_path) != len(fasta_file_path):
+        option_parser.error("The same number of FASTA (-f) and QUAL (-q) "
+                            "files must be provided.")
 
     create_dir(output_dir)
 
-    convert_fastaqual_fastq(fasta_file_path, qual_file_path, conversion_type,
-                            output_dir, multiple_output_files, ascii_increment, full_fastq,
-                            full_fasta_headers)
+    convert_fastaqual_fastq_files(fasta_file_path, qual_file_path,
+                                  conversion_type, output_dir,
+                                  multiple_output_files, ascii_increment,
+                                  full_fastq, full_fasta_headers,
+                                  jobs_to_start)
 
 if __name__ == "__main__":
     main()
@@ -12,6 +12,7 @@ __email__ = "gregcaporaso@gmail.com"
 
 from qiime.util import make_option
 from os import makedirs
+from functools import partial
 from qiime.util import (load_qiime_config,
                         parse_command_line_parameters,
                         get_options_lookup,
@@ -22,7 +23,9 @@ from qiime.workflow.util import (print_commands,
                                  print_to_stdout,
                                  no_status_updates,
                                  validate_and_set_jobs_to_start,
-                                 print_commands)
+                                 print_commands,
+                                 WorkflowResultCache,
+                                 WorkflowStepRunner)
 from qiime.workflow.core_diversity_analyses import run_core_diversity_analyses
 
 qiime_config = load_qiime_config()
@@ -112,7 +115,17 @@ script_info['optional_options'] = [
                 help='Don\'t fail if output directory exists, but attempt to recover ' +
                 'from the failed run. [default: %default]',
                 default=False),
-    options_lookup['jobs_to_start_workflow']
+    make_option('--cache_dir', type='new_dirpath', default=None,
+                help='Directory in which to cache the outputs of each step. '
+                'When this workflow (or another run using the same cache '
+                'directory) encounters a step whose command, inputs and '
+                'tool version match a cached step, the cached outputs are '
+                'hard-linked into place instead of re-running the step. '
+                'For example, re-running with a different plotting '
+                'parameter will not recompute rarefaction, distance '
+                'matrices or PCoA. [default: %default; no caching]'),
+    options_lookup['jobs_to_start_workflow'],
+    options_lookup['step_workers_workflow']
 ]
 script_info['version'] = __version__
 
@@ -169,34 +182,46 @@ def main():
     # isn't trying to recover from a failed run, raise an error.
     create_dir(output_dir, fail_on_exist=not opts.recover_from_failure)
 
+    step_runner = None
     if print_only:
         command_handler = print_commands
     else:
-        command_handler = call_commands_serially
+        handler_kwargs = {}
+        if opts.cache_dir is not None:
+            handler_kwargs['result_cache'] = \
+                WorkflowResultCache(opts.cache_dir)
+        if opts.step_workers is not None:
+            step_runner = WorkflowStepRunner(opts.step_workers)
+            handler_kwargs['step_runner'] = step_runner
+        command_handler = partial(call_commands_serially, **handler_kwargs)
 
     if verbose:
         status_update_callback = print_to_stdout
     else:
         status_update_callback = no_status_updates
 
-    run_core_diversity_analyses(
-        biom_fp=input_biom_fp,
-        mapping_fp=mapping_fp,
-        sampling_depth=sampling_depth,
-        output_dir=output_dir,
-        qiime_config=load_qiime_config(),
-        command_handler=command_handler,
-        tree_fp=tree_fp,
-        params=params,
-        categories=categories,
-        arare_min_rare_depth=10,
-        arare_num_steps=10,
-        parallel=parallel,
-        suppress_taxa_summary=suppress_taxa_summary,
-        suppress_beta_diversity=suppress_beta_diversity,
-        suppress_alpha_diversity=suppress_alpha_diversity,
-        suppress_group_significance=suppress_group_significance,
-        status_update_callback=status_update_callback)
+    try:
+        run_core_diversity_analyses(
+            biom_fp=input_biom_fp,
+            mapping_fp=mapping_fp,
+            sampling_depth=sampling_depth,
+            output_dir=output_dir,
+            qiime_config=load_qiime_config(),
+            command_handler=command_handler,
+            tree_fp=tree_fp,
+            params=params,
+            categories=categories,
+            arare_min_rare_depth=10,
+            arare_num_steps=10,
+            parallel=parallel,
+            suppress_taxa_summary=suppress_taxa_summary,
+            suppress_beta_diversity=suppress_beta_diversity,
+            suppress_alpha_diversity=suppress_alpha_diversity,
+            suppress_group_significance=suppress_group_significance,
+            status_update_callback=status_update_callback)
+    finally:
+        if step_runner is not None:
+            step_runner.close()
 
 if __name__ == "__main__":
     main()
@@ -22,8 +22,11 @@ script_info['script_usage'] = [
      "Count the sequences in a fasta file and write results to stdout.",
      "%prog -i in.fasta"),
     ("",
-     "Count the sequences in a fasta file and a fastq file and write results to file. Note that fastq files can only be processed if they end with .fastq -- all other files are assumed to be fasta.",
+     "Count the sequences in a fasta file and a fastq file and write results to file. Note that fastq files can only be processed if they end with .fastq or .fq (optionally followed by .gz) -- all other files are assumed to be fasta. Gzipped files are decompressed as they are read.",
      "%prog -i in1.fasta,in2.fastq -o seq_counts.txt"),
+    ("",
+     "Count the sequences in a read store written by split_libraries_fastq.py --write_read_store. Read stores must end with .qrs, and are counted without decompressing the reads.",
+     "%prog -i seqs.qrs"),
     ("",
      "Count the sequences all .fasta files in current directory and write results to stdout. Note that -i option must be quoted.",
      "%prog -i \"*.fasta\"")]
@@ -38,7 +41,9 @@ script_info['optional_options'] = [
                 help='the output filepath [default: write to stdout]'),
     make_option('--suppress_errors', action='store_true',
                 help='Suppress warnings about missing files [default: %default]',
-                default=False)
+                default=False),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+                help='Number of files to count at once [default: %default]')
 ]
 script_info['version'] = __version__
 
@@ -78,7 +83,7 @@ def main():
     output_fp = opts.output_fp
 
     count_data, total, inaccessible_filepaths = count_seqs_in_filepaths(
-        input_fps)
+        input_fps, processes=opts.jobs_to_start)
     r = format_output(
         count_data,
         total,
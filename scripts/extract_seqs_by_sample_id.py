@@ -11,11 +11,14 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 
+from os.path import exists
 from skbio.parse.sequences import parse_fasta
 from qiime.util import parse_command_line_parameters, get_options_lookup
 from qiime.util import make_option
 from qiime.util import extract_seqs_by_sample_id
 from qiime.parse import parse_mapping_file
+from qiime.fasta_index import (FastaIndex, fasta_index_suffix, SampleIndex,
+                               sample_index_is_current)
 from qiime.filter import (parse_metadata_state_descriptions,
                           get_sample_ids)
 
@@ -56,7 +59,9 @@ script_info['optional_options'] = [
                 help="comma-separated sample_ids to include in output fasta file" +
                 " (or exclude if --negate), or string describing mapping file states" +
                 " defining sample ids (mapping_fp must be provided for the latter)"),
-    options_lookup['mapping_fp']]
+    options_lookup['mapping_fp'],
+    options_lookup['save_fasta_index'],
+    options_lookup['sample_index_fp']]
 script_info['version'] = __version__
 
 
@@ -88,8 +93,26 @@ def main():
         # lot of time is spent
         print "Extracting samples: %s" % ', '.join(sample_ids)
 
+    if (opts.sample_index_fp and
+            not sample_index_is_current(input_fasta_fp,
+                                        opts.sample_index_fp)):
+        option_parser.error(
+            '%s is not an up-to-date sample index for %s. Rebuild it, or '
+            'run without --sample_index_fp.' %
+            (opts.sample_index_fp, input_fasta_fp))
+
     try:
-        seqs = parse_fasta(open(input_fasta_fp))
+        if (opts.sample_index_fp or
+                sample_index_is_current(input_fasta_fp)):
+            # only read the byte ranges holding the requested samples
+            seqs = SampleIndex(input_fasta_fp, opts.sample_index_fp)
+        elif (opts.save_fasta_index or
+                exists(input_fasta_fp + fasta_index_suffix)):
+            # only read the sequences from the requested samples
+            seqs = FastaIndex(input_fasta_fp,
+                              save_index=opts.save_fasta_index)
+        else:
+            seqs = parse_fasta(open(input_fasta_fp))
     except IOError:
         option_parser.error(
             'Cannot open %s. Does it exist? Do you have read access?' %
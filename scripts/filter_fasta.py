@@ -11,9 +11,13 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 
+from os.path import exists
 from qiime.util import make_option
 from qiime.util import parse_command_line_parameters, get_options_lookup
 from qiime.parse import fields_to_dict
+from qiime.fasta_index import (FastaIndex, fasta_index_suffix, SampleIndex,
+                               sample_index_is_current)
+from qiime.read_store import ReadStore, is_read_store
 from qiime.filter import (filter_fasta, filter_fastq,
                           get_seqs_to_keep_lookup_from_seq_id_file,
                           get_seqs_to_keep_lookup_from_fasta_file,
@@ -52,6 +56,10 @@ script_info[
     'script_usage'].append(("sample id list filtering", "Keep all sequences from a fasta file where the sample id portion of the sequence identifier is listed in a text file (sequence identifiers in fasta file must be in post-split libraries format: sampleID_seqID).",
                             "%prog -f sl_inseqs.fasta -o sample_id_list_filtered_seqs.fasta --sample_id_fp map.txt"))
 
+script_info[
+    'script_usage'].append(("read store filtering", "Keep all sequences from a read store written by split_libraries_fastq.py --write_read_store that are listed in a text file, writing them as fasta.",
+                            "%prog -f seqs.qrs -o list_filtered_seqs.fasta -s seqs_to_keep.txt"))
+
 script_info['output_description'] = ""
 script_info['required_options'] = [
     options_lookup['input_fasta'],
@@ -88,7 +96,9 @@ script_info['optional_options'] = [
     make_option('--valid_states', type='string',
                 help="Description of sample ids to retain (for use with "
                      "--mapping_fp) as a string in format "
-                     "'column1:good1,good2;column2:good1'. [default: %default]")
+                     "'column1:good1,good2;column2:good1'. [default: %default]"),
+    options_lookup['save_fasta_index'],
+    options_lookup['sample_index_fp']
 ]
 script_info['version'] = __version__
 
@@ -128,6 +138,8 @@ def main():
         option_parser.error(error_msg)
 
     seqid_f = None
+    # True if sequences are selected only by their sample ids
+    filter_by_sample_id = False
     if opts.otu_map:
         seqs_to_keep_lookup =\
             get_seqs_to_keep_lookup_from_otu_map(
@@ -149,6 +161,7 @@ def main():
                 open(opts.mapping_fp, 'U'),
                 opts.valid_states)
         seqid_f = lambda x: x.split()[0].rsplit('_')[0] in seqs_to_keep_lookup
+        filter_by_sample_id = True
     elif opts.biom_fp:
         seqs_to_keep_lookup = \
             get_seqs_to_keep_lookup_from_biom(opts.biom_fp)
@@ -158,15 +171,37 @@ def main():
         seqs_to_keep_lookup = \
                 get_seqs_to_keep_lookup_from_sample_ids(sample_ids)
         seqid_f = lambda x: x.split()[0].rsplit('_')[0] in seqs_to_keep_lookup
+        filter_by_sample_id = True
     else:
         option_parser.error(error_msg)
 
+    if (opts.sample_index_fp and
+            not sample_index_is_current(opts.input_fasta_fp,
+                                        opts.sample_index_fp)):
+        option_parser.error(
+            '%s is not an up-to-date sample index for %s. Rebuild it, or '
+            'run without --sample_index_fp.' %
+            (opts.sample_index_fp, opts.input_fasta_fp))
+
     if opts.input_fasta_fp.endswith('.fastq'):
         filter_fp_f = filter_fastq
     else:
         filter_fp_f = filter_fasta
 
-    input_fasta_f = open(opts.input_fasta_fp, 'U')
+    if filter_fp_f is filter_fasta and filter_by_sample_id and \
+            (opts.sample_index_fp or
+             sample_index_is_current(opts.input_fasta_fp)):
+        # only read the byte ranges holding the samples that are kept
+        input_fasta_f = SampleIndex(opts.input_fasta_fp, opts.sample_index_fp)
+    elif filter_fp_f is filter_fasta and (opts.save_fasta_index or
+            exists(opts.input_fasta_fp + fasta_index_suffix)):
+        # only read the sequences that are kept
+        input_fasta_f = FastaIndex(opts.input_fasta_fp,
+                                   save_index=opts.save_fasta_index)
+    elif filter_fp_f is filter_fasta and is_read_store(opts.input_fasta_fp):
+        input_fasta_f = ReadStore(opts.input_fasta_fp)
+    else:
+        input_fasta_f = open(opts.input_fasta_fp, 'U')
     output_fasta_f = open(opts.output_fasta_fp, 'w')
     filter_fp_f(input_fasta_f,
                 output_fasta_f,
@@ -15,6 +15,7 @@ __email__ = "gregcaporaso@gmail.com"
 
 from qiime.util import make_option
 from os import makedirs
+from functools import partial
 from qiime.util import (load_qiime_config,
                         parse_command_line_parameters,
                         get_options_lookup)
@@ -23,7 +24,8 @@ from qiime.workflow.util import (print_commands,
                                  call_commands_serially,
                                  print_to_stdout,
                                  no_status_updates,
-                                 validate_and_set_jobs_to_start)
+                                 validate_and_set_jobs_to_start,
+                                 WorkflowStepRunner)
 from qiime.workflow.downstream import run_jackknifed_beta_diversity
 
 script_info = {}
@@ -100,7 +102,8 @@ script_info['optional_options'] = [
     make_option('-a', '--parallel', action='store_true',
                 dest='parallel', default=False,
                 help='Run in parallel where available [default: %default]'),
-    options_lookup['jobs_to_start_workflow']
+    options_lookup['jobs_to_start_workflow'],
+    options_lookup['step_workers_workflow']
 ]
 
 script_info['version'] = __version__
@@ -156,8 +159,13 @@ def main():
             option_parser.error("Output directory already exists. Please choose"
                                 " a different directory, or force overwrite with -f.")
 
+    step_runner = None
     if print_only:
         command_handler = print_commands
+    elif opts.step_workers is not None:
+        step_runner = WorkflowStepRunner(opts.step_workers)
+        command_handler = partial(call_commands_serially,
+                                  step_runner=step_runner)
     else:
         command_handler = call_commands_serially
 
@@ -166,17 +174,21 @@ def main():
     else:
         status_update_callback = no_status_updates
 
-    run_jackknifed_beta_diversity(otu_table_fp=otu_table_fp,
-                                  tree_fp=tree_fp,
-                                  seqs_per_sample=seqs_per_sample,
-                                  output_dir=output_dir,
-                                  command_handler=command_handler,
-                                  params=params,
-                                  qiime_config=qiime_config,
-                                  mapping_fp=opts.mapping_fp,
-                                  parallel=parallel,
-                                  status_update_callback=status_update_callback,
-                                  master_tree=master_tree)
+    try:
+        run_jackknifed_beta_diversity(otu_table_fp=otu_table_fp,
+                                      tree_fp=tree_fp,
+                                      seqs_per_sample=seqs_per_sample,
+                                      output_dir=output_dir,
+                                      command_handler=command_handler,
+                                      params=params,
+                                      qiime_config=qiime_config,
+                                      mapping_fp=opts.mapping_fp,
+                                      parallel=parallel,
+                                      status_update_callback=status_update_callback,
+                                      master_tree=master_tree)
+    finally:
+        if step_runner is not None:
+            step_runner.close()
 
 
 if __name__ == "__main__":
@@ -24,11 +24,13 @@ script_info = {}
 script_info['brief_description'] = """Joins paired-end Illumina reads."""
 script_info['script_description'] = """This script takes forward and reverse Illumina reads and joins them using the method chosen. Will optionally create an updated index reads file containing index reads for the surviving joined paired end reads. If the option to write an updated index file is chosen, be sure that the order and header format of the index reads is the same as the order and header format of reads in the files that will be joined (this is the default for reads generated on the Illumina instruments).
 
-Currently, there are two methods that can be selected by the user to join paired-end data:
+Currently, there are three methods that can be selected by the user to join paired-end data:
 
 1. fastq-join - Erik Aronesty, 2011. ea-utils : "Command-line tools for processing biological sequencing data" (http://code.google.com/p/ea-utils)
 
 2. SeqPrep - (https://github.com/jstjohn/SeqPrep)
+
+3. native - joins reads within QIIME, without an external program. Overlaps are found and scored as fastq-join finds them, and the quality scores of overlapping bases are the posterior probabilities that the joined bases are wrong (Edgar & Flyvbjerg, Bioinformatics 2015). The updated index reads file is written while joining, and chunks of reads can be joined in parallel with -O.
 """
 script_info['script_usage'] = []
 script_info['script_usage'].append(
@@ -39,6 +41,10 @@ script_info['script_usage'].append(
     ("""Join paired-ends with \'SeqPrep\':""",
      """Produces similar output to the \'fastq-join\' but returns data in gzipped format.""",
      """ %prog -m SeqPrep -f $PWD/forward_reads.fastq -r $PWD/reverse_reads.fastq -o $PWD/SeqPrep_joined"""))
+script_info['script_usage'].append(
+    ("""Join paired-ends with \'native\':""",
+     """Joins paired-ends without an external program, using 4 processes, and writes the index reads of the joined pairs:""",
+     """ %prog -m native -f $PWD/forward_reads.fastq -r $PWD/reverse_reads.fastq -b $PWD/barcodes.fastq -O 4 -o $PWD/native_joined"""))
 script_info['script_usage'].append(
     ("""Update the index / barcode reads file to match the surviving joined pairs.""",
      """This is required if you will be using split_libraries_fastq.py.""",
@@ -58,7 +64,13 @@ script_info['output_description'] = """All paired-end joining software will retu
    - \"\*_unassembled_R1.gz\": unassembled / unjoined reads1 output
    - \"\*_unassembled_R2.gz\": unassembled / unjoined reads2 output
 
-3. If a barcode / index file is provided via the \'-b\' option, an updated
+3. native will output fastq-formatted files as fastq-join does:
+
+   - \"nativejoin.join.fastq\": assembled / joined reads output
+   - \"nativejoin.un1.fastq\": unassembled / unjoined reads1 output
+   - \"nativejoin.un2.fastq\": unassembled / unjoined reads2 output
+
+4. If a barcode / index file is provided via the \'-b\' option, an updated
    barcodes file will be output as:
 
    - \"..._barcodes.fastq\": This barcode / index file must be used in
@@ -85,12 +97,12 @@ script_info['optional_options'] = [
                 help='Path to the barcode / index reads in FASTQ format.'
                 ' Will be filtered based on surviving joined pairs.'),
     make_option('-j', '--min_overlap', type='int',
-                help='Applies to both fastq-join and SeqPrep methods.' +
+                help='Applies to the fastq-join, SeqPrep and native methods.' +
                       ' Minimum allowed overlap in base-pairs required to join pairs.' +
                       ' If not set, progam defaults will be used. For example, for fastq-join (6 bp) will be used.'
                       ' Must be an integer. [default: %default]', default=None),
     make_option('-p', '--perc_max_diff', type='int',
-                help='Only applies to fastq-join method, otherwise ignored. ' +
+                help='Only applies to fastq-join and native methods, otherwise ignored. ' +
                      'Maximum allowed % differences within region of overlap.' +
                       ' If not set, progam defaults will be used. For example, for fastq-join (8%) will be used.' +
                       ' Must be an integer between 1-100 [default: %default]',
@@ -117,7 +129,11 @@ script_info['optional_options'] = [
                 help='Only applies to SeqPrep method, otherwise ignored.' +
                       ' Set if input reads are in phred+64 format. Output will '
                       'always be phred+33. [default: %default]',
-                default=False)]
+                default=False),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+                help='Only applies to native method, otherwise ignored.' +
+                      ' Number of chunks of reads to join at once, in separate' +
+                      ' processes [default: %default]')]
 
 script_info['version'] = __version__
 
@@ -140,12 +156,18 @@ def main():
     phred_64 = opts.phred_64
     # both fastq-join & SeqPrep options
     min_overlap = opts.min_overlap
+    # native only options:
+    jobs_to_start = opts.jobs_to_start
+
+    if jobs_to_start < 1:
+        option_parser.error("--jobs_to_start must be greater than zero. "
+                            "You provided %d." % jobs_to_start)
 
     create_dir(output_dir, fail_on_exist=False)
 
     # send parameters to appropriate join method
-    # currently only two join methods exist:
-    # 'fastq-join' and 'SeqPrep'
+    # currently three join methods exist:
+    # 'fastq-join', 'SeqPrep' and 'native'
     if pe_join_method == "fastq-join":
         join_func = join_method_names["fastq-join"]
         paths = join_func(forward_reads_fp,
@@ -165,10 +187,21 @@ def main():
                           phred_64=phred_64,
                           working_dir=output_dir)
 
+    if pe_join_method == "native":
+        # the index reads of the joined pairs are written while joining
+        join_func = join_method_names["native"]
+        paths = join_func(forward_reads_fp,
+                          reverse_reads_fp,
+                          perc_max_diff=perc_max_diff,
+                          min_overlap=min_overlap,
+                          working_dir=output_dir,
+                          index_reads_fp=opts.index_reads_fp,
+                          processes=jobs_to_start)
+
     # If index / barcode file is supplied, filter unused barcode reads
     # and write them to a new file. Name based on joined-pairs / assembled
     # outfile
-    if opts.index_reads_fp:
+    if opts.index_reads_fp and pe_join_method != "native":
         index_reads = opts.index_reads_fp
         assembly_fp = paths['Assembled']  # grab joined-pairs output path
         write_synced_barcodes_fastq(assembly_fp, index_reads)
@@ -11,8 +11,7 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 from qiime.util import make_option
-from qiime.pick_otus import map_otu_map_files
-from qiime.format import write_otu_map
+from qiime.pick_otus import merge_otu_map_files
 from qiime.util import parse_command_line_parameters
 
 script_info = {}
@@ -82,8 +81,13 @@ def main():
     else:
         failures_f = None
 
+    # the OTU maps are merged as integer-coded arrays, and only converted
+    # back to sequence ids as they're written
     try:
-        result = map_otu_map_files(otu_files, failures_file=failures_f)
+        result = merge_otu_map_files(otu_files)
+        if failures_f is not None:
+            result = result.expand_ids([failure.strip()
+                                        for failure in failures_f])
     except KeyError as e:
         print ('Some keys do not map (' + str(e) + ') -- is the order of'
                ' your OTU maps equivalent to the order in which the OTU pickers'
@@ -96,7 +100,9 @@ def main():
         of.write('\n'.join(result))
         of.close()
     else:
-        write_otu_map(result.items(), output_fp)
+        of = open(output_fp, 'w')
+        result.write(of)
+        of.close()
 
 
 if __name__ == "__main__":
@@ -11,8 +11,7 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 
-from biom import load_table
-
+from qiime.parallel.merge_otus import merge_otu_tables_kway
 from qiime.util import (parse_command_line_parameters, make_option,
                         write_biom_table, get_options_lookup)
 
@@ -42,12 +41,7 @@ script_info['version'] = __version__
 
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
-    input_fps = opts.input_fps
-
-    master = load_table(input_fps[0])
-
-    for input_fp in input_fps[1:]:
-        master = master.merge(load_table(input_fp))
+    master = merge_otu_tables_kway(opts.input_fps)
 
     write_biom_table(master, opts.output_fp)
 
@@ -11,6 +11,7 @@ __email__ = "William.A.Walters@colorado.edu"
  
 from os.path import abspath, join
 from os import walk
+from functools import partial
  
 from qiime.util import (parse_command_line_parameters,
                         make_option,
@@ -18,6 +19,7 @@ from qiime.util import (parse_command_line_parameters,
                         load_qiime_config)
 from qiime.workflow.util import (print_commands,
                                  call_commands_serially,
+                                 call_commands_in_parallel,
                                  generate_log_fp,
                                  WorkflowLogger,
                                  no_status_updates,
@@ -128,6 +130,11 @@ script_info['optional_options']= [
     make_option('-w', '--print_only', action='store_true',
         help='Print the commands but don\'t call them -- '
         'useful for debugging [default: %default]', default=False),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+        help='number of extract_barcodes.py commands to run at once. If '
+        'greater than 1, the commands are run in a pool of worker processes, '
+        'which run extract_barcodes.py without starting a new interpreter '
+        'for each command [default: %default]'),
 ]
 
 script_info['version'] = __version__
@@ -147,10 +154,15 @@ def main():
     output_dir = abspath(opts.output_dir)
     remove_filepath_in_name = opts.remove_filepath_in_name
     print_only = opts.print_only
+    jobs_to_start = opts.jobs_to_start
     
     if remove_filepath_in_name and not include_input_dir_path:
         option_parser.error("If --remove_filepath_in_name is enabled, "
             "--include_input_dir_path must also be enabled.")
+
+    if jobs_to_start < 1:
+        option_parser.error("--jobs_to_start must be greater than zero. "
+                            "You provided %d." % jobs_to_start)
             
     if opts.parameter_fp:
         with open(opts.parameter_fp, 'U') as parameter_f:
@@ -182,6 +194,9 @@ def main():
     qiime_config = load_qiime_config()
     if print_only:
         command_handler = print_commands
+    elif jobs_to_start > 1:
+        command_handler = partial(call_commands_in_parallel,
+                                  processes=jobs_to_start)
     else:
         command_handler = call_commands_serially
     logger = WorkflowLogger(generate_log_fp(output_dir),
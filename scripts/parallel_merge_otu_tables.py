@@ -12,7 +12,7 @@ __email__ = "mcdonadt@colorado.edu"
 
 from qiime.util import make_option
 from qiime.util import (parse_command_line_parameters, load_qiime_config,
-                        get_options_lookup)
+                        get_options_lookup, write_biom_table)
 from os import popen, system, makedirs, mkdir
 from os.path import split, splitext, join
 from subprocess import check_call, CalledProcessError
@@ -21,7 +21,7 @@ from random import choice
 from time import sleep, time
 from qiime.parallel.merge_otus import start_job, local_job, torque_job, \
     job_complete, initial_has_dependencies, initial_nodes_to_merge, \
-    mergeorder, mergetree
+    mergeorder, mergetree, merge_otu_tables_kway
 qiime_config = load_qiime_config()
 options_lookup = get_options_lookup()
 
@@ -34,8 +34,12 @@ script_info['script_usage'].append(
     ("""Example""",
      """Merge the OTU tables $PWD/t1.biom,$PWD/t2.biom,$PWD/t3.biom,$PWD/t4.biom and write the resulting output table to the $PWD/merged/ directory.""",
      """%prog -i $PWD/t1.biom,$PWD/t2.biom,$PWD/t3.biom,$PWD/t4.biom -o $PWD/merged/"""))
+script_info['script_usage'].append(
+    ("""In-memory merge""",
+     """Merge the same OTU tables in a single pass, reading them with 4 processes and without writing any intermediate tables.""",
+     """%prog -i $PWD/t1.biom,$PWD/t2.biom,$PWD/t3.biom,$PWD/t4.biom -o $PWD/merged/ -m -O 4"""))
 script_info[
-    'output_description'] = """The output consists of many files (i.e. merged_table.biom, merged_table.log and all intermediate merge tables). The .biom file contains the result of merging the individual BIOM tables. The resulting .log file contains a list of parameters passed to this script along with the output location of the resulting .txt file, the dependency hierarchy and runtime information for each individual merge."""
+    'output_description'] = """The output consists of many files (i.e. merged_table.biom, merged_table.log and all intermediate merge tables). The .biom file contains the result of merging the individual BIOM tables. The resulting .log file contains a list of parameters passed to this script along with the output location of the resulting .txt file, the dependency hierarchy and runtime information for each individual merge. If --in_memory is passed, no intermediate merge tables are created."""
 
 script_info['required_options'] = [
     make_option('-i', '--input_fps', type='existing_filepaths',
@@ -46,6 +50,13 @@ script_info['required_options'] = [
 script_info['optional_options'] = [
     make_option('-C', '--cluster', action='store_true', default=False,
                 help="Submit to a torque cluster"),
+    make_option('-m', '--in_memory', action='store_true', default=False,
+                help="Merge all of the tables in a single pass in this "
+                "process, reading them with --jobs_to_start processes, "
+                "rather than building a tree of pairwise merge jobs. This "
+                "is much faster when merging many tables, but the merged "
+                "table must fit in memory [default: %default]"),
+    options_lookup['jobs_to_start'],
     options_lookup['seconds_to_sleep'],
     options_lookup['job_prefix']]
 script_info['version'] = __version__
@@ -94,7 +105,10 @@ def main():
     # output files.
     working_dir = '%s/%s' % (output_dir, job_prefix)
     try:
-        makedirs(working_dir)
+        if opts.in_memory:
+            makedirs(output_dir)
+        else:
+            makedirs(working_dir)
     except OSError:
     # working dir already exists
         pass
@@ -113,6 +127,16 @@ def main():
         if not os.path.exists(f):
             raise IOError("%f does not exist!" % f)
 
+    if opts.in_memory:
+        start_time = time()
+        merged = merge_otu_tables_kway(input_fps, opts.jobs_to_start)
+        write_biom_table(merged, join(output_dir, 'merged.biom'))
+        wrapper_log_output.write("In-memory merge of %d tables completed in "
+                                 "%f seconds\n" % (len(input_fps),
+                                                    time() - start_time))
+        wrapper_log_output.close()
+        return
+
     tree = mergeorder(input_fps, working_dir)
 
     if verbose:
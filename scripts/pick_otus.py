@@ -13,13 +13,15 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 from os.path import splitext, split, exists, abspath, isfile
-from os import makedirs
+from os import makedirs, fdopen
+from tempfile import mkstemp
 from multiprocessing import cpu_count
 
 from skbio.util import remove_files
 from qiime.util import (parse_command_line_parameters, create_dir,
                          make_option, load_qiime_config)
 from qiime.sort import sort_fasta_by_abundance
+from qiime.read_store import is_read_store, read_store_to_fasta
 from qiime.pick_otus  import otu_picking_method_constructors,\
     otu_picking_method_choices, MothurOtuPicker
 
@@ -177,7 +179,10 @@ The resulting .log file contains a list of parameters passed to the pick_otus.py
 
 script_info['required_options'] = [
     make_option('-i', '--input_seqs_filepath', type='existing_filepath',
-                help='Path to input sequences file'),
+                help='Path to input sequences file. This can also be a '
+                'read store written by split_libraries_fastq.py '
+                '--write_read_store, which is converted to a temporary fasta '
+                'file in the output directory'),
 ]
 
 script_info['optional_options'] = [
@@ -750,254 +755,272 @@ def main():
     output_dir = opts.output_dir or otu_picking_method + '_picked_otus'
     create_dir(output_dir, fail_on_exist=False)
 
-    # Create the output and log file names
-    result_path = '%s/%s_otus.txt' % (output_dir, input_seqs_basename)
-    log_path = '%s/%s_otus.log' % (output_dir, input_seqs_basename)
-    failure_path = '%s/%s_failures.txt' % (output_dir, input_seqs_basename)
-
-    # Perform OTU picking -- parameters and calls are made
-    # on a per-method basis
-
-    # cd-hit
-    if otu_picking_method == 'cdhit':
-        params = {'Similarity': similarity,
-                  '-M': opts.max_cdhit_memory}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path,
-                   prefix_prefilter_length=prefix_prefilter_length,
-                   trie_prefilter=trie_prefilter)
-
-    # uclust (de novo)
-    elif otu_picking_method == 'uclust':
-        params = {'Similarity': similarity,
-                  'enable_rev_strand_matching': opts.enable_rev_strand_match,
-                  'optimal': opts.optimal_uclust,
-                  'exact': opts.exact_uclust,
-                  # suppress_sort=True when seqs are or will be pre-sorted
-                  'suppress_sort': user_sort,
-                  'presort_by_abundance':
-                  not suppress_presort_by_abundance_uclust,
-                  'max_accepts': max_accepts,
-                  'max_rejects': max_rejects,
-                  'stepwords': stepwords,
-                  'word_length': word_length,
-                  'new_cluster_identifier': opts.denovo_otu_id_prefix,
-                  'stable_sort': uclust_stable_sort,
-                  'save_uc_files': save_uc_files,
-                  'output_dir': output_dir,
-                  'prefilter_identical_sequences': prefilter_identical_sequences}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path, HALT_EXEC=False)
-
-    # usearch (usearch_qf)
-    elif otu_picking_method == 'usearch':
-        params = {'percent_id': similarity,
-                  'maxrejects': max_rejects,
-                  'w': word_length,
-                  'save_intermediate_files': save_uc_files,
-                  'output_dir': output_dir,
-                  'percent_id_err': percent_id_err,
-                  'minsize': minsize,
-                  'abundance_skew': abundance_skew,
-                  'db_filepath': db_filepath,
-                  'perc_id_blast': perc_id_blast,
-                  'de_novo_chimera_detection': de_novo_chimera_detection,
-                  'reference_chimera_detection': reference_chimera_detection,
-                  'cluster_size_filtering': cluster_size_filtering,
-                  'remove_usearch_logs': remove_usearch_logs,
-                  'derep_fullseq': derep_fullseq,
-                  'chimeras_retention': chimeras_retention,
-                  'verbose': verbose,
-                  'minlen': minlen,
-                  'rev': enable_rev_strand_match}
-
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath, result_path=result_path,
-                   log_path=log_path, HALT_EXEC=False)
-
-    # usearch (usearch_qf) with reference OTU picking
-    elif otu_picking_method == 'usearch_ref':
-        params = {'percent_id': similarity,
-                  'maxrejects': max_rejects,
-                  'w': word_length,
-                  'save_intermediate_files': save_uc_files,
-                  'output_dir': output_dir,
-                  'percent_id_err': percent_id_err,
-                  'minsize': minsize,
-                  'abundance_skew': abundance_skew,
-                  'db_filepath': db_filepath,
-                  'perc_id_blast': perc_id_blast,
-                  'de_novo_chimera_detection': de_novo_chimera_detection,
-                  'reference_chimera_detection': reference_chimera_detection,
-                  'cluster_size_filtering': cluster_size_filtering,
-                  'remove_usearch_logs': remove_usearch_logs,
-                  'suppress_new_clusters': opts.suppress_new_clusters,
-                  'derep_fullseq': derep_fullseq,
-                  'chimeras_retention': chimeras_retention,
-                  'verbose': verbose,
-                  'minlen': minlen,
-                  'rev': enable_rev_strand_match}
-
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath, result_path=result_path,
-                   refseqs_fp=refseqs_fp, failure_path=failure_path,
-                   log_path=log_path, HALT_EXEC=False)
-
-    # usearch 6.1 (de novo OTU picking only)
-    elif otu_picking_method == 'usearch61':
-        otu_prefix = opts.denovo_otu_id_prefix or 'denovo'
-        params = {
-            'percent_id': similarity,
-            'wordlength': word_length,
-            'save_intermediate_files': save_uc_files,
-            'output_dir': output_dir,
-            'remove_usearch_logs': remove_usearch_logs,
-            'verbose': verbose,
-            'minlen': minlen,
-            'rev': enable_rev_strand_match,
-            'usearch_fast_cluster': usearch_fast_cluster,
-            'usearch61_sort_method': usearch61_sort_method,
-            'usearch61_maxrejects': max_rejects,
-            'usearch61_maxaccepts': max_accepts,
-            'sizeorder': sizeorder,
-            'threads': threads
-        }
-
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath, result_path=result_path,
-                   log_path=log_path, otu_prefix=otu_prefix,
-                   HALT_EXEC=False)
-
-    # usearch 6.1 reference OTU picking
-    elif otu_picking_method == 'usearch61_ref':
-        otu_prefix = opts.denovo_otu_id_prefix or 'denovo'
-        params = {
-            'percent_id': similarity,
-            'wordlength': word_length,
-            'save_intermediate_files': save_uc_files,
-            'output_dir': output_dir,
-            'remove_usearch_logs': remove_usearch_logs,
-            'verbose': verbose,
-            'minlen': minlen,
-            'rev': enable_rev_strand_match,
-            'usearch_fast_cluster': usearch_fast_cluster,
-            'usearch61_sort_method': usearch61_sort_method,
-            'usearch61_maxrejects': max_rejects,
-            'usearch61_maxaccepts': max_accepts,
-            'sizeorder': sizeorder,
-            'suppress_new_clusters': opts.suppress_new_clusters,
-            'threads': threads
-        }
-
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath, refseqs_fp, result_path=result_path,
-                   log_path=log_path, failure_path=failure_path,
-                   otu_prefix=otu_prefix, HALT_EXEC=False)
-
-    # uclust (reference-based)
-    elif otu_picking_method == 'uclust_ref':
-        params = {'Similarity': similarity,
-                  'enable_rev_strand_matching': opts.enable_rev_strand_match,
-                  'optimal': opts.optimal_uclust,
-                  'exact': opts.exact_uclust,
-                  # suppress_sort=True when seqs are or will be pre-sorted
-                  'suppress_sort': user_sort,
-                  'presort_by_abundance':
-                  not suppress_presort_by_abundance_uclust,
-                  'suppress_new_clusters': opts.suppress_new_clusters,
-                  'max_accepts': max_accepts,
-                  'max_rejects': max_rejects,
-                  'stepwords': stepwords,
-                  'word_length': word_length,
-                  'new_cluster_identifier': opts.denovo_otu_id_prefix,
-                  'stable_sort': uclust_stable_sort,
-                  'save_uc_files': save_uc_files,
-                  'output_dir': output_dir,
-                  'prefilter_identical_sequences':
-                  prefilter_identical_sequences,
-                  'chimeras_retention': chimeras_retention}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath, refseqs_fp,
-                   result_path=result_path, log_path=log_path,
-                   failure_path=failure_path)
-
-    # prefix/suffix
-    elif otu_picking_method == 'prefix_suffix':
-        otu_picker = otu_picker_constructor({})
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path,
-                   prefix_length=prefix_length, suffix_length=suffix_length)
-
-    # mothur
-    elif otu_picking_method == 'mothur':
-        params = {'Similarity': similarity,
-                  'Algorithm': opts.clustering_algorithm}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path)
-
-    # trie
-    elif otu_picking_method == 'trie':
-        params = {'Reverse': trie_reverse_seqs}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path)
-
-    # blast
-    elif otu_picking_method == 'blast':
-        params = {'max_e_value': opts.max_e_value_blast,
-                  'Similarity': similarity,
-                  'min_aligned_percent': min_aligned_percent}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path,
-                   blast_db=blast_db, refseqs_fp=refseqs_fp)
-
-    # sortmerna
-    elif otu_picking_method == 'sortmerna':
-        params = {'max_e_value': sortmerna_e_value,
-                  'similarity': similarity,
-                  'coverage': sortmerna_coverage,
-                  'threads': threads,
-                  'blast': sortmerna_tabular,
-                  'best': sortmerna_best_N_alignments,
-                  'max_pos': sortmerna_max_pos,
-                  'prefilter_identical_sequences':
-                  prefilter_identical_sequences}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path,
-                   sortmerna_db=sortmerna_db, refseqs_fp=refseqs_fp,
-                   failure_path=failure_path)
-
-    # sumaclust
-    elif otu_picking_method == 'sumaclust':
-        params = {'similarity': similarity,
-                  'exact': sumaclust_exact,
-                  'threads': threads,
-                  'l': sumaclust_l,
-                  'prefilter_identical_sequences':
-                  prefilter_identical_sequences,
-                  'denovo_otu_id_prefix': denovo_otu_id_prefix}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path)
-
-    # swarm
-    elif otu_picking_method == 'swarm':
-        params = {'resolution': swarm_resolution,
-                  'threads': threads,
-                  'denovo_otu_id_prefix': denovo_otu_id_prefix}
-        otu_picker = otu_picker_constructor(params)
-        otu_picker(input_seqs_filepath,
-                   result_path=result_path, log_path=log_path)
-
-    # other -- shouldn't be able to get here as a KeyError would have
-    # been raised earlier
-    else:
-        raise ValueError("Unknown OTU picking method: %s" % otu_picking_method)
+    # the OTU pickers (and the tools that many of them wrap) read fasta, so
+    # write read stores out as fasta, removing the fasta file when done
+    converted_seqs_fp = None
+    try:
+        if is_read_store(input_seqs_filepath):
+            read_store_f = open(input_seqs_filepath, 'rb')
+            fd, input_seqs_filepath = mkstemp(dir=abspath(output_dir),
+                                              prefix=input_seqs_basename + '_',
+                                              suffix='.fna')
+            converted_seqs_fp = input_seqs_filepath
+            seqs_f = fdopen(fd, 'w')
+            read_store_to_fasta(read_store_f, seqs_f)
+            seqs_f.close()
+            read_store_f.close()
+
+        # Create the output and log file names
+        result_path = '%s/%s_otus.txt' % (output_dir, input_seqs_basename)
+        log_path = '%s/%s_otus.log' % (output_dir, input_seqs_basename)
+        failure_path = '%s/%s_failures.txt' % (output_dir, input_seqs_basename)
+
+        # Perform OTU picking -- parameters and calls are made
+        # on a per-method basis
+
+        # cd-hit
+        if otu_picking_method == 'cdhit':
+            params = {'Similarity': similarity,
+                      '-M': opts.max_cdhit_memory}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path,
+                       prefix_prefilter_length=prefix_prefilter_length,
+                       trie_prefilter=trie_prefilter)
+
+        # uclust (de novo)
+        elif otu_picking_method == 'uclust':
+            params = {'Similarity': similarity,
+                      'enable_rev_strand_matching': opts.enable_rev_strand_match,
+                      'optimal': opts.optimal_uclust,
+                      'exact': opts.exact_uclust,
+                      # suppress_sort=True when seqs are or will be pre-sorted
+                      'suppress_sort': user_sort,
+                      'presort_by_abundance':
+                      not suppress_presort_by_abundance_uclust,
+                      'max_accepts': max_accepts,
+                      'max_rejects': max_rejects,
+                      'stepwords': stepwords,
+                      'word_length': word_length,
+                      'new_cluster_identifier': opts.denovo_otu_id_prefix,
+                      'stable_sort': uclust_stable_sort,
+                      'save_uc_files': save_uc_files,
+                      'output_dir': output_dir,
+                      'prefilter_identical_sequences': prefilter_identical_sequences}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path, HALT_EXEC=False)
+
+        # usearch (usearch_qf)
+        elif otu_picking_method == 'usearch':
+            params = {'percent_id': similarity,
+                      'maxrejects': max_rejects,
+                      'w': word_length,
+                      'save_intermediate_files': save_uc_files,
+                      'output_dir': output_dir,
+                      'percent_id_err': percent_id_err,
+                      'minsize': minsize,
+                      'abundance_skew': abundance_skew,
+                      'db_filepath': db_filepath,
+                      'perc_id_blast': perc_id_blast,
+                      'de_novo_chimera_detection': de_novo_chimera_detection,
+                      'reference_chimera_detection': reference_chimera_detection,
+                      'cluster_size_filtering': cluster_size_filtering,
+                      'remove_usearch_logs': remove_usearch_logs,
+                      'derep_fullseq': derep_fullseq,
+                      'chimeras_retention': chimeras_retention,
+                      'verbose': verbose,
+                      'minlen': minlen,
+                      'rev': enable_rev_strand_match}
+
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath, result_path=result_path,
+                       log_path=log_path, HALT_EXEC=False)
+
+        # usearch (usearch_qf) with reference OTU picking
+        elif otu_picking_method == 'usearch_ref':
+            params = {'percent_id': similarity,
+                      'maxrejects': max_rejects,
+                      'w': word_length,
+                      'save_intermediate_files': save_uc_files,
+                      'output_dir': output_dir,
+                      'percent_id_err': percent_id_err,
+                      'minsize': minsize,
+                      'abundance_skew': abundance_skew,
+                      'db_filepath': db_filepath,
+                      'perc_id_blast': perc_id_blast,
+                      'de_novo_chimera_detection': de_novo_chimera_detection,
+                      'reference_chimera_detection': reference_chimera_detection,
+                      'cluster_size_filtering': cluster_size_filtering,
+                      'remove_usearch_logs': remove_usearch_logs,
+                      'suppress_new_clusters': opts.suppress_new_clusters,
+                      'derep_fullseq': derep_fullseq,
+                      'chimeras_retention': chimeras_retention,
+                      'verbose': verbose,
+                      'minlen': minlen,
+                      'rev': enable_rev_strand_match}
+
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath, result_path=result_path,
+                       refseqs_fp=refseqs_fp, failure_path=failure_path,
+                       log_path=log_path, HALT_EXEC=False)
+
+        # usearch 6.1 (de novo OTU picking only)
+        elif otu_picking_method == 'usearch61':
+            otu_prefix = opts.denovo_otu_id_prefix or 'denovo'
+            params = {
+                'percent_id': similarity,
+                'wordlength': word_length,
+                'save_intermediate_files': save_uc_files,
+                'output_dir': output_dir,
+                'remove_usearch_logs': remove_usearch_logs,
+                'verbose': verbose,
+                'minlen': minlen,
+                'rev': enable_rev_strand_match,
+                'usearch_fast_cluster': usearch_fast_cluster,
+                'usearch61_sort_method': usearch61_sort_method,
+                'usearch61_maxrejects': max_rejects,
+                'usearch61_maxaccepts': max_accepts,
+                'sizeorder': sizeorder,
+                'threads': threads
+            }
+
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath, result_path=result_path,
+                       log_path=log_path, otu_prefix=otu_prefix,
+                       HALT_EXEC=False)
+
+        # usearch 6.1 reference OTU picking
+        elif otu_picking_method == 'usearch61_ref':
+            otu_prefix = opts.denovo_otu_id_prefix or 'denovo'
+            params = {
+                'percent_id': similarity,
+                'wordlength': word_length,
+                'save_intermediate_files': save_uc_files,
+                'output_dir': output_dir,
+                'remove_usearch_logs': remove_usearch_logs,
+                'verbose': verbose,
+                'minlen': minlen,
+                'rev': enable_rev_strand_match,
+                'usearch_fast_cluster': usearch_fast_cluster,
+                'usearch61_sort_method': usearch61_sort_method,
+                'usearch61_maxrejects': max_rejects,
+                'usearch61_maxaccepts': max_accepts,
+                'sizeorder': sizeorder,
+                'suppress_new_clusters': opts.suppress_new_clusters,
+                'threads': threads
+            }
+
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath, refseqs_fp, result_path=result_path,
+                       log_path=log_path, failure_path=failure_path,
+                       otu_prefix=otu_prefix, HALT_EXEC=False)
+
+        # uclust (reference-based)
+        elif otu_picking_method == 'uclust_ref':
+            params = {'Similarity': similarity,
+                      'enable_rev_strand_matching': opts.enable_rev_strand_match,
+                      'optimal': opts.optimal_uclust,
+                      'exact': opts.exact_uclust,
+                      # suppress_sort=True when seqs are or will be pre-sorted
+                      'suppress_sort': user_sort,
+                      'presort_by_abundance':
+                      not suppress_presort_by_abundance_uclust,
+                      'suppress_new_clusters': opts.suppress_new_clusters,
+                      'max_accepts': max_accepts,
+                      'max_rejects': max_rejects,
+                      'stepwords': stepwords,
+                      'word_length': word_length,
+                      'new_cluster_identifier': opts.denovo_otu_id_prefix,
+                      'stable_sort': uclust_stable_sort,
+                      'save_uc_files': save_uc_files,
+                      'output_dir': output_dir,
+                      'prefilter_identical_sequences':
+                      prefilter_identical_sequences,
+                      'chimeras_retention': chimeras_retention}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath, refseqs_fp,
+                       result_path=result_path, log_path=log_path,
+                       failure_path=failure_path)
+
+        # prefix/suffix
+        elif otu_picking_method == 'prefix_suffix':
+            otu_picker = otu_picker_constructor({})
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path,
+                       prefix_length=prefix_length, suffix_length=suffix_length)
+
+        # mothur
+        elif otu_picking_method == 'mothur':
+            params = {'Similarity': similarity,
+                      'Algorithm': opts.clustering_algorithm}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path)
+
+        # trie
+        elif otu_picking_method == 'trie':
+            params = {'Reverse': trie_reverse_seqs}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path)
+
+        # blast
+        elif otu_picking_method == 'blast':
+            params = {'max_e_value': opts.max_e_value_blast,
+                      'Similarity': similarity,
+                      'min_aligned_percent': min_aligned_percent}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path,
+                       blast_db=blast_db, refseqs_fp=refseqs_fp)
+
+        # sortmerna
+        elif otu_picking_method == 'sortmerna':
+            params = {'max_e_value': sortmerna_e_value,
+                      'similarity': similarity,
+                      'coverage': sortmerna_coverage,
+                      'threads': threads,
+                      'blast': sortmerna_tabular,
+                      'best': sortmerna_best_N_alignments,
+                      'max_pos': sortmerna_max_pos,
+                      'prefilter_identical_sequences':
+                      prefilter_identical_sequences}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path,
+                       sortmerna_db=sortmerna_db, refseqs_fp=refseqs_fp,
+                       failure_path=failure_path)
+
+        # sumaclust
+        elif otu_picking_method == 'sumaclust':
+            params = {'similarity': similarity,
+                      'exact': sumaclust_exact,
+                      'threads': threads,
+                      'l': sumaclust_l,
+                      'prefilter_identical_sequences':
+                      prefilter_identical_sequences,
+                      'denovo_otu_id_prefix': denovo_otu_id_prefix}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path)
+
+        # swarm
+        elif otu_picking_method == 'swarm':
+            params = {'resolution': swarm_resolution,
+                      'threads': threads,
+                      'denovo_otu_id_prefix': denovo_otu_id_prefix}
+            otu_picker = otu_picker_constructor(params)
+            otu_picker(input_seqs_filepath,
+                       result_path=result_path, log_path=log_path)
+
+        # other -- shouldn't be able to get here as a KeyError would have
+        # been raised earlier
+        else:
+            raise ValueError("Unknown OTU picking method: %s" % otu_picking_method)
+    finally:
+        if converted_seqs_fp is not None:
+            remove_files([converted_seqs_fp])
 
 
 if __name__ == "__main__":
@@ -11,11 +11,13 @@ __version__ = "1.9.1-dev"
 __maintainer__ = "Daniel McDonald"
 __email__ = "wasade@gmail.com"
 
-from qiime.util import parse_command_line_parameters
+from qiime.util import parse_command_line_parameters, get_options_lookup
 from qiime.util import make_option
 from qiime.pick_rep_set import (rep_set_picking_methods,
                                 reference_rep_set_picking_methods)
 
+options_lookup = get_options_lookup()
+
 script_info = {}
 script_info['brief_description'] = """Pick representative set of sequences"""
 script_info['script_description'] = """After picking OTUs, you can then pick a\
@@ -84,7 +86,8 @@ script_info['optional_options'] = [
                 help='sort by otu or seq_id [default: %default]'),
     make_option('-r', '--reference_seqs_fp', type='existing_filepath',
                 help='collection of preferred representative '
-                'sequences [default: %default]')
+                'sequences [default: %default]'),
+    options_lookup['save_fasta_index']
 ]
 script_info['version'] = __version__
 
@@ -107,7 +110,8 @@ def main():
                        reference_seqs_filepath,
                        result_path=result_path,
                        log_path=log_path,
-                       sort_by=opts.sort_by)
+                       sort_by=opts.sort_by,
+                       save_fasta_index=opts.save_fasta_index)
     else:
         if not input_seqs_filepath:
             option_parser.error('--fasta_fp must be provided when not picking'
@@ -118,7 +122,8 @@ def main():
                        input_otu_filepath,
                        result_path=result_path,
                        log_path=log_path,
-                       sort_by=opts.sort_by)
+                       sort_by=opts.sort_by,
+                       save_fasta_index=opts.save_fasta_index)
 
 
 if __name__ == "__main__":
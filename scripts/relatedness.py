@@ -14,7 +14,8 @@ __email__ = "wdwvt1@gmail.com"
 
 from sys import stdout
 
-from qiime.parse import parse_newick, PhyloNode
+from qiime.parse import parse_newick
+from cogent.core.tree import PhyloNode
 from qiime.relatedness_library import nri, nti
 from qiime.util import parse_command_line_parameters, make_option
 
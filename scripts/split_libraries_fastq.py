@@ -12,15 +12,24 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 from os import rename
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from multiprocessing import Pool
 
 from skbio.util import safe_md5, create_dir
 from skbio.sequence import DNA
 from skbio.format.sequences import format_fastq_record
 
 from qiime.util import parse_command_line_parameters, make_option, gzip_open
+from qiime.fasta_index import (SampleIndexBuilder, write_sample_index,
+                               sample_index_suffix)
 from qiime.parse import parse_mapping_file, parse_items
+from qiime.read_store import (ReadStoreWriter, parse_read_store,
+                              read_store_suffix)
 from qiime.split_libraries_fastq import (process_fastq_single_end_read_file,
-                                         BARCODE_DECODER_LOOKUP, process_fastq_single_end_read_file_no_barcode)
+                                         BARCODE_DECODER_LOOKUP, process_fastq_single_end_read_file_no_barcode,
+                                         offset_seq_id, offset_seq_ids_in_lines)
 from qiime.split_libraries import check_map
 from qiime.split_libraries_fastq import get_illumina_qual_chars
 from qiime.golay import get_invalid_golay_barcodes
@@ -139,6 +148,25 @@ script_info['optional_options'] = [
                 "decoding phred scores (either 33 or 64). Warning: in most "
                 "cases you don't need to pass this value "
                 "[default: determined automatically]"),
+    make_option('--write_sample_index', default=False, action='store_true',
+                help='write an index of the byte ranges of each sample\'s '
+                'sequences in seqs.fna (as seqs.fna.sidx). Tools such as '
+                'extract_seqs_by_sample_id.py and filter_fasta.py use the '
+                'index to read only the requested samples\' sequences '
+                '[default: %default]'),
+    make_option('--write_read_store', default=False, action='store_true',
+                help='also write the sequences and quality scores to a '
+                'compressed binary read store (seqs.qrs). A read store is '
+                'several times smaller than seqs.fna plus seqs.qual, and can '
+                'be read by count_seqs.py and filter_fasta.py, or converted '
+                'back to fasta/qual or fastq with convert_fastaqual_fastq.py '
+                '[default: %default]'),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+                help='number of sequence read files to process at once. If '
+                'greater than 1, each file (and its barcode read file) is '
+                'processed in a separate process and the results are '
+                'concatenated in order, giving the same output as processing '
+                'the files in turn [default: %default]'),
     make_option('--read_arguments_from_file', default=False,
                 action='store_true', help='If this flag is enabled, then the '
                 'inputs to "-i" or "--sequence_read_fps", "-b" or '
@@ -159,6 +187,197 @@ script_info['optional_options'] = [
 script_info['version'] = __version__
 
 
+def get_barcode_to_sample_id(mapping_fp, barcode_read_fp,
+                             rev_comp_mapping_barcodes=False):
+    """Return {barcode: sample_id} from mapping_fp ({} if it is None)"""
+    if mapping_fp is not None:
+        mapping_f = open(mapping_fp, 'U')
+        _, _, barcode_to_sample_id, _, _, _, _ = check_map(mapping_f,
+            disable_primer_check=True,
+            has_barcodes=barcode_read_fp is not None)
+    else:
+        barcode_to_sample_id = {}
+
+    if rev_comp_mapping_barcodes:
+        barcode_to_sample_id = {str(DNA(k).rc()): v for k, v in
+                                barcode_to_sample_id.iteritems()}
+    return barcode_to_sample_id
+
+
+class DemultiplexedSeqsWriter(object):
+
+    """Writes demultiplexed sequences to seqs.fna and the optional outputs
+
+    Options holds whether each optional output (qual, fastq, read store)
+    is written, so that the same outputs can be written for each pair of
+    input files when they're processed in parallel.
+    """
+
+    def __init__(self, seqs_fp, qual_fp=None, fastq_fp=None,
+                 read_store_fp=None, write_sample_index=False):
+        self.Options = (qual_fp is not None, fastq_fp is not None,
+                        read_store_fp is not None)
+        self._seqs_f = open(seqs_fp, 'w')
+        self._qual_f = open(qual_fp, 'w') if qual_fp is not None else None
+        self._fastq_f = open(fastq_fp, 'w') if fastq_fp is not None else None
+        if read_store_fp is not None:
+            self._read_store = ReadStoreWriter(open(read_store_fp, 'wb'))
+        else:
+            self._read_store = None
+        if write_sample_index:
+            self._sample_index = SampleIndexBuilder()
+        else:
+            self._sample_index = None
+
+    @classmethod
+    def in_dir(cls, output_dir, options):
+        """Return a writer for the outputs in options, in output_dir"""
+        write_qual, write_fastq, write_read_store = options
+        return cls(join(output_dir, 'seqs.fna'),
+                   join(output_dir, 'seqs.qual') if write_qual else None,
+                   join(output_dir, 'seqs.fastq') if write_fastq else None,
+                   join(output_dir, 'seqs' + read_store_suffix)
+                   if write_read_store else None)
+
+    def write(self, h, s, q):
+        record = '>%s\n%s\n' % (h, s)
+        self._seqs_f.write(record)
+        if self._sample_index is not None:
+            self._sample_index.add(h, len(record))
+        if self._qual_f is not None:
+            self._qual_f.write('>%s\n%s\n' % (h, q))
+        if self._fastq_f is not None:
+            self._fastq_f.write(format_fastq_record(h, s, q))
+        if self._read_store is not None:
+            self._read_store.write(h, s, q)
+
+    def append_with_offset(self, input_dir, offset):
+        """Append the outputs written to input_dir by a writer from in_dir
+
+        offset is added to the sequence numbers of the appended records.
+        """
+        seqs_f = open(join(input_dir, 'seqs.fna'), 'U')
+        for line in offset_seq_ids_in_lines(seqs_f, offset):
+            self._seqs_f.write(line)
+            if self._sample_index is not None:
+                if line.startswith('>'):
+                    label = line[1:]
+                # the label and sequence lines of a record are merged into
+                # one range
+                self._sample_index.add(label, len(line))
+        seqs_f.close()
+
+        if self._qual_f is not None:
+            qual_f = open(join(input_dir, 'seqs.qual'), 'U')
+            self._qual_f.writelines(offset_seq_ids_in_lines(qual_f, offset))
+            qual_f.close()
+
+        if self._fastq_f is not None:
+            fastq_f = open(join(input_dir, 'seqs.fastq'), 'U')
+            self._fastq_f.writelines(
+                offset_seq_ids_in_lines(fastq_f, offset, 'fastq'))
+            fastq_f.close()
+
+        if self._read_store is not None:
+            read_store_f = open(join(input_dir, 'seqs' + read_store_suffix),
+                                'rb')
+            for h, s, q in parse_read_store(read_store_f):
+                self._read_store.write(offset_seq_id(h, offset), s, q)
+            read_store_f.close()
+
+    def close(self):
+        """Close the output files, returning the SampleIndexBuilder (if any)
+        """
+        self._seqs_f.close()
+        if self._qual_f is not None:
+            self._qual_f.close()
+        if self._fastq_f is not None:
+            self._fastq_f.close()
+        if self._read_store is not None:
+            self._read_store.close()
+        return self._sample_index
+
+
+def split_read_file_pair(read_file_pair, start_seq_id, log_f, histogram_f,
+                         seqs_writer, rev_comp_barcode=False,
+                         barcode_correction_fn=None, max_barcode_errors=1.5,
+                         **kwargs):
+    """Demultiplex and quality filter one sequence read file
+
+    read_file_pair is (sequence_read_fp, barcode_read_fp, mapping_fp,
+    barcode_to_sample_id, sample_id); barcode_read_fp and mapping_fp are
+    None (and sample_id is used) if the reads are not barcoded. Each
+    sequence is passed to seqs_writer as (header, sequence, quality). The
+    remaining arguments are passed to
+    process_fastq_single_end_read_file(_no_barcode). Returns the
+    start_seq_id for the next file.
+    """
+    (sequence_read_fp, barcode_read_fp, mapping_fp, barcode_to_sample_id,
+     sample_id) = read_file_pair
+
+    log_f.write("Input file paths\n")
+    if mapping_fp is not None:
+        log_f.write('Mapping filepath: %s (md5: %s)\n' %
+                    (mapping_fp, safe_md5(open(mapping_fp)).hexdigest()))
+    log_f.write('Sequence read filepath: %s (md5: %s)\n' %
+                (sequence_read_fp,
+                 str(safe_md5(open(sequence_read_fp)).hexdigest())))
+
+    if sequence_read_fp.endswith('.gz'):
+        sequence_read_f = gzip_open(sequence_read_fp)
+    else:
+        sequence_read_f = open(sequence_read_fp, 'U')
+
+    seq_id = start_seq_id
+
+    if barcode_read_fp is not None:
+        log_f.write('Barcode read filepath: %s (md5: %s)\n\n' %
+                    (barcode_read_fp,
+                     safe_md5(open(barcode_read_fp)).hexdigest()))
+
+        if barcode_read_fp.endswith('.gz'):
+            barcode_read_f = gzip_open(barcode_read_fp)
+        else:
+            barcode_read_f = open(barcode_read_fp, 'U')
+
+        seq_generator = process_fastq_single_end_read_file(
+            sequence_read_f, barcode_read_f, barcode_to_sample_id,
+            rev_comp_barcode=rev_comp_barcode, start_seq_id=start_seq_id,
+            log_f=log_f, histogram_f=histogram_f,
+            barcode_correction_fn=barcode_correction_fn,
+            max_barcode_errors=max_barcode_errors, **kwargs)
+    else:
+        seq_generator = process_fastq_single_end_read_file_no_barcode(
+            sequence_read_f, sample_id, start_seq_id=start_seq_id,
+            log_f=log_f, histogram_f=histogram_f, **kwargs)
+
+    for fasta_header, sequence, quality, seq_id in seq_generator:
+        seqs_writer(fasta_header, sequence, quality)
+
+    log_f.write('\n---\n\n')
+    return seq_id + 1
+
+
+def split_read_file_pair_to_dir(args):
+    """Run split_read_file_pair, writing the outputs to a new directory
+
+    args is (output_dir, read_file_pair, writer_options, kwargs). Sequence
+    numbers start at 0. This is run in worker processes by main, and
+    returns the start_seq_id for the next file (relative to 0).
+    """
+    output_dir, read_file_pair, writer_options, kwargs = args
+    create_dir(output_dir)
+    writer = DemultiplexedSeqsWriter.in_dir(output_dir, writer_options)
+    log_f = open(join(output_dir, 'split_library_log.txt'), 'w')
+    histogram_f = open(join(output_dir, 'histograms.txt'), 'w')
+    next_seq_id = split_read_file_pair(read_file_pair, 0, log_f, histogram_f,
+                                       writer.write, **kwargs)
+    writer.close()
+    log_f.close()
+    histogram_f.close()
+    return next_seq_id
+
+
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
     read_arguments_from_file = opts.read_arguments_from_file
@@ -247,62 +466,11 @@ def main():
         option_parser.error("Same number of sequence, barcode, and mapping "
                             "files must be provided.")
 
-    output_dir = opts.output_dir
-    create_dir(output_dir)
-
-    output_fp_temp = '%s/seqs.fna.incomplete' % output_dir
-    output_fp = '%s/seqs.fna' % output_dir
-    output_f = open(output_fp_temp, 'w')
-    qual_fp_temp = '%s/qual.fna.incomplete' % output_dir
-    qual_fp = '%s/seqs.qual' % output_dir
-    output_fastq_fp_temp = '%s/seqs.fastq.incomplete' % output_dir
-    output_fastq_fp = '%s/seqs.fastq' % output_dir
-
-    if store_qual_scores:
-        qual_f = open(qual_fp_temp, 'w')
-        # define a qual writer whether we're storing
-        # qual strings or not so we don't have to check
-        # every time through the for loop below
-
-        def qual_writer(h, q):
-            qual_f.write('>%s\n%s\n' % (h, q))
-    else:
-        def qual_writer(h, q):
-            pass
-
-    if store_demultiplexed_fastq:
-        output_fastq_f = open(output_fastq_fp_temp, 'w')
-        # define a fastq writer whether we're storing
-        # qual strings or not so we don't have to check
-        # every time through the for loop below
-
-        def fastq_writer(h, s, q):
-            output_fastq_f.write(format_fastq_record(h, s, q))
-    else:
-        def fastq_writer(h, s, q):
-            pass
-
-    log_fp = '%s/split_library_log.txt' % output_dir
-    log_f = open(log_fp, 'w')
-    histogram_fp = '%s/histograms.txt' % output_dir
-    histogram_f = open(histogram_fp, 'w')
-
-    for i in range(len(sequence_read_fps)):
-        sequence_read_fp = sequence_read_fps[i]
-        barcode_read_fp = barcode_read_fps[i]
-        mapping_fp = mapping_fps[i]
-        if mapping_fp is not None:
-            mapping_f = open(mapping_fp, 'U')
-            _, _, barcode_to_sample_id, _, _, _, _ = check_map(mapping_f,
-                disable_primer_check=True,
-                has_barcodes=barcode_read_fp is not None)
-        else:
-            mapping_f = None
-            barcode_to_sample_id = {}
-
-        if rev_comp_mapping_barcodes:
-            barcode_to_sample_id = {str(DNA(k).rc()): v for k, v in
-                                    barcode_to_sample_id.iteritems()}
+    barcode_to_sample_ids = []
+    for sequence_read_fp, barcode_read_fp, mapping_fp in \
+            zip(sequence_read_fps, barcode_read_fps, mapping_fps):
+        barcode_to_sample_id = get_barcode_to_sample_id(
+            mapping_fp, barcode_read_fp, rev_comp_mapping_barcodes)
 
         if barcode_type == 'golay_12':
             invalid_golay_barcodes = get_invalid_golay_barcodes(
@@ -315,77 +483,92 @@ def main():
                                     "the barcodes are not 12 base pairs, where # is the size "
                                     "of the barcodes. Invalid codes:\n\t%s" %
                                     ' '.join(invalid_golay_barcodes))
+        barcode_to_sample_ids.append(barcode_to_sample_id)
 
-        log_f.write("Input file paths\n")
-        if mapping_fp is not None:
-            log_f.write('Mapping filepath: %s (md5: %s)\n' %
-                        (mapping_fp, safe_md5(open(mapping_fp)).hexdigest()))
-        log_f.write('Sequence read filepath: %s (md5: %s)\n' %
-                    (sequence_read_fp,
-                     str(safe_md5(open(sequence_read_fp)).hexdigest())))
+    output_dir = opts.output_dir
+    create_dir(output_dir)
 
-        if sequence_read_fp.endswith('.gz'):
-            sequence_read_f = gzip_open(sequence_read_fp)
-        else:
-            sequence_read_f = open(sequence_read_fp, 'U')
-
-        seq_id = start_seq_id
-
-        if barcode_read_fp is not None:
-            log_f.write('Barcode read filepath: %s (md5: %s)\n\n' %
-                        (barcode_read_fp,
-                         safe_md5(open(barcode_read_fp)).hexdigest()))
-
-            if barcode_read_fp.endswith('.gz'):
-                barcode_read_f = gzip_open(barcode_read_fp)
-            else:
-                barcode_read_f = open(barcode_read_fp, 'U')
-
-            seq_generator = process_fastq_single_end_read_file(
-                sequence_read_f, barcode_read_f, barcode_to_sample_id,
-                store_unassigned=retain_unassigned_reads,
-                max_bad_run_length=max_bad_run_length,
-                phred_quality_threshold=phred_quality_threshold,
-                min_per_read_length_fraction=min_per_read_length_fraction,
-                rev_comp=rev_comp, rev_comp_barcode=rev_comp_barcode,
-                seq_max_N=seq_max_N, start_seq_id=start_seq_id,
-                filter_bad_illumina_qual_digit=filter_bad_illumina_qual_digit,
-                log_f=log_f, histogram_f=histogram_f,
-                barcode_correction_fn=barcode_correction_fn,
-                max_barcode_errors=max_barcode_errors,
-                phred_offset=phred_offset)
-        else:
-            seq_generator = process_fastq_single_end_read_file_no_barcode(
-                sequence_read_f, sample_ids[i],
-                store_unassigned=retain_unassigned_reads,
-                max_bad_run_length=max_bad_run_length,
-                phred_quality_threshold=phred_quality_threshold,
-                min_per_read_length_fraction=min_per_read_length_fraction,
-                rev_comp=rev_comp, seq_max_N=seq_max_N,
-                start_seq_id=start_seq_id,
-                filter_bad_illumina_qual_digit=filter_bad_illumina_qual_digit,
-                log_f=log_f, histogram_f=histogram_f,
-                phred_offset=phred_offset)
-
-        for fasta_header, sequence, quality, seq_id in seq_generator:
-            output_f.write('>%s\n%s\n' % (fasta_header, sequence))
-            qual_writer(fasta_header, quality)
-            fastq_writer(fasta_header, sequence, quality)
-
-        start_seq_id = seq_id + 1
-        log_f.write('\n---\n\n')
-
-    output_f.close()
-    rename(output_fp_temp, output_fp)
-
-    # process the optional output files, as necessary
+    output_fp = '%s/seqs.fna' % output_dir
+    qual_fp = '%s/seqs.qual' % output_dir
+    output_fastq_fp = '%s/seqs.fastq' % output_dir
+    read_store_fp = '%s/seqs%s' % (output_dir, read_store_suffix)
+    output_files = [(output_fp, '%s/seqs.fna.incomplete' % output_dir)]
     if store_qual_scores:
-        qual_f.close()
-        rename(qual_fp_temp, qual_fp)
-
+        output_files.append((qual_fp, '%s/qual.fna.incomplete' % output_dir))
     if store_demultiplexed_fastq:
-        output_fastq_f.close()
-        rename(output_fastq_fp_temp, output_fastq_fp)
+        output_files.append((output_fastq_fp,
+                             '%s/seqs.fastq.incomplete' % output_dir))
+    if opts.write_read_store:
+        output_files.append((read_store_fp,
+                             '%s.incomplete' % read_store_fp))
+    output_fps = dict(output_files)
+    writer = DemultiplexedSeqsWriter(
+        output_fps[output_fp], output_fps.get(qual_fp),
+        output_fps.get(output_fastq_fp), output_fps.get(read_store_fp),
+        opts.write_sample_index)
+
+    log_fp = '%s/split_library_log.txt' % output_dir
+    log_f = open(log_fp, 'w')
+    histogram_fp = '%s/histograms.txt' % output_dir
+    histogram_f = open(histogram_fp, 'w')
+
+    split_params = dict(
+        store_unassigned=retain_unassigned_reads,
+        max_bad_run_length=max_bad_run_length,
+        phred_quality_threshold=phred_quality_threshold,
+        min_per_read_length_fraction=min_per_read_length_fraction,
+        rev_comp=rev_comp, rev_comp_barcode=rev_comp_barcode,
+        seq_max_N=seq_max_N,
+        filter_bad_illumina_qual_digit=filter_bad_illumina_qual_digit,
+        barcode_correction_fn=barcode_correction_fn,
+        max_barcode_errors=max_barcode_errors,
+        phred_offset=phred_offset)
+    if sample_ids is None:
+        sample_ids = [None] * len(sequence_read_fps)
+    read_file_pairs = zip(sequence_read_fps, barcode_read_fps, mapping_fps,
+                          barcode_to_sample_ids, sample_ids)
+
+    if opts.jobs_to_start > 1 and len(read_file_pairs) > 1:
+        # demultiplex each pair of files into its own directory, numbering
+        # the sequences from 0, and then concatenate the results, offsetting
+        # the sequence numbers as if the pairs had been processed in turn
+        temp_dir = mkdtemp(dir=output_dir, prefix='split_libraries_fastq_')
+        try:
+            pair_dirs = [join(temp_dir, str(i))
+                         for i in range(len(read_file_pairs))]
+            pool = Pool(min(opts.jobs_to_start, len(read_file_pairs)))
+            try:
+                next_seq_ids = pool.map(
+                    split_read_file_pair_to_dir,
+                    [(pair_dir, pair, writer.Options, split_params)
+                     for pair_dir, pair in zip(pair_dirs, read_file_pairs)])
+            finally:
+                pool.close()
+                pool.join()
+
+            for pair_dir, next_seq_id in zip(pair_dirs, next_seq_ids):
+                log_f.write(
+                    open(join(pair_dir, 'split_library_log.txt')).read())
+                histogram_f.write(
+                    open(join(pair_dir, 'histograms.txt')).read())
+                writer.append_with_offset(pair_dir, start_seq_id)
+                start_seq_id += next_seq_id
+        finally:
+            rmtree(temp_dir)
+    else:
+        for read_file_pair in read_file_pairs:
+            start_seq_id = split_read_file_pair(
+                read_file_pair, start_seq_id, log_f, histogram_f,
+                writer.write, **split_params)
+
+    sample_index = writer.close()
+    for final_fp, incomplete_fp in output_files:
+        rename(incomplete_fp, final_fp)
+    if opts.write_sample_index:
+        write_sample_index(sample_index.Index, output_fp,
+                           output_fp + sample_index_suffix)
+    log_f.close()
+    histogram_f.close()
 
 if __name__ == "__main__":
     main()
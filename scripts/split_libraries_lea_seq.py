@@ -102,8 +102,8 @@ script_info['optional_options'] = [
                 '[default: %default]',
                 default=77),
     make_option('--min_difference_in_clusters', type='float',
-                help='the percent identity threshold while using '
-                'uclust to cluster sequence reads, which is helpful'
+                help='the percent identity threshold while '
+                'clustering sequence reads, which is helpful'
                 'in measuring quality of sequencing.'
                 '[default: %default]',
                 default=0.98),
@@ -122,6 +122,9 @@ script_info['optional_options'] = [
                 help='header of reverse primer column'
                 '[default: %default]',
                 default='ReversePrimer'),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+                help='Number of processes across which to spread the '
+                'consensus sequence computation [default: %default]'),
 ]
 script_info['version'] = __version__
 
@@ -142,6 +145,7 @@ def main():
     min_diff_in_clusters = opts.min_difference_in_clusters
     barcode_column = opts.header_barcode_column
     reverse_primer_column = opts.reverse_primer_column
+    jobs_to_start = opts.jobs_to_start
     create_dir(output_dir)
     fwd_consensus_outfile = open(path.join(output_dir, "fwd.fna"), "w")
     rev_consensus_outfile = open(path.join(output_dir, "rev.fna"), "w")
@@ -180,6 +184,10 @@ def main():
         option_parser.error("Invalid barcode length: %d. Must be greater "
                             "than zero." % barcode_len)
 
+    if jobs_to_start < 1:
+        option_parser.error("--jobs_to_start must be greater than zero. "
+                            "You provided %d." % jobs_to_start)
+
     if len(sequence_read_fps) != 2:
         option_parser.error("You must provide exactly two sequence read "
                             "filepaths, the first for forward reads and "
@@ -208,7 +216,8 @@ def main():
                                            min_reads_per_random_bc,
                                            min_diff_in_clusters,
                                            barcode_column,
-                                           reverse_primer_column)
+                                           reverse_primer_column,
+                                           jobs_to_start)
 
     for sample_id in consensus_seq_lookup:
         for bc_index, rand_bc in enumerate(consensus_seq_lookup[sample_id]):
@@ -11,7 +11,8 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 
-from skbio.parse.sequences import parse_fasta
+from qiime.fasta_index import (build_sample_index, write_sample_index,
+                               sample_index_suffix)
 from qiime.util import (parse_command_line_parameters,
                         make_option,
                         split_sequence_file_on_sample_ids_to_files)
@@ -27,27 +28,45 @@ script_info['script_usage'] = [(
     "%prog -i seqs.fna -o out/"),
     ("",
     "Split seqs.fastq into one fastq file per sample and store the resulting fastq files in 'out_fastq'",
-    "%prog -i seqs.fastq --file_type fastq -o out_fastq/")]
-script_info['script_usage_output_to_remove'] = ['$PWD/out/']
+    "%prog -i seqs.fastq --file_type fastq -o out_fastq/"),
+    ("",
+    "Split seqs.fna into one gzipped fasta file per sample and store the resulting files in 'out_gz'",
+    "%prog -i seqs.fna -o out_gz/ --compress"),
+    ("",
+    "Rather than writing per-sample files, write an index of the byte ranges of each sample's sequences in seqs.fna (seqs.fna.sidx, next to seqs.fna). Tools such as extract_seqs_by_sample_id.py and filter_fasta.py use the index to read a sample's sequences directly from seqs.fna",
+    "%prog -i seqs.fna --write_index")]
+script_info['script_usage_output_to_remove'] = ['$PWD/out/', '$PWD/out_gz/',
+                                                  '$PWD/seqs.fna.sidx']
 script_info[
-    'output_description'] = "This script will produce an output directory with as many files as samples."
+    'output_description'] = "This script will produce an output directory with as many files as samples, or, if --write_index is passed, a sample index file next to the input file (<input filepath>.sidx), where tools that can use it will find it. The sample index is a tab-separated file with one line per byte range of the input file, giving the sample id, the byte offset of the range and its length."
 script_info['required_options'] = [
     make_option(
         '-i',
         '--input_seqs_fp',
         type="existing_filepath",
         help='the input fasta file to split'),
+]
+script_info['optional_options'] = [
     make_option(
         '-o',
         '--output_dir',
         type="new_dirpath",
-        help='the output directory [default: %default]'),
-]
-script_info['optional_options'] = [
+        help='the output directory (required unless --write_index is '
+        'passed) [default: %default]'),
     make_option('--buffer_size', type="int", default=500,
-                help="the number of sequences to read into memory before writing to file (you usually won't need to change this) [default: %default]"),
+                help="the number of sequences to read into memory for a sample before writing them to file (you usually won't need to change this) [default: %default]"),
+    make_option('--max_buffer_size', type="int", default=64,
+                help="the maximum amount of sequence data (in MB) to hold in memory before writing to file (you usually won't need to change this) [default: %default]"),
+    make_option('--max_open_files', type="int", default=256,
+                help="the maximum number of output files to hold open at once (you usually won't need to change this) [default: %default]"),
     make_option('--file_type', type=str, default='fasta',
-                help="Type of file. Either fasta or fastq")
+                help="Type of file. Either fasta or fastq"),
+    make_option('--compress', action='store_true', default=False,
+                help="gzip the per-sample output files [default: %default]"),
+    make_option('--write_index', action='store_true', default=False,
+                help="write an index of the byte ranges of each sample's "
+                "sequences in the input file (to <input_seqs_fp>.sidx), "
+                "rather than per-sample files [default: %default]")
 ]
 script_info['version'] = __version__
 
@@ -56,12 +75,28 @@ def main():
     option_parser, opts, args =\
         parse_command_line_parameters(**script_info)
 
-    with open(opts.input_seqs_fp, 'U') as input_seqs_f:
+    if opts.write_index:
+        # the index is written next to the input file, which is where
+        # SampleIndex (and so the scripts that use it) look for it
+        with open(opts.input_seqs_fp, 'rb') as input_seqs_f:
+            index = build_sample_index(input_seqs_f, opts.file_type)
+        write_sample_index(index, opts.input_seqs_fp,
+                           opts.input_seqs_fp + sample_index_suffix)
+        return
+
+    if opts.output_dir is None:
+        option_parser.error("-o/--output_dir is required unless "
+                            "--write_index is passed.")
+
+    with open(opts.input_seqs_fp, 'rb') as input_seqs_f:
         split_sequence_file_on_sample_ids_to_files(
             input_seqs_f,
             opts.file_type,
             opts.output_dir,
-            opts.buffer_size)
+            opts.buffer_size,
+            max_buffer_size=opts.max_buffer_size * 2 ** 20,
+            max_open_files=opts.max_open_files,
+            compress=opts.compress)
 
 
 if __name__ == "__main__":
@@ -60,6 +60,9 @@ script_info['optional_options'] = [
                 '[default: %default]'),
     make_option('-p', '--suppress_primer_checks', default=False,
                 action='store_true', help='Suppress primer checks ' +
+                '[default: %default]'),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+                help='Number of parts of the fasta file to check at once ' +
                 '[default: %default]')
 
 ]
@@ -106,7 +109,8 @@ def main():
     validate_fasta(
         input_fasta_fp, mapping_fp, output_dir, tree_fp, tree_subset,
         tree_exact_match, same_seq_lens, all_ids_found,
-        opts.suppress_barcode_checks, opts.suppress_primer_checks)
+        opts.suppress_barcode_checks, opts.suppress_primer_checks,
+        opts.jobs_to_start)
 
 
 if __name__ == "__main__":
@@ -19,9 +19,14 @@ from unittest import TestCase, main
 from skbio.util import remove_files
 
 
+from skbio.parse.sequences import parse_fastq
+
 from qiime.convert_fastaqual_fastq import (convert_fastq, convert_fastaqual,
                                            convert_fastaqual_fastq,
+                                           convert_fastaqual_fastq_files,
+                                           convert_read_store,
                                            get_filename_with_new_ext)
+from qiime.read_store import ReadStoreWriter
 
 
 class MakeFastqTests(TestCase):
@@ -155,6 +160,34 @@ class MakeFastqTests(TestCase):
 
             self.assertEquals(actual_output, expected_output)
 
+    def test_convert_fastaqual_fastq_files(self):
+        """ Converts several FASTA and QUAL files at once """
+        input_dir = mkdtemp(prefix='convert_fastaqual_fastq_input_')
+        fasta_fps = [join(input_dir, 'seqs%d.fna' % i) for i in range(3)]
+        qual_fps = [join(input_dir, 'seqs%d.qual' % i) for i in range(3)]
+        for fasta_fp, qual_fp in zip(fasta_fps, qual_fps):
+            open(fasta_fp, 'w').write(fasta_test_string)
+            open(qual_fp, 'w').write(qual_test_string)
+        try:
+            convert_fastaqual_fastq_files(fasta_fps, qual_fps,
+                                          output_directory=self.output_dir,
+                                          processes=2)
+            for i in range(3):
+                actual_output_file_path = join(self.output_dir,
+                                               'seqs%d.fastq' % i)
+                self.assertEquals(open(actual_output_file_path).read(),
+                                  expected_fastq_default_options)
+
+            self.assertRaises(ValueError, convert_fastaqual_fastq_files,
+                              fasta_fps, qual_fps[:2],
+                              output_directory=self.output_dir)
+            # outputs would be written to the same file
+            self.assertRaises(ValueError, convert_fastaqual_fastq_files,
+                              fasta_fps[:1] * 2, qual_fps[:1] * 2,
+                              output_directory=self.output_dir)
+        finally:
+            rmtree(input_dir)
+
     def test_ascii_increment(self):
         """ Tests for proper range of ascii increments """
         self.assertRaises(ValueError, convert_fastq, self.fasta_file_path,
@@ -243,6 +276,36 @@ class MakeFastaqualTests(TestCase):
         self.assertEquals(actual_fasta, expected_fasta_default_options)
         self.assertEquals(actual_qual, expected_qual_default_options)
 
+    def test_convert_read_store(self):
+        """ Read stores are converted to fasta/qual and fastq files """
+        fd, read_store_fp = mkstemp(prefix='read_store_', suffix='.qrs')
+        close(fd)
+        self._files_to_remove.append(read_store_fp)
+        writer = ReadStoreWriter(open(read_store_fp, 'wb'), chunk_size=2)
+        for label, seq, qual in parse_fastq(open(self.fasta_file_path, 'U'),
+                                            phred_offset=33):
+            writer.write(label, seq, qual)
+        writer.close()
+
+        convert_fastaqual_fastq(read_store_fp, None,
+                                conversion_type='read_store_to_fastaqual',
+                                output_directory=self.output_dir)
+        actual_fasta = open(get_filename_with_new_ext(
+            read_store_fp, '.fna', self.output_dir)).read()
+        actual_qual = open(get_filename_with_new_ext(
+            read_store_fp, '.qual', self.output_dir)).read()
+        self.assertEquals(actual_fasta, expected_fasta_default_options)
+        self.assertEquals(actual_qual, expected_qual_default_options)
+
+        convert_read_store(read_store_fp, self.output_dir, to_fastq=True,
+                           full_fasta_headers=True)
+        actual_fastq = open(get_filename_with_new_ext(
+            read_store_fp, '.fastq', self.output_dir)).read()
+        self.assertEquals(actual_fastq, fastq_test_string)
+
+        self.assertRaises(ValueError, convert_read_store, read_store_fp,
+                          self.output_dir, multiple_output_files=True)
+
     def test_full_fasta_headers(self):
         """ Full headers written to fasta/qual files """
         convert_fastaqual(self.fasta_file_path, full_fasta_headers=True,
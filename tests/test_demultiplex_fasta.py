@@ -25,7 +25,8 @@ from qiime.demultiplex_fasta import (
     get_added_demultiplex_field, get_exact_bc_matches, attempt_bc_correction,
     get_curr_bc_added_field, get_demultiplex_data, write_qual_line,
     write_fasta_line, get_label_line, initialize_log_data,
-    get_output_ids, assign_seqs, process_files_and_demultiplex_sequences
+    get_output_ids, assign_seqs, process_files_and_demultiplex_sequences,
+    iter_seq_records, iter_assign_seqs_jobs, assign_seqs_chunk
 )
 
 
@@ -1384,6 +1385,50 @@ class TopLevelTests(TestCase):
         self.assertEqual(seq_counts, expected_seq_counts)
         self.assertEqual(corrected_bc_count, expected_corrected_bc_count)
 
+    def test_assign_seqs_parallel(self):
+        """ Demultiplexes chunks in separate processes, numbering in order """
+
+        ids_bcs_added_field = {('AACTCGTCGATG', ''): 's1',
+                               ('AGCAGCACTTGT', ''): 's2', ('ACCGCAGAGTCA', ''): 's3'}
+        bc_lens = [12]
+        all_bcs = ['AACTCGTCGATG', 'AGCAGCACTTGT', 'ACCGCAGAGTCA']
+
+        # Chunks are numbered from the count of the sequences before them
+        file_data = {}
+        file_data['fasta_files'] = [self.valid_fasta_file_with_bc_errors]
+        file_data['qual_files'] = [self.valid_qual_file_no_errors]
+        settings = (ids_bcs_added_field, bc_lens, all_bcs)
+        jobs = list(iter_assign_seqs_jobs(iter_seq_records(file_data), 5,
+                                          settings, chunk_size=2))
+        self.assertEqual([(len(records), enum_val)
+                          for records, enum_val, _ in jobs], [(2, 5), (1, 7)])
+        outputs, log_data, bc_freqs, seq_counts, corrected_bc_count =\
+            assign_seqs_chunk(jobs[1][0], jobs[1][1], *settings)
+        self.assertEqual(outputs['demultiplexed_seqs_f'],
+                         '>s2_7 IJKL0003 orig_bc=AGCAGCACTTGT new_bc=AGCAGCACTTGT bc_diffs=0\nGACCGATTACGATAACG\n')
+        self.assertEqual(bc_freqs, [('AGCAGCACTTGT', 1)])
+        self.assertEqual(seq_counts, 1)
+
+        # Results are the same as when demultiplexing in a single process,
+        # including when they are merged from several chunks
+        results = []
+        for processes, chunk_size in [(1, 10000), (1, 1), (2, 1)]:
+            file_data = {}
+            file_data['fasta_files'] = [self.valid_fasta_file_with_bc_errors]
+            file_data['qual_files'] = [self.valid_qual_file_no_errors]
+            file_data['demultiplexed_seqs_f'] = FakeOutFile()
+            file_data['demultiplexed_qual_f'] = FakeOutFile()
+            log_data, bc_freqs, seq_counts, corrected_bc_count =\
+                assign_seqs(file_data, ids_bcs_added_field, bc_lens, all_bcs,
+                            processes=processes, chunk_size=chunk_size)
+            results.append((file_data['demultiplexed_seqs_f'].data,
+                            file_data['demultiplexed_qual_f'].data, log_data,
+                            bc_freqs, seq_counts, corrected_bc_count))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+        self.assertEqual(results[2][4], 3)
+        self.assertEqual(results[2][5], [2, 0])
+
     def test_assign_seqs_exceeds_error_correction(self):
         """ Properly iterates through, demultiplexes with error correction """
 
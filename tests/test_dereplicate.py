@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from os import listdir
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from skbio.parse.sequences import parse_fasta
+
+from qiime.dereplicate import external_sort, dereplicate_seqs
+from qiime.parse import fields_to_dict
+
+
+class DereplicateTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp(prefix='qiime_dereplicate_tests_')
+        self.seqs = list(parse_fasta(fasta1.split('\n')))
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_external_sort(self):
+        """external_sort sorts records in and out of memory"""
+        records = [(5, 'a'), (1, 'b'), (3, 'c'), (1, 'a'), (9, 'z'), (2, 'q')]
+        for max_records in (1, 2, 4, 100):
+            self.assertEqual(list(external_sort(records, max_records,
+                                                tmp_dir=self.tmp_dir)),
+                             sorted(records))
+            self.assertEqual(list(external_sort(records, max_records,
+                                                reverse=True,
+                                                tmp_dir=self.tmp_dir)),
+                             sorted(records, reverse=True))
+        self.assertEqual(list(external_sort([], 2)), [])
+        # temp files are cleaned up
+        self.assertEqual(listdir(self.tmp_dir), [])
+
+    def test_dereplicate_seqs(self):
+        """dereplicate_seqs writes abundance-sorted unique seqs and map"""
+        for max_seqs in (1, 3, 100):
+            unique_seqs_f = StringIO()
+            seq_id_map_f = StringIO()
+            sorted_seqs_f = StringIO()
+            obs = dereplicate_seqs(self.seqs, unique_seqs_f, seq_id_map_f,
+                                   sorted_seqs_f,
+                                   max_seqs_in_memory=max_seqs,
+                                   tmp_dir=self.tmp_dir)
+            self.assertEqual(obs, 3)
+            self.assertEqual(unique_seqs_f.getvalue(), exp_unique_seqs1)
+            self.assertEqual(
+                fields_to_dict(seq_id_map_f.getvalue().split('\n')),
+                {'QiimeExactMatch.s2': ['s2', 's4', 's5'],
+                 'QiimeExactMatch.s1': ['s1', 's6'],
+                 'QiimeExactMatch.s3': ['s3']})
+            self.assertEqual(sorted_seqs_f.getvalue(), exp_sorted_seqs1)
+            self.assertEqual(listdir(self.tmp_dir), [])
+
+    def test_dereplicate_seqs_input_order(self):
+        """dereplicate_seqs can retain the input order of unique seqs"""
+        for max_seqs in (1, 100):
+            unique_seqs_f = StringIO()
+            dereplicate_seqs(self.seqs, unique_seqs_f,
+                             sort_by_abundance=False,
+                             max_seqs_in_memory=max_seqs,
+                             tmp_dir=self.tmp_dir)
+            self.assertEqual(unique_seqs_f.getvalue(),
+                             '>QiimeExactMatch.s1\nACGT\n'
+                             '>QiimeExactMatch.s2\nAAAA\n'
+                             '>QiimeExactMatch.s3\nCCCC\n')
+
+
+fasta1 = """>s1 comment
+ACGT
+>s2
+AAAA
+>s3
+CCCC
+>s4 x
+AAAA
+>s5
+AAAA
+>s6
+ACGT
+"""
+
+exp_unique_seqs1 = """>QiimeExactMatch.s2
+AAAA
+>QiimeExactMatch.s1
+ACGT
+>QiimeExactMatch.s3
+CCCC
+"""
+
+exp_sorted_seqs1 = """>s2
+AAAA
+>s4 x
+AAAA
+>s5
+AAAA
+>s1 comment
+ACGT
+>s6
+ACGT
+>s3
+CCCC
+"""
+
+if __name__ == "__main__":
+    main()
@@ -17,10 +17,12 @@ from unittest import TestCase, main
 
 import numpy as np
 from skbio.util import create_dir
+from skbio.sequence import BiologicalSequenceError
 from qiime.extract_barcodes import (extract_barcodes,
                                     process_barcode_single_end_data, process_barcode_paired_end_data,
                                     process_barcode_paired_stitched, process_barcode_in_label,
-                                    get_primers)
+                                    get_primers, reverse_complement_seqs,
+                                    process_barcode_paired_stitched_reads)
 
 
 class FakeOutFile(object):
@@ -175,6 +177,47 @@ class ExtractBarcodes(TestCase):
 
         self.assertEqual(actual_reads, expected_reads)
 
+    def test_reverse_complement_seqs(self):
+        """ Reverse complements a list of sequences """
+
+        self.assertEqual(reverse_complement_seqs(['AACG', '', 'tRN-', 'G']),
+                         ['CGTT', '', '-NYa', 'C'])
+        self.assertEqual(reverse_complement_seqs([]), [])
+        self.assertRaises(BiologicalSequenceError, reverse_complement_seqs,
+                          ['ACG', 'AXG'])
+
+    def test_process_barcode_paired_stitched_reads(self):
+        """ Handles blocks of stitched reads, orients reads """
+
+        reads = [("r1", "AAAATTTTCCCCGGGG", "ABCDEFGHIJKLMNOP"),
+                 ("r2", "TTGGTTTTCCCCAAAC", "ABCDEFGHIJKLMNOP"),
+                 ("r3", "GGGGGGGGGGGGGGGG", "ABCDEFGHIJKLMNOP")]
+        reads_out = FakeOutFile()
+        bcs_out = FakeOutFile()
+        output_bc_not_oriented = FakeOutFile()
+        fastq_out_not_oriented = FakeOutFile()
+        forward_primers = [compile('AAAATT')]
+        reverse_primers = [compile('GGTTTT')]
+
+        process_barcode_paired_stitched_reads(reads, bcs_out, reads_out,
+                                              bc1_len=2, bc2_len=3, rev_comp_bc2=True,
+                                              attempt_read_orientation=True, forward_primers=forward_primers,
+                                              reverse_primers=reverse_primers,
+                                              output_bc_not_oriented=output_bc_not_oriented,
+                                              fastq_out_not_oriented=fastq_out_not_oriented)
+
+        # r2 is reverse complemented (and its quality scores reversed)
+        self.assertEqual(bcs_out.data.split('\n'),
+                         ['@r1', 'AACCC', '+', 'ABPON', '@r2', 'GTTTG',
+                          '+', 'POABC', ''])
+        self.assertEqual(reads_out.data.split('\n'),
+                         ['@r1', 'AATTTTCCCCG', '+', 'CDEFGHIJKLM',
+                          '@r2', 'TTGGGGAAAAC', '+', 'NMLKJIHGFED', ''])
+        self.assertEqual(output_bc_not_oriented.data.split('\n'),
+                         ['@r3', 'GGCCC', '+', 'ABPON', ''])
+        self.assertEqual(fastq_out_not_oriented.data.split('\n'),
+                         ['@r3', 'GGGGGGGGGGG', '+', 'CDEFGHIJKLM', ''])
+
     def test_process_barcode_paired_end_data(self):
         """ Handles paired fastq lines, parses barcodes """
 
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from os import utime
+from os.path import exists, getmtime
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from qiime.fasta_index import (build_fasta_index, parse_fasta_index,
+                               parse_fasta_with_offsets,
+                               parse_fastq_with_offsets, write_fasta_index,
+                               build_sample_index, write_sample_index,
+                               parse_sample_index, sample_index_is_current,
+                               FastaIndex, SampleIndex)
+
+
+class FastaIndexTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp(prefix='qiime_fasta_index_tests_')
+        self.fasta_fp = '%s/seqs.fna' % self.tmp_dir
+        open(self.fasta_fp, 'w').write(fasta1)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_build_fasta_index(self):
+        """build_fasta_index records the offset and length of each record"""
+        expected = {'s1': (0, 29), 's2': (29, 17), 's3': (46, 9)}
+        self.assertEqual(build_fasta_index(StringIO(fasta1)), expected)
+        self.assertEqual(build_fasta_index(StringIO('')), {})
+        # duplicate sequence ids can't be indexed
+        self.assertRaises(ValueError, build_fasta_index,
+                          StringIO(fasta1 + '>s2 again\nA\n'))
+
+    def test_parse_fasta_with_offsets(self):
+        """parse_fasta_with_offsets yields records with their offsets"""
+        self.assertEqual(list(parse_fasta_with_offsets(StringIO(fasta1))),
+                         [('s1 some comment', 'ACGTACGTAA', 0, 29),
+                          ('s2', 'GGGGCCCCTT', 29, 17),
+                          ('s3', 'ACGT', 46, 9)])
+        self.assertEqual(list(parse_fasta_with_offsets(StringIO(''))), [])
+
+    def test_parse_fastq_with_offsets(self):
+        """parse_fastq_with_offsets yields records with their offsets"""
+        self.assertEqual(list(parse_fastq_with_offsets(StringIO(fastq1))),
+                         [('S1_0 x', 'ACG', 'III', 0, 18),
+                          ('S1_1', 'AA', 'II', 18, 18)])
+        # wrapped sequences and quality scores
+        wrapped = '@a\nAC\nGT\n+\nII\nII\n@b\nA\n+\n@\n@c\n\n+\n\n'
+        self.assertEqual(list(parse_fastq_with_offsets(StringIO(wrapped))),
+                         [('a', 'ACGT', 'IIII', 0, 17),
+                          ('b', 'A', '@', 17, 9),
+                          ('c', '', '', 26, 7)])
+        self.assertRaises(ValueError, list,
+                          parse_fastq_with_offsets(StringIO('@a\nAC\n+\n')))
+        self.assertRaises(ValueError, list,
+                          parse_fastq_with_offsets(StringIO('@a\nAC\n')))
+        self.assertRaises(ValueError, list, parse_fastq_with_offsets(
+                          StringIO('@a\nAC\n+\nIII\n')))
+        self.assertRaises(ValueError, list,
+                          parse_fastq_with_offsets(StringIO(fasta1)))
+
+    def test_build_sample_index(self):
+        """build_sample_index merges consecutive records of a sample"""
+        self.assertEqual(build_sample_index(StringIO(demux_fasta1)),
+                         {'S1': [(0, 22), (34, 11)],
+                          'S.2': [(22, 12)]})
+        self.assertEqual(build_sample_index(StringIO(fastq1), 'fastq'),
+                         {'S1': [(0, 36)]})
+        self.assertRaises(ValueError, build_sample_index,
+                          StringIO(fastq1), 'sff')
+
+    def test_write_and_parse_sample_index(self):
+        """sample indices can be written and parsed"""
+        seqs_fp = '%s/seqs.fna' % self.tmp_dir
+        open(seqs_fp, 'w').write(demux_fasta1)
+        index = build_sample_index(open(seqs_fp, 'rb'))
+        index_fp = seqs_fp + '.sidx'
+        write_sample_index(index, seqs_fp, index_fp)
+        lines = open(index_fp, 'U').readlines()
+        self.assertEqual(lines[1:], ['S1\t0\t22\n', 'S.2\t22\t12\n',
+                                     'S1\t34\t11\n'])
+        self.assertEqual(parse_sample_index(lines), index)
+
+    def test_sample_index(self):
+        """SampleIndex reads only the records of the requested samples"""
+        seqs_fp = '%s/seqs.fna' % self.tmp_dir
+        open(seqs_fp, 'w').write(demux_fasta1)
+        self.assertFalse(sample_index_is_current(seqs_fp))
+        self.assertRaises(ValueError, SampleIndex, seqs_fp)
+        write_sample_index(build_sample_index(open(seqs_fp, 'rb')),
+                           seqs_fp, seqs_fp + '.sidx')
+        self.assertTrue(sample_index_is_current(seqs_fp))
+
+        seqs = SampleIndex(seqs_fp)
+        self.assertEqual(sorted(seqs), ['S.2', 'S1'])
+        self.assertTrue('S1' in seqs)
+        self.assertEqual(list(seqs.iter_records(['S1', 'x'])),
+                         [('S1_0', 'ACGT'), ('S1_1', 'ACGT'),
+                          ('S1_3', 'ACGT')])
+        self.assertEqual(list(seqs.iter_lines(['S.2'])),
+                         ['>S.2_2\n', 'ACGT\n'])
+        self.assertEqual(list(seqs.iter_records([])), [])
+
+    def test_write_and_parse_fasta_index(self):
+        """fasta indices can be written and parsed"""
+        index = build_fasta_index(open(self.fasta_fp, 'rb'))
+        index_fp = '%s/seqs.fna.idx' % self.tmp_dir
+        write_fasta_index(index, self.fasta_fp, index_fp)
+        self.assertEqual(parse_fasta_index(open(index_fp, 'U')), index)
+
+    def test_getitem(self):
+        """FastaIndex returns sequences by id"""
+        seqs = FastaIndex(self.fasta_fp)
+        self.assertEqual(seqs['s1'], 'ACGTACGTAA')
+        self.assertEqual(seqs['s2'], 'GGGGCCCCTT')
+        self.assertEqual(seqs['s3'], 'ACGT')
+        self.assertEqual(seqs.get_label('s1'), 's1 some comment')
+        self.assertRaises(KeyError, seqs.__getitem__, 'S1')
+        self.assertEqual(seqs.get('S1'), None)
+        self.assertTrue('s2' in seqs)
+        self.assertEqual(len(seqs), 3)
+        self.assertEqual(dict(seqs), {'s1': 'ACGTACGTAA',
+                                      's2': 'GGGGCCCCTT',
+                                      's3': 'ACGT'})
+        self.assertEqual(seqs.items(), [('s1', 'ACGTACGTAA'),
+                                        ('s2', 'GGGGCCCCTT'),
+                                        ('s3', 'ACGT')])
+        seqs.close()
+
+    def test_iter_records(self):
+        """FastaIndex yields requested records in file order"""
+        seqs = FastaIndex(self.fasta_fp)
+        self.assertEqual(list(seqs.iter_records(['s3', 's1', 'x'])),
+                         [('s1 some comment', 'ACGTACGTAA'),
+                          ('s3', 'ACGT')])
+        self.assertEqual([label for label, seq in seqs.iter_records()],
+                         ['s1 some comment', 's2', 's3'])
+
+    def test_save_index(self):
+        """FastaIndex saves and reuses the index file"""
+        index_fp = self.fasta_fp + '.idx'
+        FastaIndex(self.fasta_fp)
+        self.assertFalse(exists(index_fp))
+        FastaIndex(self.fasta_fp, save_index=True)
+        self.assertTrue(exists(index_fp))
+
+        # the saved index is used if it's up-to-date...
+        open(index_fp, 'a').write('s4\t46\t9\n')
+        seqs = FastaIndex(self.fasta_fp)
+        self.assertEqual(seqs['s4'], 'ACGT')
+
+        # ...and rebuilt if the fasta file has changed
+        open(self.fasta_fp, 'a').write('>s5\nAA\n')
+        mtime = getmtime(self.fasta_fp) + 10
+        utime(self.fasta_fp, (mtime, mtime))
+        seqs = FastaIndex(self.fasta_fp)
+        self.assertFalse('s4' in seqs)
+        self.assertEqual(seqs['s5'], 'AA')
+
+    def test_empty_file(self):
+        """FastaIndex handles empty fasta files"""
+        open(self.fasta_fp, 'w').close()
+        seqs = FastaIndex(self.fasta_fp)
+        self.assertEqual(len(seqs), 0)
+        self.assertEqual(list(seqs.iter_records()), [])
+        seqs.close()
+
+
+fasta1 = """>s1 some comment
+ACGTAC
+GTAA
+>s2
+GGGGCCCC
+TT
+
+>s3
+ACGT
+"""
+
+fastq1 = """@S1_0 x
+ACG
++
+III
+@S1_1
+AA
++S1_1
+II
+"""
+
+demux_fasta1 = """>S1_0
+ACGT
+>S1_1
+ACGT
+>S.2_2
+ACGT
+>S1_3
+ACGT
+"""
+
+if __name__ == "__main__":
+    main()
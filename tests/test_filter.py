@@ -20,6 +20,7 @@ from numpy.testing import assert_almost_equal
 from cogent.parse.tree import DndParser
 from cogent.core.tree import PhyloNode
 from skbio.util import remove_files, safe_md5
+from skbio.parse.sequences import parse_fasta
 from biom.parse import parse_biom_table
 from qiime.parse import (parse_distmat, parse_mapping_file,
                          parse_metadata_state_descriptions)
@@ -37,6 +38,9 @@ from qiime.filter import (filter_fasta, filter_samples_from_otu_table,
                           sample_ids_from_metadata_description,
                           get_seq_ids_from_seq_id_file)
 from qiime.test import FakeFile
+from qiime.fasta_index import (FastaIndex, SampleIndex, build_sample_index,
+                               write_sample_index)
+from qiime.read_store import ReadStore, ReadStoreWriter
 from qiime.util import get_qiime_temp_dir
 
 
@@ -181,6 +185,50 @@ T"""
                      negate=True)
         self.assertEqual(actual.s, self.filter_fasta_expected2)
 
+        # only the kept sequences are read when filtering a FastaIndex
+        fd, fasta_fp = mkstemp(prefix='qiime_filter_fasta_', suffix='.fna')
+        close(fd)
+        open(fasta_fp, 'w').write(input_seqs)
+        input_index = FastaIndex(fasta_fp)
+        actual = fake_output_f()
+        filter_fasta(input_index, actual, seqs_to_keep, negate=False)
+        self.assertEqual(actual.s, self.filter_fasta_expected1)
+        actual = fake_output_f()
+        filter_fasta(input_index, actual, seqs_to_keep, negate=True)
+        self.assertEqual(actual.s, self.filter_fasta_expected2)
+        # seqid_f is passed the full sequence labels
+        actual = fake_output_f()
+        filter_fasta(input_index, actual, seqs_to_keep, negate=False,
+                     seqid_f=lambda label: 'comment' in label)
+        self.assertEqual(actual.s, ''.join(
+            ['>%s\n%s\n' % r for r in parse_fasta(StringIO(input_seqs))
+             if 'comment' in r[0]]))
+        input_index.close()
+
+        # only the kept samples are read when filtering a SampleIndex
+        write_sample_index(build_sample_index(open(fasta_fp, 'rb')),
+                           fasta_fp, fasta_fp + '.sidx')
+        input_index = SampleIndex(fasta_fp)
+        actual = fake_output_f()
+        filter_fasta(input_index, actual, None,
+                     seqid_f=lambda x: x.split('_')[0] in ['S3', 'S7'])
+        self.assertEqual(actual.s, '>S3\nAAGGCCGG\n>S7\nT\n')
+        remove_files([fasta_fp, fasta_fp + '.sidx'])
+
+        # read stores are decoded and filtered
+        fd, read_store_fp = mkstemp(prefix='qiime_filter_fasta_',
+                                    suffix='.qrs')
+        close(fd)
+        writer = ReadStoreWriter(open(read_store_fp, 'wb'))
+        for seq_id, seq in parse_fasta(StringIO(input_seqs)):
+            writer.write(seq_id, seq)
+        writer.close()
+        actual = fake_output_f()
+        filter_fasta(ReadStore(read_store_fp), actual, seqs_to_keep,
+                     negate=True)
+        self.assertEqual(actual.s, self.filter_fasta_expected2)
+        remove_files([read_store_fp])
+
     def test_filter_fastq(self):
         """filter_fastq functions as expected"""
 
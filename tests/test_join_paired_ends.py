@@ -15,8 +15,12 @@ import os
 import shutil
 from tempfile import mkdtemp, NamedTemporaryFile
 
+from random import choice, randint, seed
 from unittest import TestCase, main
-from qiime.join_paired_ends import write_synced_barcodes_fastq
+from qiime.join_paired_ends import (write_synced_barcodes_fastq,
+                                    find_overlap,
+                                    join_overlapping_reads,
+                                    join_paired_end_reads_native)
 
 
 class JoinPairedEndsTests(TestCase):
@@ -103,6 +107,129 @@ class JoinPairedEndsTests(TestCase):
                           self.jpe_fp,
                           self.missing_bc_fp)
 
+    def test_find_overlap(self):
+        """find_overlap: should find the overlap that fastq-join would"""
+        self.assertEqual(find_overlap('AAAACCCCGGGGTTTTACGT',
+                                      'GGGGTTTTACGTCCAA'), 12)
+        # one mismatch is more than 8% of 12 bases
+        self.assertEqual(find_overlap('AAAACCCCGGGGTTTTACGT',
+                                      'GGGGTTATACGTCCAA'), 0)
+        self.assertEqual(find_overlap('AAAACCCCGGGGTTTTACGT',
+                                      'GGGGTTATACGTCCAA',
+                                      perc_max_diff=10), 12)
+        self.assertEqual(find_overlap('ACGTA', 'ACGTA'), 0)
+        # overlaps that score the same (all 0 mismatch overlaps of 201 to
+        # 250 bases score 4) are resolved in favor of the longest
+        self.assertEqual(find_overlap('G' * 250, 'G' * 250), 250)
+
+        # compare with scoring each overlap in turn, from the longest, as
+        # fastq-join does
+        seed(0)
+        for i in range(50):
+            seq1 = ''.join([choice('ACGT') for j in range(randint(5, 40))])
+            seq2 = ''.join([choice('ACGT') for j in range(randint(5, 40))])
+            if i % 2:
+                seq2 = seq1[randint(0, len(seq1) - 1):] + seq2
+            best_score, expected = None, 0
+            for k in range(min(len(seq1), len(seq2)), 3, -1):
+                d = sum([a != b for a, b in zip(seq1[-k:], seq2[:k])])
+                score = 1000 * (d * d + 1) // k
+                if d <= 20 * k // 100 and (best_score is None or
+                                           score < best_score):
+                    best_score, expected = score, k
+            self.assertEqual(find_overlap(seq1, seq2, 4, 20), expected)
+
+    def test_join_overlapping_reads(self):
+        """join_overlapping_reads: should keep the more likely bases"""
+        seq, qual = join_overlapping_reads('AACCGGTA', 'IIIIIII5', 'GGTTCC',
+                                           '+III++', 4)
+        self.assertEqual(seq, 'AACCGGTTCC')
+        # agreeing bases score at most 41, and the disagreeing base is taken
+        # from read 2 (Q40 over Q20), scoring 20
+        self.assertEqual(qual, 'IIIIJJJ5++')
+
+    def test_join_paired_end_reads_native(self):
+        """join_paired_end_reads_native: should join and sync barcodes"""
+        reads1_fp = os.path.join(self.temp_dir_path, 'reads1.fastq')
+        reads2_fp = os.path.join(self.temp_dir_path, 'reads2.fastq')
+        with open(reads1_fp, 'w') as f:
+            f.write('@r1 1:N:0\nAAAACCCCGGGGTTTTACGT\n+\nIIIIIIIIIIIIIIIIIIII\n'
+                    '@r2 1:N:0\nACACACACACACACACACAC\n+\nIIIIIIIIIIIIIIIIIIII\n')
+        with open(reads2_fp, 'w') as f:
+            f.write('@r1 2:N:0\nTTGGACGTAAAACCCC\n+\nIIIIIIIIIIIIIIII\n'
+                    '@r2 2:N:0\nGGGGGGGGGG\n+\nIIIIIIIIII\n')
+        index_fp = os.path.join(self.temp_dir_path, 'index.fastq')
+        with open(index_fp, 'w') as f:
+            f.write('@r1 1:N:0\nACGT\n+\nFFFF\n@r2 1:N:0\nTGCA\n+\nFFFF\n')
+
+        for processes in 1, 2:
+            paths = join_paired_end_reads_native(
+                reads1_fp, reads2_fp, working_dir=self.temp_dir_path,
+                index_reads_fp=index_fp, processes=processes,
+                chunk_size=1)
+            self.assertEqual(open(paths['Assembled']).read(),
+                             '@r1 1:N:0\nAAAACCCCGGGGTTTTACGTCCAA\n+\n'
+                             'IIIIIIIIJJJJJJJJJJJJIIII\n')
+            self.assertEqual(open(paths['UnassembledReads1']).read(),
+                             '@r2 1:N:0\nACACACACACACACACACAC\n+\n'
+                             'IIIIIIIIIIIIIIIIIIII\n')
+            self.assertEqual(open(paths['UnassembledReads2']).read(),
+                             '@r2 2:N:0\nGGGGGGGGGG\n+\nIIIIIIIIII\n')
+            self.assertEqual(paths['Barcodes'],
+                             os.path.join(self.temp_dir_path,
+                                          'nativejoin.join_barcodes.fastq'))
+            self.assertEqual(open(paths['Barcodes']).read(),
+                             '@r1 1:N:0\nACGT\n+\nFFFF\n')
+
+        # the index reads must have the headers of the forward reads
+        self.assertRaises(ValueError, join_paired_end_reads_native,
+                          reads1_fp, reads2_fp,
+                          working_dir=self.temp_dir_path,
+                          index_reads_fp=self.all_bc_fp)
+        self.assertRaises(ValueError, join_paired_end_reads_native,
+                          reads1_fp, reads2_fp, min_overlap=0)
+
+    def test_join_paired_end_reads_native_mismatched_files(self):
+        """join_paired_end_reads_native: should reject unpaired reads"""
+        reads = ['@r1 %d:N:0\nAAAACCCCGGGGTTTTACGT\n+\nIIIIIIIIIIIIIIIIIIII\n',
+                 '@r2 %d:N:0\nACACACACACACACACACAC\n+\nIIIIIIIIIIIIIIIIIIII\n']
+        reads1_fp = os.path.join(self.temp_dir_path, 'reads1.fastq')
+        reads2_fp = os.path.join(self.temp_dir_path, 'reads2.fastq')
+        short_reads2_fp = os.path.join(self.temp_dir_path, 'short2.fastq')
+        other_reads2_fp = os.path.join(self.temp_dir_path, 'other2.fastq')
+        index_fp = os.path.join(self.temp_dir_path, 'index.fastq')
+        with open(reads1_fp, 'w') as f:
+            f.write(''.join([r % 1 for r in reads]))
+        with open(reads2_fp, 'w') as f:
+            f.write(''.join([r % 2 for r in reads]))
+        with open(short_reads2_fp, 'w') as f:
+            f.write(reads[0] % 2)
+        with open(other_reads2_fp, 'w') as f:
+            f.write(''.join([r % 2 for r in reversed(reads)]))
+        with open(index_fp, 'w') as f:
+            f.write('@r1 1:N:0\nACGT\n+\nFFFF\n')
+
+        for processes in 1, 2:
+            # reads 2 file is one read short
+            self.assertRaises(ValueError, join_paired_end_reads_native,
+                              reads1_fp, short_reads2_fp,
+                              working_dir=self.temp_dir_path,
+                              processes=processes)
+            # index reads file is one read short
+            self.assertRaises(ValueError, join_paired_end_reads_native,
+                              reads1_fp, reads2_fp,
+                              working_dir=self.temp_dir_path,
+                              index_reads_fp=index_fp, processes=processes)
+            # reads 2 are in a different order
+            self.assertRaises(ValueError, join_paired_end_reads_native,
+                              reads1_fp, other_reads2_fp,
+                              working_dir=self.temp_dir_path,
+                              processes=processes)
+        # reads 1 file is one read short
+        self.assertRaises(ValueError, join_paired_end_reads_native,
+                          short_reads2_fp, reads1_fp,
+                          working_dir=self.temp_dir_path)
+
 
 all_barcodes = """@MISEQ03:64:000000000-A2H3D:1:1101:14358:1530 1:N:0:TCCACAGGAGT
 TCCACAGGAGT
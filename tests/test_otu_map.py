@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from StringIO import StringIO
+from unittest import TestCase, main
+
+from qiime.otu_map import OtuMap
+
+
+class OtuMapTests(TestCase):
+
+    def setUp(self):
+        self.otu_map1 = OtuMap.from_lines(otu_map1.split('\n'))
+        self.otu_map2 = OtuMap.from_lines(otu_map2.split('\n'))
+
+    def test_from_lines(self):
+        """OtuMap parses OTU map files"""
+        self.assertEqual(self.otu_map1.OtuIds, ['0', '1', '2'])
+        self.assertEqual(self.otu_map1['1'], ['seq3', 'seq4'])
+        self.assertEqual(self.otu_map1.to_dict(),
+                         {'0': ['seq1', 'seq2', 'seq5'],
+                          '1': ['seq3', 'seq4'],
+                          '2': ['seq6', 'seq7', 'seq8']})
+        self.assertEqual(list(self.otu_map1.Offsets), [0, 3, 5, 8])
+        self.assertEqual(len(self.otu_map1.SeqIds), 8)
+        self.assertTrue('2' in self.otu_map1)
+        self.assertFalse('3' in self.otu_map1)
+        self.assertEqual(len(self.otu_map1), 3)
+
+        # mixed whitespace, and the last entry for a repeated OTU id is kept
+        otu_map = OtuMap.from_lines(['a\tx y', 'b z', '', 'a\tw'],
+                                    delim=None)
+        self.assertEqual(otu_map.items(), [('a', ['w']), ('b', ['z'])])
+
+    def test_from_clusters(self):
+        """OtuMap can be built from lists of clusters"""
+        otu_map = OtuMap.from_clusters([['s1', 's2'], [], ['s1']],
+                                       otu_ids=['x', 'y', 'z'])
+        self.assertEqual(otu_map.items(),
+                         [('x', ['s1', 's2']), ('y', []), ('z', ['s1'])])
+        self.assertEqual(otu_map.SeqIds, ['s1', 's2'])
+        self.assertEqual(OtuMap.from_clusters([]).items(), [])
+
+    def test_expand(self):
+        """OtuMap.expand composes chained OTU maps"""
+        expanded = self.otu_map2.expand(self.otu_map1)
+        self.assertEqual(expanded.items(),
+                         [('110', ['seq1', 'seq2', 'seq5', 'seq6', 'seq7',
+                                   'seq8']),
+                          ('221', ['seq3', 'seq4'])])
+        otu_map3 = OtuMap.from_lines(['a\t110\t221'])
+        self.assertEqual(otu_map3.expand(expanded).items(),
+                         [('a', ['seq1', 'seq2', 'seq5', 'seq6', 'seq7',
+                                 'seq8', 'seq3', 'seq4'])])
+        self.assertRaises(KeyError, otu_map3.expand, self.otu_map1)
+
+    def test_expand_ids(self):
+        """OtuMap.expand_ids returns the members of several OTUs"""
+        self.assertEqual(self.otu_map1.expand_ids(['2', '0']),
+                         ['seq6', 'seq7', 'seq8', 'seq1', 'seq2', 'seq5'])
+        self.assertEqual(self.otu_map1.expand_ids([]), [])
+        self.assertRaises(KeyError, self.otu_map1.expand_ids, ['3'])
+
+    def test_write(self):
+        """OtuMap writes QIIME OTU map files"""
+        f = StringIO()
+        self.otu_map1.write(f)
+        self.assertEqual(f.getvalue(), otu_map1)
+
+
+otu_map1 = """0\tseq1\tseq2\tseq5
+1\tseq3\tseq4
+2\tseq6\tseq7\tseq8
+"""
+
+otu_map2 = """110\t0\t2
+221\t1
+"""
+
+if __name__ == "__main__":
+    main()
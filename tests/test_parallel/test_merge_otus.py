@@ -1,9 +1,17 @@
 #!/usr/bin/env python
 
 from unittest import TestCase, main
+from shutil import rmtree
+from tempfile import mkdtemp
+from os.path import join
+from numpy import array
+from biom import load_table
+from biom.table import Table
 from qiime.parallel.merge_otus import mergetree, mergeorder, \
     initial_nodes_to_merge, initial_has_dependencies, job_complete, \
-    torque_job, local_job, start_job, JobError, reset_internal_count
+    torque_job, local_job, start_job, JobError, reset_internal_count, \
+    merge_otu_tables_kway
+from qiime.util import write_biom_table
 import os
 
 __author__ = "Daniel McDonald"
@@ -115,5 +123,89 @@ class MergeTests(TestCase):
         obs = local_job('abc', 'xyz', 'notused', 'notused')
         self.assertEqual(obs, exp)
 
+
+class MergeOtuTablesKwayTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp(prefix='qiime_merge_otus_tests_')
+        tables = [
+            Table(array([[1, 0], [2, 3]]), ['O1', 'O2'], ['S1', 'S2'],
+                  [{'taxonomy': ['k__A']}, {'taxonomy': ['k__B']}],
+                  [{'run': '1'}, {'run': '1'}]),
+            Table(array([[4, 5], [0, 1]]), ['O3', 'O1'], ['S2', 'S3'],
+                  [{'taxonomy': ['k__C']}, {'taxonomy': ['k__X']}],
+                  [{'run': '2'}, {'run': '2'}]),
+            Table(array([[7], [8], [9]]), ['O2', 'O4', 'O3'], ['S4'],
+                  [{'taxonomy': ['k__B']}, {'taxonomy': ['k__D']},
+                   {'taxonomy': ['k__C']}],
+                  [{'run': '3'}])]
+        self.table_fps = []
+        for i, table in enumerate(tables):
+            table_fp = join(self.tmp_dir, 't%d.biom' % i)
+            write_biom_table(table, table_fp)
+            self.table_fps.append(table_fp)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def pairwise_merge(self, table_fps):
+        master = load_table(table_fps[0])
+        for table_fp in table_fps[1:]:
+            master = master.merge(load_table(table_fp))
+        return master
+
+    def test_merge_otu_tables_kway(self):
+        """k-way merge gives the same table as pairwise merges"""
+        obs = merge_otu_tables_kway(self.table_fps)
+        self.assertEqual(obs, self.pairwise_merge(self.table_fps))
+        self.assertEqual(list(obs.ids(axis='observation')),
+                         ['O1', 'O2', 'O3', 'O4'])
+        self.assertEqual(list(obs.ids()), ['S1', 'S2', 'S3', 'S4'])
+        self.assertEqual(obs.get_value_by_ids('O2', 'S2'), 3.0)
+        self.assertEqual(obs.get_value_by_ids('O3', 'S2'), 4.0)
+        self.assertEqual(obs.get_value_by_ids('O2', 'S4'), 7.0)
+        self.assertEqual(obs.get_value_by_ids('O1', 'S2'), 0.0)
+        # metadata comes from the first table that has the observation
+        self.assertEqual(obs.metadata('O1', axis='observation'),
+                         {'taxonomy': ['k__A']})
+
+    def test_merge_otu_tables_kway_no_metadata_first(self):
+        """k-way merge handles a first table without metadata as merge does
+        """
+        tables = [Table(array([[5, 0], [0, 6]]), ['O1', 'O5'], ['S1', 'S5']),
+                  Table(array([[1]]), ['O5'], ['S5'],
+                        [{'taxonomy': ['k__E']}], [{'run': '4'}])]
+        table_fps = []
+        for i, table in enumerate(tables):
+            table_fp = join(self.tmp_dir, 'extra%d.biom' % i)
+            write_biom_table(table, table_fp)
+            table_fps.append(table_fp)
+        table_fps.insert(1, self.table_fps[1])
+        obs = merge_otu_tables_kway(table_fps)
+        self.assertEqual(obs, self.pairwise_merge(table_fps))
+        # the first table's ids take metadata from the second table, but
+        # ids that the second table doesn't have get empty metadata, which
+        # later tables don't fill in
+        self.assertEqual(obs.metadata('O1', axis='observation'),
+                         {'taxonomy': ['k__X']})
+        self.assertEqual(obs.metadata('O5', axis='observation'), {})
+        self.assertEqual(obs.metadata('S5'), {})
+
+    def test_merge_otu_tables_kway_parallel(self):
+        """k-way merge with parallel readers gives the same table"""
+        obs = merge_otu_tables_kway(self.table_fps, processes=2)
+        self.assertEqual(obs, self.pairwise_merge(self.table_fps))
+
+    def test_merge_otu_tables_kway_single_table(self):
+        """k-way merge of one table gives that table's data"""
+        obs = merge_otu_tables_kway(self.table_fps[:1])
+        exp = load_table(self.table_fps[0])
+        self.assertEqual(list(obs.ids()), list(exp.ids()))
+        self.assertEqual(obs.get_value_by_ids('O2', 'S2'), 3.0)
+
+    def test_merge_otu_tables_kway_no_tables(self):
+        """k-way merge of no tables raises ValueError"""
+        self.assertRaises(ValueError, merge_otu_tables_kway, [])
+
 if __name__ == '__main__':
     main()
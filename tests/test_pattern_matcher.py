@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from random import choice, randint, seed
+from unittest import TestCase, main
+
+from qiime.pattern_matcher import PatternMatcher
+from qiime.split_libraries import count_mismatches
+
+
+class PatternMatcherTests(TestCase):
+
+    def test_find_all(self):
+        """find_all finds every occurrence of every pattern"""
+        matcher = PatternMatcher(['ACG', 'CGT', 'TTTT', 'ACG'])
+        self.assertEqual(len(matcher), 3)
+        self.assertEqual(matcher.find_all('ACGTTTTTACG'),
+                         [(0, 'ACG', 0), (1, 'CGT', 0), (3, 'TTTT', 0),
+                          (4, 'TTTT', 0), (8, 'ACG', 0)])
+        self.assertEqual(matcher.find_all('AC'), [])
+        self.assertEqual(matcher.search('GGG'), None)
+        self.assertEqual(matcher.search('GGCGT'), (2, 'CGT', 0))
+        self.assertEqual(PatternMatcher([]).find_all('ACGT'), [])
+
+    def test_find_all_mismatches(self):
+        """find_all finds patterns with up to max_mismatches mismatches"""
+        matcher = PatternMatcher(['AAAACCCC', 'GGGG'], max_mismatches=1)
+        self.assertEqual(matcher.find_all('TTAAATCCCCTT'),
+                         [(2, 'AAAACCCC', 1)])
+        self.assertEqual(matcher.find_all('GAGG'), [(0, 'GGGG', 1)])
+        self.assertEqual(matcher.find_all('AATACCGC'), [])
+        # patterns too short to seed are still matched
+        matcher = PatternMatcher(['A', ''], max_mismatches=1)
+        self.assertEqual(matcher.find_all('CG'),
+                         [(0, '', 0), (0, 'A', 1), (1, '', 0), (1, 'A', 1),
+                          (2, '', 0)])
+        self.assertRaises(ValueError, PatternMatcher, ['A'], -1)
+
+    def test_find_all_matches_brute_force(self):
+        """find_all gives the same hits as comparing at every position"""
+        seed(0)
+        patterns = [''.join([choice('ACGT') for i in range(randint(5, 9))])
+                    for j in range(30)]
+        for max_mismatches in range(3):
+            matcher = PatternMatcher(patterns, max_mismatches)
+            for i in range(20):
+                seq = ''.join([choice('ACGT') for i in range(50)])
+                expected = []
+                for pattern in sorted(set(patterns)):
+                    for start in range(len(seq) - len(pattern) + 1):
+                        mm = count_mismatches(seq[start:], pattern, 100)
+                        if mm <= max_mismatches:
+                            expected.append((start, pattern, mm))
+                self.assertEqual(matcher.find_all(seq), sorted(expected))
+
+    def test_expand_degeneracies(self):
+        """degenerate patterns are expanded when requested"""
+        matcher = PatternMatcher(['ACR'], expand_degeneracies=True)
+        self.assertEqual(matcher.patterns, ['ACA', 'ACG'])
+        self.assertTrue('ACG' in matcher)
+        self.assertFalse('ACR' in matcher)
+        self.assertEqual(matcher.search('TTACGTT'), (2, 'ACG', 0))
+        self.assertEqual(PatternMatcher(['ACR']).search('TTACGTT'), None)
+
+    def test_match_start(self):
+        """match_start compares patterns with the start of a sequence"""
+        matcher = PatternMatcher(['AACCGGTT', 'AACCGGAA', 'TTTT'],
+                                 max_mismatches=1)
+        self.assertEqual(matcher.match_start('AACCGGTT'), ('AACCGGTT', 0))
+        self.assertEqual(matcher.match_start('AACCGGTA'), ('AACCGGAA', 1))
+        self.assertEqual(matcher.match_start('CACCGGAA'), ('AACCGGAA', 1))
+        self.assertEqual(matcher.match_start('GACCGGAC'), None)
+        self.assertEqual(matcher.match_start('TATTGGGG'), ('TTTT', 1))
+        # comparisons are over the length of the shorter sequence
+        self.assertEqual(matcher.match_start('AAC'), ('AACCGGAA', 0))
+        self.assertEqual(matcher.match_start(''), ('AACCGGAA', 0))
+        self.assertEqual(PatternMatcher(['ACGT']).match_start('ACGA'), None)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,7 @@ from filecmp import cmp
 
 from unittest import TestCase, main
 from numpy.testing import assert_almost_equal
+from skbio.parse.sequences import parse_fasta
 from skbio.sequence import DNA
 from skbio.util import create_dir, remove_files
 from bfillings.formatdb import build_blast_db_from_fasta_path
@@ -2949,6 +2950,41 @@ class UclustOtuPickerTests(TestCase):
         seq_file.close()
         return fp
 
+    def test_apply_identical_sequences_prefilter(self):
+        """UclustOtuPicker: prefilter can presort by abundance in one pass
+        """
+        seqs = [('s1 comment1', 'ACCTTGTTACTTT'),
+                ('s2 comment2', 'ACCTTGTTACTTTC'),
+                ('s3 comment3', 'ACCTTGTTACTTTCC'),
+                ('s4 comment4', 'ACCTTGTTACTTT'),
+                ('s5 comment5', 'ACCTTGTTACTTTCC'),
+                ('s6 comment6', 'ACCTTGTTACTTT')]
+        seqs_fp = self.seqs_to_temp_fasta(seqs)
+        app = UclustOtuPicker(params={'suppress_sort': False})
+
+        # the result matches presorting and then prefiltering in memory
+        app.files_to_remove = []
+        sorted_fp = app._presort_by_abundance(seqs_fp)
+        self._files_to_remove.append(sorted_fp)
+        exp_seqs, exp_map = app._prefilter_exact_matches(
+            parse_fasta(open(sorted_fp, 'U')))
+
+        app.Params['suppress_sort'] = False
+        obs_map, obs_fp = app._apply_identical_sequences_prefilter(
+            seqs_fp, sort_by_abundance=True)
+        self._files_to_remove.extend(app.files_to_remove)
+        self.assertEqual(list(parse_fasta(open(obs_fp, 'U'))), exp_seqs)
+        self.assertEqual(obs_map.to_dict(), exp_map)
+        self.assertTrue(app.Params['suppress_sort'])
+
+        # without presorting, the input order is retained
+        app.files_to_remove = []
+        obs_map, obs_fp = app._apply_identical_sequences_prefilter(seqs_fp)
+        self._files_to_remove.extend(app.files_to_remove)
+        exp_seqs, exp_map = app._prefilter_exact_matches(seqs)
+        self.assertEqual(list(parse_fasta(open(obs_fp, 'U'))), exp_seqs)
+        self.assertEqual(obs_map.to_dict(), exp_map)
+
     def test_toggle_collapse_identical_sequences(self):
         """UclustOtuPicker: toggle prefilter identical seqs doesn't affect clusters
         """
@@ -22,7 +22,7 @@ from skbio.sequence import DNA
 
 from qiime.pick_rep_set import (RepSetPicker, GenericRepSetPicker, first_id,
                                 first, random_id, longest_id, unique_id_map, label_to_name,
-                                make_most_abundant, parse_fasta, ReferenceRepSetPicker)
+                                make_most_abundant, ReferenceRepSetPicker)
 
 
 class RepSetPickerTests(TestCase):
@@ -129,6 +129,25 @@ class GenericRepSetPickerTests(SharedSetupTestCase):
         # confirm that nothing is returned when result_path is specified
         self.assertEqual(obs, None)
 
+    def test_call_duplicate_ids(self):
+        """GenericRepSetPicker.__call__ uses the last record for duplicate ids
+        """
+        seq_file = open(self.tmp_seq_filepath, 'a')
+        seq_file.write('>U1PLI_7889 duplicate\nAAAA\n')
+        seq_file.close()
+        fd, tmp_result_filepath = mkstemp(
+            prefix='GenericRepSetPickerTest.test_call_duplicate_ids_',
+            suffix='.txt')
+        close(fd)
+        self.files_to_remove.append(tmp_result_filepath)
+
+        app = GenericRepSetPicker(params=self.params)
+        app(self.tmp_seq_filepath, self.tmp_otu_filepath,
+            result_path=tmp_result_filepath)
+        obs = dict(parse_fasta(open(tmp_result_filepath)))
+        self.assertEqual(obs['1 U1PLI_7889'], 'AAAA')
+        self.assertEqual(obs['2 W3Cecum_4858'], 'TTGGGCCGTGTCTCAGT')
+
     def test_call_output_to_file_sorted(self):
         """GenericRepSetPicker.__call__ output to file sorts when requested
         """
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from random import Random
+from unittest import TestCase, main
+
+from skbio.tree import CompressedTrie, fasta_to_pairlist
+
+from qiime.prefix_map import build_prefix_map
+
+
+class PrefixMapTests(TestCase):
+
+    def test_build_prefix_map(self):
+        """build_prefix_map clusters seqs with seqs they are a prefix of"""
+        seqs = [('s1', 'ACGTT'), ('s2', 'ACG'), ('s3', 'ACGTT'),
+                ('s4', 'AAA'), ('s5', 'ACGTA'), ('s6', 'A'), ('s7', 'ACGT'),
+                ('s8', 'CC')]
+        self.assertEqual(build_prefix_map(seqs),
+                         {'s1': ['s3', 's7', 's2', 's6'],
+                          's4': [],
+                          's5': [],
+                          's8': []})
+        self.assertEqual(build_prefix_map([]), {})
+        self.assertEqual(build_prefix_map([('a', 'AC'), ('b', '')]),
+                         {'a': ['b']})
+
+    def test_build_prefix_map_suffixes(self):
+        """build_prefix_map builds suffix maps from reversed seqs"""
+        seqs = [('s1', 'TTGCA'), ('s2', 'GCA'), ('s3', 'GGGA')]
+        self.assertEqual(
+            build_prefix_map([(i, s[::-1]) for i, s in seqs]),
+            {'s1': ['s2'], 's3': []})
+
+    def test_build_prefix_map_matches_trie(self):
+        """build_prefix_map gives the same clusters as a compressed trie"""
+        seqs = [('a', 'AACC'), ('b', 'AA'), ('c', 'AACG'), ('d', 'AACG'),
+                ('e', 'A'), ('f', 'AACGT'), ('g', 'C'), ('h', 'CGT'),
+                ('i', 'AA')]
+        expected = CompressedTrie(fasta_to_pairlist(seqs)).prefix_map
+        self.assertEqual(build_prefix_map(seqs), expected)
+
+        # where clusters tie, the choice of cluster may differ from the
+        # trie's, but the cluster ids and sizes are always the same
+        rand = Random(42)
+        for i in range(200):
+            seqs = [(str(j), ''.join([rand.choice('AC')
+                                      for k in range(rand.randint(1, 6))]))
+                    for j in range(rand.randint(1, 30))]
+            seqs_lookup = dict(seqs)
+            actual = build_prefix_map(seqs)
+            expected = CompressedTrie(fasta_to_pairlist(seqs)).prefix_map
+            self.assertEqual(sorted(actual), sorted(expected))
+            self.assertEqual(sorted(map(len, actual.values())),
+                             sorted(map(len, expected.values())))
+            for seq_id, ids in actual.items():
+                for prefix_id in ids:
+                    self.assertTrue(seqs_lookup[seq_id].startswith(
+                        seqs_lookup[prefix_id]))
+
+    def test_build_prefix_map_ties(self):
+        """build_prefix_map breaks ties in favour of the first seq in sort order
+        """
+        seqs = [('x', 'ACT'), ('y', 'ACG'), ('z', 'AC')]
+        expected = {'y': ['z'], 'x': []}
+        self.assertEqual(build_prefix_map(seqs), expected)
+        self.assertEqual(build_prefix_map(seqs[::-1]), expected)
+        self.assertEqual(build_prefix_map([('y', 'ACT'), ('x', 'ACG'),
+                                           ('z', 'AC')]),
+                         {'x': ['z'], 'y': []})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from random import choice, randint, seed
+from unittest import TestCase, main
+
+from qiime.primer_aligner import PrimerAligner
+from qiime.split_libraries import pair_hmm_align_unaligned_seqs
+
+
+def cogent_align(primer, seq):
+    """Return the (primer_hit, target_hit) alignment from PyCogent"""
+    alignment = pair_hmm_align_unaligned_seqs([primer, seq])
+    return str(alignment.Seqs[0]), str(alignment.Seqs[1])
+
+
+class PrimerAlignerTests(TestCase):
+
+    def test_align(self):
+        """align finds the best local alignment of the primer"""
+        aligner = PrimerAligner('ATCGGGCGATCATT')
+        self.assertEqual(aligner.align('GGATCGGGCGATCATTGG'),
+                         ('ATCGGGCGATCATT', 'ATCGGGCGATCATT'))
+        self.assertEqual(aligner.align('ATCGGGTTCGATCATT'),
+                         ('ATCGGG--CGATCATT', 'ATCGGGTTCGATCATT'))
+        aligner = PrimerAligner('ACGGTACAGTGG')
+        self.assertEqual(aligner.align('acggcagtgg'),
+                         ('ACGGTACAGTGG', 'ACGG--CAGTGG'))
+
+    def test_align_seqs_matches_cogent(self):
+        """align_seqs gives the same alignments as PyCogent"""
+        seed(0)
+        for primer in ['GCTGGAAA', 'ATTAGAWACCCBDGTAGTCC', 'YATGCTGCCTCCCG']:
+            aligner = PrimerAligner(primer, batch_size=7)
+            seqs = []
+            for i in range(40):
+                seq = [choice('ACGTACGTACGTN') for j in range(randint(1, 60))]
+                # plant a mutated copy of the primer in most sequences
+                if randint(0, 3):
+                    start = randint(0, len(seq))
+                    planted = [c if randint(0, 5) else choice('ACGT')
+                               for c in primer.replace('W', 'A')]
+                    seq[start:start] = planted[:randint(2, len(planted))]
+                seqs.append(''.join(seq))
+            self.assertEqual(aligner.align_seqs(seqs),
+                             [cogent_align(primer, s) for s in seqs])
+
+    def test_cache(self):
+        """alignments are remembered, up to max_cache_size"""
+        aligner = PrimerAligner('GCTGGAAA', max_cache_size=2)
+        expected = aligner.align_seqs(['AAGCTGCAAA', 'CCGCAGGAAC'])
+        self.assertEqual(len(aligner._cache), 2)
+        self.assertEqual(aligner.align_seqs(['CCGCAGGAAC', 'AAGCTGCAAA']),
+                         expected[::-1])
+        aligner.align('GCTGG')
+        self.assertEqual(aligner._cache, {})
+
+    def test_invalid(self):
+        """primers and sequences that can't be aligned raise ValueError"""
+        self.assertRaises(ValueError, PrimerAligner, '')
+        self.assertRaises(ValueError, PrimerAligner, 'ACGX')
+        aligner = PrimerAligner('ACGT')
+        self.assertRaises(ValueError, aligner.align, '')
+        self.assertRaises(ValueError, aligner.align_seqs, ['ACGT', 'AC.GT'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from os import close
+from StringIO import StringIO
+from tempfile import mkstemp
+from unittest import TestCase, main
+
+from numpy import array, uint8
+from numpy.testing import assert_array_equal
+from skbio.util import remove_files
+
+from qiime.read_store import (ReadStoreWriter, ReadStore, parse_read_store,
+                              pack_bases, unpack_bases, delta_encode_quals,
+                              delta_decode_quals, count_read_store,
+                              is_read_store, read_store_to_fasta,
+                              read_store_to_fastq)
+
+
+class ReadStoreTests(TestCase):
+
+    def setUp(self):
+        fd, self.read_store_fp = mkstemp(prefix='ReadStoreTests_',
+                                         suffix='.qrs')
+        close(fd)
+        self.files_to_remove = [self.read_store_fp]
+        self.reads = [('S1_0 r1 orig_bc=AA new_bc=AA bc_diffs=0', 'ACGTN',
+                       [40, 40, 38, 2, 0]),
+                      ('S.2_1 r2', 'GGC', [30, 31, 29]),
+                      ('S1_2 r3', '', []),
+                      ('noid', 'ACGTACGTAC', range(10)),
+                      ('S.2_4', 'tacgRY', [1, 2, 3, 4, 5, 6])]
+
+    def tearDown(self):
+        remove_files(self.files_to_remove)
+
+    def write_reads(self, reads, chunk_size=2, quals=True):
+        writer = ReadStoreWriter(open(self.read_store_fp, 'wb'),
+                                 chunk_size=chunk_size)
+        for label, seq, qual in reads:
+            writer.write(label, seq, qual if quals else None)
+        writer.close()
+
+    def test_pack_bases(self):
+        """pack_bases packs bases 2 bits each, storing other chars apart"""
+        packed, positions, values = pack_bases(['ACGT', 'TNa', ''])
+        self.assertEqual(list(packed), [0b00011011, 0b11000000])
+        self.assertEqual(list(positions), [5, 6])
+        self.assertEqual(values.tostring(), 'Na')
+        self.assertEqual(unpack_bases(packed, 7, positions, values),
+                         'ACGTTNa')
+        packed, positions, values = pack_bases([])
+        self.assertEqual(unpack_bases(packed, 0, positions, values), '')
+
+    def test_delta_quals(self):
+        """quality scores are delta coded within each read"""
+        quals = array([40, 38, 38, 2, 10, 0, 255], dtype=uint8)
+        lengths = array([3, 0, 2, 2])
+        deltas = delta_encode_quals(quals, lengths)
+        self.assertEqual(list(deltas), [40, 254, 0, 2, 8, 0, 255])
+        assert_array_equal(delta_decode_quals(deltas, lengths), quals)
+
+    def test_round_trip(self):
+        """reads are read back as they were written"""
+        self.write_reads(self.reads)
+        self.assertTrue(is_read_store(self.read_store_fp))
+        records = list(parse_read_store(open(self.read_store_fp, 'rb')))
+        self.assertEqual([(l, s) for l, s, _ in records],
+                         [(l, s) for l, s, _ in self.reads])
+        for (_, _, obs), (_, _, exp) in zip(records, self.reads):
+            self.assertEqual(list(obs), exp)
+
+        # a single chunk, and no quality scores
+        self.write_reads(self.reads, chunk_size=100, quals=False)
+        records = list(ReadStore(self.read_store_fp))
+        self.assertEqual(records, [(l, s, None) for l, s, _ in self.reads])
+        self.assertEqual(list(ReadStore(self.read_store_fp).iter_records()),
+                         [(l, s) for l, s, _ in self.reads])
+
+    def test_invalid(self):
+        """invalid reads and files raise ValueError"""
+        writer = ReadStoreWriter(StringIO())
+        self.assertRaises(ValueError, writer.write, 'a_1', 'AC', [1])
+        writer.write('a_1', 'AC', [1, 2])
+        writer.write('a_2', 'AC')
+        self.assertRaises(ValueError, writer.flush)
+
+        self.assertFalse(is_read_store(__file__))
+        self.assertRaises(ValueError, list,
+                          parse_read_store(StringIO('>a\nACGT\n')))
+
+    def test_count_read_store(self):
+        """count_read_store counts reads from the chunk headers"""
+        self.write_reads(self.reads)
+        count, mean, std = count_read_store(self.read_store_fp)
+        self.assertEqual(count, 5)
+        self.assertAlmostEqual(mean, 4.8)
+        self.assertAlmostEqual(std, 3.3105890714493698)
+        self.assertEqual(len(ReadStore(self.read_store_fp)), 5)
+
+        self.write_reads([])
+        self.assertEqual(count_read_store(self.read_store_fp),
+                         (0, None, None))
+
+    def test_read_store_to_fasta(self):
+        """read stores are converted to fasta, qual and fastq"""
+        self.write_reads(self.reads[:2])
+        fasta_f = StringIO()
+        qual_f = StringIO()
+        read_store_to_fasta(open(self.read_store_fp, 'rb'), fasta_f, qual_f,
+                            label_to_name=lambda x: x.split()[0])
+        self.assertEqual(fasta_f.getvalue(), '>S1_0\nACGTN\n>S.2_1\nGGC\n')
+        self.assertEqual(qual_f.getvalue(),
+                         '>S1_0\n40 40 38 2 0\n>S.2_1\n30 31 29\n')
+
+        fastq_f = StringIO()
+        read_store_to_fastq(open(self.read_store_fp, 'rb'), fastq_f)
+        self.assertEqual(fastq_f.getvalue(),
+                         '@S1_0 r1 orig_bc=AA new_bc=AA bc_diffs=0\nACGTN\n'
+                         '+\nIIG#!\n@S.2_1 r2\nGGC\n+\n?@>\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# File created on 19 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from cStringIO import StringIO
+from os.path import abspath, dirname, join
+from unittest import TestCase, main
+
+from cogent.parse.binary_sff import (parse_binary_sff, write_common_header,
+                                     write_read, UnsupportedSffError)
+
+from qiime.sff_reader import SffReader
+from qiime.util import qiime_open
+
+
+class SffReaderTests(TestCase):
+
+    def setUp(self):
+        test_dir = join(dirname(abspath(__file__)), 'test_support_files')
+        self.sff_fp = join(test_dir, 'F6AVWTA', 'F6AVWTA01.sff')
+        self.sff_gz_fp = join(test_dir, 'test_gz.sff.gz')
+
+    def assertReadsEqual(self, reader, sff_file):
+        """Compare the reads of reader with those parsed by PyCogent"""
+        header, reads = parse_binary_sff(sff_file, True)
+        self.assertEqual(reader.header, header)
+        reads = list(reads)
+        self.assertEqual(len(reader), len(reads))
+        for i, read in enumerate(reads):
+            self.assertEqual(reader.get_read(i), read)
+
+    def test_reads(self):
+        """SffReader gives the same reads as parse_binary_sff"""
+        reader = SffReader(open(self.sff_fp, 'rb'))
+        self.assertReadsEqual(reader, open(self.sff_fp, 'rb'))
+        self.assertEqual(len(reader), 20)
+        self.assertEqual(reader.names[:2], ['GA202I001ER3QL',
+                                            'GA202I001DBRNC'])
+        self.assertEqual(reader.read_headers['clip_qual_right'][:2].tolist(),
+                         [271, 271])
+        self.assertEqual(reader.get_bases(0)[:10], 'TCAGCAGTAG')
+        self.assertEqual(reader.get_flowgram_values(0)[:4].tolist(),
+                         [101, 0, 98, 3])
+        # reads are copied as they are in the file
+        sff_data = open(self.sff_fp, 'rb').read()
+        self.assertEqual(reader.get_header_bytes(), sff_data[:440])
+        self.assertEqual(reader.get_read_bytes(19),
+                         sff_data[reader.read_offsets[19]:33464])
+        reader.close()
+
+        reader = SffReader(qiime_open(self.sff_gz_fp, 'rb'))
+        self.assertReadsEqual(reader, qiime_open(self.sff_gz_fp, 'rb'))
+
+    def test_index(self):
+        """SffReader skips an index section between reads"""
+        header, reads = parse_binary_sff(open(self.sff_fp, 'rb'), True)
+        reads = list(reads)[:3]
+        sff_file = StringIO()
+        header['number_of_reads'] = 3
+        header['index_length'] = 16
+        write_common_header(sff_file, header)
+        write_read(sff_file, reads[0])
+        header['index_offset'] = sff_file.tell()
+        sff_file.write('x' * 16)
+        for read in reads[1:]:
+            write_read(sff_file, read)
+        sff_file.seek(0)
+        write_common_header(sff_file, header)
+
+        sff_file.seek(0)
+        reader = SffReader(sff_file)
+        sff_file.seek(0)
+        self.assertReadsEqual(reader, sff_file)
+        self.assertEqual(reader.read_offsets[1] - reader.read_ends[0], 16)
+
+    def test_invalid_files(self):
+        """SffReader raises errors on unsupported or truncated files"""
+        sff_data = open(self.sff_fp, 'rb').read()
+        self.assertRaises(UnsupportedSffError, SffReader,
+                          StringIO('x' * 40))
+        self.assertRaises(ValueError, SffReader, StringIO(sff_data[:20]))
+        self.assertRaises(ValueError, SffReader, StringIO(sff_data[:-1000]))
+
+
+if __name__ == "__main__":
+    main()
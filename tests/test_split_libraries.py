@@ -13,7 +13,7 @@ __email__ = "william.a.walters@colorado.edu"
 from os import close
 from os.path import exists
 from StringIO import StringIO
-from numpy import array
+from numpy import array, uint8
 from shutil import rmtree
 from tempfile import mkstemp, mkdtemp
 
@@ -27,8 +27,9 @@ from qiime.split_libraries import (
     count_ambig, split_seq, primer_exceeds_mismatches,
     check_barcode, make_histograms, SeqQualBad,
     seq_exceeds_homopolymers, check_window_qual_scores, check_seqs,
-    local_align_primer_seq, preprocess)
-from qiime.parse import parse_qual_score
+    local_align_primer_seq, local_align_primer_seqs, preprocess,
+    QualScores)
+from qiime.parse import parse_qual_score, QiimeParseError
 
 class FakeOutFile(object):
 
@@ -185,6 +186,32 @@ class TopLevelTests(TestCase):
         # check each base  in its own window
         self.assertEqual(check_window_qual_scores(scores1, 1, 2), (True, 11))
         self.assertEqual(check_window_qual_scores(scores1, 1, 5), (False, 7))
+        # uint8 scores are summed without overflowing
+        scores2 = array([200] * 10 + [2] * 5, dtype=uint8)
+        self.assertEqual(check_window_qual_scores(scores2, 5, 100),
+                         (False, 8))
+
+    def test_qual_scores(self):
+        """QualScores looks up quality scores in or out of file order"""
+        qual_files = [StringIO('>r1 x\n10 20\n30\n>r2\n40\n'),
+                      StringIO('>r3\n1 2 3\n')]
+        quals = QualScores(qual_files)
+        self.assertTrue(quals)
+        self.assertFalse(QualScores([]))
+        obs = quals.get('r1')
+        self.assertEqual(obs.dtype, uint8)
+        self.assertEqual(list(obs), [10, 20, 30])
+        self.assertEqual(list(quals.get('r2')), [40])
+        # out of order lookups read records from their offsets
+        self.assertEqual(list(quals.get('r1')), [10, 20, 30])
+        self.assertEqual(list(quals.get('r3')), [1, 2, 3])
+        self.assertEqual(quals.get('r4'), None)
+        self.assertEqual(list(quals.get('r2')), [40])
+
+        quals = QualScores([StringIO('>r1\n10 300\n')])
+        self.assertRaises(QiimeParseError, quals.get, 'r1')
+        quals = QualScores([StringIO('>r1\n10 x\n')])
+        self.assertRaises(QiimeParseError, quals.get, 'r1')
 
     def test_expand_degeneracies(self):
         """expand_degeneracies should make possible strings"""
@@ -431,6 +458,21 @@ z\tGG\tGC\t5\tsample_z"""
         actual = local_align_primer_seq(primer, seq)
         self.assertEqual(actual, expected)
 
+    def test_local_align_primer_seqs(self):
+        "local_align_primer_seqs aligns many seqs as local_align_primer_seq"
+        primer_seqs = {'ATCGGGCGATCATT': ['ATCGGGTTCGATCATT', 'AATCGGGC',
+                                          'TTATCGGGCGATCATTAA'],
+                       'CATCGTCGATCA': ['CCTCGTGATCA', 'CCTCGTGATCA',
+                                        'GAGATYAGCATCGTCRATCAGG']}
+        primer_aligners = {}
+        actual = local_align_primer_seqs(primer_seqs, primer_aligners)
+        expected = {}
+        for primer, seqs in primer_seqs.items():
+            for seq in seqs:
+                expected[primer, seq] = local_align_primer_seq(primer, seq)
+        self.assertEqual(actual, expected)
+        self.assertEqual(sorted(primer_aligners), sorted(primer_seqs))
+
     def test_seq_exceeds_homopolymers(self):
         """seq_exceeds_homopolymers returns True if too many homopolymers"""
         self.assertEqual(seq_exceeds_homopolymers('AAACGA', 3), False)
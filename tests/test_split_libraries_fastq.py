@@ -12,6 +12,10 @@ __email__ = "gregcaporaso@gmail.com"
 
 import numpy as np
 
+from glob import glob
+from os import listdir
+from os.path import join
+from StringIO import StringIO
 from unittest import TestCase, main
 from tempfile import mkdtemp, NamedTemporaryFile
 from shutil import rmtree
@@ -27,9 +31,15 @@ from qiime.split_libraries_fastq import (
     check_header_match_180_or_later,
     correct_barcode,
     process_fastq_single_end_read_file_no_barcode,
-    extract_reads_from_interleaved
+    extract_reads_from_interleaved,
+    offset_seq_id,
+    offset_seq_ids_in_lines,
+    iter_fastq_spans,
+    parse_fastq_labels_and_seqs,
+    parse_fastq_records
 )
 from qiime.golay import decode_golay_12
+from qiime.util import qiime_system_call
 
 import skbio.parse.sequences
 from skbio.parse.sequences.fastq import ascii_to_phred64, ascii_to_phred33
@@ -291,6 +301,14 @@ class SplitLibrariesFastqTests(TestCase):
         self.assertFalse(check_header_match_180_or_later(
             "M00176:17:000000000-A0CNA:1:1:15487:1773 1:N:0:0",
             "M00176:17:000000000-A0CNA:1:1:16427:1774 1:N:0:0"))
+        # different index sequences
+        self.assertFalse(check_header_match_180_or_later(
+            "M00176:17:000000000-A0CNA:1:1:15487:1773 1:N:0:ACGT",
+            "M00176:17:000000000-A0CNA:1:1:15487:1773 2:N:0:ACGA"))
+        # only the fields present in both headers are compared
+        self.assertTrue(check_header_match_180_or_later(
+            "M00176:17:000000000-A0CNA:1:1:15487:1773 1:N:0:0",
+            "M00176:17:000000000-A0CNA:1:1:15487:1773"))
 
     def test_process_fastq_single_end_read_file_toggle_store_unassigned(self):
         """process_fastq_single_end_read_file handles store_unassigned
@@ -1075,6 +1093,114 @@ class SplitLibrariesFastqTests(TestCase):
                 self.create_forward_and_reverse_fp, '1N', '2N',
                 self.temp_dir_path)
 
+    def test_iter_fastq_spans(self):
+        """iter_fastq_spans gives the same records as parse_fastq"""
+        fastq = ('@r1 1:N:0\nACGT\n+\nIIII\n'
+                 '@r2 2:N:0\nGG\n+r2 2:N:0\nII\n'
+                 ' @r3 \r\nT\r\n+\r\nI\r\n'
+                 '@r4\nAC\n+\nII\n\n')
+        # small blocks, to check that records aren't split between blocks
+        for block_size in 1, 7, 100:
+            spans = list(iter_fastq_spans(StringIO(fastq), block_size))
+            self.assertEqual(
+                [(b[ls:le], b[ss:se], b[qs:qe])
+                 for b, _, _, ls, le, ss, se, qs, qe, _ in spans],
+                [(l, s, q) for l, s, q in skbio.parse.sequences.parse_fastq(
+                    StringIO(fastq), strict=False, phred_offset=33,
+                    enforce_qual_range=False)
+                 for q in [''.join(chr(c + 33) for c in q)]])
+            self.assertEqual([span[-1] for span in spans],
+                             [True, False, False, True])
+            block, start, end = spans[0][:3]
+            self.assertEqual(block[start:end],
+                             '@r1 1:N:0\nACGT\n+\nIIII\n')
+
+        self.assertEqual(list(parse_fastq_labels_and_seqs(fastq.split('\n'))),
+                         [('r1 1:N:0', 'ACGT'), ('r2 2:N:0', 'GG'),
+                          ('r3', 'T'), ('r4', 'AC')])
+        self.assertEqual(list(parse_fastq_records(StringIO(fastq))),
+                         [('r1 1:N:0', 'ACGT', 'IIII'), ('r2 2:N:0', 'GG', 'II'),
+                          ('r3', 'T', 'I'), ('r4', 'AC', 'II')])
+
+        self.assertRaises(FastqParseError, list,
+                          iter_fastq_spans(StringIO('@r1\nACGT\n+\n')))
+        self.assertRaises(FastqParseError, list,
+                          parse_fastq_labels_and_seqs(['@r1', 'ACGT']))
+
+    def test_extract_reads_from_interleaved_reformats(self):
+        """extract_reads_from_interleaved rewrites irregular records"""
+        input_fp = join(self.temp_dir_path, 'interleaved.fastq')
+        with open(input_fp, 'w') as f:
+            f.write('@r1 1:N:0\nACGT\n+\nIIII\n'
+                    '@r1 2:N:0\r\nAC\r\n+r1 2:N:0\r\nII\r\n'
+                    '@r2 1:N:0\nGG\n+\nII\n'
+                    '@r3 1:N:0\nT\n+\nI')
+        extract_reads_from_interleaved(input_fp, '1:N:0', '2:N:0',
+                                       self.temp_dir_path)
+        self.assertEqual(
+            open(join(self.temp_dir_path, 'forward_reads.fastq')).read(),
+            '@r1 1:N:0\nACGT\n+\nIIII\n@r2 1:N:0\nGG\n+\nII\n'
+            '@r3 1:N:0\nT\n+\nI\n')
+        self.assertEqual(
+            open(join(self.temp_dir_path, 'reverse_reads.fastq')).read(),
+            '@r1 2:N:0\nAC\n+\nII\n')
+
+    def test_offset_seq_id(self):
+        """offset_seq_id renumbers post-split_libraries labels"""
+        self.assertEqual(offset_seq_id('s1_0', 5), 's1_5')
+        self.assertEqual(offset_seq_id('s.1_x_9 M001:1:1 orig_bc=AC', 10),
+                         's.1_x_19 M001:1:1 orig_bc=AC')
+        self.assertRaises(ValueError, offset_seq_id, 's1 x_1', 1)
+
+    def test_offset_seq_ids_in_lines(self):
+        """offset_seq_ids_in_lines renumbers fasta, qual and fastq labels"""
+        fasta = ['>s1_0 a\n', 'ACGT\n', '>s2_1 b\n', 'A\n']
+        self.assertEqual(list(offset_seq_ids_in_lines(fasta, 3)),
+                         ['>s1_3 a\n', 'ACGT\n', '>s2_4 b\n', 'A\n'])
+        qual = ['>s1_0 a\n', '[40 40\n', ' 40]\n']
+        self.assertEqual(list(offset_seq_ids_in_lines(qual, 1)),
+                         ['>s1_1 a\n', '[40 40\n', ' 40]\n'])
+        fastq = ['@s1_0 a\n', 'AC\n', '+\n', '@@\n',
+                 '@s2_1\n', 'A\n', '+\n', 'I\n']
+        self.assertEqual(list(offset_seq_ids_in_lines(fastq, 2, 'fastq')),
+                         ['@s1_2 a\n', 'AC\n', '+\n', '@@\n',
+                          '@s2_3\n', 'A\n', '+\n', 'I\n'])
+
+    def test_split_libraries_fastq_script_parallel(self):
+        """split_libraries_fastq.py -O gives the same output as a serial run
+        """
+        fps = []
+        for i, data in enumerate([fastq2, forward_reads, fastq2]):
+            fp = join(self.temp_dir_path, 'reads%d.fastq' % i)
+            open(fp, 'w').write(data)
+            fps.append(fp)
+        output_fns = ['histograms.txt', 'seqs.fastq', 'seqs.fna',
+                      'seqs.qual', 'split_library_log.txt']
+        command = ('split_libraries_fastq.py -i %s --sample_ids s1,s2,s3 '
+                   '--barcode_type not-barcoded --store_qual_scores '
+                   '--store_demultiplexed_fastq -o %%s -O %%d' % ','.join(fps))
+
+        outputs = []
+        for jobs_to_start in (1, 2):
+            output_dir = join(self.temp_dir_path, 'out%d' % jobs_to_start)
+            stdout, stderr, return_value = qiime_system_call(
+                command % (output_dir, jobs_to_start))
+            self.assertEqual(return_value, 0, stderr)
+            self.assertEqual(sorted(listdir(output_dir)), output_fns)
+            outputs.append([open(join(output_dir, fn)).read()
+                            for fn in output_fns])
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertTrue('>s3_' in outputs[1][2])
+
+        # the per-file output is removed if a worker fails
+        open(fps[1], 'w').write('@truncated\nACGT\n')
+        output_dir = join(self.temp_dir_path, 'out_failed')
+        stdout, stderr, return_value = qiime_system_call(
+            command % (output_dir, 2))
+        self.assertNotEqual(return_value, 0)
+        self.assertEqual(glob(join(output_dir, 'split_libraries_fastq_*')),
+                         [])
+
 
 barcode_map1 = {'AAAAAAAAAAAA': 's1',
                 'AAAAAAAAAAAC': 's2',
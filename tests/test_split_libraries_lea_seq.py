@@ -15,6 +15,9 @@ from unittest import TestCase, main
 from skbio.util import remove_files
 from qiime.util import get_qiime_temp_dir
 from qiime.split_libraries_lea_seq import (get_cluster_ratio, get_consensus,
+                                           get_cluster_sizes,
+                                           get_seqs_consensus,
+                                           get_random_bc_consensus,
                                            get_LEA_seq_consensus_seqs,
                                            select_unique_rand_bcs,
                                            extract_primer,
@@ -202,6 +205,45 @@ class WorkflowTests(TestCase):
         expected = 2.5
         self.assertEqual(actual, expected)
 
+    def test_get_cluster_sizes(self):
+        seqs = ['AAAAAAAAAA', 'AAAAAAAAAT', 'AAAAAAAAAA', 'TTTTTTTTTT',
+                'AAAAAAAATT', 'AAAAA', 'TTTTTTTTTA']
+        self.assertEqual(get_cluster_sizes(seqs, 0.9), [4, 2, 1])
+        self.assertEqual(get_cluster_sizes(seqs, 0.98), [3, 1, 1, 1, 1])
+        self.assertEqual(get_cluster_sizes([], 0.98), [])
+
+        actual = get_cluster_ratio(['ACGT', 'ACGT', 'TTTT'], 0.98)
+        self.assertEqual(actual, 2.0)
+        self.assertEqual(get_cluster_ratio(['ACGT'], 0.98), 1)
+
+    def test_get_seqs_consensus(self):
+        actual = get_seqs_consensus(['ACGTA', 'ACGAT', 'TCGAT'], [5, 2, 2],
+                                    2)
+        self.assertEqual(actual, 'ACGTA')
+        # ties go to the base of the sequence with the highest count
+        actual = get_seqs_consensus(['AAC', 'ATG', 'ATG'], [4, 2, 2], 2)
+        self.assertEqual(actual, 'AAC')
+        with self.assertRaises(SeqLengthMismatchError):
+            get_seqs_consensus(['ACGT', 'ACG'], [1, 1], 2)
+        with self.assertRaises(LowConsensusScoreError):
+            get_seqs_consensus(['ACGT', 'TGCA'], [1, 1], 6)
+
+    def test_get_random_bc_consensus(self):
+        seq_counts = [(('AAAAAAAAAA', 'CCCCC'), 4),
+                      (('AAAAAAAAAT', 'CCCCG'), 1)]
+        # one cluster for each read: the consensus of the reads is used
+        actual = get_random_bc_consensus(seq_counts, 0.98, 0.5, 2)
+        self.assertEqual(actual, 'AAAAAAAAAA^CCCCC')
+        seq_counts.append((('AAAAAAAAAA', 'CCCCA'), 2))
+        actual = get_random_bc_consensus(seq_counts, 0.9, 2.5, 2)
+        self.assertEqual(actual, 'AAAAAAAAAA^CCCCC')
+        # both cluster ratios are above max_cluster_ratio: the most common
+        # read is used
+        actual = get_random_bc_consensus(seq_counts, 0.9, 0.5, 15)
+        self.assertEqual(actual, 'AAAAAAAAAA^CCCCC')
+        with self.assertRaises(LowConsensusScoreError):
+            get_random_bc_consensus(seq_counts, 0.9, 2.5, 15)
+
     def test_extract_primers(self):
         actual = extract_primer(
             self.fasta_seq_for_primer, self.possible_primers)
@@ -3,6 +3,7 @@ from __future__ import division
 # unit tests for util.py
 
 from os import chdir, getcwd, mkdir, rmdir, remove, close
+from sys import executable
 from os.path import split, abspath, dirname, exists, isdir, join
 from glob import glob
 from random import seed
@@ -20,6 +21,7 @@ from numpy.testing import assert_almost_equal
 
 from skbio.sequence import DNASequence
 from skbio.parse.sequences import parse_fasta
+from skbio.io import RecordError
 from skbio.util import remove_files
 
 from cogent.cluster.procrustes import procrustes
@@ -29,6 +31,9 @@ from bfillings.formatdb import build_blast_db_from_fasta_file
 from qiime.parse import (fields_to_dict, parse_distmat, parse_mapping_file,
                          parse_mapping_file_to_dict, parse_otu_table,
                          QiimeParseError)
+from qiime.fasta_index import (FastaIndex, SampleIndex, build_sample_index,
+                               write_sample_index)
+from qiime.read_store import ReadStoreWriter
 from qiime.util import (make_safe_f, FunctionWithParams, qiime_blast_seqs,
                         extract_seqs_by_sample_id, get_qiime_project_dir,
                         get_qiime_scripts_dir, matrix_stats,
@@ -41,11 +46,13 @@ from qiime.util import (make_safe_f, FunctionWithParams, qiime_blast_seqs,
                         write_seqs_to_fastq, split_fasta_on_sample_ids,
                         split_fasta_on_sample_ids_to_dict,
                         split_sequence_file_on_sample_ids_to_files,
+                        SampleFileWriter,
                         median_absolute_deviation, guess_even_sampling_depth,
                         compute_days_since_epoch,
                         get_interesting_mapping_fields, inflate_denoiser_output,
                         flowgram_id_to_seq_id_map, count_seqs, count_seqs_from_file,
-                        count_seqs_in_filepaths,
+                        count_seqs_in_filepaths, scan_seq_lengths,
+                        seq_length_stats,
                         iseq_to_qseq_fields,
                         make_compatible_distance_matrices, stderr, _chk_asarray, expand_otu_ids,
                         subsample_fasta, summarize_otu_sizes_from_otu_map,
@@ -54,7 +61,7 @@ from qiime.util import (make_safe_f, FunctionWithParams, qiime_blast_seqs,
                         qiime_blastx_seqs, add_filename_suffix, is_valid_git_refname,
                         is_valid_git_sha1, sync_biom_and_mf,
                         biom_taxonomy_formatter, invert_dict,
-                        write_biom_table)
+                        write_biom_table, qiime_system_call)
 
 import numpy
 from numpy import array, asarray
@@ -308,6 +315,69 @@ o4	seq6	seq7""".split('\n')
         self.assertEqual(open('%s/samp2.fastq' % temp_output_dir_fastq).read(),
                          "@samp2_1\nTTTGGTCCGATGA\n+\nAAAAAAAAAAAAA\n")
 
+    def test_split_sequence_file_on_sample_ids_to_files_pooled(self):
+        """ split_sequence_file_on_sample_ids_to_files pools file handles
+        """
+        temp_output_dir = mkdtemp()
+        self.dirs_to_remove.append(temp_output_dir)
+
+        # a tiny memory budget and a single open file force buffers to be
+        # written out, and files to be re-opened in append mode
+        actual = split_sequence_file_on_sample_ids_to_files(
+            StringIO(fasta2),
+            'fasta',
+            output_dir=temp_output_dir,
+            max_buffer_size=10,
+            max_open_files=1,
+            compress=True)
+        self.assertEqual(actual,
+                         ['%s/Samp1.fasta.gz' % temp_output_dir,
+                          '%s/s2_a.fasta.gz' % temp_output_dir,
+                          '%s/s3.fasta.gz' % temp_output_dir])
+        self.assertEqual(
+            gzip.open('%s/Samp1.fasta.gz' % temp_output_dir).read(),
+            ">Samp1_42\nACCGGTT\n>Samp1_43 some comme_nt\nAACCG\n"
+            ">Samp1_44\nA\n")
+        self.assertEqual(
+            gzip.open('%s/s3.fasta.gz' % temp_output_dir).read(),
+            ">s3_25\nAAACCC\n")
+
+        # existing output files are not overwritten
+        self.assertRaises(IOError,
+                          split_sequence_file_on_sample_ids_to_files,
+                          StringIO(fasta2), 'fasta', temp_output_dir,
+                          compress=True)
+
+    def test_SampleFileWriter(self):
+        """ SampleFileWriter buffers data within its memory budget """
+        temp_output_dir = mkdtemp()
+        self.dirs_to_remove.append(temp_output_dir)
+        fp1 = join(temp_output_dir, 'a.txt')
+        fp2 = join(temp_output_dir, 'b.txt')
+        open(fp1, 'w').write('old contents\n')
+
+        writer = SampleFileWriter(max_buffer_size=8, max_open_files=1)
+        writer.write(fp1, 'aaaa')
+        writer.write(fp2, 'bb')
+        self.assertFalse(exists(fp2))
+        # exceeding the budget writes out only the largest buffer
+        writer.write(fp1, 'aaa')
+        self.assertFalse(exists(fp2))
+        # writing fp2 closes fp1, which is re-opened in append mode
+        writer.flush()
+        self.assertEqual(open(fp1).read(), 'aaaaaaa')
+        writer.write(fp1, 'a')
+        writer.write(fp2, 'b')
+        writer.close()
+        self.assertEqual(open(fp1).read(), 'aaaaaaaa')
+        self.assertEqual(open(fp2).read(), 'bbb')
+
+        # with append, files are not truncated when first written to
+        writer = SampleFileWriter(append=True)
+        writer.write(fp1, 'c')
+        writer.close()
+        self.assertEqual(open(fp1).read(), 'aaaaaaaac')
+
     def test_convert_otu_table_relative(self):
         """should convert a parsed otu table into relative abundances"""
         otu_table = parse_otu_table(self.otu_table_f1)
@@ -362,6 +432,49 @@ o4	seq6	seq7""".split('\n')
         actual = list(extract_seqs_by_sample_id(seqs, sample_ids))
         self.assertEqual(actual, expected)
 
+        # sample ids can contain underscores
+        seqs = [('s_1_5 x', 'AC'), ('s_10', 'GG'), ('s_1_6', 'TT')]
+        self.assertEqual(list(extract_seqs_by_sample_id(seqs, ['s_1'])),
+                         [('s_1_5 x', 'AC'), ('s_1_6', 'TT')])
+        self.assertEqual(list(extract_seqs_by_sample_id(seqs, ['s'])),
+                         [('s_10', 'GG')])
+
+    def test_extract_seqs_by_sample_id_fasta_index(self):
+        """extract_seqs_by_sample_id: functions with a FastaIndex """
+        fd, fasta_fp = mkstemp(prefix='qiime_extract_seqs_', suffix='.fna')
+        close(fd)
+        self.files_to_remove.append(fasta_fp)
+        open(fasta_fp, 'w').write(
+            '>Samp1_109 x\nACGG\n>samp1_109\nGCGG\n>S44 y\nTT\n')
+        seqs = FastaIndex(fasta_fp)
+        self.assertEqual(
+            list(extract_seqs_by_sample_id(seqs, ['Samp1', 'S44'])),
+            [('Samp1_109 x', 'ACGG'), ('S44 y', 'TT')])
+        self.assertEqual(
+            list(extract_seqs_by_sample_id(seqs, ['Samp1'], negate=True)),
+            [('samp1_109', 'GCGG'), ('S44 y', 'TT')])
+        seqs.close()
+
+    def test_extract_seqs_by_sample_id_sample_index(self):
+        """extract_seqs_by_sample_id: functions with a SampleIndex """
+        fd, fasta_fp = mkstemp(prefix='qiime_extract_seqs_', suffix='.fna')
+        close(fd)
+        self.files_to_remove.extend([fasta_fp, fasta_fp + '.sidx'])
+        open(fasta_fp, 'w').write(
+            '>Samp1_109 x\nACGG\n>samp1_109\nGCGG\n>Samp1_110\nAA\n'
+            '>S44_1 y\nTT\n>S_44_2\nGG\n')
+        write_sample_index(build_sample_index(open(fasta_fp, 'rb')),
+                           fasta_fp, fasta_fp + '.sidx')
+        seqs = SampleIndex(fasta_fp)
+        self.assertEqual(
+            list(extract_seqs_by_sample_id(seqs, ['Samp1', 'S44'])),
+            [('Samp1_109 x', 'ACGG'), ('Samp1_110', 'AA'), ('S44_1 y', 'TT')])
+        self.assertEqual(
+            list(extract_seqs_by_sample_id(seqs, ['Samp1'], negate=True)),
+            [('samp1_109', 'GCGG'), ('S44_1 y', 'TT'), ('S_44_2', 'GG')])
+        self.assertEqual(list(extract_seqs_by_sample_id(seqs, ['S_44'])),
+                         [('S_44_2', 'GG')])
+
     def test_get_qiime_project_dir(self):
         """getting the qiime project directory functions as expected """
 
@@ -605,6 +718,83 @@ o4	seq6	seq7""".split('\n')
         self.assertEqual(count_seqs_in_filepaths(
             in_fps, seq_counter), expected)
 
+    def test_scan_seq_lengths(self):
+        """ scan_seq_lengths sums seq lengths without parsing records
+        """
+        f1 = '>seq1\nAACCTT\nACTGGT\n>seq2\nCCAATT\n>seq3\nCCC---GG\n'
+        f2 = '> s42\r\nABCDEFG\r\n>s33\r\nA\r\n\r\n> 4>\r\nAA>\r\n>blah\r\nAA'
+        for block_size in [1, 5, 2 ** 22]:
+            self.assertEqual(
+                scan_seq_lengths(StringIO(f1), block_size=block_size),
+                (3, 26, 244))
+            self.assertEqual(
+                scan_seq_lengths(StringIO(f2), block_size=block_size),
+                (4, 13, 63))
+        self.assertEqual(scan_seq_lengths(StringIO('')), (0, 0, 0))
+        # leading and trailing whitespace isn't counted, and blank lines
+        # are ignored, as by parse_fasta
+        f3 = ' \n>a\nACGT  \n\t\n>b\n AC GT\t\r\n'
+        for block_size in [1, 5, 2 ** 22]:
+            self.assertEqual(
+                scan_seq_lengths(StringIO(f3), block_size=block_size),
+                (2, 9, 41))
+        # sequence data before the first label, and labels without
+        # sequences, are errors
+        for f in ['\nAC\n>a\nA\n', 'AC', '>a\n>b\nA\n', '>a\nA\n>b\n \n']:
+            for block_size in [1, 2 ** 22]:
+                self.assertRaises(RecordError, scan_seq_lengths, StringIO(f),
+                                  block_size=block_size)
+
+        fastq = '@a\nACGT\n+\nIIII\n@b\r\nA\r\n+\r\nI\r\n@c\n\n+\n\n'
+        for block_size in [1, 7, 2 ** 22]:
+            self.assertEqual(scan_seq_lengths(StringIO(fastq), 'fastq',
+                                              block_size=block_size),
+                             (3, 5, 17))
+
+        assert_almost_equal(seq_length_stats(3, 26, 244), (3, 8.666, 2.4944),
+                            decimal=3)
+        self.assertEqual(seq_length_stats(0, 0, 0), (0, None, None))
+
+    def test_count_seqs_files(self):
+        """ count_seqs scans fasta, fastq and gzipped files
+        """
+        temp_dir = mkdtemp(prefix='count_seqs_')
+        self.dirs_to_remove.append(temp_dir)
+        fasta_fp = join(temp_dir, 'seqs.fna')
+        open(fasta_fp, 'w').write('>a\nAC\n>b\nACGT\n')
+        fastq_gz_fp = join(temp_dir, 'seqs.fastq.gz')
+        fastq_f = gzip.open(fastq_gz_fp, 'wb')
+        fastq_f.write('@a\nACG\n+\nIII\n')
+        fastq_f.close()
+
+        self.assertEqual(count_seqs(fasta_fp), (2, 3.0, 1.0))
+        self.assertEqual(count_seqs(fastq_gz_fp), (1, 3.0, 0.0))
+        self.assertEqual(count_seqs(fasta_fp, parser=parse_fasta),
+                         (2, 3.0, 1.0))
+
+        missing_fp = join(temp_dir, 'missing.fna')
+        for processes in [1, 2]:
+            self.assertEqual(
+                count_seqs_in_filepaths([fasta_fp, missing_fp, fastq_gz_fp],
+                                        processes=processes),
+                ([((2, 3.0, 1.0), fasta_fp), ((1, 3.0, 0.0), fastq_gz_fp)],
+                 3, [missing_fp]))
+
+    def test_count_seqs_read_store(self):
+        """ count_seqs counts the reads in read stores
+        """
+        fd, read_store_fp = mkstemp(prefix='count_seqs_', suffix='.qrs')
+        close(fd)
+        self.files_to_remove.append(read_store_fp)
+        writer = ReadStoreWriter(open(read_store_fp, 'wb'), chunk_size=2)
+        for label, seq in [('s1_0', 'AC'), ('s2_1', 'ACGT'), ('s1_2', 'A')]:
+            writer.write(label, seq)
+        writer.close()
+        count, mean, std = count_seqs(read_store_fp)
+        self.assertEqual(count, 3)
+        assert_almost_equal(mean, 7. / 3)
+        assert_almost_equal(std, numpy.std([2, 4, 1]))
+
 
     def test_make_compatible_distance_matrices(self):
         """make_compatible_distance_matrices: functions as expected"""
@@ -2206,6 +2396,21 @@ class SyncBiomTests(TestCase):
         self.assertEqual(obs, exp)
 
 
+class ImportTests(TestCase):
+
+    def test_heavy_dependencies_not_imported(self):
+        """importing qiime.util doesn't import its heavy dependencies"""
+        command = ('%s -c "import sys, qiime.util; '
+                   'print \' \'.join(sys.modules)"' % executable)
+        stdout, stderr, return_value = qiime_system_call(command)
+        self.assertEqual(return_value, 0)
+        loaded = set([m.split('.')[0] for m in stdout.split()])
+        for module in ['biom', 'h5py', 'cogent', 'skbio', 'bfillings',
+                       'qiime_default_reference', 'matplotlib']:
+            self.assertFalse(module in loaded,
+                             "%s was imported by qiime.util" % module)
+
+
 class RExecutorTests(TestCase):
 
     """Tests of the RExecutor class."""
@@ -18,11 +18,14 @@ from os.path import exists, join, split
 from tempfile import mkstemp, mkdtemp
 
 from skbio.util import remove_files
+from skbio.io import RecordError
 
 from qiime.validate_demultiplexed_fasta import check_fasta_seqs,\
     get_dup_labels_perc, check_labels_sampleids,\
     run_fasta_checks, validate_fasta, check_fasta_seqs_lens, check_all_ids,\
-    check_tree_subset, check_tree_exact_match
+    check_tree_subset, check_tree_exact_match, check_fasta, get_fasta_chunks,\
+    DuplicateLabelsChecker, SampleIdLabelsChecker, SeqContentsChecker,\
+    SeqLengthsChecker
 
 
 class ValidateDemultiplexedFastaTests(TestCase):
@@ -369,6 +372,42 @@ class ValidateDemultiplexedFastaTests(TestCase):
 
         self.assertEqual(actual_fasta_report, expected_fasta_report)
 
+    def test_get_fasta_chunks(self):
+        """ Splits fasta files into parts at record boundaries """
+
+        self.assertEqual(get_fasta_chunks(self.sample_fasta_invalid_fp),
+                         [(0, 159)])
+        self.assertEqual(get_fasta_chunks(self.sample_fasta_invalid_fp, 40),
+                         [(0, 72), (72, 116), (116, 159)])
+        self.assertEqual(get_fasta_chunks(self.sample_fasta_invalid_fp, 1),
+                         [(0, 32), (32, 72), (72, 116), (116, 159)])
+
+    def test_check_fasta(self):
+        """ Runs checkers in one pass, or in parts that are merged """
+
+        for processes in 1, 2:
+            checkers = [DuplicateLabelsChecker(),
+                        SampleIdLabelsChecker(set(['seq1', 'seq3'])),
+                        SeqContentsChecker(['GAGA', 'ACCAGG'], ['TTTT']),
+                        SeqLengthsChecker()]
+            self.assertEqual(check_fasta(self.sample_fasta_invalid_fp,
+                                         checkers, processes, chunk_size=40),
+                             4)
+            self.assertEqual(checkers[0].results(), ('0.250', ['seq1']))
+            self.assertEqual(checkers[1].results(4), ('0.500', '0.750'))
+            self.assertEqual(checkers[1].label_prefixes,
+                             set(['seq1', 'seq3', 'seq4']))
+            self.assertEqual(checkers[2].results(4),
+                             ('0.500', '0.750', '0.250', '0.250'))
+            self.assertEqual(checkers[3].results(),
+                             [(2, 35), (1, 33), (1, 25)])
+
+        fasta_f = open(self.sample_fasta_invalid_fp, 'a')
+        fasta_f.write('\n>seq5_1\n>seq5_2\nACGT\n')
+        fasta_f.close()
+        self.assertRaises(RecordError, check_fasta,
+                          self.sample_fasta_invalid_fp, [])
+
     def test_run_fasta_checks_with_invalid_data(self):
         """ Properly returns dictionary of percentage for each check """
 
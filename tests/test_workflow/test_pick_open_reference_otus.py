@@ -12,7 +12,7 @@ __email__ = "gregcaporaso@gmail.com"
 
 from glob import glob
 from os import chdir, getcwd
-from os.path import exists
+from os.path import exists, join
 from shutil import rmtree
 from tempfile import mkdtemp
 from unittest import TestCase, main
@@ -29,7 +29,8 @@ from qiime.test import initiate_timeout, disable_timeout, get_test_data_fps
 from qiime.workflow.pick_open_reference_otus import (
     pick_subsampled_open_reference_otus,
     iterative_pick_subsampled_open_reference_otus,
-    final_repset_from_iteration_repsets)
+    final_repset_from_iteration_repsets, write_failures_fasta,
+    filter_failures_fasta, merge_and_filter_otu_maps)
 from bfillings.sortmerna_v2 import build_database_sortmerna
 
 
@@ -1966,5 +1967,73 @@ A""".split('\n')
             final_repset_from_iteration_repsets([repset1, repset2, repset3]))
         self.assertEqual(actual, exp)
 
+    def test_write_failures_fasta(self):
+        """ write_failures_fasta writes, indexes and subsamples failures """
+        input_fp = join(self.wf_out, 'seqs.fna')
+        open(input_fp, 'w').write(failures_input_fasta)
+        failures_list_fp = join(self.wf_out, 'failures.txt')
+        open(failures_list_fp, 'w').write('s3\ns1\n')
+        failures_fp = join(self.wf_out, 'failures.fasta')
+        subsample_fp = join(self.wf_out, 'subsample.fasta')
+        index_fp = failures_fp + '.idx'
+
+        actual = write_failures_fasta(input_fp, index_fp,
+                                      failures_list_fp=failures_list_fp,
+                                      failures_fasta_fp=failures_fp,
+                                      subsample_fasta_fp=subsample_fp,
+                                      percent_subsample=1.0)
+        self.assertEqual(actual, 2)
+        exp = '>s1 comment\nACGTACGT\n>s3\nGGGG\n'
+        self.assertEqual(open(failures_fp).read(), exp)
+        self.assertEqual(open(subsample_fp).read(), exp)
+
+        # the step 3 failures are read from the failures using the index
+        step3_failures_list_fp = join(self.wf_out, 'failures_failures.txt')
+        open(step3_failures_list_fp, 'w').write('s3\n')
+        step3_failures_fp = join(self.wf_out, 'failures_failures.fasta')
+        filter_failures_fasta(failures_fp, step3_failures_list_fp,
+                              step3_failures_fp)
+        self.assertEqual(open(step3_failures_fp).read(), '>s3\nGGGG\n')
+
+        # pre-computed failures are indexed and subsampled, but not copied
+        index_fp = join(self.wf_out, 'precomputed.idx')
+        actual = write_failures_fasta(input_fp, index_fp,
+                                      subsample_fasta_fp=subsample_fp,
+                                      percent_subsample=0.0)
+        self.assertEqual(actual, 3)
+        self.assertEqual(open(subsample_fp).read(), '')
+        filter_failures_fasta(input_fp, failures_list_fp, step3_failures_fp,
+                              index_fp)
+        self.assertEqual(open(step3_failures_fp).read(), exp)
+
+    def test_merge_and_filter_otu_maps(self):
+        """ merge_and_filter_otu_maps merges and filters in one pass """
+        otu_map_fps = []
+        for i, otu_map in enumerate(['r1\ts1\ts2\nr2\ts3\n',
+                                     'n1\ts4\ts5\ts6\n']):
+            otu_map_fp = join(self.wf_out, 'otu_map%d.txt' % i)
+            open(otu_map_fp, 'w').write(otu_map)
+            otu_map_fps.append(otu_map_fp)
+        merged_fp = join(self.wf_out, 'final_otu_map.txt')
+        filtered_fp = join(self.wf_out, 'final_otu_map_mc2.txt')
+        open(merged_fp, 'w').write('old\tcontents\n')
+
+        actual = merge_and_filter_otu_maps(otu_map_fps, merged_fp,
+                                           filtered_fp, 2)
+        self.assertEqual(actual, set(['r1', 'n1']))
+        self.assertEqual(open(merged_fp).read(),
+                         'r1\ts1\ts2\nr2\ts3\nn1\ts4\ts5\ts6\n')
+        self.assertEqual(open(filtered_fp).read(),
+                         'r1\ts1\ts2\nn1\ts4\ts5\ts6\n')
+
+
+failures_input_fasta = """>s1 comment
+ACGTACGT
+>s2
+AAAA
+>s3
+GGGG
+"""
+
 if __name__ == "__main__":
     main()
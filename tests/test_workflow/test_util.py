@@ -12,8 +12,11 @@ __email__ = "gregcaporaso@gmail.com"
 
 from shutil import rmtree
 from glob import glob
+from os import listdir, makedirs, stat
 from os.path import exists, join, getsize
 from tempfile import mkdtemp
+from time import time
+from functools import partial
 
 from unittest import TestCase, main
 from skbio.util import remove_files
@@ -23,8 +26,14 @@ from qiime.test import (initiate_timeout,
                         disable_timeout,
                         get_test_data_fps)
 from qiime.workflow.util import (call_commands_serially,
+                                 call_commands_in_parallel,
                                  no_status_updates,
-                                 WorkflowError)
+                                 WorkflowError,
+                                 WorkflowLogger,
+                                 WorkflowResultCache,
+                                 PythonStep,
+                                 WorkflowStepRunner,
+                                 run_workflow_step)
 from qiime.workflow.downstream import run_beta_diversity_through_plots
 
 
@@ -77,5 +86,229 @@ class WorkflowTests(TestCase):
         log_fp = glob(join(self.test_out, 'log*.txt'))[0]
         self.assertTrue(getsize(log_fp) > 0)
 
+
+class PythonStepTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp(dir=get_qiime_temp_dir(),
+                               prefix='python_step_test_')
+        self.input_fp = join(self.tmp_dir, 'in.txt')
+        self.output_fp = join(self.tmp_dir, 'out.txt')
+        with open(self.input_fp, 'w') as f:
+            f.write('abc\n')
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_str(self):
+        """PythonStep is shown as the equivalent python -c command"""
+        step = PythonStep('qiime.util.subsample_fasta', 'in.fna',
+                          'out.fna', 0.5)
+        self.assertEqual(str(step),
+                         'python -c "import qiime; qiime.util.subsample_fasta'
+                         '(\'in.fna\', \'out.fna\', 0.5)"')
+
+    def test_run(self):
+        """PythonStep calls its function in-process"""
+        step = PythonStep('shutil.copyfile', self.input_fp, self.output_fp)
+        self.assertEqual(step.run(), ('', '', 0))
+        self.assertEqual(open(self.output_fp).read(), 'abc\n')
+
+    def test_run_failures(self):
+        """PythonStep reports failures as non-zero return values"""
+        stdout, stderr, return_value = PythonStep('sys.exit', 3).run()
+        self.assertEqual(return_value, 3)
+        stdout, stderr, return_value = \
+            PythonStep('shutil.copyfile', 'not-a-file', self.output_fp).run()
+        self.assertEqual(return_value, 1)
+        self.assertTrue('IOError' in stderr)
+        stdout, stderr, return_value = \
+            PythonStep('qiime.not_a_function').run()
+        self.assertEqual(return_value, 1)
+
+    def test_run_workflow_step(self):
+        """run_workflow_step runs PythonSteps and command strings"""
+        step = PythonStep('shutil.copyfile', self.input_fp, self.output_fp)
+        self.assertEqual(run_workflow_step(step), ('', '', 0))
+        stdout, stderr, return_value = \
+            run_workflow_step('cat %s' % self.input_fp, in_process=True)
+        self.assertEqual(stdout, 'abc\n')
+        self.assertEqual(return_value, 0)
+
+    def test_workflow_step_runner(self):
+        """WorkflowStepRunner runs steps in-process or in a worker pool"""
+        for processes in (0, 1):
+            runner = WorkflowStepRunner(processes)
+            step = PythonStep('shutil.copyfile', self.input_fp,
+                              self.output_fp)
+            self.assertEqual(runner.run(step), ('', '', 0))
+            self.assertEqual(open(self.output_fp).read(), 'abc\n')
+            stdout, stderr, return_value = \
+                runner.run('cat %s' % self.input_fp)
+            self.assertEqual(stdout, 'abc\n')
+            runner.close()
+
+    def test_call_commands_serially_with_step_runner(self):
+        """call_commands_serially runs PythonSteps with a step_runner"""
+        log_fp = join(self.tmp_dir, 'log.txt')
+        commands = [[('Copy', PythonStep('shutil.copyfile', self.input_fp,
+                                         self.output_fp))]]
+        call_commands_serially(commands, no_status_updates,
+                               WorkflowLogger(log_fp),
+                               step_runner=WorkflowStepRunner())
+        self.assertEqual(open(self.output_fp).read(), 'abc\n')
+        self.assertTrue('python -c "import qiime; shutil.copyfile(' in
+                        open(log_fp).read())
+
+    def test_call_commands_in_parallel(self):
+        """call_commands_in_parallel runs and logs commands in order"""
+        log_fp = join(self.tmp_dir, 'log.txt')
+        output_fps = [join(self.tmp_dir, 'out%d.txt' % i) for i in range(4)]
+        commands = [[('Copy %d' % i, PythonStep('shutil.copyfile',
+                                                self.input_fp, fp))]
+                    for i, fp in enumerate(output_fps)]
+        call_commands_in_parallel(commands, no_status_updates,
+                                  WorkflowLogger(log_fp), processes=2)
+        for fp in output_fps:
+            self.assertEqual(open(fp).read(), 'abc\n')
+        log = open(log_fp).read()
+        self.assertTrue(log.index('# Copy 0 command') <
+                        log.index('# Copy 3 command'))
+
+        # the steps after a failing step are not run
+        commands = [[('Fail', PythonStep('sys.exit', 2)),
+                     ('Copy', PythonStep('shutil.copyfile', self.input_fp,
+                                         self.output_fp))]]
+        self.assertRaises(WorkflowError, call_commands_in_parallel, commands,
+                          no_status_updates, WorkflowLogger(log_fp))
+        self.assertFalse(exists(self.output_fp))
+
+        # commands that are still running when one fails are stopped
+        commands = [[('Fail', PythonStep('sys.exit', 2))],
+                    [('Sleep', PythonStep('time.sleep', 30))]]
+        start = time()
+        self.assertRaises(WorkflowError, call_commands_in_parallel, commands,
+                          no_status_updates, WorkflowLogger(log_fp),
+                          processes=2)
+        self.assertTrue(time() - start < 15)
+
+
+class WorkflowResultCacheTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp(dir=get_qiime_temp_dir(),
+                               prefix='workflow_result_cache_test_')
+        self.cache = WorkflowResultCache(join(self.tmp_dir, 'cache'))
+        self.input_fp = join(self.tmp_dir, 'in.txt')
+        with open(self.input_fp, 'w') as f:
+            f.write('b\na\nc\n')
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _run_sort(self, output_fp):
+        return self.cache.run('sort -o %s %s' % (output_fp, self.input_fp))
+
+    def test_run_stores_and_restores_outputs(self):
+        """WorkflowResultCache restores matching steps from the cache"""
+        out1 = join(self.tmp_dir, 'sorted.txt')
+        out2 = join(self.tmp_dir, 'out2', 'sorted.txt')
+        stdout, stderr, return_value = self._run_sort(out1)
+        self.assertEqual(return_value, 0)
+        self.assertEqual(open(out1).read(), 'a\nb\nc\n')
+        self.assertEqual(len(listdir(self.cache.cache_dir)), 1)
+
+        # the output path differs, but the step is the same, so its
+        # output is hard-linked from the cache
+        stdout, stderr, return_value = self._run_sort(out2)
+        self.assertEqual(return_value, 0)
+        self.assertEqual(open(out2).read(), 'a\nb\nc\n')
+        self.assertEqual(stat(out1).st_ino, stat(out2).st_ino)
+        self.assertEqual(len(listdir(self.cache.cache_dir)), 1)
+
+    def test_run_changed_input(self):
+        """WorkflowResultCache re-runs steps whose inputs changed"""
+        out1 = join(self.tmp_dir, 'out1.txt')
+        out2 = join(self.tmp_dir, 'out2.txt')
+        self._run_sort(out1)
+        with open(self.input_fp, 'w') as f:
+            f.write('z\ny\n')
+        self._run_sort(out2)
+        self.assertEqual(open(out2).read(), 'y\nz\n')
+        self.assertEqual(len(listdir(self.cache.cache_dir)), 2)
+
+    def test_run_uncacheable(self):
+        """WorkflowResultCache always runs uncacheable commands"""
+        out_fp = join(self.tmp_dir, 'out.txt')
+        self.cache.run('cat %s > %s' % (self.input_fp, out_fp))
+        self.assertEqual(open(out_fp).read(), 'b\na\nc\n')
+        self.assertEqual(listdir(self.cache.cache_dir), [])
+
+    def test_get_step_key_literals(self):
+        """get_step_key keeps non-path values in the key"""
+        key1, output_tokens, dir_tokens = self.cache.get_step_key(
+            ['sort', '-k', '1', self.input_fp, '-o', 'x/y.txt'])
+        key2, _, _ = self.cache.get_step_key(
+            ['sort', '-k', '2', self.input_fp, '-o', 'z/y.txt'])
+        self.assertNotEqual(key1, key2)
+        self.assertEqual(output_tokens, [2, 5])
+        self.assertEqual(dir_tokens, [])
+
+    def test_get_step_key_existing_outputs(self):
+        """get_step_key doesn't hash existing outputs into the key"""
+        out_dir = join(self.tmp_dir, 'out')
+        tokens = ['sort', '-o', out_dir, self.input_fp]
+        key1, output_tokens, dir_tokens = self.cache.get_step_key(tokens)
+        # an earlier run's outputs don't change the key
+        makedirs(out_dir)
+        with open(join(out_dir, 'old.txt'), 'w') as f:
+            f.write('x\n')
+        key2, _, _ = self.cache.get_step_key(tokens)
+        self.assertEqual(key1, key2)
+        self.assertEqual(output_tokens, [2])
+        self.assertEqual(dir_tokens, [])
+
+    def test_beta_diversity_through_plots_with_cache(self):
+        """changing a plotting parameter doesn't re-run upstream steps"""
+        test_data = get_test_data_fps()
+        out_dir = join(self.tmp_dir, 'bdiv')
+        params = parse_qiime_parameters({})
+        log_fps = []
+        for number_of_axes in ['10', '5']:
+            params['make_emperor'] = {'number_of_axes': number_of_axes}
+            log_fp = join(self.tmp_dir, 'log_%s.txt' % number_of_axes)
+            log_fps.append(log_fp)
+            run_beta_diversity_through_plots(
+                test_data['biom'][0], test_data['map'][0], out_dir,
+                partial(call_commands_serially, result_cache=self.cache),
+                params, load_qiime_config(), tree_fp=test_data['tree'][0],
+                logger=WorkflowLogger(log_fp),
+                status_update_callback=no_status_updates)
+        self.assertFalse('Restored outputs' in open(log_fps[0]).read())
+        # the beta diversity and PCoA steps are restored for both metrics,
+        # and only the emperor steps are re-run
+        log_lines = open(log_fps[1]).read().split('\n')
+        restored = [log_lines[i - 2] for i, line in enumerate(log_lines)
+                    if line.startswith('Restored outputs')]
+        self.assertEqual(len(restored), 4)
+        self.assertEqual(
+            len([l for l in restored if 'beta_diversity.py' in l]), 2)
+        self.assertEqual(
+            len([l for l in restored if 'principal_coordinates.py' in l]), 2)
+        self.assertTrue(exists(join(out_dir, 'unweighted_unifrac_pc.txt')))
+
+    def test_call_commands_serially_with_cache(self):
+        """call_commands_serially uses result_cache when provided"""
+        out1 = join(self.tmp_dir, 'out1.txt')
+        out2 = join(self.tmp_dir, 'out2.txt')
+        log_fp = join(self.tmp_dir, 'log.txt')
+        commands = [[('Sort', 'sort -o %s %s' % (out1, self.input_fp))],
+                    [('Sort', 'sort -o %s %s' % (out2, self.input_fp))]]
+        call_commands_serially(commands, no_status_updates,
+                               WorkflowLogger(log_fp),
+                               result_cache=self.cache)
+        self.assertEqual(open(out2).read(), 'a\nb\nc\n')
+        self.assertTrue('Restored outputs from cache' in open(log_fp).read())
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""Benchmark the start-up (import) time of QIIME's scripts.
+
+Some pipelines call QIIME scripts thousands of times, so the time it takes
+a script to start can dominate their total runtime. This times how long it
+takes to load each script in scripts/ (i.e., run its module-level code and
+imports, without calling main) in a fresh interpreter, and optionally
+compares the results against a baseline written by a previous run on the
+same machine, failing if any script's start-up has regressed.
+
+This is a developer tool rather than a test: start-up times depend on the
+machine, so they can only be compared against a baseline recorded on the
+same machine.
+"""
+from __future__ import division
+from glob import glob
+from os.path import join, split
+from sys import executable, exit
+from time import time
+from qiime.util import (parse_command_line_parameters, make_option,
+                        get_qiime_project_dir, qiime_system_call)
+
+__author__ = "agent"
+__copyright__ = "Copyright 2026, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.9.1-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+script_info = {}
+script_info['brief_description'] = "Benchmark QIIME script start-up times"
+script_info['script_description'] = __doc__
+script_info['script_usage'] = [
+    ("", "Record a baseline for all scripts:",
+     "%prog -w startup_baseline.txt"),
+    ("", "Fail if any script's start-up has regressed since the baseline:",
+     "%prog -b startup_baseline.txt")]
+script_info['output_description'] = ("Tab-separated script names and "
+                                     "start-up times (in seconds, excluding "
+                                     "interpreter start-up) are printed.")
+script_info['required_options'] = []
+script_info['optional_options'] = [
+    make_option('-b', '--baseline_fp', type='existing_filepath',
+                help='baseline start-up times to compare against '
+                '[default: %default]', default=None),
+    make_option('-w', '--write_baseline_fp', type='new_filepath',
+                help='write the measured start-up times to this file, for '
+                'use as a baseline in later runs [default: %default]',
+                default=None),
+    make_option('-s', '--scripts', type='string',
+                help='comma-separated list of scripts to benchmark '
+                '[default: all scripts]', default=None),
+    make_option('-n', '--num_repeats', type='int',
+                help='number of times to load each script; the fastest time '
+                'is reported [default: %default]', default=3),
+    make_option('-t', '--tolerance', type='float',
+                help='fraction by which a script\'s start-up time may exceed '
+                'its baseline before it is considered a regression '
+                '[default: %default]', default=0.25),
+    make_option('-m', '--min_increase', type='float',
+                help='minimum increase (in seconds) over the baseline for a '
+                'script to be considered a regression, to avoid flagging '
+                'noise in very fast scripts [default: %default]',
+                default=0.05),
+]
+script_info['version'] = __version__
+script_info['help_on_no_arguments'] = False
+
+_load_script_code = ("import imp, sys; sys.argv = [%r]; "
+                     "imp.load_source('_qiime_startup_benchmark', %r)")
+
+
+def time_command(command, num_repeats):
+    """Return the fastest wall-clock time of num_repeats runs of command"""
+    times = []
+    for i in range(num_repeats):
+        start = time()
+        stdout, stderr, return_value = qiime_system_call(command)
+        times.append(time() - start)
+        if return_value != 0:
+            raise RuntimeError("Command failed: %s\n%s" % (command, stderr))
+    return min(times)
+
+
+def time_script_startup(script_fp, num_repeats=3, interpreter_time=0.0):
+    """Return the time to load script_fp, excluding interpreter start-up"""
+    command = '%s -c "%s"' % (executable,
+                              _load_script_code % (script_fp, script_fp))
+    return max(time_command(command, num_repeats) - interpreter_time, 0.0)
+
+
+def parse_startup_times(lines):
+    """Parse tab-separated script names and start-up times"""
+    result = {}
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            script_name, seconds = line.split('\t')
+            result[script_name] = float(seconds)
+    return result
+
+
+def find_regressions(startup_times, baseline, tolerance=0.25,
+                     min_increase=0.05):
+    """Return (script, time, baseline time) for scripts that have regressed
+
+    Scripts that aren't in the baseline are ignored.
+    """
+    result = []
+    for script_name, seconds in sorted(startup_times.items()):
+        try:
+            baseline_seconds = baseline[script_name]
+        except KeyError:
+            continue
+        if (seconds > baseline_seconds * (1 + tolerance) and
+                seconds - baseline_seconds > min_increase):
+            result.append((script_name, seconds, baseline_seconds))
+    return result
+
+
+def main():
+    option_parser, opts, args =\
+        parse_command_line_parameters(**script_info)
+
+    scripts_dir = join(get_qiime_project_dir(), 'scripts')
+    if opts.scripts is None:
+        script_fps = sorted(glob(join(scripts_dir, '*.py')))
+    else:
+        script_fps = [join(scripts_dir, s) for s in opts.scripts.split(',')]
+
+    interpreter_time = time_command('%s -c "pass"' % executable,
+                                    opts.num_repeats)
+    startup_times = {}
+    for script_fp in script_fps:
+        script_name = split(script_fp)[1]
+        startup_times[script_name] = time_script_startup(
+            script_fp, opts.num_repeats, interpreter_time)
+        print '%s\t%1.3f' % (script_name, startup_times[script_name])
+
+    if opts.write_baseline_fp is not None:
+        with open(opts.write_baseline_fp, 'w') as f:
+            f.write('# script\tstart-up time (seconds)\n')
+            for script_name, seconds in sorted(startup_times.items()):
+                f.write('%s\t%1.3f\n' % (script_name, seconds))
+
+    if opts.baseline_fp is not None:
+        baseline = parse_startup_times(open(opts.baseline_fp, 'U'))
+        regressions = find_regressions(startup_times, baseline,
+                                       opts.tolerance, opts.min_increase)
+        if regressions:
+            print "\nStart-up time regressed for the following scripts:"
+            for script_name, seconds, baseline_seconds in regressions:
+                print '%s\t%1.3f (baseline: %1.3f)' % (script_name, seconds,
+                                                       baseline_seconds)
+            return 1
+        print "\nNo start-up time regressions."
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())